@@ -45,7 +45,13 @@ def chiste_callback(interface, args, msg, metadata):
     try:
         from Models.Database import Database
         db = Database()
-        chiste = db.get_random_chiste(approved_only=True)
+        # Una bolsa sin repeticiones por canal; los privados comparten una
+        metadata = metadata or {}
+        if metadata.get('is_direct'):
+            bag = Database.CHISTE_DM_BAG
+        else:
+            bag = f"ch{metadata.get('channel', 0) or 0}"
+        chiste = db.get_random_chiste(approved_only=True, bag=bag)
         if chiste and chiste.get('content'):
             response = f"Chiste: {chiste.get('content')}"
         else:
@@ -56,15 +62,9 @@ def chiste_callback(interface, args, msg, metadata):
     # Trocear en hasta 3 mensajes de ~200 caracteres (límite de Meshtastic).
     # Los chistes los añaden los usuarios con "!chiste add" y pueden superar el
     # límite; sin trocear, la malla los rechaza o trunca silenciosamente.
-    from functions import split_messages, MESH_MAX_BYTES, MESH_MAX_PARTS
-    from time import sleep
-    parts = split_messages(response, max_bytes=MESH_MAX_BYTES, max_parts=MESH_MAX_PARTS)
-    if not parts:
-        parts = [response]
-    for idx, part in enumerate(parts):
-        interface.reply_to_message(part, metadata)
-        # Pequeña espera entre partes para no saturar la malla
-        if idx < len(parts) - 1:
-            sleep(2.5)
+    # Las partes se encolan: la pausa entre ellas la pone el planificador de
+    # transmisión, no este worker.
+    from functions import reply_long
+    reply_long(interface, metadata, response)
     # El registro en commands_sent se hace de forma centralizada en
     # SerialInterface.on_receive_text tras ejecutar el callback.
@@ -1,8 +1,7 @@
 
 def help_callback(interface, args, msg, metadata):
     from data import commands_dict
-    from functions import split_messages, MESH_MAX_BYTES, MESH_MAX_PARTS
-    from time import sleep
+    from functions import reply_long
 
     if args and len(args):
         # Ayuda concreta de un comando: !help <comando>
@@ -20,10 +19,7 @@ def help_callback(interface, args, msg, metadata):
     cmds = ' '.join(f"/{name}" for name, info in commands_dict.items() if not info.get('hidden'))
     full = f"Comandos: {cmds}. Detalle: !help <comando>"
 
-    parts = split_messages(full, max_bytes=MESH_MAX_BYTES, max_parts=MESH_MAX_PARTS)
-    for idx, part in enumerate(parts):
-        interface.reply_to_message(part, metadata)
-        if idx < len(parts) - 1:
-            sleep(2.5)
+    # Las partes se encolan en el planificador de transmisión, que las espacia
+    reply_long(interface, metadata, full)
     # El registro en commands_sent se hace de forma centralizada en
     # SerialInterface.on_receive_text tras ejecutar el callback.
@@ -60,6 +60,13 @@ def routers_callback(interface, args, msg, metadata):
 
         router_nodes = db.get_router_nodes(routers_cfg, max_hops=max_hops)
 
+        # Rutas exteriores precalculadas de todos los routers en una sola consulta
+        base_idents = [b for b in [base_short, base_id] if b]
+        trace_routes = db.get_latest_trace_routes(
+            [n.get('node_id') or n.get('short_name') for n in router_nodes if not n.get('offline')],
+            base_idents,
+        )
+
         for node in router_nodes:
             ident = node.get('identifier')
             short_name = node.get('short_name')
@@ -101,8 +108,7 @@ def routers_callback(interface, args, msg, metadata):
             if raw_hops is not None and raw_hops > 0 and (base_short or base_id):
                 effective_hops = max(0, raw_hops - 1)
 
-            base_idents = [b for b in [base_short, base_id] if b]
-            trace_info = db.get_latest_trace_route_info(node_id or short_name or ident, base_idents)
+            trace_info = trace_routes.get(node_id or short_name or ident)
 
             # Priorizar información del trace reciente (hops y SNRs exteriores tramo a tramo)
             if trace_info is not None:
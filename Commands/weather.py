@@ -107,19 +107,14 @@ def weather_callback(interface, args, msg, metadata):
 
     full = body
 
-    # Trocear en hasta 3 mensajes de ~200 caracteres (límite de Meshtastic)
-    from functions import split_messages, MESH_MAX_BYTES, MESH_MAX_PARTS
-    parts = split_messages(full, max_bytes=MESH_MAX_BYTES, max_parts=MESH_MAX_PARTS)
-    if not parts:
+    # Trocear en hasta 3 mensajes de ~200 caracteres (límite de Meshtastic),
+    # encolados en el planificador de transmisión, que los espacia.
+    from functions import reply_long
+    if not full.strip():
         interface.reply_to_message('Sin datos de clima disponibles.', metadata)
         return
 
-    from time import sleep
-    for idx, part in enumerate(parts):
-        interface.reply_to_message(part, metadata)
-        # Pequeña espera entre partes para no saturar la malla
-        if idx < len(parts) - 1:
-            sleep(2.5)
+    reply_long(interface, metadata, full)
 
     # El registro en commands_sent se hace de forma centralizada en
     # SerialInterface.on_receive_text tras ejecutar el callback.
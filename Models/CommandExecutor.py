@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from functions import log_p
+
+# Muestras de espera en cola que se conservan para la media
+WAIT_SAMPLES = 200
+
+
+class CommandExecutor:
+    """Ejecuta los callbacks de comandos fuera del hilo 'publishing' de Meshtastic.
+
+    SerialInterface.on_receive_text solo encola el comando y retorna, así que
+    un comando lento (/prevision, /marea, respuestas largas) ya no retrasa la
+    recepción del resto de paquetes de la malla. Reglas:
+      - Como mucho COMMAND_WORKERS comandos a la vez (tope global).
+      - Los comandos de un mismo remitente se ejecutan de uno en uno y en
+        orden de llegada (FIFO por remitente); remitentes distintos en paralelo.
+      - Con COMMAND_QUEUE_MAX comandos esperando se descartan los nuevos.
+      - COMMAND_WORKERS = 0 ejecuta el callback en el propio hilo (modo antiguo).
+
+    `snapshot()` expone profundidad de cola y tiempos de espera para el
+    heartbeat (system_status).
+    """
+
+    _instance: Optional[CommandExecutor] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, workers: Optional[int] = None, max_pending: Optional[int] = None) -> None:
+        import env as _env
+        self.workers = int(workers if workers is not None else getattr(_env, 'COMMAND_WORKERS', 2))
+        self.max_pending = int(max_pending if max_pending is not None
+                               else getattr(_env, 'COMMAND_QUEUE_MAX', 50))
+        self._cond = threading.Condition()
+        # Cola por remitente y remitentes con trabajo listo (sin comando en curso)
+        self._queues: Dict[str, Deque[Tuple[float, Callable[..., Any], Tuple[Any, ...]]]] = {}
+        self._ready: Deque[str] = deque()
+        self._busy: Set[str] = set()
+        self._threads: List[threading.Thread] = []
+        self._pending = 0
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.stats = {"submitted": 0, "completed": 0, "dropped": 0, "errors": 0,
+                      "max_depth": 0, "wait_ms_max": 0.0, "run_ms_max": 0.0}
+
+    @classmethod
+    def get_instance(cls) -> CommandExecutor:
+        """Obtiene o crea la instancia singleton."""
+        # Se llega desde el hilo de recepción y el heartbeat de main.loop(): dos
+        # instancias romperían el orden por remitente y el tope de la cola
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def submit(self, sender: Optional[str], func: Callable[..., Any], *args: Any) -> bool:
+        """Encola `func(*args)` tras los comandos pendientes de `sender`.
+
+        Devuelve False si la cola está llena y el comando se descarta.
+        """
+        if self.workers <= 0:
+            self._run(func, args)
+            return True
+
+        key = str(sender or '?')
+        with self._cond:
+            if self._pending >= self.max_pending:
+                self.stats["dropped"] += 1
+                log_p(f"CommandExecutor: cola llena ({self._pending}), se descarta comando de {key}",
+                      level="WARN")
+                return False
+            queue = self._queues.setdefault(key, deque())
+            queue.append((time.monotonic(), func, args))
+            self._pending += 1
+            self.stats["submitted"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], self._pending)
+            # Si el remitente ya tiene un comando en curso o en _ready, lo
+            # recogerá el worker que termine el anterior
+            if key not in self._busy and len(queue) == 1:
+                self._ready.append(key)
+            self._start_workers()
+            self._cond.notify()
+        return True
+
+    def _start_workers(self) -> None:
+        # Se llama con self._cond tomado; los hilos se crean bajo demanda
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"command-{len(self._threads) + 1}",
+                                      daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                queued_at, func, args = self._queues[key].popleft()
+                self._busy.add(key)
+                self._pending -= 1
+                wait_ms = (time.monotonic() - queued_at) * 1000
+                self._waits.append(wait_ms)
+                self.stats["wait_ms_max"] = round(max(self.stats["wait_ms_max"], wait_ms), 2)
+
+            start = time.perf_counter()
+            try:
+                self._run(func, args)
+            except BaseException as e:
+                # SystemExit y similares no deben matar al worker
+                with self._cond:
+                    self.stats["errors"] += 1
+                    self.stats["completed"] += 1
+                log_p(f"CommandExecutor: comando interrumpido: {e!r}", level="WARN")
+            finally:
+                # Aunque el callback lance SystemExit/KeyboardInterrupt, el
+                # remitente se libera y su siguiente comando sigue en marcha
+                with self._cond:
+                    self._busy.discard(key)
+                    run_ms = (time.perf_counter() - start) * 1000
+                    self.stats["run_ms_max"] = round(max(self.stats["run_ms_max"], run_ms), 2)
+                    if self._queues[key]:
+                        self._ready.append(key)
+                    else:
+                        del self._queues[key]
+                    self._cond.notify_all()
+
+    def _run(self, func: Callable[..., Any], args: Tuple[Any, ...]) -> float:
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except Exception as e:
+            with self._cond:
+                self.stats["errors"] += 1
+            log_p(f"CommandExecutor: error ejecutando comando: {e}", level="WARN")
+        with self._cond:
+            self.stats["completed"] += 1
+        return (time.perf_counter() - start) * 1000
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que no queden comandos en cola ni en curso (True si lo consigue)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Métricas para el heartbeat (system_status)."""
+        with self._cond:
+            out = dict(self.stats)
+            out["workers"] = self.workers
+            out["pending"] = self._pending
+            out["running"] = len(self._busy)
+            out["senders_waiting"] = sum(1 for q in self._queues.values() if q)
+            out["wait_ms_avg"] = round(sum(self._waits) / len(self._waits), 2) if self._waits else None
+            return out
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from create_db import attach_history, history_path
+from Models.QueryProfiler import ProfiledConnection, QueryProfiler
+from Models.Storage import connection_pragmas
+
+# Sentencias preparadas que conserva cada conexión (caché interna de sqlite3).
+# Con conexiones persistentes, las queries frecuentes (get_node, update_node,
+# log_command...) se compilan una sola vez por hilo en lugar de en cada llamada.
+STATEMENT_CACHE_SIZE = 256
+
+
+class PooledConnection(ProfiledConnection):
+    """Conexión SQLite reutilizable.
+
+    `close()` NO cierra la conexión: la devuelve al pool deshaciendo cualquier
+    transacción sin confirmar (misma semántica que cerrar sin commit). Así el
+    patrón `with closing(self._connect()) as conn:` de Models/Database.py sigue
+    siendo válido sin reabrir el fichero en cada método. Con DB_PROFILE, el
+    cierre marca también el fin de la llamada perfilada (Models/QueryProfiler.py).
+    """
+
+    def close(self) -> None:
+        profiler = QueryProfiler.active()
+        if profiler is not None:
+            profiler.end(self)
+        try:
+            if self.in_transaction:
+                self.rollback()
+        except sqlite3.ProgrammingError:
+            # Conexión ya cerrada de verdad (dispose)
+            pass
+
+    def dispose(self) -> None:
+        """Cierra realmente la conexión (apagado o fichero reemplazado)."""
+        super().close()
+
+
+class ConnectionPool:
+    """Pool de conexiones SQLite por hilo y por proceso.
+
+    Cada hilo mantiene una conexión abierta por ruta de BD. Se descarta y se
+    reabre si el fichero (o el de histórico, DB_HISTORY_SPLIT) cambia de inodo
+    o aparece (borrado/recreado, p. ej. en tests) o si el proceso se ha
+    bifurcado (fork). El histórico se adjunta y los PRAGMA por conexión se
+    aplican una única vez al abrirla.
+    """
+
+    _instance: Optional[ConnectionPool] = None
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: List[PooledConnection] = []
+        self._pid = os.getpid()
+        self._history_paths: Dict[str, str] = {}
+
+    @classmethod
+    def get_instance(cls) -> ConnectionPool:
+        """Obtiene o crea la instancia singleton del pool."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @staticmethod
+    def _file_key(db_path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(db_path)
+            return st.st_dev, st.st_ino
+        except OSError:
+            return None
+
+    def _conn_key(self, db_path: str) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        history = self._history_paths.get(db_path)
+        if history is None:
+            history = self._history_paths[db_path] = str(history_path(db_path))
+        return self._file_key(db_path), self._file_key(history)
+
+    def _thread_conns(self) -> Dict[str, Tuple[PooledConnection, Tuple[Optional[Tuple[int, int]], ...]]]:
+        pid = os.getpid()
+        if pid != self._pid:
+            # Proceso hijo tras fork: las conexiones heredadas no son seguras
+            with self._lock:
+                self._pid = pid
+                self._all = []
+            self._local = threading.local()
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = {}
+            self._local.conns = conns
+        return conns
+
+    def _open(self, db_path: str) -> PooledConnection:
+        # timeout: tiempo que el driver espera por un lock antes de lanzar
+        # OperationalError. busy_timeout: equivalente a nivel SQLite (ms).
+        # Ambos protegen frente a escrituras concurrentes (daemon + cron).
+        # check_same_thread=False solo para poder cerrarla en el apagado desde
+        # otro hilo; en uso normal cada conexión la utiliza únicamente su hilo.
+        conn = sqlite3.connect(
+            db_path,
+            timeout=10.0,
+            factory=PooledConnection,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+        )
+        conn.execute('PRAGMA busy_timeout = 10000')
+        # Tablas frías en su propio fichero (create_db.HISTORY_TABLES)
+        attach_history(conn, db_path)
+        # Checkpoint automático, tamaño del WAL y mmap según DB_STORAGE_MODE
+        for pragma in connection_pragmas():
+            conn.execute(pragma)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get(self, db_path: str) -> PooledConnection:
+        """Devuelve la conexión del hilo actual para db_path (la abre si hace falta)."""
+        conns = self._thread_conns()
+        key = self._conn_key(db_path)
+        entry = conns.get(db_path)
+        if entry is not None:
+            conn, conn_key = entry
+            if conn_key == key:
+                return conn
+            self._discard(conn)
+
+        conn = self._open(db_path)
+        conns[db_path] = (conn, self._conn_key(db_path))
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def _discard(self, conn: PooledConnection) -> None:
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+        try:
+            conn.dispose()
+        except Exception:
+            pass
+
+    def close_thread(self) -> None:
+        """Cierra las conexiones del hilo actual (p. ej. al terminar un worker)."""
+        conns = self._thread_conns()
+        for conn, _ in list(conns.values()):
+            self._discard(conn)
+        conns.clear()
+
+    def close_all(self) -> None:
+        """Cierra todas las conexiones de todos los hilos (apagado del proceso)."""
+        with self._lock:
+            pending = list(self._all)
+            self._all = []
+        for conn in pending:
+            try:
+                conn.dispose()
+            except Exception:
+                pass
+        self._local = threading.local()
@@ -1,47 +1,263 @@
 from __future__ import annotations
 
+import json
+import random
 import sqlite3
-from contextlib import closing
+import time
+import uuid
+from contextlib import closing, contextmanager
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Iterable, Tuple
+from typing import Any, Dict, List, Optional, Iterable, Iterator, Tuple
 import hashlib
 
-from create_db import ensure_database
-from functions import sanitize_text
+from create_db import (
+    HISTORY_SCHEMA,
+    TRACES_COLUMNS,
+    ensure_database,
+    ensure_mirror_triggers,
+    memory_mirror_enabled,
+    outbox_content_hash,
+    table_schema,
+)
+from Models.ConnectionPool import ConnectionPool
+from Models.MemoryMirror import MemoryMirror
+from Models.QueryProfiler import QueryProfiler
+from Models.Wakeup import WAKE_AEMET, WAKE_OUTBOX, WAKE_TRACE, wake_main_loop
+from Models.WriteBatcher import WriteBatcher
+from functions import log_p, sanitize_text
 
 
 class Database:
     """Modelo simple para interactuar con la base de datos SQLite."""
 
+    # Columnas de `nodes` que se pueden actualizar desde fuera (update_node,
+    # upsert_nodes y Models/NodeStore.py)
+    NODE_COLUMNS = (
+        "name",
+        "num",
+        "short_name",
+        "mac_addr",
+        "hw_model",
+        "role",
+        "is_favorite",
+        "snr",
+        "rssi",
+        "public_key",
+        "hops",
+        "hop_start",
+        "uptime",
+        "via_mqtt",
+        "battery",
+        "voltage",
+        "last_heard",
+    )
+
+    # Columnas de `nodes` que afectan a la prioridad de traces (trace_state)
+    TRACE_STATE_NODE_COLUMNS = frozenset(("role", "short_name", "hops", "via_mqtt"))
+
+    # Política de selección de traces usada hasta que get_next_node_to_trace
+    # guarde la suya en tasks_control (TRACE_POLICY_TASK)
+    TRACE_POLICY_TASK = 'trace_policy'
+    TRACE_POLICY_DEFAULTS = {
+        "hops_limit": 2,
+        "reload_hours": 72,
+        "router_reload_hours": 6,
+        "router_max_hops": 2,
+        "router_retry_short_hours": 1,
+        "router_max_retries": 5,
+        "router_retry_long_hours": 24,
+        "retry_hours": 24,
+        "router_identifiers": [],
+    }
+
+    # Retención del histórico: regla -> (tabla, columna de tiempo, columna epoch?, condición extra)
+    RETENTION_RULES = {
+        "pings": ("pings", "created_ts", True, None),
+        "commands_sent": ("commands_sent", "created_ts", True, None),
+        "traces": ("traces", "updated_ts", True, "status = 'done'"),
+        "traces_error": ("traces", "updated_ts", True, "status = 'error'"),
+        "aemet": ("aemet", "created_ts", True, "published = 1"),
+        "aemet_weather": ("aemet_weather", "created_ts", True, None),
+        "tides": ("tides", "created_at", False, None),
+        "outbox": ("outbox", "updated_ts", True, "status IN ('sent', 'error', 'expired')"),
+    }
+    # Días de retención por defecto (None = indefinido). Se sobreescriben con
+    # env.DB_RETENTION_DAYS. El histórico de interacciones válidas se conserva.
+    RETENTION_DEFAULTS = {
+        "pings": None,
+        "commands_sent": None,
+        "traces": None,
+        "traces_error": 30,
+        "aemet": None,
+        "aemet_weather": 30,
+        "tides": 30,
+        "outbox": 30,
+    }
+
+    # (ruta, DB_MEMORY_MIRROR) cuyos triggers de mirror_changes ya se han ajustado
+    _mirror_triggers_synced: set = set()
+
     def __init__(self, db_path: Optional[str] = None) -> None:
         self.db_path = str(ensure_database(db_path))
+        enabled = memory_mirror_enabled()
+        if (self.db_path, enabled) not in Database._mirror_triggers_synced:
+            # Una vez por proceso: se crean o borran si DB_MEMORY_MIRROR cambió
+            with closing(self._connect()) as conn:
+                ensure_mirror_triggers(conn, enabled)
+            Database._mirror_triggers_synced.discard((self.db_path, not enabled))
+            Database._mirror_triggers_synced.add((self.db_path, enabled))
 
     def _connect(self) -> sqlite3.Connection:
-        # timeout: tiempo que el driver espera por un lock antes de lanzar
-        # OperationalError. busy_timeout: equivalente a nivel SQLite (ms).
-        # Ambos protegen frente a escrituras concurrentes (daemon + cron).
-        conn = sqlite3.connect(self.db_path, timeout=10.0)
-        conn.execute('PRAGMA busy_timeout = 10000')
-        conn.row_factory = sqlite3.Row
+        # Conexión persistente del hilo actual (ver Models/ConnectionPool.py).
+        # close() la devuelve al pool, por lo que `with closing(...)` es seguro.
+        conn = ConnectionPool.get_instance().get(self.db_path)
+        profiler = QueryProfiler.active()
+        if profiler is not None:
+            # Con DB_PROFILE: llamada atribuida al método que pide la conexión
+            profiler.begin(conn)
         return conn
 
+    @staticmethod
+    def close_connections() -> None:
+        """Cierra todas las conexiones del pool (apagado del proceso)."""
+        MemoryMirror.close_all()
+        ConnectionPool.get_instance().close_all()
+
+    def _mirror(self) -> Optional[MemoryMirror]:
+        """Réplica en RAM de las tablas calientes si DB_MEMORY_MIRROR está activo."""
+        if not memory_mirror_enabled():
+            return None
+        return MemoryMirror.get_instance(self.db_path)
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Conexión para lecturas de nodes, tasks_control y últimos clima/mareas.
+
+        Con DB_MEMORY_MIRROR sirve desde la réplica en RAM (Models/MemoryMirror.py);
+        si no, o si la réplica falla, desde el fichero.
+        """
+        mirror = self._mirror()
+        with closing(self._connect()) as conn:
+            if mirror is None:
+                yield conn
+                return
+            with mirror.reading(conn) as mem:
+                yield mem if mem is not None else conn
+
+    def preload_mirror(self) -> bool:
+        """Carga ya la réplica en RAM (arranque) en lugar de en la primera lectura.
+
+        Devuelve False si DB_MEMORY_MIRROR está desactivado o la carga falla.
+        """
+        mirror = self._mirror()
+        if mirror is None:
+            return False
+        with closing(self._connect()) as conn:
+            return mirror.sync(conn)
+
+    def _write_through(self, conn: sqlite3.Connection) -> None:
+        """Refleja en la réplica en RAM lo recién confirmado en `conn`."""
+        mirror = self._mirror()
+        if mirror is not None:
+            mirror.write_through(conn)
+
     # ---------- CHISTES ----------
-    def get_random_chiste(self, approved_only: bool = True) -> Optional[Dict[str, Any]]:
+    # tasks_control.extra con la versión del conjunto de chistes aprobados. La
+    # incrementan los triggers de create_db.py en cada alta, baja o cambio de
+    # need_approve (también si se aprueba editando la BD a mano).
+    CHISTES_VERSION_TASK = "chistes_version"
+    # Bolsa compartida por todos los privados: una por remitente crecería con
+    # (chistes × remitentes distintos) sin que nada la podara
+    CHISTE_DM_BAG = "dm"
+
+    def get_random_chiste(self, approved_only: bool = True, bag: str = "ch0") -> Optional[Dict[str, Any]]:
         """Devuelve un chiste aleatorio o None si no hay.
 
-        Si approved_only es True, solo devuelve chistes con need_approve = 0.
+        Si approved_only es True, solo devuelve chistes con need_approve = 0 y
+        los sirve desde la bolsa barajada `bag` (canal 'ch<N>' o CHISTE_DM_BAG
+        en privado): un mismo canal no repite chiste hasta agotar la bolsa. Cada
+        llamada es una lectura por clave primaria; solo se baraja al agotar la
+        bolsa o al cambiar el conjunto de aprobados.
         """
         with closing(self._connect()) as conn:
-            if approved_only:
-                cur = conn.execute(
-                    'SELECT id, "from", content, need_upload FROM chistes WHERE need_approve = 0 ORDER BY RANDOM() LIMIT 1'
-                )
-            else:
-                cur = conn.execute(
+            if not approved_only:
+                row = conn.execute(
                     'SELECT id, "from", content, need_upload FROM chistes ORDER BY RANDOM() LIMIT 1'
-                )
-            row = cur.fetchone()
-            return dict(row) if row else None
+                ).fetchone()
+                return dict(row) if row else None
+
+            row = conn.execute(
+                'SELECT extra FROM tasks_control WHERE name = ?', (self.CHISTES_VERSION_TASK,)
+            ).fetchone()
+            version = int(row['extra']) if row and str(row['extra'] or '').isdigit() else 0
+
+            # Unos pocos intentos: otro hilo puede avanzar el cursor a la vez o
+            # el chiste de la posición pudo borrarse tras barajar.
+            for _ in range(5):
+                state = conn.execute(
+                    'SELECT cursor, size, version, last_id FROM chiste_bag_state WHERE bag = ?', (bag,)
+                ).fetchone()
+                if state is None or state['cursor'] >= state['size']:
+                    self._refill_chiste_bag(conn, bag, version, keep=0, last_id=state['last_id'] if state else None)
+                elif state['version'] != version:
+                    self._refill_chiste_bag(conn, bag, version, keep=state['cursor'], last_id=state['last_id'])
+                else:
+                    row = conn.execute(
+                        """
+                        SELECT c.id, c."from", c.content, c.need_upload
+                        FROM chiste_bag b JOIN chistes c ON c.id = b.chiste_id
+                        WHERE b.bag = ? AND b.position = ? AND c.need_approve = 0
+                        """,
+                        (bag, state['cursor']),
+                    ).fetchone()
+                    cur = conn.execute(
+                        'UPDATE chiste_bag_state SET cursor = cursor + 1, last_id = COALESCE(?, last_id) '
+                        'WHERE bag = ? AND cursor = ?',
+                        (row['id'] if row else None, bag, state['cursor']),
+                    )
+                    conn.commit()
+                    if cur.rowcount and row:
+                        return dict(row)
+                    continue
+                conn.commit()
+                size = conn.execute('SELECT size FROM chiste_bag_state WHERE bag = ?', (bag,)).fetchone()
+                if not size or not size['size']:
+                    return None
+            return None
+
+    @staticmethod
+    def _refill_chiste_bag(
+        conn: sqlite3.Connection, bag: str, version: int, keep: int = 0, last_id: Optional[int] = None
+    ) -> None:
+        """Baraja de nuevo la bolsa a partir de la posición `keep`.
+
+        Las posiciones ya servidas (< keep) se conservan y se excluyen del nuevo
+        barajado, así un cambio en los aprobados no provoca repeticiones en la
+        vuelta actual. Al empezar vuelta nueva (keep=0) se evita abrir con el
+        último chiste servido.
+        """
+        seen = {
+            r[0] for r in conn.execute(
+                'SELECT chiste_id FROM chiste_bag WHERE bag = ? AND position < ?', (bag, keep)
+            ).fetchall()
+        }
+        ids = [r[0] for r in conn.execute('SELECT id FROM chistes WHERE need_approve = 0').fetchall() if r[0] not in seen]
+        random.shuffle(ids)
+        if keep == 0 and len(ids) > 1 and ids[0] == last_id:
+            ids[0], ids[-1] = ids[-1], ids[0]
+        conn.execute('DELETE FROM chiste_bag WHERE bag = ? AND position >= ?', (bag, keep))
+        conn.executemany(
+            'INSERT INTO chiste_bag (bag, position, chiste_id) VALUES (?, ?, ?)',
+            [(bag, keep + i, chiste_id) for i, chiste_id in enumerate(ids)],
+        )
+        conn.execute(
+            """
+            INSERT INTO chiste_bag_state (bag, cursor, size, version, last_id) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(bag) DO UPDATE SET
+                cursor = excluded.cursor, size = excluded.size, version = excluded.version
+            """,
+            (bag, keep, keep + len(ids), version, last_id),
+        )
 
     def save_chiste(
         self,
@@ -138,11 +354,15 @@ class Database:
     def save_trace(self, from_: Optional[str], to: str, data_raw: Optional[str]) -> int:
         """Inserta un trace directamente como completado ('done')."""
         now = datetime.now().isoformat(timespec='seconds')
+        now_ts = self._iso_to_epoch(now)
         with closing(self._connect()) as conn:
             cur = conn.execute(
-                'INSERT INTO traces ("from", "to", data_raw, status, created_at, updated_at) VALUES (?, ?, ?, "done", ?, ?)',
-                (from_, to, data_raw, now, now),
+                'INSERT INTO traces ("from", "to", data_raw, status, created_at, updated_at, created_ts, updated_ts) '
+                'VALUES (?, ?, ?, "done", ?, ?, ?, ?)',
+                (from_, to, data_raw, now, now, now_ts, now_ts),
             )
+            self._record_trace_result(conn, to, int(cur.lastrowid), 'done', self._iso_to_epoch(now))
+            self._store_trace_route(conn, int(cur.lastrowid))
             conn.commit()
             return int(cur.lastrowid)
 
@@ -158,55 +378,100 @@ class Database:
             if row:
                 return int(row['id'])
             cur2 = conn.execute(
-                'INSERT INTO traces ("to", status, created_at) VALUES (?, "pending", ?)',
-                (node_id, now),
+                'INSERT INTO traces ("to", status, created_at, created_ts) VALUES (?, "pending", ?, ?)',
+                (node_id, now, self._iso_to_epoch(now)),
             )
+            trace_id = int(cur2.lastrowid)
+            conn.execute('INSERT OR IGNORE INTO trace_state (node_id) VALUES (?)', (node_id,))
+            conn.execute('UPDATE trace_state SET pending_trace_id = ? WHERE node_id = ?', (trace_id, node_id))
             conn.commit()
-            return int(cur2.lastrowid)
+        wake_main_loop(WAKE_TRACE)
+        return trace_id
 
-    def get_next_pending_trace(self, router_identifiers: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
-        """Obtiene el trace pendiente más prioritario (routers primero, luego por created_at ASC)."""
-        router_idents = [str(r).upper() for r in (router_identifiers or [])]
+    def get_next_pending_trace(
+        self,
+        router_identifiers: Optional[List[str]] = None,
+        exclude_ids: Optional[Iterable[int]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Obtiene el trace pendiente más prioritario (routers primero, luego por created_at ASC).
+
+        La prioridad es la precalculada en trace_state (0 = router cercano). Se
+        mantiene router_identifiers por compatibilidad: los routers configurados
+        forman parte de la política guardada por get_next_node_to_trace.
+        exclude_ids omite traces ya en vuelo (siguen 'pending' hasta su resultado).
+        """
+        exclude = [int(i) for i in (exclude_ids or [])]
+        not_in = f'AND t.id NOT IN ({",".join("?" for _ in exclude)})' if exclude else ''
         with closing(self._connect()) as conn:
-            query = """
+            cur = conn.execute(
+                f"""
                 SELECT t.id, t."to", t.created_at
                 FROM traces t
-                LEFT JOIN nodes n ON n.node_id = t."to"
-                WHERE t.status = "pending"
-                ORDER BY
-                    CASE
-                        WHEN n.role IN (2, 4, 9)
-                          OR UPPER(COALESCE(n.role, '')) IN ('ROUTER', 'ROUTER_LATE', 'REPEATER')
-                          OR UPPER(COALESCE(n.short_name, '')) IN ({ro_placeholders})
-                          OR UPPER(COALESCE(t."to", '')) IN ({ro_placeholders})
-                        THEN 0 ELSE 1
-                    END,
-                    t.created_at ASC
+                LEFT JOIN trace_state s ON s.node_id = t."to"
+                WHERE t.status = "pending" {not_in}
+                ORDER BY COALESCE(s.priority, 1), t.created_at ASC
                 LIMIT 1
-            """.format(
-                ro_placeholders=','.join(['?'] * len(router_idents)) if router_idents else "''"
+                """,
+                tuple(exclude),
             )
-            params = tuple(router_idents * 2) if router_idents else ()
-            cur = conn.execute(query, params)
             row = cur.fetchone()
             return dict(row) if row else None
 
+    def count_pending_traces(self) -> int:
+        """Número de traces en cola (status 'pending'), incluidos los que están en vuelo."""
+        with closing(self._connect()) as conn:
+            return int(conn.execute('SELECT COUNT(*) FROM traces WHERE status = \'pending\'').fetchone()[0])
+
+    def get_trace_rtt(self, node_id: str) -> Optional[int]:
+        """Tiempo de respuesta esperado (ms) de un traceroute al nodo.
+
+        El propio del nodo (media móvil de sus traces completados) o, si aún no
+        tiene, la media de los nodos a su misma distancia en saltos. None si no
+        hay histórico con el que estimarlo.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                """
+                SELECT s.rtt_ms,
+                       (SELECT CAST(AVG(h.rtt_ms) AS INTEGER)
+                        FROM trace_state h
+                        WHERE h.rtt_ms IS NOT NULL AND h.rtt_hops = COALESCE(s.rtt_hops, n.hops)) AS hop_rtt_ms
+                FROM (SELECT ? AS node_id) q
+                LEFT JOIN trace_state s ON s.node_id = q.node_id
+                LEFT JOIN nodes n ON n.node_id = q.node_id
+                """,
+                (node_id,),
+            ).fetchone()
+        if row['rtt_ms'] is not None:
+            return int(row['rtt_ms'])
+        return int(row['hop_rtt_ms']) if row['hop_rtt_ms'] is not None else None
+
     def cleanup_stale_pending_traces(self, max_age_minutes: int = 15) -> int:
         """Marca como error trazas que lleven más de max_age_minutes en estado pending sin procesar."""
+        now_iso = datetime.now().isoformat(timespec='seconds')
+        now_ts = self._iso_to_epoch(now_iso)
         with closing(self._connect()) as conn:
-            cur = conn.execute(
+            stale = conn.execute(
+                'SELECT id, "to" FROM traces WHERE status = \'pending\' AND created_ts <= ?',
+                (now_ts - int(max_age_minutes) * 60,),
+            ).fetchall()
+            if not stale:
+                return 0
+            conn.executemany(
                 """
                 UPDATE traces
                 SET status = 'error',
                     data_raw = 'Timeout: cola pendiente expirada',
-                    updated_at = datetime('now', 'localtime')
-                WHERE status = 'pending'
-                  AND strftime('%s', 'now', 'localtime') - strftime('%s', created_at) >= ?
+                    updated_at = ?,
+                    updated_ts = ?
+                WHERE id = ?
                 """,
-                (int(max_age_minutes) * 60,),
+                [(now_iso, now_ts, r['id']) for r in stale],
             )
+            for r in stale:
+                self._record_trace_result(conn, r['to'], r['id'], 'error', now_ts)
             conn.commit()
-            return cur.rowcount
+            return len(stale)
 
     def mark_trace_done(self, trace_id: int, ok: bool, payload: str, from_: str = 'local') -> None:
         """Marca un trace pendiente como procesado, guardando resultado y sellando updated_at.
@@ -219,9 +484,12 @@ class Database:
         status = 'done' if ok else 'error'
         with closing(self._connect()) as conn:
             conn.execute(
-                'UPDATE traces SET status = ?, data_raw = ?, "from" = ?, updated_at = ? WHERE id = ?',
-                (status, payload, from_, when_str, trace_id),
+                'UPDATE traces SET status = ?, data_raw = ?, "from" = ?, updated_at = ?, updated_ts = ? WHERE id = ?',
+                (status, payload, from_, when_str, self._iso_to_epoch(when_str), trace_id),
             )
+            self._record_trace_result(conn, self._trace_target(conn, trace_id), trace_id, status, self._iso_to_epoch(when_str))
+            if ok:
+                self._store_trace_route(conn, trace_id)
             conn.commit()
 
     def mark_trace_done_with_route(
@@ -235,62 +503,142 @@ class Database:
         hops: Optional[List[Dict[str, Any]]] = None,
         return_hops: Optional[List[Dict[str, Any]]] = None,
         from_: str = 'local',
+        rtt_ms: Optional[int] = None,
     ) -> None:
         """Marca un trace pendiente como procesado y guarda campos enriquecidos.
 
         - text: cadena completa del trace (se almacena en data_raw)
         - to_name / to_name_short: nombres del destino (si disponibles)
-        - hops: lista de hasta 7 dicts con claves: id, name, name_short, snr, rssi (ida)
-        - return_hops: lista de hasta 7 dicts (regreso) con las mismas claves
+        - hops: lista de dicts con claves: id, snr, rssi (ida), sin límite de saltos
+        - return_hops: lista de dicts (regreso) con las mismas claves
+        - rtt_ms: tiempo de respuesta medido; en un trace correcto actualiza la
+          media móvil del nodo en trace_state (ver get_trace_rtt)
+
+        Los saltos se guardan en `trace_hops` (una fila por salto); los nombres
+        se resuelven al leer con JOIN a `nodes`.
         """
         when_str = datetime.now().isoformat(timespec='seconds')
         status = 'done' if ok else 'error'
         hops = hops or []
         return_hops = return_hops or []
 
-        # Preparar columnas y valores
-        set_cols: List[str] = [
-            'status = ?',
-            'data_raw = ?',
-            '"from" = ?',
-            'updated_at = ?',
-            'hops = ?',
-            'hops_back = ?',
-            'to_name = ?',
-            'to_name_short = ?',
-        ]
         # Cálculo de número de saltos: contamos nodos en la lista y restamos 1 para excluir el destino/origen final
         hops_count = max(len(hops) - 1, 0) if hops else 0
         hops_back_count = max(len(return_hops) - 1, 0) if return_hops else 0
-        values: List[Any] = [status, text, from_, when_str, hops_count, hops_back_count, to_name, to_name_short]
-
-        # Rellenar hop1..hop7
-        for i in range(1, 8):
-            item = hops[i - 1] if i - 1 < len(hops) else None
-            for suffix in ('id', 'name', 'name_short', 'snr', 'rssi'):
-                set_cols.append(f'hop{i}_{suffix} = ?')
-                if item:
-                    values.append(item.get(suffix))
-                else:
-                    values.append(None)
-
-        # Rellenar hop_return1..hop_return7
-        for i in range(1, 8):
-            item = return_hops[i - 1] if i - 1 < len(return_hops) else None
-            for suffix in ('id', 'name', 'name_short', 'snr', 'rssi'):
-                set_cols.append(f'hop_return{i}_{suffix} = ?')
-                if item:
-                    values.append(item.get(suffix))
-                else:
-                    values.append(None)
 
-        values.append(trace_id)
+        hop_rows: List[Tuple[Any, ...]] = []
+        for direction, items in (('forward', hops), ('return', return_hops)):
+            for idx, item in enumerate(items, start=1):
+                if not item:
+                    continue
+                hop_rows.append((trace_id, direction, idx, item.get('id'), item.get('snr'), item.get('rssi')))
 
-        sql = f'UPDATE traces SET {", ".join(set_cols)} WHERE id = ?'
         with closing(self._connect()) as conn:
-            conn.execute(sql, tuple(values))
+            conn.execute(
+                """
+                UPDATE traces
+                SET status = ?, data_raw = ?, "from" = ?, updated_at = ?, updated_ts = ?,
+                    hops = ?, hops_back = ?, to_name = ?, to_name_short = ?
+                WHERE id = ?
+                """,
+                (status, text, from_, when_str, self._iso_to_epoch(when_str),
+                 hops_count, hops_back_count, to_name, to_name_short, trace_id),
+            )
+            conn.execute('DELETE FROM trace_hops WHERE trace_id = ?', (trace_id,))
+            if hop_rows:
+                conn.executemany(
+                    'INSERT INTO trace_hops (trace_id, direction, idx, node_id, snr, rssi) VALUES (?, ?, ?, ?, ?, ?)',
+                    hop_rows,
+                )
+            target = self._trace_target(conn, trace_id)
+            self._record_trace_result(conn, target, trace_id, status, self._iso_to_epoch(when_str))
+            if ok and rtt_ms is not None and target:
+                conn.execute(
+                    """
+                    UPDATE trace_state
+                    SET rtt_ms = CASE WHEN rtt_ms IS NULL THEN ? ELSE (rtt_ms * 3 + ?) / 4 END,
+                        rtt_hops = ?
+                    WHERE node_id = ?
+                    """,
+                    (int(rtt_ms), int(rtt_ms), hops_count, target),
+                )
+            if ok:
+                self._store_trace_route(conn, trace_id)
             conn.commit()
 
+    @staticmethod
+    def _trace_tables(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+        """Pares (traces, trace_hops) a consultar para el histórico de rutas.
+
+        Con el histórico separado (DB_HISTORY_SPLIT) incluye también
+        traces_archive/trace_hops_archive, donde archive_traces mueve los antiguos.
+        """
+        tables = [("main.traces", "main.trace_hops")]
+        if table_schema(conn, "traces_archive") == HISTORY_SCHEMA:
+            tables.append((f"{HISTORY_SCHEMA}.traces_archive", f"{HISTORY_SCHEMA}.trace_hops_archive"))
+        return tables
+
+    def get_trace_hops(self, trace_ids: Iterable[int]) -> Dict[int, Dict[str, List[Dict[str, Any]]]]:
+        """Saltos de varias trazas en una sola consulta (también las archivadas).
+
+        Devuelve {trace_id: {'forward': [...], 'return': [...]}} con dicts
+        id, name, name_short, snr, rssi ordenados por posición.
+        """
+        ids = [int(t) for t in trace_ids]
+        out: Dict[int, Dict[str, List[Dict[str, Any]]]] = {t: {'forward': [], 'return': []} for t in ids}
+        if not ids:
+            return out
+        placeholders = ','.join('?' for _ in ids)
+        with closing(self._connect()) as conn:
+            tables = self._trace_tables(conn)
+            hops = " UNION ALL ".join(
+                f"SELECT trace_id, direction, idx, node_id, snr, rssi FROM {hop_table} "
+                f"WHERE trace_id IN ({placeholders})"
+                for _, hop_table in tables
+            )
+            cur = conn.execute(
+                f"""
+                SELECT h.trace_id, h.direction, h.node_id, h.snr, h.rssi,
+                       n.name, n.short_name
+                FROM ({hops}) h
+                LEFT JOIN nodes n ON n.node_id = h.node_id
+                ORDER BY h.trace_id, h.direction, h.idx
+                """,
+                tuple(ids) * len(tables),
+            )
+            for r in cur.fetchall():
+                out[r['trace_id']].setdefault(r['direction'], []).append({
+                    'id': r['node_id'],
+                    'name': r['name'],
+                    'name_short': r['short_name'],
+                    'snr': r['snr'],
+                    'rssi': r['rssi'],
+                })
+        return out
+
+    def get_node_link_history(self, node_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Histórico de apariciones de un nodo como salto en traceroutes (más reciente primero).
+
+        Incluye los traces archivados cuando el histórico está separado.
+        """
+        with closing(self._connect()) as conn:
+            tables = self._trace_tables(conn)
+            sql = " UNION ALL ".join(
+                f"""
+                SELECT h.trace_id, h.direction, h.idx, h.snr, h.rssi,
+                       t."to", t.to_name, t.to_name_short, t.updated_at
+                FROM {hop_table} h
+                JOIN {trace_table} t ON t.id = h.trace_id
+                WHERE h.node_id = ?
+                """
+                for trace_table, hop_table in tables
+            )
+            cur = conn.execute(
+                f"{sql} ORDER BY trace_id DESC LIMIT ?",
+                (node_id,) * len(tables) + (int(limit),),
+            )
+            return [dict(r) for r in cur.fetchall()]
+
     def get_last_trace_updated_at(self) -> Optional[str]:
         """Devuelve el timestamp (ISO) del último trace procesado (updated_at no NULL)."""
         with closing(self._connect()) as conn:
@@ -315,15 +663,26 @@ class Database:
         - to_id se guarda en la columna "to"
         - hops se guarda en la columna hops
         - data_raw debe ser un string (p.ej., JSON) con los datos crudos
+
+        Con el agrupado de escrituras activo (Models/WriteBatcher.py) la fila se
+        escribe en el siguiente volcado y devuelve 0.
         """
+        now = datetime.now().isoformat(timespec='seconds')
+        row = (from_id, to_id, from_name, hops, data_raw, now, self._iso_to_epoch(now))
+        batcher = WriteBatcher.active()
+        if batcher is not None:
+            # Modo SD: se escribe en el siguiente volcado agrupado (sin id aún)
+            batcher.add('pings', row, db=self)
+            return 0
         with closing(self._connect()) as conn:
-            cur = conn.execute(
-                'INSERT INTO pings ("from", "to", from_name, hops, data_raw) VALUES (?, ?, ?, ?, ?)',
-                (from_id, to_id, from_name, hops, data_raw),
-            )
+            cur = conn.execute(self._PING_INSERT, row)
             conn.commit()
             return int(cur.lastrowid)
 
+    _PING_INSERT = (
+        'INSERT INTO pings ("from", "to", from_name, hops, data_raw, created_at, created_ts) VALUES (?, ?, ?, ?, ?, ?, ?)'
+    )
+
     # ---------- QUEUE ----------
     def get_next_in_queue(self) -> Optional[Dict[str, Any]]:
         """TODO: Obtener el siguiente elemento de la cola (queue).
@@ -366,7 +725,7 @@ class Database:
     # ---------- NODES ----------
     def get_node(self, node_id: str) -> Optional[Dict[str, Any]]:
         """Obtiene un nodo por su node_id."""
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             cur = conn.execute(
                 """
                 SELECT node_id, name, num, short_name, mac_addr, hw_model, role, is_favorite,
@@ -380,26 +739,83 @@ class Database:
             row = cur.fetchone()
             return dict(row) if row else None
 
-    def get_node_by_identifier(self, identifier: str) -> Optional[Dict[str, Any]]:
-        """Busca un nodo por node_id, nombre corto o nombre largo (case-insensitive)."""
-        if not identifier:
-            return None
-        with closing(self._connect()) as conn:
-            cur = conn.execute(
-                """
-                SELECT node_id, name, num, short_name, mac_addr, hw_model, role, is_favorite,
-                       snr, rssi, public_key, hops, hop_start, uptime, via_mqtt,
-                       battery, voltage, last_heard, updated_at
-                FROM nodes
-                WHERE UPPER(node_id) = UPPER(?)
-                   OR UPPER(short_name) = UPPER(?)
-                   OR UPPER(name) = UPPER(?)
-                ORDER BY updated_at DESC LIMIT 1
+    # Tipos de coincidencia de resolve_identifier, por orden de preferencia
+    IDENTIFIER_KINDS = ("node_id", "num", "short_name", "name")
+
+    def resolve_identifier(self, identifier: str) -> Dict[str, Any]:
+        """Resuelve un identificador de nodo con una única consulta indexada.
+
+        Acepta `!hex` (node_id), número decimal (`num`), nombre corto o nombre
+        largo (sin distinguir mayúsculas). Gana el tipo de coincidencia más
+        fuerte (IDENTIFIER_KINDS); dentro de él, el nodo actualizado más
+        recientemente.
+
+        Devuelve {"node": dict|None, "kind": str|None, "candidates": [dict...],
+        "ambiguous": bool}, donde candidates son todos los nodos del tipo
+        ganador (más de uno si, p. ej., dos nodos comparten nombre corto).
+        """
+        result: Dict[str, Any] = {"node": None, "kind": None, "candidates": [], "ambiguous": False}
+        ident = str(identifier or '').strip()
+        if not ident:
+            return result
+
+        node_id: Optional[str] = None
+        num: Optional[int] = None
+        if ident.startswith('!'):
+            node_id = ident.lower()
+            try:
+                num = int(ident[1:], 16)
+            except ValueError:
+                pass
+        elif ident.isdigit():
+            num = int(ident)
+            node_id = f"!{num:08x}" if num <= 0xFFFFFFFF else None
+
+        cols = """node_id, name, num, short_name, mac_addr, hw_model, role, is_favorite,
+                  snr, rssi, public_key, hops, hop_start, uptime, via_mqtt,
+                  battery, voltage, last_heard, updated_at"""
+        with self._reader() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT 0 AS kind, {cols} FROM nodes WHERE node_id = :node_id
+                UNION ALL
+                SELECT 1, {cols} FROM nodes WHERE num = :num
+                UNION ALL
+                SELECT 2, {cols} FROM nodes WHERE short_name = :ident COLLATE NOCASE
+                UNION ALL
+                SELECT 3, {cols} FROM nodes WHERE name = :ident COLLATE NOCASE
+                ORDER BY kind, updated_at DESC
                 """,
-                (identifier, identifier, identifier),
-            )
-            row = cur.fetchone()
-            return dict(row) if row else None
+                {"node_id": node_id, "num": num, "ident": ident},
+            ).fetchall()
+        if not rows:
+            return result
+
+        best = rows[0]['kind']
+        candidates: List[Dict[str, Any]] = []
+        seen = set()
+        for r in rows:
+            if r['kind'] != best or r['node_id'] in seen:
+                continue
+            seen.add(r['node_id'])
+            d = dict(r)
+            d.pop('kind', None)
+            candidates.append(d)
+        result.update(
+            node=candidates[0],
+            kind=self.IDENTIFIER_KINDS[best],
+            candidates=candidates,
+            ambiguous=len(candidates) > 1,
+        )
+        return result
+
+    def get_node_by_identifier(self, identifier: str) -> Optional[Dict[str, Any]]:
+        """Busca un nodo por node_id, num, nombre corto o nombre largo (case-insensitive).
+
+        Ante nombres repetidos devuelve el más reciente; usar resolve_identifier
+        para saber si hubo ambigüedad.
+        """
+        return self.resolve_identifier(identifier)["node"]
 
     def get_router_nodes(
         self,
@@ -431,7 +847,7 @@ class Database:
                     found_nodes.append({'identifier': ident, 'offline': True})
 
         # 2. Auto-detectar nodos con role ROUTER, ROUTER_LATE o REPEATER (según protocolo Meshtastic)
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             query = """
                 SELECT node_id, name, num, short_name, mac_addr, hw_model, role, is_favorite,
                        snr, rssi, public_key, hops, hop_start, uptime, via_mqtt,
@@ -466,11 +882,14 @@ class Database:
         clean_id = str(node_id).strip()
         now = datetime.now().isoformat(timespec="seconds")
         with closing(self._connect()) as conn:
-            conn.execute(
+            cur = conn.execute(
                 'INSERT OR IGNORE INTO nodes (node_id, created_at, updated_at) VALUES (?, ?, ?)',
                 (clean_id, now, now),
             )
+            if cur.rowcount:
+                self._refresh_trace_state(conn, [clean_id])
             conn.commit()
+            self._write_through(conn)
 
         # Si se pasa data, realizar una actualización inicial
         if data:
@@ -482,25 +901,7 @@ class Database:
             return
         clean_id = str(node_id).strip()
 
-        allowed = {
-            "name",
-            "num",
-            "short_name",
-            "mac_addr",
-            "hw_model",
-            "role",
-            "is_favorite",
-            "snr",
-            "rssi",
-            "public_key",
-            "hops",
-            "hop_start",
-            "uptime",
-            "via_mqtt",
-            "battery",
-            "voltage",
-            "last_heard",
-        }
+        allowed = self.NODE_COLUMNS
 
         # Filtrar y preparar valores
         fields: List[str] = []
@@ -517,7 +918,8 @@ class Database:
         if not fields:
             return
 
-        values.append(datetime.now().isoformat(timespec="seconds"))
+        now = datetime.now().isoformat(timespec="seconds")
+        values.append(now)
         values.append(clean_id)
 
         set_clause = ", ".join(fields + ["updated_at = ?"])  # siempre actualizar updated_at
@@ -527,11 +929,129 @@ class Database:
                 f"UPDATE nodes SET {set_clause} WHERE node_id = ?",
                 tuple(values),
             )
+            if self.TRACE_STATE_NODE_COLUMNS.intersection(data):
+                self._refresh_trace_state(conn, [clean_id])
+            else:
+                # Solo telemetría: basta con el desempate por actividad reciente
+                conn.execute('UPDATE trace_state SET node_updated_epoch = ? WHERE node_id = ?',
+                             (self._iso_to_epoch(now), clean_id))
+            if self._NODE_NAME_COLUMNS.intersection(data):
+                self._bump_node_names_version(conn)
             conn.commit()
+            self._write_through(conn)
+
+    def upsert_nodes(self, changes: Dict[str, Dict[str, Any]]) -> int:
+        """Crea o actualiza varios nodos en una única transacción.
+
+        changes: {node_id: {columna: valor}} con solo las columnas modificadas.
+        Los nodos con el mismo conjunto de columnas se agrupan en un único
+        executemany. Devuelve el número de nodos escritos.
+        """
+        groups: Dict[Tuple[str, ...], List[Tuple[Any, ...]]] = {}
+        now = datetime.now().isoformat(timespec="seconds")
+        for node_id, data in (changes or {}).items():
+            if not node_id or str(node_id).strip() in ("", "None", "null", "Desconocido", "none"):
+                continue
+            cols = tuple(sorted(k for k in (data or {}) if k in self.NODE_COLUMNS))
+            values: List[Any] = []
+            for k in cols:
+                v = data[k]
+                if k in ("is_favorite", "via_mqtt") and v is not None:
+                    v = 1 if bool(v) else 0
+                values.append(v)
+            groups.setdefault(cols, []).append((str(node_id).strip(), *values, now, now))
+
+        if not groups:
+            return 0
+
+        written = 0
+        refresh: List[str] = []
+        others: List[str] = []
+        renamed = False
+        with closing(self._connect()) as conn:
+            for cols, rows in groups.items():
+                insert_cols = ", ".join(("node_id",) + cols + ("created_at", "updated_at"))
+                placeholders = ", ".join("?" for _ in range(len(cols) + 3))
+                updates = ", ".join(f"{c} = excluded.{c}" for c in cols + ("updated_at",))
+                conn.executemany(
+                    f"""
+                    INSERT INTO nodes ({insert_cols}) VALUES ({placeholders})
+                    ON CONFLICT(node_id) DO UPDATE SET {updates}
+                    """,
+                    rows,
+                )
+                written += len(rows)
+                if self.TRACE_STATE_NODE_COLUMNS.intersection(cols):
+                    refresh.extend(r[0] for r in rows)
+                else:
+                    others.extend(r[0] for r in rows)
+                renamed = renamed or bool(self._NODE_NAME_COLUMNS.intersection(cols))
+            # Nodos nuevos sin fila en trace_state también necesitan su prioridad;
+            # al resto solo se le actualiza el desempate por actividad reciente
+            now_epoch = self._iso_to_epoch(now)
+            for start in range(0, len(others), 500):
+                part = others[start:start + 500]
+                known = {
+                    r['node_id'] for r in conn.execute(
+                        f"SELECT node_id FROM trace_state WHERE node_id IN ({','.join('?' for _ in part)})",
+                        tuple(part),
+                    ).fetchall()
+                }
+                refresh.extend(n for n in part if n not in known)
+                conn.executemany('UPDATE trace_state SET node_updated_epoch = ? WHERE node_id = ?',
+                                 [(now_epoch, n) for n in part if n in known])
+            self._refresh_trace_state(conn, refresh)
+            if renamed:
+                self._bump_node_names_version(conn)
+            conn.commit()
+            self._write_through(conn)
+        return written
+
+    def sync_nodes(self, device_nodes: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Sincroniza en bloque la lista de nodos del dispositivo con `nodes`.
+
+        device_nodes: {node_id: {columna: valor}} tal como los ve el nodo local
+        (los valores None se ignoran para no borrar datos conocidos). Lee la
+        tabla con una única SELECT, compara en memoria y escribe solo las
+        columnas distintas con `upsert_nodes` (una transacción).
+
+        Devuelve {"rows": {node_id: fila resultante}, "total": n, "changed": n}.
+        """
+        cols = ", ".join(self.NODE_COLUMNS)
+        with self._reader() as conn:
+            existing = {
+                r['node_id']: dict(r)
+                for r in conn.execute(f"SELECT node_id, {cols}, updated_at FROM nodes").fetchall()
+            }
+
+        changes: Dict[str, Dict[str, Any]] = {}
+        rows: Dict[str, Dict[str, Any]] = {}
+        for node_id, data in (device_nodes or {}).items():
+            if not node_id or str(node_id).strip() in ("", "None", "null", "Desconocido", "none"):
+                continue
+            node_id = str(node_id).strip()
+            current = existing.get(node_id)
+            row = dict(current) if current else {"node_id": node_id}
+            diff: Dict[str, Any] = {}
+            for col, value in (data or {}).items():
+                if col not in self.NODE_COLUMNS or value is None:
+                    continue
+                if col in ("is_favorite", "via_mqtt"):
+                    value = 1 if bool(value) else 0
+                if current is None or current.get(col) != value:
+                    diff[col] = value
+            if diff or current is None:
+                changes[node_id] = diff
+                row.update(diff)
+            rows[node_id] = row
+
+        if changes:
+            self.upsert_nodes(changes)
+        return {"rows": rows, "total": len(rows), "changed": len(changes)}
 
     # ---------- TASKS CONTROL ----------
     def get_task_last_run(self, name: str) -> Optional[str]:
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             cur = conn.execute('SELECT last_run_at FROM tasks_control WHERE name = ?', (name,))
             row = cur.fetchone()
             return row['last_run_at'] if row and row['last_run_at'] else None
@@ -552,6 +1072,328 @@ class Database:
                 (name, when_str, extra),
             )
             conn.commit()
+            self._write_through(conn)
+
+    # ---------- RUTAS DE TRACES (PRECALCULADAS) ----------
+    # Versión de los nombres de nodos (tasks_control.extra). Se incrementa cuando
+    # cambia name/short_name y permite a cada proceso invalidar su caché.
+    NODE_NAMES_VERSION_TASK = 'node_names_version'
+    _NODE_NAME_COLUMNS = frozenset(("name", "short_name"))
+    # Caché de nombres por ruta de BD: {db_path: (versión, {node_id: nombre})}
+    _node_names_cache: Dict[str, Tuple[Optional[str], Dict[str, str]]] = {}
+
+    @staticmethod
+    def _route_base_set(base_identifiers: Optional[List[str]] = None) -> List[str]:
+        """Identificadores de la base (ordenados, en mayúsculas) para la ruta exterior.
+
+        Sin base_identifiers se usa la configuración (BASE_NODE_SHORT_NAME o
+        MESH_GATEWAY_SHORT_NAME y BASE_NODE_ID), igual que /routers.
+        """
+        if not base_identifiers:
+            import env as _env
+            base_short = getattr(_env, 'BASE_NODE_SHORT_NAME', None) or getattr(_env, 'MESH_GATEWAY_SHORT_NAME', 'RAU0') or 'RAU0'
+            base_identifiers = [b for b in (base_short, getattr(_env, 'BASE_NODE_ID', None)) if b]
+        return sorted({str(b).upper() for b in base_identifiers})
+
+    @staticmethod
+    def _parse_trace_route(
+        data_raw: str,
+        first_hops: Dict[str, Any],
+        hops_count: int,
+        hops_back_count: int,
+        base_set: Iterable[str],
+    ) -> Optional[Dict[str, Any]]:
+        """Calcula la ruta exterior (base -> destino) de un trace completado.
+
+        Usa las líneas "Route traced back to us" / "Route traced towards
+        destination" de data_raw y, si no están, los primeros saltos
+        estructurados (first_hops: {'return1'|'forward1'|'forward2': fila}).
+        Devuelve hops, snrs, intermediates y path como node_id (los nombres se
+        resuelven al leer) o None si no hay información útil.
+        """
+        import re
+
+        base_set = set(base_set)
+        bot_set = {"LOCAL", "!BOT", "BOT", ""}
+
+        def parse_part(part: str):
+            m = re.search(r"(!?[0-9a-fA-F]{6,8}|![0-9a-fA-F]+)", part)
+            node = m.group(1) if m else ""
+            if node and not node.startswith("!"):
+                node = "!" + node
+            m2 = re.search(r"\(([-+]?\d+(?:\.\d+)?)\s*dB\)", part)
+            snr = float(m2.group(1)) if m2 else None
+            return node.lower(), snr
+
+        def route_line(prefix: str) -> Optional[str]:
+            for i, l in enumerate(lines):
+                if l.lower().startswith(prefix):
+                    return lines[i + 1] if i + 1 < len(lines) else None
+            return None
+
+        def outer(path: List[Tuple[str, Optional[float]]], snr_items) -> Dict[str, Any]:
+            return {
+                "hops": len(path[1:-1]),
+                "snrs": [item[1] for item in snr_items if item[1] is not None],
+                "intermediates": [item[0] for item in path[1:-1]],
+                "path": [item[0] for item in path],
+            }
+
+        lines = [l.strip() for l in (data_raw or "").splitlines() if l.strip()]
+
+        # Intento 1: Ruta de vuelta (el último elemento es nuestro nodo local receptor)
+        ret_line = route_line("route traced back to us")
+        if ret_line:
+            parsed = [parse_part(p.strip()) for p in ret_line.split("-->")]
+            if len(parsed) >= 2:
+                reversed_path = parsed[:-1][::-1]
+                return outer(reversed_path, reversed_path)
+
+        # Intento 2: Ruta de ida (el primero es el Bot emisor y parsed[1] la base)
+        fwd_line = route_line("route traced towards destination")
+        if fwd_line:
+            parsed = [parse_part(p.strip()) for p in fwd_line.split("-->")]
+            if len(parsed) >= 2:
+                clean_path = parsed[1:]
+                return outer(clean_path, clean_path[1:])
+
+        # Fallback: saltos estructurados (trace_hops)
+        def single(hops: int, val: float) -> Dict[str, Any]:
+            return {"hops": hops, "snrs": [val], "intermediates": [], "path": []}
+
+        ret1 = first_hops.get("return1")
+        if ret1 is not None and ret1["snr"] is not None:
+            ret1_id = (ret1["node_id"] or "").upper()
+            ret1_short = (ret1["short_name"] or "").upper()
+            if ret1_id not in bot_set and ret1_short not in bot_set:
+                return single(max(0, hops_back_count - 1), ret1["snr"])
+            elif hops_back_count <= 1:
+                return single(0, ret1["snr"])
+
+        fwd2 = first_hops.get("forward2")
+        if fwd2 is not None and fwd2["snr"] is not None:
+            return single(max(0, hops_count - 1), fwd2["snr"])
+
+        fwd1 = first_hops.get("forward1")
+        if hops_count <= 1 and fwd1 is not None and fwd1["snr"] is not None:
+            hop1_id = (fwd1["node_id"] or "").upper()
+            hop1_short = (fwd1["short_name"] or "").upper()
+            if hop1_id not in base_set and hop1_short not in base_set:
+                return single(0, fwd1["snr"])
+
+        return None
+
+    @classmethod
+    def _trace_route_row(
+        cls,
+        conn: sqlite3.Connection,
+        trace_id: int,
+        base_set: Optional[List[str]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Calcula (sin guardar) la fila de trace_routes de un trace 'done'.
+
+        Devuelve None si el trace no existe o no está 'done'.
+        """
+        trace = conn.execute(
+            'SELECT id, "to", data_raw, hops, hops_back, updated_at FROM traces WHERE id = ? AND status = \'done\'',
+            (trace_id,),
+        ).fetchone()
+        if trace is None or not trace['to']:
+            return None
+        base_set = base_set or cls._route_base_set()
+        first: Dict[str, Any] = {}
+        for hr in conn.execute(
+            """
+            SELECT h.direction, h.idx, h.node_id, h.snr, n.short_name
+            FROM trace_hops h
+            LEFT JOIN nodes n ON n.node_id = h.node_id
+            WHERE h.trace_id = ? AND h.idx <= 2
+            """,
+            (trace_id,),
+        ).fetchall():
+            first[f'{hr["direction"]}{hr["idx"]}'] = hr
+
+        info = cls._parse_trace_route(
+            trace['data_raw'] or '', first, trace['hops'] or 0, trace['hops_back'] or 0, base_set
+        )
+        return {
+            'node_id': trace['to'],
+            'trace_id': int(trace['id']),
+            'hops': info['hops'] if info else None,
+            'snrs': json.dumps(info['snrs']) if info else None,
+            'intermediates': json.dumps(info['intermediates']) if info else None,
+            'path': json.dumps(info['path']) if info else None,
+            'snr_text': (", ".join(f"{s:.1f}dB" for s in info['snrs']) or None) if info else None,
+            'base': json.dumps(sorted(base_set)),
+            'updated_at': trace['updated_at'],
+        }
+
+    @classmethod
+    def _store_trace_route(
+        cls,
+        conn: sqlite3.Connection,
+        trace_id: int,
+        base_set: Optional[List[str]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Precalcula y guarda en trace_routes la ruta exterior de un trace 'done'.
+
+        Se llama dentro de la transacción que completa el trace (y desde la
+        migración trace_routes_backfill para los anteriores). Devuelve la fila
+        guardada (o None si el trace no existe o no está 'done').
+        """
+        row = cls._trace_route_row(conn, trace_id, base_set)
+        if row is None:
+            return None
+        conn.execute(
+            """
+            INSERT INTO trace_routes (node_id, trace_id, hops, snrs, intermediates, path, snr_text, base, updated_at)
+            VALUES (:node_id, :trace_id, :hops, :snrs, :intermediates, :path, :snr_text, :base, :updated_at)
+            ON CONFLICT(node_id) DO UPDATE SET
+                trace_id = excluded.trace_id,
+                hops = excluded.hops,
+                snrs = excluded.snrs,
+                intermediates = excluded.intermediates,
+                path = excluded.path,
+                snr_text = excluded.snr_text,
+                base = excluded.base,
+                updated_at = excluded.updated_at
+            WHERE excluded.updated_at >= COALESCE(trace_routes.updated_at, '')
+               OR excluded.base <> trace_routes.base
+            """,
+            row,
+        )
+        return row
+
+    @classmethod
+    def _bump_node_names_version(cls, conn: sqlite3.Connection) -> None:
+        """Invalida las cachés de nombres (de todos los procesos) tras renombrar nodos."""
+        conn.execute(
+            """
+            INSERT INTO tasks_control (name, last_run_at, extra) VALUES (?, ?, '1')
+            ON CONFLICT(name) DO UPDATE SET
+                last_run_at = excluded.last_run_at,
+                extra = CAST(COALESCE(tasks_control.extra, '0') AS INTEGER) + 1
+            """,
+            (cls.NODE_NAMES_VERSION_TASK, datetime.now().isoformat(timespec='seconds')),
+        )
+
+    def _resolve_node_names(self, conn: sqlite3.Connection, node_ids: Iterable[str]) -> Dict[str, str]:
+        """Nombre visible (short_name, name o el propio id) de varios nodos.
+
+        Cada identificador se busca por node_id y, si no coincide ninguno, por
+        nombre corto (sin distinguir mayúsculas). Usa una caché por proceso que
+        se descarta cuando cambia la versión de nombres; los que falten se
+        consultan en una sola query.
+        """
+        row = conn.execute('SELECT extra FROM tasks_control WHERE name = ?', (self.NODE_NAMES_VERSION_TASK,)).fetchone()
+        version = row['extra'] if row else None
+        cached = Database._node_names_cache.get(self.db_path)
+        if cached is None or cached[0] != version:
+            cached = (version, {})
+            Database._node_names_cache[self.db_path] = cached
+        names = cached[1]
+
+        missing = [n for n in dict.fromkeys(node_ids) if n and n not in names]
+        for start in range(0, len(missing), 500):
+            part = missing[start:start + 500]
+            placeholders = ','.join('?' for _ in part)
+            by_id: Dict[str, str] = {}
+            by_short: Dict[str, str] = {}
+            for r in conn.execute(
+                f"""
+                SELECT node_id, short_name, name FROM nodes
+                WHERE node_id IN ({placeholders}) OR short_name COLLATE NOCASE IN ({placeholders})
+                ORDER BY updated_at
+                """,
+                tuple(part) * 2,
+            ).fetchall():
+                label = r['short_name'] or r['name'] or r['node_id']
+                by_id[str(r['node_id']).lower()] = label
+                if r['short_name']:
+                    # El más reciente gana si varios comparten nombre corto
+                    by_short[r['short_name'].upper()] = label
+            for n in part:
+                names[n] = by_id.get(n.lower()) or by_short.get(n.upper()) or n
+        return names
+
+    def get_latest_trace_routes(
+        self,
+        identifiers: Iterable[str],
+        base_identifiers: Optional[List[str]] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Rutas exteriores precalculadas del último trace exitoso de varios nodos.
+
+        Devuelve {identifier: info} (ver get_latest_trace_route_info) solo para
+        los que tienen información. Solo lee: las rutas se guardan en
+        trace_routes al completar el trace (y en la migración
+        trace_routes_backfill para los anteriores); si falta la fila o se
+        calculó con otra base, se calcula en memoria sin guardarla.
+        """
+        idents = [i for i in dict.fromkeys(identifiers or []) if i]
+        if not idents:
+            return {}
+        base_set = self._route_base_set(base_identifiers)
+        base_key = json.dumps(base_set)
+        # Nombres → node_id con el índice NOCASE de nodes (los traces se guardan por "to")
+        targets = {
+            ident: ident if str(ident).startswith('!') else (self.resolve_identifier(ident)["node"] or {}).get('node_id')
+            for ident in idents
+        }
+
+        with closing(self._connect()) as conn:
+            for ident in [i for i, t in targets.items() if not t]:
+                # Nombre que no está en nodes: el que se guardó con el trace
+                latest = conn.execute(
+                    """
+                    SELECT "to" FROM traces
+                    WHERE (UPPER(COALESCE(to_name_short, '')) = UPPER(?) OR UPPER(COALESCE(to_name, '')) = UPPER(?))
+                      AND status = 'done'
+                    ORDER BY updated_at DESC
+                    LIMIT 1
+                    """,
+                    (ident, ident),
+                ).fetchone()
+                targets[ident] = latest['to'] if latest else None
+            keys = [t for t in dict.fromkeys(targets.values()) if t]
+            if not keys:
+                return {}
+            stored = {
+                r['node_id']: dict(r)
+                for r in conn.execute(
+                    f"SELECT * FROM trace_routes WHERE node_id IN ({','.join('?' for _ in keys)})",
+                    tuple(keys),
+                ).fetchall()
+            }
+            routes: Dict[str, Dict[str, Any]] = {}
+            for ident, target in targets.items():
+                if not target:
+                    continue
+                row = stored.get(target)
+                if row is not None and row['base'] != base_key:
+                    # Calculada con otra base (base explícita o configuración cambiada)
+                    row = self._trace_route_row(conn, row['trace_id'], base_set)
+                elif row is None:
+                    latest = conn.execute(
+                        'SELECT id FROM traces WHERE "to" = ? AND status = \'done\' ORDER BY updated_at DESC LIMIT 1',
+                        (target,),
+                    ).fetchone()
+                    row = self._trace_route_row(conn, latest['id'], base_set) if latest else None
+                if row is not None and row['hops'] is not None:
+                    routes[ident] = row
+
+            node_ids = [n for r in routes.values() for n in json.loads(r['intermediates'] or '[]')]
+            names = self._resolve_node_names(conn, node_ids) if node_ids else {}
+
+        return {
+            ident: {
+                "hops": r['hops'],
+                "snrs": json.loads(r['snrs'] or '[]'),
+                "intermediates": [names.get(n, n) for n in json.loads(r['intermediates'] or '[]')],
+                "path": json.loads(r['path'] or '[]'),
+                "snr_text": r['snr_text'],
+            }
+            for ident, r in routes.items()
+        }
 
     def get_latest_trace_route_info(
         self,
@@ -563,136 +1405,15 @@ class Database:
         Retorna un dict con:
         - 'hops': saltos exteriores entre la base y el destino (0 para directo, 1 para 1 repetidor intermedio, etc.)
         - 'snrs': lista de floats con el SNR de cada tramo exterior (desde la base hacia el destino)
-        - 'intermediates': lista de identificadores/nombres de repetidores intermedios
+        - 'intermediates': lista de nombres de repetidores intermedios
+        - 'path': node_id desde la base hasta el destino (vacío si solo hay saltos estructurados)
         - 'snr_text': cadena formateada, ej. '5.2dB' o '9.0dB, 9.3dB'
+
+        La ruta se precalcula al completar el trace (tabla trace_routes).
         """
         if not identifier:
             return None
-        import re
-
-        with closing(self._connect()) as conn:
-            cur = conn.execute(
-                """
-                SELECT * FROM traces
-                WHERE ("to" = ? OR UPPER(COALESCE(to_name_short, '')) = UPPER(?) OR UPPER(COALESCE(to_name, '')) = UPPER(?))
-                  AND status = 'done'
-                ORDER BY updated_at DESC
-                LIMIT 1
-                """,
-                (identifier, identifier, identifier),
-            )
-            row = cur.fetchone()
-            if not row:
-                return None
-
-            row_dict = dict(row)
-            data_raw = row_dict.get("data_raw") or ""
-
-            base_set = {str(b).upper() for b in (base_identifiers or ["RAU0"])}
-            bot_set = {"LOCAL", "!BOT", "BOT", ""}
-
-            def parse_part(part: str):
-                m = re.search(r"(!?[0-9a-fA-F]{6,8}|![0-9a-fA-F]+)", part)
-                node = m.group(1) if m else ""
-                if node and not node.startswith("!"):
-                    node = "!" + node
-                m2 = re.search(r"\(([-+]?\d+(?:\.\d+)?)\s*dB\)", part)
-                snr = float(m2.group(1)) if m2 else None
-                return node.upper(), snr
-
-            lines = [l.strip() for l in data_raw.splitlines() if l.strip()]
-
-            # Intento 1: Ruta de vuelta (Route traced back to us)
-            ret_line = None
-            for i, l in enumerate(lines):
-                if l.lower().startswith("route traced back to us"):
-                    if i + 1 < len(lines):
-                        ret_line = lines[i + 1]
-                    break
-
-            if ret_line:
-                parts = [p.strip() for p in ret_line.split("-->")]
-                parsed = [parse_part(p) for p in parts]
-                if len(parsed) >= 2:
-                    # El último elemento es siempre nuestro nodo local receptor (Bot)
-                    clean_path = parsed[:-1]
-                    reversed_path = clean_path[::-1]
-                    def resolve_names(n_list):
-                        out_names = []
-                        for n_id in n_list:
-                            nr = conn.execute("SELECT short_name, name FROM nodes WHERE UPPER(node_id) = UPPER(?) OR UPPER(short_name) = UPPER(?) LIMIT 1", (n_id, n_id)).fetchone()
-                            if nr and nr["short_name"]:
-                                out_names.append(nr["short_name"])
-                            elif nr and nr["name"]:
-                                out_names.append(nr["name"])
-                            else:
-                                out_names.append(n_id)
-                        return out_names
-
-                    snrs = [item[1] for item in reversed_path if item[1] is not None]
-                    intermediate_nodes = resolve_names([item[0] for item in reversed_path[1:-1]])
-                    hops = len(intermediate_nodes)
-                    snr_text = ", ".join(f"{s:.1f}dB" for s in snrs) if snrs else None
-                    return {
-                        "hops": hops,
-                        "snrs": snrs,
-                        "intermediates": intermediate_nodes,
-                        "snr_text": snr_text,
-                    }
-
-            # Intento 2: Ruta de ida (Route traced towards destination)
-            fwd_line = None
-            for i, l in enumerate(lines):
-                if l.lower().startswith("route traced towards destination"):
-                    if i + 1 < len(lines):
-                        fwd_line = lines[i + 1]
-                    break
-
-            if fwd_line:
-                parts = [p.strip() for p in fwd_line.split("-->")]
-                parsed = [parse_part(p) for p in parts]
-                if len(parsed) >= 2:
-                    # El primer elemento es siempre nuestro nodo local emisor (Bot)
-                    # parsed[1] es la base/antena
-                    clean_path = parsed[1:]
-                    # Tramo exterior: desde la base hasta el destino
-                    snrs = [item[1] for item in clean_path[1:] if item[1] is not None]
-                    intermediate_nodes = resolve_names([item[0] for item in clean_path[1:-1]])
-                    hops = len(intermediate_nodes)
-                    snr_text = ", ".join(f"{s:.1f}dB" for s in snrs) if snrs else None
-                    return {
-                        "hops": hops,
-                        "snrs": snrs,
-                        "intermediates": intermediate_nodes,
-                        "snr_text": snr_text,
-                    }
-
-            # Fallback: columnas estructuradas de BD
-            hops_count = row_dict.get("hops") or 0
-            hops_back_count = row_dict.get("hops_back") or 0
-
-            if row_dict.get("hop_return1_snr") is not None:
-                ret1_id = (row_dict.get("hop_return1_id") or "").upper()
-                ret1_short = (row_dict.get("hop_return1_name_short") or "").upper()
-                if ret1_id not in bot_set and ret1_short not in bot_set:
-                    val = row_dict.get("hop_return1_snr")
-                    return {"hops": max(0, hops_back_count - 1), "snrs": [val], "intermediates": [], "snr_text": f"{val:.1f}dB"}
-                elif hops_back_count <= 1:
-                    val = row_dict.get("hop_return1_snr")
-                    return {"hops": 0, "snrs": [val], "intermediates": [], "snr_text": f"{val:.1f}dB"}
-
-            if row_dict.get("hop2_snr") is not None:
-                val = row_dict.get("hop2_snr")
-                return {"hops": max(0, hops_count - 1), "snrs": [val], "intermediates": [], "snr_text": f"{val:.1f}dB"}
-
-            if hops_count <= 1 and row_dict.get("hop1_snr") is not None:
-                hop1_id = (row_dict.get("hop1_id") or "").upper()
-                hop1_short = (row_dict.get("hop1_name_short") or "").upper()
-                if hop1_id not in base_set and hop1_short not in base_set:
-                    val = row_dict.get("hop1_snr")
-                    return {"hops": 0, "snrs": [val], "intermediates": [], "snr_text": f"{val:.1f}dB"}
-
-            return None
+        return self.get_latest_trace_routes([identifier], base_identifiers).get(identifier)
 
     def get_latest_trace_snr(self, identifier: str, base_identifiers: Optional[List[str]] = None) -> Optional[float]:
         """Obtiene el SNR del enlace exterior con la base (o directo) desde el último trace exitoso."""
@@ -702,6 +1423,205 @@ class Database:
         return None
 
     # ---------- NODE TRACE CONTROL ----------
+    @staticmethod
+    def _iso_to_epoch(value: Optional[str]) -> Optional[int]:
+        """Convierte un ISO local (como se guardan updated_at/created_at) a epoch."""
+        if not value:
+            return None
+        try:
+            return int(datetime.fromisoformat(str(value)).timestamp())
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _trace_target(conn: sqlite3.Connection, trace_id: int) -> Optional[str]:
+        row = conn.execute('SELECT "to" FROM traces WHERE id = ?', (trace_id,)).fetchone()
+        return row['to'] if row else None
+
+    def _load_trace_policy(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        policy = dict(self.TRACE_POLICY_DEFAULTS)
+        row = conn.execute('SELECT extra FROM tasks_control WHERE name = ?', (self.TRACE_POLICY_TASK,)).fetchone()
+        if row and row['extra']:
+            try:
+                policy.update(json.loads(row['extra']))
+            except ValueError:
+                pass
+        return policy
+
+    @staticmethod
+    def _is_router(node: Dict[str, Any], router_idents: set) -> bool:
+        role = node.get('role')
+        if role in (2, 4, 9) or str(role or '').upper() in ('ROUTER', 'ROUTER_LATE', 'REPEATER'):
+            return True
+        return (str(node.get('short_name') or '').upper() in router_idents
+                or str(node.get('node_id') or '').upper() in router_idents)
+
+    def _trace_schedule(self, node: Optional[Dict[str, Any]], state: Dict[str, Any], policy: Dict[str, Any]) -> Tuple[int, int]:
+        """Calcula (priority, next_eligible_at) de un nodo según su último resultado.
+
+        priority: 0 router cercano, 1 nodo normal (o router lejano), 2 excluido
+        (MQTT, demasiado lejos o nodo desconocido).
+        """
+        idents = {str(r).upper() for r in (policy.get('router_identifiers') or [])}
+        hops = node.get('hops') if node else None
+        if not node or node.get('via_mqtt'):
+            priority = 2
+        elif self._is_router(node, idents) and (hops is None or hops <= int(policy['router_max_hops'])):
+            priority = 0
+        elif hops is None or hops <= int(policy['hops_limit']):
+            priority = 1
+        else:
+            priority = 2
+
+        last = state.get('last_updated_epoch')
+        if last is None:
+            return priority, 0
+        status = state.get('last_status')
+        if priority == 0:
+            if status == 'done':
+                wait_h = policy['router_reload_hours']
+            elif int(state.get('consecutive_errors') or 0) < int(policy['router_max_retries']):
+                wait_h = policy['router_retry_short_hours']
+            else:
+                wait_h = policy['router_retry_long_hours']
+        else:
+            wait_h = policy['reload_hours'] if status == 'done' else policy['retry_hours']
+        return priority, int(last) + int(wait_h) * 3600
+
+    def _refresh_trace_state(
+        self,
+        conn: sqlite3.Connection,
+        node_ids: Iterable[str],
+        policy: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Recalcula priority/next_eligible_at de los nodos indicados (crea la fila si falta).
+
+        Guarda también nodes.updated_at (node_updated_epoch), el desempate de
+        get_next_node_to_trace.
+        """
+        ids = list(dict.fromkeys(str(i) for i in node_ids if i))
+        if not ids:
+            return
+        policy = policy or self._load_trace_policy(conn)
+        conn.executemany('INSERT OR IGNORE INTO trace_state (node_id) VALUES (?)', [(i,) for i in ids])
+        updates: List[Tuple[int, int, Optional[int], str]] = []
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            rows = conn.execute(
+                f"""
+                SELECT s.node_id, s.last_status, s.last_updated_epoch, s.consecutive_errors,
+                       n.node_id AS known, n.role, n.short_name, n.hops, n.via_mqtt, n.updated_at
+                FROM trace_state s
+                LEFT JOIN nodes n ON n.node_id = s.node_id
+                WHERE s.node_id IN ({','.join('?' for _ in part)})
+                """,
+                tuple(part),
+            ).fetchall()
+            for r in rows:
+                d = dict(r)
+                priority, next_at = self._trace_schedule(d if d['known'] else None, d, policy)
+                updates.append((priority, next_at, self._iso_to_epoch(d['updated_at']), d['node_id']))
+        conn.executemany(
+            'UPDATE trace_state SET priority = ?, next_eligible_at = ?, node_updated_epoch = ? WHERE node_id = ?',
+            updates,
+        )
+
+    def _record_trace_result(
+        self,
+        conn: sqlite3.Connection,
+        node_id: Optional[str],
+        trace_id: int,
+        status: str,
+        when_epoch: Optional[int],
+    ) -> None:
+        """Actualiza trace_state tras procesar un trace (misma transacción que traces)."""
+        if not node_id:
+            return
+        conn.execute('INSERT OR IGNORE INTO trace_state (node_id) VALUES (?)', (node_id,))
+        conn.execute(
+            """
+            UPDATE trace_state
+            SET last_status = ?,
+                last_updated_epoch = ?,
+                consecutive_errors = CASE WHEN ? = 'done' THEN 0 ELSE consecutive_errors + 1 END,
+                pending_trace_id = CASE WHEN pending_trace_id = ? THEN NULL ELSE pending_trace_id END
+            WHERE node_id = ?
+            """,
+            (status, when_epoch, status, trace_id, node_id),
+        )
+        self._refresh_trace_state(conn, [node_id])
+
+    def rebuild_trace_state(self, node_ids: Optional[Iterable[str]] = None) -> int:
+        """Reconstruye trace_state desde el histórico de traces.
+
+        Se ejecuta sola al cambiar la política (y la primera vez tras migrar).
+        También sirve si se han editado filas de traces a mano. Devuelve el número
+        de nodos recalculados.
+        """
+        only = {str(n) for n in node_ids} if node_ids is not None else None
+        with closing(self._connect()) as conn:
+            states: Dict[str, Dict[str, Any]] = {}
+            for r in conn.execute('SELECT node_id FROM nodes').fetchall():
+                states[r['node_id']] = {'last_status': None, 'last_updated_epoch': None,
+                                        'consecutive_errors': 0, 'pending_trace_id': None}
+            for r in conn.execute(
+                """
+                SELECT t."to" AS node_id, t.status, t.updated_at
+                FROM traces t
+                JOIN (
+                    SELECT "to", MAX(updated_at) AS last_updated
+                    FROM traces
+                    WHERE updated_at IS NOT NULL AND status IN ('done', 'error')
+                    GROUP BY "to"
+                ) lp ON lp."to" = t."to" AND lp.last_updated = t.updated_at
+                WHERE t.status IN ('done', 'error')
+                ORDER BY t.id
+                """
+            ).fetchall():
+                st = states.setdefault(r['node_id'], {'consecutive_errors': 0, 'pending_trace_id': None})
+                st['last_status'] = r['status']
+                st['last_updated_epoch'] = self._iso_to_epoch(r['updated_at'])
+            for r in conn.execute(
+                """
+                SELECT t."to" AS node_id, COUNT(*) AS errs
+                FROM traces t
+                LEFT JOIN (
+                    SELECT "to", MAX(id) AS last_done FROM traces WHERE status = 'done' GROUP BY "to"
+                ) d ON d."to" = t."to"
+                WHERE t.status = 'error' AND t.id > COALESCE(d.last_done, 0)
+                GROUP BY t."to"
+                """
+            ).fetchall():
+                states.setdefault(r['node_id'], {'last_status': None, 'last_updated_epoch': None,
+                                                 'pending_trace_id': None})['consecutive_errors'] = r['errs']
+            for r in conn.execute(
+                'SELECT "to" AS node_id, MIN(id) AS pending_id FROM traces WHERE status = \'pending\' GROUP BY "to"'
+            ).fetchall():
+                states.setdefault(r['node_id'], {'last_status': None, 'last_updated_epoch': None,
+                                                 'consecutive_errors': 0})['pending_trace_id'] = r['pending_id']
+
+            if only is not None:
+                states = {k: v for k, v in states.items() if k in only}
+            conn.executemany(
+                """
+                INSERT INTO trace_state (node_id, last_status, last_updated_epoch, consecutive_errors, pending_trace_id)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(node_id) DO UPDATE SET
+                    last_status = excluded.last_status,
+                    last_updated_epoch = excluded.last_updated_epoch,
+                    consecutive_errors = excluded.consecutive_errors,
+                    pending_trace_id = excluded.pending_trace_id
+                """,
+                [
+                    (nid, st.get('last_status'), st.get('last_updated_epoch'),
+                     st.get('consecutive_errors') or 0, st.get('pending_trace_id'))
+                    for nid, st in states.items()
+                ],
+            )
+            self._refresh_trace_state(conn, states.keys())
+            conn.commit()
+            return len(states)
+
     def get_next_node_to_trace(
         self,
         *,
@@ -717,143 +1637,55 @@ class Database:
     ) -> Optional[str]:
         """Devuelve el próximo node_id candidato para traceroute.
 
-        Prioridad 1: Nodos routers cercanos (en router_identifiers o con role ROUTER/ROUTER_LATE/REPEATER)
+        Prioridad 0: Nodos routers cercanos (en router_identifiers o con role ROUTER/ROUTER_LATE/REPEATER)
                     con hops <= router_max_hops (2).
                     - Éxito previo ('done'): re-trazar cada router_reload_hours (6h).
                     - Fallo previo ('error') con < router_max_retries (5): reintentar cada router_retry_short_hours (1h).
                     - Fallo previo ('error') con >= router_max_retries (5): enfriamiento de router_retry_long_hours (24h).
-        Prioridad 2: Nodos normales y routers más lejanos (hops <= hops_limit, no MQTT)
+        Prioridad 1: Nodos normales y routers más lejanos (hops <= hops_limit, no MQTT)
                     cuya última traza exitosa tenga ≥ reload_hours (72h) o reintento de retry_hours (24h).
+
+        Las ventanas se precalculan en trace_state (next_eligible_at) al encolar y
+        al procesar cada trace, así que la selección es una única consulta
+        indexada. Entre candidatos con la misma ventana (p. ej. los nunca
+        trazados, con next_eligible_at = 0) va primero el nodo actualizado más
+        recientemente (node_updated_epoch). Si los parámetros cambian respecto a la política guardada, se
+        guardan y se recalcula trace_state completo.
         """
-        router_idents = [str(r) for r in (router_identifiers or [])]
+        policy = {
+            "hops_limit": int(hops_limit),
+            "reload_hours": int(reload_hours),
+            "router_reload_hours": int(router_reload_hours),
+            "router_max_hops": int(router_max_hops),
+            "router_retry_short_hours": int(router_retry_short_hours),
+            "router_max_retries": int(router_max_retries),
+            "router_retry_long_hours": int(router_retry_long_hours),
+            "retry_hours": int(retry_hours),
+            "router_identifiers": sorted(str(r).upper() for r in (router_identifiers or [])),
+        }
+        policy_json = json.dumps(policy, sort_keys=True)
 
         with closing(self._connect()) as conn:
-            # 1. Comprobar primero si algún ROUTER CERCANO (<= router_max_hops) necesita traceroute (prioridad 1)
-            query_routers = '''
-                WITH last_processed AS (
-                    SELECT "to" AS node_id, MAX(updated_at) AS last_updated
-                    FROM traces
-                    WHERE updated_at IS NOT NULL AND status IN ('done','error')
-                    GROUP BY "to"
-                ), last_status AS (
-                    SELECT t."to" AS node_id, t.status AS last_status, t.updated_at AS last_updated
-                    FROM traces t
-                    WHERE t.updated_at IS NOT NULL AND t.status IN ('done','error')
-                    AND t.updated_at = (
-                        SELECT MAX(t2.updated_at) FROM traces t2
-                        WHERE t2."to" = t."to" AND t2.updated_at IS NOT NULL AND t2.status IN ('done','error')
-                    )
-                ), consecutive_errors AS (
-                    SELECT t1."to" AS node_id, COUNT(*) AS err_count
-                    FROM traces t1
-                    WHERE t1.status = 'error'
-                      AND t1.id > COALESCE(
-                          (SELECT MAX(t2.id) FROM traces t2 WHERE t2."to" = t1."to" AND t2.status = 'done'),
-                          0
-                      )
-                    GROUP BY t1."to"
-                ), pend AS (
-                    SELECT "to" AS node_id, COUNT(*) AS pendings
-                    FROM traces
-                    WHERE status = 'pending'
-                    GROUP BY "to"
-                )
-                SELECT n.node_id
-                FROM nodes n
-                LEFT JOIN last_processed lp ON lp.node_id = n.node_id
-                LEFT JOIN last_status ls ON ls.node_id = n.node_id
-                LEFT JOIN consecutive_errors ce ON ce.node_id = n.node_id
-                LEFT JOIN pend p ON p.node_id = n.node_id
-                WHERE COALESCE(n.via_mqtt, 0) = 0
-                  AND (n.hops IS NULL OR n.hops <= ?)
-                  AND COALESCE(p.pendings, 0) = 0
-                  AND (
-                      n.role IN (2, 4, 9)
-                   OR UPPER(COALESCE(n.role, '')) IN ('ROUTER', 'ROUTER_LATE', 'REPEATER')
-                   OR UPPER(COALESCE(n.short_name, '')) IN ({ro_placeholders})
-                   OR UPPER(COALESCE(n.node_id, '')) IN ({ro_placeholders})
-                  )
-                  AND (
-                        lp.last_updated IS NULL
-                     OR (ls.last_status = 'done'  AND strftime('%s','now','localtime') - strftime('%s', lp.last_updated) >= ?)
-                     OR (ls.last_status = 'error' AND COALESCE(ce.err_count, 0) < ?  AND strftime('%s','now','localtime') - strftime('%s', lp.last_updated) >= ?)
-                     OR (ls.last_status = 'error' AND COALESCE(ce.err_count, 0) >= ? AND strftime('%s','now','localtime') - strftime('%s', lp.last_updated) >= ?)
-                  )
-                ORDER BY lp.last_updated ASC, n.updated_at DESC
-                LIMIT 1
-            '''.format(
-                ro_placeholders=','.join(['?'] * len(router_idents)) if router_idents else "''"
-            )
-
-            params_routers = tuple(
-                [int(router_max_hops)] + [r.upper() for r in router_idents] * 2 + [
-                    int(router_reload_hours) * 3600,
-                    int(router_max_retries),
-                    int(router_retry_short_hours) * 3600,
-                    int(router_max_retries),
-                    int(router_retry_long_hours) * 3600,
-                ]
-            ) if router_idents else (
-                int(router_max_hops),
-                int(router_reload_hours) * 3600,
-                int(router_max_retries),
-                int(router_retry_short_hours) * 3600,
-                int(router_max_retries),
-                int(router_retry_long_hours) * 3600,
-            )
+            row = conn.execute('SELECT extra FROM tasks_control WHERE name = ?', (self.TRACE_POLICY_TASK,)).fetchone()
+            stored = row['extra'] if row else None
 
-            cur = conn.execute(query_routers, params_routers)
-            row = cur.fetchone()
-            if row:
-                return row['node_id']
+        if stored != policy_json:
+            self.set_task_run(self.TRACE_POLICY_TASK, extra=policy_json)
+            self.rebuild_trace_state()
 
-            # 2. Si ningún router cercano necesita trace, seleccionar nodo normal o router lejano cumpliendo reload_hours (72h)
-            cur = conn.execute(
-                '''
-                WITH last_processed AS (
-                    SELECT "to" AS node_id, MAX(updated_at) AS last_updated
-                    FROM traces
-                    WHERE updated_at IS NOT NULL AND status IN ('done','error')
-                    GROUP BY "to"
-                ), last_status AS (
-                    SELECT t."to" AS node_id, t.status AS last_status, t.updated_at AS last_updated
-                    FROM traces t
-                    WHERE t.updated_at IS NOT NULL AND t.status IN ('done','error')
-                    AND t.updated_at = (
-                        SELECT MAX(t2.updated_at) FROM traces t2
-                        WHERE t2."to" = t."to" AND t2.updated_at IS NOT NULL AND t2.status IN ('done','error')
-                    )
-                ), pend AS (
-                    SELECT "to" AS node_id, COUNT(*) AS pendings
-                    FROM traces
-                    WHERE status = 'pending'
-                    GROUP BY "to"
-                )
-                SELECT n.node_id
-                FROM nodes n
-                LEFT JOIN last_processed lp ON lp.node_id = n.node_id
-                LEFT JOIN last_status ls ON ls.node_id = n.node_id
-                LEFT JOIN pend p ON p.node_id = n.node_id
-                WHERE COALESCE(n.via_mqtt, 0) = 0
-                  AND (n.hops IS NULL OR n.hops <= ?)
-                  AND COALESCE(p.pendings, 0) = 0
-                  AND (
-                        lp.last_updated IS NULL
-                     OR (
-                          (ls.last_status = 'done'  AND strftime('%s','now','localtime') - strftime('%s', lp.last_updated) >= ?)
-                       OR (ls.last_status = 'error' AND strftime('%s','now','localtime') - strftime('%s', lp.last_updated) >= ?)
-                        )
-                  )
-                ORDER BY n.updated_at DESC
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                """
+                SELECT node_id
+                FROM trace_state
+                WHERE pending_trace_id IS NULL
+                  AND priority < 2
+                  AND next_eligible_at <= ?
+                ORDER BY priority, next_eligible_at, node_updated_epoch DESC
                 LIMIT 1
-                ''',
-                (
-                    int(hops_limit),
-                    int(reload_hours) * 3600,
-                    int(retry_hours) * 3600,
-                ),
-            )
-            row = cur.fetchone()
+                """,
+                (int(time.time()),),
+            ).fetchone()
             return row['node_id'] if row else None
 
     # ---------- AEMET ALERTS ----------
@@ -877,14 +1709,16 @@ class Database:
         with closing(self._connect()) as conn:
             try:
                 cur = conn.execute(
-                    'INSERT INTO aemet (province, data_raw, message, data_hash, created_at, published) VALUES (?, ?, ?, ?, ?, 0)',
-                    (province, data_raw_s, message_s, h, now),
+                    'INSERT INTO aemet (province, data_raw, message, data_hash, created_at, created_ts, published) '
+                    'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                    (province, data_raw_s, message_s, h, now, self._iso_to_epoch(now)),
                 )
                 conn.commit()
-                return int(cur.lastrowid)
             except sqlite3.IntegrityError:
                 # Duplicada por hash
                 return None
+        wake_main_loop(WAKE_AEMET)
+        return int(cur.lastrowid)
 
     def aemet_bulk_insert(self, province: Optional[str], items: Iterable[Any]) -> Tuple[int, int]:
         """Inserta múltiples alertas.
@@ -1173,11 +2007,12 @@ class Database:
         now = datetime.now().isoformat(timespec='seconds')
         with closing(self._connect()) as conn:
             cur = conn.execute(
-                'INSERT INTO aemet_weather (scope, province, province_code, city, city_code, day, content, data_raw, created_at) '
-                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                (scope, province, province_code, city, city_code, day, content_s, data_raw, now),
+                'INSERT INTO aemet_weather (scope, province, province_code, city, city_code, day, content, data_raw, created_at, created_ts) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (scope, province, province_code, city, city_code, day, content_s, data_raw, now, self._iso_to_epoch(now)),
             )
             conn.commit()
+            self._write_through(conn)
             return int(cur.lastrowid)
 
     def aemet_weather_get_latest(self, scope: Optional[str] = None, province_code: Optional[str] = None) -> Optional[Dict[str, Any]]:
@@ -1189,7 +2024,7 @@ class Database:
         excluye los de previsión multi-día ('forecast') para no mezclarlos con
         el tiempo actual de /weather.
         """
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             query = "SELECT id, scope, province, province_code, city, city_code, day, content, created_at FROM aemet_weather WHERE "
             params = []
             conditions = []
@@ -1218,16 +2053,16 @@ class Database:
         """
         with closing(self._connect()) as conn:
             if hours is not None:
-                threshold = (datetime.now() - timedelta(hours=int(hours))).isoformat(timespec='seconds')
+                threshold = int(time.time()) - int(hours) * 3600
                 cur = conn.execute(
                     'SELECT id, province, data_raw, message, created_at FROM aemet '
-                    'WHERE created_at >= ? ORDER BY created_at DESC LIMIT ?',
+                    'WHERE created_ts >= ? ORDER BY created_ts DESC LIMIT ?',
                     (threshold, int(limit)),
                 )
             else:
                 cur = conn.execute(
                     'SELECT id, province, data_raw, message, created_at FROM aemet '
-                    'ORDER BY created_at DESC LIMIT ?',
+                    'ORDER BY created_ts DESC LIMIT ?',
                     (int(limit),),
                 )
             return [dict(r) for r in cur.fetchall()]
@@ -1247,19 +2082,76 @@ class Database:
         - command: nombre del comando (sin prefijo / o !), p.ej. 'ping', 'help'
         - message: texto posterior al comando y parámetros
         - parameters: reservado para uso futuro (se almacena tal cual)
+
+        Con el agrupado de escrituras activo (Models/WriteBatcher.py) el registro
+        y sus agregados se escriben en el siguiente volcado y devuelve 0.
         """
         if not command or str(command).strip() in ("", "/", "!", "None", "null"):
             return 0
         clean_node_id = str(node_id).strip() if (node_id and str(node_id).strip() not in ("", "None", "null", "Desconocido")) else None
         clean_cmd = str(command).strip().lstrip("/!").lower()
         when_str = datetime.now().isoformat(timespec='seconds')
+        row = (clean_node_id, clean_cmd, parameters, message, when_str, self._iso_to_epoch(when_str))
+        batcher = WriteBatcher.active()
+        if batcher is not None:
+            batcher.add('commands_sent', row, db=self)
+            return 0
         with closing(self._connect()) as conn:
-            cur = conn.execute(
-                'INSERT INTO commands_sent (node_id, command, parameters, message, created_at) VALUES (?, ?, ?, ?, ?)',
-                (clean_node_id, clean_cmd, parameters, message, when_str),
-            )
+            command_id = self._insert_command(conn, row)
             conn.commit()
-            return int(cur.lastrowid)
+            return command_id
+
+    @staticmethod
+    def _insert_command(conn: sqlite3.Connection, row: Tuple[Any, ...]) -> int:
+        """Inserta un comando y suma sus agregados (sin commit). Devuelve el id."""
+        clean_node_id, clean_cmd, _, _, when_str, when_ts = row
+        cur = conn.execute(
+            'INSERT INTO commands_sent (node_id, command, parameters, message, created_at, created_ts) VALUES (?, ?, ?, ?, ?, ?)',
+            row,
+        )
+        command_id = int(cur.lastrowid)
+        # Agregados incrementales (misma transacción que el registro)
+        conn.execute(
+            """
+            INSERT INTO command_rollup_hourly (hour, command, node_id, count, last_at, last_id)
+            VALUES (?, ?, ?, 1, ?, ?)
+            ON CONFLICT(hour, command, node_id) DO UPDATE SET
+                count = count + 1, last_at = excluded.last_at, last_id = excluded.last_id
+            """,
+            (when_ts - when_ts % 3600, clean_cmd, clean_node_id or '', when_str, command_id),
+        )
+        conn.execute(
+            """
+            INSERT INTO command_rollup_total (node_id, command, count, last_at, last_id)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT(node_id, command) DO UPDATE SET
+                count = count + 1, last_at = excluded.last_at, last_id = excluded.last_id
+            """,
+            (clean_node_id or '', clean_cmd, when_str, command_id),
+        )
+        return command_id
+
+    @staticmethod
+    def _command_window(since_ts: Optional[int]) -> Tuple[str, Tuple[Any, ...]]:
+        """Subconsulta de agregados de comandos desde since_ts (None = todo el histórico).
+
+        Columnas: command, node_id ('' sin nodo), count, last_at, last_id. Las
+        horas completas salen de command_rollup_hourly; el tramo inicial hasta
+        la siguiente hora en punto se lee de commands_sent (rango indexado sobre
+        created_ts, como mucho una hora de registros).
+        """
+        if since_ts is None:
+            return "(SELECT command, node_id, count, last_at, last_id FROM command_rollup_total)", ()
+        full_start = -(-int(since_ts) // 3600) * 3600
+        sql = """(
+            SELECT command, node_id, count, last_at, last_id
+            FROM command_rollup_hourly WHERE hour >= ?
+            UNION ALL
+            SELECT command, COALESCE(node_id, ''), 1, created_at, id
+            FROM commands_sent
+            WHERE created_ts >= ? AND created_ts < ? AND command IS NOT NULL
+        )"""
+        return sql, (full_start, int(since_ts), full_start)
 
     # ---------- TIDES (mareas) ----------
     def tides_insert(self, *, location: Optional[str], source: str, approximate: bool,
@@ -1282,12 +2174,13 @@ class Database:
                 (location, source, 1 if approximate else 0, json.dumps(norm, ensure_ascii=False), now),
             )
             conn.commit()
+            self._write_through(conn)
             return int(cur.lastrowid)
 
     def tides_get_latest(self) -> Optional[Dict[str, Any]]:
         """Devuelve la última predicción de mareas (extremos ya parseados) o None."""
         import json
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             cur = conn.execute(
                 'SELECT id, location, source, approximate, extremes, created_at '
                 'FROM tides ORDER BY created_at DESC, id DESC LIMIT 1'
@@ -1318,12 +2211,20 @@ class Database:
         now = datetime.now()
         now_iso = now.isoformat(timespec='seconds')
         with closing(self._connect()) as conn:
+            due = [r['id'] for r in conn.execute(
+                "SELECT id FROM encuestas WHERE status = 'active' AND ends_at IS NOT NULL AND ends_at <= ?",
+                (now_iso,),
+            ).fetchall()]
+            if not due:
+                return 0
+            marks = ','.join('?' for _ in due)
             cur = conn.execute(
-                "UPDATE encuestas SET status = 'closed', closed_at = ? "
-                "WHERE status = 'active' AND ends_at IS NOT NULL AND ends_at <= ?",
-                (now_iso, now_iso),
+                f"UPDATE encuestas SET status = 'closed', closed_at = ? WHERE status = 'active' AND id IN ({marks})",
+                (now_iso, *due),
             )
             conn.commit()
+            for encuesta_id in due:
+                self._poll_updated(conn, encuesta_id, reason='expired')
             return cur.rowcount or 0
 
     def encuesta_create(self, *, owner_node_id: str, question: str,
@@ -1399,14 +2300,57 @@ class Database:
             row = cur.fetchone()
             return self._row_to_encuesta(row) if row else None
 
-    def encuesta_list_active(self, limit: int = 10) -> List[Dict[str, Any]]:
-        # Solo activas no vencidas; sin escribir en BD (ver punto 2 revisión).
+    def _encuestas_with_results(self, conn: sqlite3.Connection, where: str, params: Tuple[Any, ...],
+                                limit: int = -1) -> List[Dict[str, Any]]:
+        """Encuestas que cumplen `where` con su recuento, en una única consulta.
+
+        Añade a cada encuesta counts (votos por opción) y total_votes, leídos de
+        encuesta_recuento (mantenida por triggers) en lugar de agrupar votos.
+        """
+        rows = conn.execute(
+            f"""
+            SELECT e.id, e.owner_node_id, e.question, e.options, e.created_at, e.ends_at, e.status,
+                   e.closed_at, r.option_index, r.count
+            FROM (
+                SELECT * FROM encuestas WHERE {where} ORDER BY created_at DESC, id DESC LIMIT ?
+            ) AS e
+            LEFT JOIN encuesta_recuento r ON r.encuesta_id = e.id
+            ORDER BY e.created_at DESC, e.id DESC, r.option_index
+            """,
+            (*params, int(limit)),
+        ).fetchall()
+        polls: Dict[int, Dict[str, Any]] = {}
+        for r in rows:
+            enc = polls.get(r['id'])
+            if enc is None:
+                enc = self._row_to_encuesta({k: r[k] for k in r.keys() if k not in ('option_index', 'count')})
+                enc['counts'] = [0] * len(enc['options'])
+                enc['total_votes'] = 0
+                polls[r['id']] = enc
+            if r['option_index'] is None:
+                continue
+            count = int(r['count'] or 0)
+            enc['total_votes'] += count
+            if 0 <= int(r['option_index']) < len(enc['counts']):
+                enc['counts'][int(r['option_index'])] = count
+        return list(polls.values())
+
+    def encuesta_list_active(self, limit: int = 10, with_results: bool = False) -> List[Dict[str, Any]]:
+        """Encuestas activas no vencidas (más recientes primero); no escribe en BD.
+
+        Con with_results=True cada encuesta incluye counts y total_votes (misma
+        consulta, sin una lectura de resultados por encuesta).
+        """
         now = datetime.now().isoformat(timespec='seconds')
         with closing(self._connect()) as conn:
+            if with_results:
+                return self._encuestas_with_results(
+                    conn, "status = 'active' AND (ends_at IS NULL OR ends_at > ?)", (now,), limit
+                )
             cur = conn.execute(
                 "SELECT id, owner_node_id, question, options, created_at, ends_at, status, closed_at "
                 "FROM encuestas WHERE status = 'active' AND (ends_at IS NULL OR ends_at > ?) "
-                "ORDER BY created_at DESC LIMIT ?",
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
                 (now, int(limit)),
             )
             return [self._row_to_encuesta(r) for r in cur.fetchall()]
@@ -1421,7 +2365,10 @@ class Database:
                 (now, encuesta_id, owner_node_id),
             )
             conn.commit()
-            return (cur.rowcount or 0) > 0
+            closed = (cur.rowcount or 0) > 0
+            if closed:
+                self._poll_updated(conn, encuesta_id, reason='closed')
+            return closed
 
     def encuesta_delete(self, encuesta_id: int, owner_node_id: str) -> bool:
         """Borra una encuesta y sus votos. Solo el nodo dueño.
@@ -1439,8 +2386,12 @@ class Database:
             )
             if cur.rowcount:
                 conn.execute('DELETE FROM encuesta_votos WHERE encuesta_id = ?', (encuesta_id,))
+                conn.execute('DELETE FROM encuesta_recuento WHERE encuesta_id = ?', (encuesta_id,))
             conn.commit()
-            return (cur.rowcount or 0) > 0
+            deleted = (cur.rowcount or 0) > 0
+            if deleted:
+                self._poll_updated(conn, encuesta_id, reason='deleted')
+            return deleted
 
     def encuesta_vote(self, encuesta_id: int, node_id: str, option_index: int) -> str:
         """Registra o cambia el voto de un nodo. Devuelve 'new'|'changed'|'same'.
@@ -1456,6 +2407,10 @@ class Database:
         no vota, así que dos votos del MISMO nodo no coinciden en el tiempo; el
         UPSERT se adopta como buena práctica de robustez, no para corregir un
         fallo que se diera hoy.
+
+        El recuento por opción (encuesta_recuento) lo actualizan los triggers de
+        encuesta_votos dentro de esta misma transacción, también al cambiar de
+        opción. Tras confirmar se emite el evento `poll_updated`.
         """
         now = datetime.now().isoformat(timespec='seconds')
         with closing(self._connect()) as conn:
@@ -1475,45 +2430,54 @@ class Database:
                 (encuesta_id, node_id, option_index, now, now),
             )
             conn.commit()
-            return 'new' if row is None else 'changed'
+            result = 'new' if row is None else 'changed'
+            self._poll_updated(conn, encuesta_id, reason='vote', vote=result)
+            return result
 
     def encuesta_results(self, encuesta_id: int) -> Dict[str, Any]:
-        """Devuelve {counts: [n por opción], total: int}."""
-        enc = self.encuesta_get(encuesta_id)
-        n_opts = len(enc['options']) if enc else 0
-        counts = [0] * n_opts
+        """Devuelve {counts: [n por opción], total: int} desde encuesta_recuento."""
         with closing(self._connect()) as conn:
-            cur = conn.execute(
-                'SELECT option_index, COUNT(*) AS c FROM encuesta_votos WHERE encuesta_id = ? GROUP BY option_index',
-                (encuesta_id,),
-            )
-            total = 0
-            for r in cur.fetchall():
-                idx = int(r['option_index'])
-                c = int(r['c'])
-                total += c
-                if 0 <= idx < n_opts:
-                    counts[idx] = c
-        return {'counts': counts, 'total': total}
+            polls = self._encuestas_with_results(conn, 'id = ?', (int(encuesta_id),))
+        if not polls:
+            return {'counts': [], 'total': 0}
+        return {'counts': polls[0]['counts'], 'total': polls[0]['total_votes']}
+
+    def _poll_updated(self, conn: sqlite3.Connection, encuesta_id: int, **extra: Any) -> None:
+        """Emite `poll_updated` con el recuento actual (ya confirmado) de la encuesta.
+
+        Los paneles actualizan sus contadores con el evento en lugar de volver a
+        pedir get_polls. Si la encuesta ya no existe se envía status 'deleted'.
+        """
+        try:
+            from Models.EventBroadcaster import broadcast_event
+            polls = self._encuestas_with_results(conn, 'id = ?', (int(encuesta_id),))
+            data: Dict[str, Any] = {"poll_id": int(encuesta_id), **extra}
+            if polls:
+                enc = polls[0]
+                data.update(status=enc['status'], counts=enc['counts'], total_votes=enc['total_votes'])
+            else:
+                data['status'] = 'deleted'
+            broadcast_event("poll_updated", data)
+        except Exception as e:
+            log_p(f"[Database] No se pudo emitir poll_updated: {e}", level="DEBUG")
 
     # ---------- STATS ----------
     def stats_summary(self) -> Dict[str, Any]:
         """Resumen para /stats: comandos (hoy/total), comando top, pings y nodos."""
-        today = datetime.now().date().isoformat()
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        today_sql, today_params = self._command_window(int(midnight.timestamp()))
         out: Dict[str, Any] = {}
         with closing(self._connect()) as conn:
-            row = conn.execute('SELECT COUNT(*) AS c FROM commands_sent').fetchone()
-            out['cmd_total'] = int(row['c']) if row else 0
+            # Contadores de comandos servidos desde command_rollup_*
+            row = conn.execute('SELECT SUM(count) AS c FROM command_rollup_total').fetchone()
+            out['cmd_total'] = int(row['c'] or 0) if row else 0
 
-            row = conn.execute(
-                'SELECT COUNT(*) AS c FROM commands_sent WHERE substr(created_at, 1, 10) = ?',
-                (today,),
-            ).fetchone()
-            out['cmd_today'] = int(row['c']) if row else 0
+            row = conn.execute(f'SELECT SUM(count) AS c FROM {today_sql}', today_params).fetchone()
+            out['cmd_today'] = int(row['c'] or 0) if row else 0
 
             row = conn.execute(
-                'SELECT command, COUNT(*) AS c FROM commands_sent '
-                'WHERE command IS NOT NULL GROUP BY command ORDER BY c DESC LIMIT 1'
+                'SELECT command, SUM(count) AS c FROM command_rollup_total '
+                'GROUP BY command ORDER BY c DESC LIMIT 1'
             ).fetchone()
             out['cmd_top'] = (row['command'], int(row['c'])) if row else (None, 0)
 
@@ -1533,7 +2497,7 @@ class Database:
     def nodes_overview(self, active_hours: int = 24) -> Dict[str, Any]:
         """Resumen de nodos para /nodos: total, RF, MQTT, activos recientes."""
         out: Dict[str, Any] = {}
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             row = conn.execute('SELECT COUNT(*) AS c FROM nodes').fetchone()
             out['total'] = int(row['c']) if row else 0
             row = conn.execute('SELECT COUNT(*) AS c FROM nodes WHERE COALESCE(via_mqtt,0) = 1').fetchone()
@@ -1553,10 +2517,10 @@ class Database:
 
     def get_node_by_short_name(self, short_name: str) -> Optional[Dict[str, Any]]:
         """Busca un nodo por nombre corto (case-insensitive). Devuelve dict o None."""
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             cur = conn.execute(
                 'SELECT node_id, name, short_name, snr, rssi, hops, via_mqtt, last_heard '
-                'FROM nodes WHERE UPPER(short_name) = UPPER(?) ORDER BY updated_at DESC LIMIT 1',
+                'FROM nodes WHERE short_name = ? COLLATE NOCASE ORDER BY updated_at DESC LIMIT 1',
                 (short_name,),
             )
             row = cur.fetchone()
@@ -1564,7 +2528,7 @@ class Database:
 
     def snr_average(self, exclude_mqtt: bool = True) -> Dict[str, Any]:
         """Media de SNR de los nodos con SNR conocido. Devuelve {avg, count}."""
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             sql = 'SELECT AVG(snr) AS avg, COUNT(*) AS c FROM nodes WHERE snr IS NOT NULL'
             if exclude_mqtt:
                 sql += ' AND COALESCE(via_mqtt,0) = 0'
@@ -1574,7 +2538,7 @@ class Database:
 
     def get_all_nodes(self, limit: int = 500, only_rf: bool = False) -> List[Dict[str, Any]]:
         """Devuelve la lista de nodos ordenados por favoritos y actividad reciente."""
-        with closing(self._connect()) as conn:
+        with self._reader() as conn:
             sql = """
                 SELECT node_id AS id, node_id, name, num, short_name, mac_addr, hw_model, role,
                        is_favorite, snr, rssi, hops, uptime, via_mqtt, battery, voltage, last_heard, created_at, updated_at
@@ -1601,81 +2565,204 @@ class Database:
             return results
 
     def get_recent_traces(self, limit: int = 15) -> List[Dict[str, Any]]:
-        """Devuelve los últimos traceroutes completados con sus saltos estructurados."""
+        """Devuelve los últimos traceroutes completados con sus saltos estructurados.
+
+        Incluye los traces archivados cuando el histórico está separado.
+        """
         with closing(self._connect()) as conn:
-            cur = conn.execute(
-                """
+            tables = self._trace_tables(conn)
+            sql = " UNION ALL ".join(
+                f"""
                 SELECT id, "from", "to", status, created_at, updated_at, hops, hops_back,
-                       to_name, to_name_short, data_raw,
-                       hop1_id, hop1_name, hop1_snr,
-                       hop2_id, hop2_name, hop2_snr,
-                       hop3_id, hop3_name, hop3_snr,
-                       hop4_id, hop4_name, hop4_snr,
-                       hop5_id, hop5_name, hop5_snr,
-                       hop6_id, hop6_name, hop6_snr,
-                       hop7_id, hop7_name, hop7_snr
-                FROM traces
+                       to_name, to_name_short, data_raw
+                FROM {trace_table}
                 WHERE status IN ('done', 'error')
-                ORDER BY id DESC
-                LIMIT ?
-                """,
-                (int(limit),),
+                """
+                for trace_table, _ in tables
             )
-            rows = cur.fetchall()
-            out = []
-            for r in rows:
-                item = dict(r)
-                hops_fwd = []
-                for i in range(1, 8):
-                    h_id = item.get(f"hop{i}_id")
-                    if h_id:
-                        hops_fwd.append({
-                            "id": h_id,
-                            "name": item.get(f"hop{i}_name") or h_id,
-                            "snr": item.get(f"hop{i}_snr"),
-                        })
-                item["hops_forward"] = hops_fwd
-                item["success"] = (item.get("status") == "done")
-                out.append(item)
-            return out
+            cur = conn.execute(f"{sql} ORDER BY id DESC LIMIT ?", (int(limit),))
+            rows = [dict(r) for r in cur.fetchall()]
+
+        hops_by_trace = self.get_trace_hops(r['id'] for r in rows)
+        out = []
+        for item in rows:
+            route = hops_by_trace.get(item['id'], {})
+            item["hops_forward"] = [
+                {"id": h["id"], "name": h["name"] or h["id"], "snr": h["snr"]}
+                for h in route.get('forward', []) if h["id"]
+            ]
+            item["hops_backward"] = [
+                {"id": h["id"], "name": h["name"] or h["id"], "snr": h["snr"]}
+                for h in route.get('return', []) if h["id"]
+            ]
+            item["success"] = (item.get("status") == "done")
+            out.append(item)
+        return out
 
     # ---------- OUTBOX (COLA DE MENSAJES SALIENTES) ----------
-    def enqueue_outbox(self, text: str, dest: str = '^all', channel: int = 0) -> int:
-        """Encola un mensaje para ser enviado a la malla por el proceso de radio (main.py). Deduplica si ya está pendiente."""
+    # Prioridades (menor = antes): alertas de emergencia, mensajes de operador
+    # (Gateway / Web) y peticiones NodeInfo.
+    OUTBOX_PRIORITY_ALERT = 0
+    OUTBOX_PRIORITY_OPERATOR = 1
+    OUTBOX_PRIORITY_NODEINFO = 2
+    OUTBOX_PRIORITIES = {"alert": 0, "operator": 1, "nodeinfo": 2}
+    OUTBOX_NODEINFO_TEXT = "__REQ_NODEINFO__"
+    # Reintentos tras caducar una reclamación (p. ej. caída a mitad de envío)
+    OUTBOX_MAX_ATTEMPTS = 3
+    # Hay otra copia idéntica ya pendiente (no se puede volver a 'pending' por
+    # el índice único parcial idx_outbox_pending_hash)
+    _OUTBOX_HAS_PENDING_TWIN = (
+        "EXISTS (SELECT 1 FROM outbox AS twin WHERE twin.content_hash = outbox.content_hash "
+        "AND twin.status = 'pending')"
+    )
+
+    def enqueue_outbox(
+        self,
+        text: str,
+        dest: str = '^all',
+        channel: int = 0,
+        priority: Optional[int] = None,
+        ttl: Optional[int] = None,
+    ) -> int:
+        """Encola un mensaje para ser enviado a la malla por el proceso de radio (main.py).
+
+        priority: OUTBOX_PRIORITY_* (por defecto operador, o NodeInfo para
+        peticiones __REQ_NODEINFO__). ttl: segundos de validez; None usa
+        env.OUTBOX_TTL y 0 desactiva la caducidad. Si ya hay un mensaje igual
+        pendiente (hash de destino, canal y texto) devuelve su id, subiendo su
+        prioridad si la nueva es mayor.
+        """
+        import env as _env
+        if priority is None:
+            priority = self.OUTBOX_PRIORITY_NODEINFO if text == self.OUTBOX_NODEINFO_TEXT else self.OUTBOX_PRIORITY_OPERATOR
+        if ttl is None:
+            ttl = int(getattr(_env, 'OUTBOX_TTL', 900) or 0)
         now_str = datetime.now().isoformat(timespec='seconds')
+        now_ts = self._iso_to_epoch(now_str)
+        expires_ts = now_ts + int(ttl) if ttl else None
+        digest = outbox_content_hash(text, str(dest), int(channel))
         with closing(self._connect()) as conn:
-            cur = conn.execute(
-                "SELECT id FROM outbox WHERE text = ? AND dest = ? AND channel = ? AND status = 'pending' ORDER BY id ASC LIMIT 1",
-                (text, str(dest), int(channel)),
-            )
-            row = cur.fetchone()
-            if row:
-                return int(row['id'])
-
-            cur2 = conn.execute(
-                "INSERT INTO outbox (text, dest, channel, status, created_at) VALUES (?, ?, ?, 'pending', ?)",
-                (text, str(dest), int(channel), now_str),
+            conn.execute(
+                """
+                INSERT INTO outbox (text, dest, channel, status, created_at, created_ts, priority, expires_ts, content_hash)
+                VALUES (?, ?, ?, 'pending', ?, ?, ?, ?, ?)
+                ON CONFLICT(content_hash) WHERE status = 'pending' DO UPDATE SET
+                    priority = MIN(priority, excluded.priority)
+                """,
+                (text, str(dest), int(channel), now_str, now_ts, int(priority), expires_ts, digest),
             )
+            row = conn.execute(
+                "SELECT id FROM outbox WHERE content_hash = ? AND status = 'pending'", (digest,)
+            ).fetchone()
             conn.commit()
-            return int(cur2.lastrowid)
+        wake_main_loop(WAKE_OUTBOX)
+        return int(row['id'])
 
     def get_next_pending_outbox(self) -> Optional[Dict[str, Any]]:
-        """Obtiene el siguiente mensaje pendiente de envío."""
+        """Obtiene (sin reclamarlo) el siguiente mensaje pendiente y vigente por prioridad."""
         with closing(self._connect()) as conn:
             cur = conn.execute(
-                "SELECT id, text, dest, channel, created_at FROM outbox WHERE status = 'pending' ORDER BY id ASC LIMIT 1"
+                "SELECT id, text, dest, channel, created_at, priority FROM outbox "
+                "WHERE status = 'pending' AND (expires_ts IS NULL OR expires_ts > ?) "
+                "ORDER BY priority ASC, id ASC LIMIT 1",
+                (int(time.time()),),
             )
             row = cur.fetchone()
             return dict(row) if row else None
 
+    def claim_outbox(self, limit: int = 1, lease_seconds: int = 120) -> List[Dict[str, Any]]:
+        """Reclama los siguientes `limit` mensajes enviables (prioridad, luego FIFO).
+
+        Los reclamados pasan a 'sending' con un lease; si el proceso cae antes
+        de mark_outbox_sent, al caducar el lease vuelven a 'pending' (hasta
+        OUTBOX_MAX_ATTEMPTS intentos, después 'error'). Antes de reclamar se
+        marcan como 'expired' los pendientes caducados. La reclamación es una
+        única sentencia UPDATE, así que dos procesos nunca obtienen la misma fila.
+        """
+        now_ts = int(time.time())
+        now_str = datetime.now().isoformat(timespec='seconds')
+        token = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'expired', sent_at = ?, updated_ts = ? "
+                "WHERE status = 'pending' AND expires_ts IS NOT NULL AND expires_ts <= ?",
+                (now_str, now_ts, now_ts),
+            )
+            # Lease caducado con un duplicado ya pendiente: se envía el duplicado
+            conn.execute(
+                f"UPDATE outbox SET status = 'expired', sent_at = ?, updated_ts = ?, lease_token = NULL, lease_until = NULL "
+                f"WHERE status = 'sending' AND lease_until <= ? AND {self._OUTBOX_HAS_PENDING_TWIN}",
+                (now_str, now_ts, now_ts),
+            )
+            conn.execute(
+                """
+                UPDATE outbox SET
+                    status = CASE WHEN attempts >= ? THEN 'error' ELSE 'pending' END,
+                    sent_at = CASE WHEN attempts >= ? THEN ? ELSE sent_at END,
+                    updated_ts = ?, lease_token = NULL, lease_until = NULL
+                WHERE status = 'sending' AND lease_until <= ?
+                """,
+                (self.OUTBOX_MAX_ATTEMPTS, self.OUTBOX_MAX_ATTEMPTS, now_str, now_ts, now_ts),
+            )
+            conn.execute(
+                """
+                UPDATE outbox SET status = 'sending', lease_token = ?, lease_until = ?,
+                    attempts = attempts + 1, updated_ts = ?
+                WHERE id IN (
+                    SELECT id FROM outbox WHERE status = 'pending'
+                    ORDER BY priority ASC, id ASC LIMIT ?
+                )
+                """,
+                (token, now_ts + int(lease_seconds), now_ts, max(1, int(limit))),
+            )
+            rows = conn.execute(
+                "SELECT id, text, dest, channel, created_at, priority, attempts, lease_token FROM outbox "
+                "WHERE status = 'sending' AND lease_token = ? ORDER BY priority ASC, id ASC",
+                (token,),
+            ).fetchall()
+            conn.commit()
+            return [dict(r) for r in rows]
+
+    def release_outbox(self, outbox_ids: Iterable[int], count_attempt: bool = False) -> None:
+        """Devuelve a 'pending' mensajes reclamados que no se llegaron a enviar.
+
+        Con `count_attempt` (el envío se intentó y falló) el intento cuenta:
+        los que ya agotaron OUTBOX_MAX_ATTEMPTS pasan a 'error'.
+        """
+        ids = [int(i) for i in outbox_ids]
+        if not ids:
+            return
+        placeholders = ','.join('?' * len(ids))
+        now_ts = int(time.time())
+        with closing(self._connect()) as conn:
+            conn.execute(
+                f"UPDATE outbox SET status = 'expired', lease_token = NULL, lease_until = NULL, updated_ts = ? "
+                f"WHERE status = 'sending' AND id IN ({placeholders}) AND {self._OUTBOX_HAS_PENDING_TWIN}",
+                [now_ts, *ids],
+            )
+            if count_attempt:
+                conn.execute(
+                    f"UPDATE outbox SET status = 'error', sent_at = ?, updated_ts = ?, lease_token = NULL, "
+                    f"lease_until = NULL WHERE status = 'sending' AND attempts >= ? AND id IN ({placeholders})",
+                    [datetime.now().isoformat(timespec='seconds'), now_ts, self.OUTBOX_MAX_ATTEMPTS, *ids],
+                )
+            conn.execute(
+                f"UPDATE outbox SET status = 'pending', lease_token = NULL, lease_until = NULL, updated_ts = ?, "
+                f"attempts = CASE WHEN ? THEN attempts ELSE MAX(attempts - 1, 0) END "
+                f"WHERE status = 'sending' AND id IN ({placeholders})",
+                [now_ts, int(count_attempt), *ids],
+            )
+            conn.commit()
+
     def mark_outbox_sent(self, outbox_id: int, ok: bool = True) -> None:
         """Marca un mensaje saliente como enviado o con error."""
         status = 'sent' if ok else 'error'
         when_str = datetime.now().isoformat(timespec='seconds')
         with closing(self._connect()) as conn:
             conn.execute(
-                "UPDATE outbox SET status = ?, sent_at = ? WHERE id = ?",
-                (status, when_str, outbox_id),
+                "UPDATE outbox SET status = ?, sent_at = ?, updated_ts = ?, lease_token = NULL, lease_until = NULL "
+                "WHERE id = ?",
+                (status, when_str, self._iso_to_epoch(when_str), outbox_id),
             )
             conn.commit()
 
@@ -1699,8 +2786,8 @@ class Database:
             conds = []
             params = []
             if hours is not None:
-                threshold = (datetime.now() - timedelta(hours=hours)).isoformat(timespec='seconds')
-                conds.append("c.created_at >= ?")
+                threshold = int(time.time()) - int(hours) * 3600
+                conds.append("c.created_ts >= ?")
                 params.append(threshold)
             if node_id:
                 conds.append("c.node_id = ?")
@@ -1718,29 +2805,33 @@ class Database:
             return [dict(r) for r in cur.fetchall()]
 
     def get_top_command_users(self, limit: int = 20, hours: Optional[int] = 24) -> List[Dict[str, Any]]:
-        """Ranking de nodos con más comandos ejecutados (Top 20 por defecto)."""
+        """Ranking de nodos con más comandos ejecutados (Top 20 por defecto).
+
+        Se calcula sobre command_rollup_*; last_command es el último comando
+        del nodo en todo el histórico.
+        """
+        since = int(time.time()) - int(hours) * 3600 if hours is not None else None
+        window_sql, params = self._command_window(since)
         with closing(self._connect()) as conn:
-            sql = """
-                SELECT c.node_id, COUNT(*) AS count,
-                       MAX(c.created_at) AS last_command_at,
-                       (SELECT c2.command FROM commands_sent c2 WHERE c2.node_id = c.node_id ORDER BY c2.id DESC LIMIT 1) AS last_command,
+            # MAX(last_id) con columna "desnuda": SQLite devuelve el command de esa fila
+            sql = f"""
+                SELECT NULLIF(w.node_id, '') AS node_id, SUM(w.count) AS count,
+                       MAX(w.last_at) AS last_command_at,
+                       l.command AS last_command,
                        n.name, n.short_name, n.role, n.via_mqtt
-                FROM commands_sent c
-                LEFT JOIN nodes n ON n.node_id = c.node_id
+                FROM {window_sql} w
+                LEFT JOIN (
+                    SELECT node_id, command, MAX(last_id) AS last_id
+                    FROM command_rollup_total GROUP BY node_id
+                ) l ON l.node_id = w.node_id
+                LEFT JOIN nodes n ON n.node_id = NULLIF(w.node_id, '')
+                GROUP BY w.node_id ORDER BY count DESC LIMIT ?
             """
-            params = []
-            if hours is not None:
-                threshold = (datetime.now() - timedelta(hours=hours)).isoformat(timespec='seconds')
-                sql += " WHERE c.created_at >= ?"
-                params.append(threshold)
-            sql += " GROUP BY c.node_id ORDER BY count DESC LIMIT ?"
-            params.append(int(limit))
-
-            cur = conn.execute(sql, tuple(params))
+            cur = conn.execute(sql, params + (int(limit),))
             return [dict(r) for r in cur.fetchall()]
 
     def get_commands_audit_summary(self, hours: Optional[int] = 24) -> Dict[str, Any]:
-        """Resumen estadístico de uso de comandos para tarjetas de dashboard."""
+        """Resumen estadístico de uso de comandos para tarjetas de dashboard (desde command_rollup_*)."""
         out = {
             "total": 0,
             "unique_nodes": 0,
@@ -1749,18 +2840,13 @@ class Database:
             "top_user": "N/D",
             "top_user_count": 0,
         }
+        since = int(time.time()) - int(hours) * 3600 if hours is not None else None
+        window_sql, params = self._command_window(since)
         with closing(self._connect()) as conn:
-            params = []
-            where_sql = ""
-            if hours is not None:
-                threshold = (datetime.now() - timedelta(hours=hours)).isoformat(timespec='seconds')
-                where_sql = "WHERE created_at >= ?"
-                params.append(threshold)
-            
             # Total y nodos únicos
             row = conn.execute(
-                f"SELECT COUNT(*) AS total, COUNT(DISTINCT node_id) AS unique_nodes FROM commands_sent {where_sql}",
-                tuple(params),
+                f"SELECT SUM(count) AS total, COUNT(DISTINCT NULLIF(node_id, '')) AS unique_nodes FROM {window_sql}",
+                params,
             ).fetchone()
             if row:
                 out["total"] = int(row["total"] or 0)
@@ -1768,24 +2854,22 @@ class Database:
 
             # Comando top
             row = conn.execute(
-                f"SELECT command, COUNT(*) AS c FROM commands_sent {where_sql} GROUP BY command ORDER BY c DESC LIMIT 1",
-                tuple(params),
+                f"SELECT command, SUM(count) AS c FROM {window_sql} GROUP BY command ORDER BY c DESC LIMIT 1",
+                params,
             ).fetchone()
             if row:
                 out["top_command"] = str(row["command"] or "N/D")
                 out["top_command_count"] = int(row["c"] or 0)
 
             # Nodo top
-            where_join = f"WHERE c.created_at >= ?" if hours is not None else ""
             row = conn.execute(
                 f"""
-                SELECT c.node_id, n.short_name, n.name, COUNT(*) AS cnt
-                FROM commands_sent c
-                LEFT JOIN nodes n ON n.node_id = c.node_id
-                {where_join}
-                GROUP BY c.node_id ORDER BY cnt DESC LIMIT 1
+                SELECT NULLIF(w.node_id, '') AS node_id, n.short_name, n.name, SUM(w.count) AS cnt
+                FROM {window_sql} w
+                LEFT JOIN nodes n ON n.node_id = NULLIF(w.node_id, '')
+                GROUP BY w.node_id ORDER BY cnt DESC LIMIT 1
                 """,
-                tuple(params),
+                params,
             ).fetchone()
             if row:
                 disp_name = row["short_name"] or row["name"] or row["node_id"] or "N/D"
@@ -1793,3 +2877,240 @@ class Database:
                 out["top_user_count"] = int(row["cnt"] or 0)
 
         return out
+
+    # ---------- RETENCIÓN Y MANTENIMIENTO ----------
+    def _archive_rows(self, archive_dir: str, table: str, rows: List[sqlite3.Row]) -> None:
+        """Añade filas a un JSONL comprimido (<archive_dir>/<tabla>-AAAAMM.jsonl.gz).
+
+        gzip en modo 'a' añade un miembro nuevo por lote; zcat/gzip.open leen
+        el fichero completo. Rutas relativas se resuelven junto a la BD.
+        """
+        import gzip
+        from pathlib import Path
+
+        base = Path(archive_dir)
+        if not base.is_absolute():
+            base = Path(self.db_path).parent / base
+        base.mkdir(parents=True, exist_ok=True)
+        path = base / f"{table}-{datetime.now():%Y%m}.jsonl.gz"
+        with gzip.open(path, "at", encoding="utf-8") as fh:
+            for r in rows:
+                fh.write(json.dumps(dict(r), ensure_ascii=False, default=str) + "\n")
+
+    def purge_expired(
+        self,
+        rule: str,
+        older_than_ts: int,
+        *,
+        batch_size: int = 500,
+        max_batches: int = 20,
+        archive_dir: Optional[str] = None,
+        pause: float = 0.05,
+    ) -> int:
+        """Borra por lotes las filas de una regla de RETENTION_RULES anteriores a older_than_ts.
+
+        Cada lote es una transacción corta (el lock de escritura se libera entre
+        lotes y se cede `pause` segundos a main.py). Como mucho max_batches
+        lotes por llamada; el resto queda para la siguiente pasada del cron.
+        Con archive_dir, las filas se copian antes a un JSONL comprimido. Los
+        traces borrados arrastran sus trace_hops; con el histórico separado se
+        purgan también los archivados (traces_archive). Devuelve filas borradas.
+        """
+        table, col, is_epoch, cond = self.RETENTION_RULES[rule]
+        limit_value: Any = int(older_than_ts) if is_epoch else (
+            datetime.fromtimestamp(int(older_than_ts)).isoformat(timespec="seconds")
+        )
+        where = f"{col} IS NOT NULL AND {col} < ?" + (f" AND {cond}" if cond else "")
+        columns = "*" if archive_dir else "id"
+        # (tabla, tabla de saltos) a purgar con la misma regla
+        targets: List[Tuple[str, Optional[str]]] = [(table, "trace_hops" if table == "traces" else None)]
+        if table == "traces":
+            with closing(self._connect()) as conn:
+                if table_schema(conn, "traces_archive") == HISTORY_SCHEMA:
+                    targets.append(("traces_archive", "trace_hops_archive"))
+        deleted = 0
+        for source, hops_table in targets:
+            for batch in range(int(max_batches)):
+                if batch:
+                    time.sleep(pause)
+                with closing(self._connect()) as conn:
+                    rows = conn.execute(
+                        f"SELECT {columns} FROM {source} WHERE {where} ORDER BY {col} LIMIT ?",
+                        (limit_value, int(batch_size)),
+                    ).fetchall()
+                    if not rows:
+                        break
+                    ids = [r["id"] for r in rows]
+                    placeholders = ",".join("?" for _ in ids)
+                    if archive_dir:
+                        self._archive_rows(archive_dir, table, rows)
+                    if hops_table:
+                        if archive_dir:
+                            hops = conn.execute(
+                                f"SELECT * FROM {hops_table} WHERE trace_id IN ({placeholders})", ids
+                            ).fetchall()
+                            if hops:
+                                self._archive_rows(archive_dir, "trace_hops", hops)
+                        conn.execute(f"DELETE FROM {hops_table} WHERE trace_id IN ({placeholders})", ids)
+                    conn.execute(f"DELETE FROM {source} WHERE id IN ({placeholders})", ids)
+                    conn.commit()
+                deleted += len(ids)
+                if len(ids) < int(batch_size):
+                    break
+        return deleted
+
+    def archive_traces(
+        self,
+        older_than_ts: int,
+        *,
+        batch_size: int = 500,
+        max_batches: int = 20,
+        pause: float = 0.05,
+    ) -> int:
+        """Mueve al histórico (traces_archive/trace_hops_archive) los traces antiguos.
+
+        Solo con el histórico separado (DB_HISTORY_SPLIT); si no, devuelve 0.
+        Mueve los 'done'/'error' con updated_ts < older_than_ts anteriores al
+        último 'done' de su nodo: ese y los posteriores siguen en traces, así
+        trace_state, trace_routes y /routers no cambian. Lotes cortos como en
+        purge_expired. Devuelve traces movidos.
+        """
+        cols = ", ".join(name for name, _ in TRACES_COLUMNS)
+        moved = 0
+        for batch in range(int(max_batches)):
+            if batch:
+                time.sleep(pause)
+            with closing(self._connect()) as conn:
+                if table_schema(conn, "traces_archive") != HISTORY_SCHEMA:
+                    return 0
+                ids = [
+                    r["id"]
+                    for r in conn.execute(
+                        """
+                        SELECT t.id FROM main.traces t
+                        WHERE t.status IN ('done', 'error') AND t.updated_ts IS NOT NULL AND t.updated_ts < ?
+                          AND t.id < (
+                              SELECT MAX(d.id) FROM main.traces d WHERE d."to" = t."to" AND d.status = 'done'
+                          )
+                        ORDER BY t.updated_ts
+                        LIMIT ?
+                        """,
+                        (int(older_than_ts), int(batch_size)),
+                    ).fetchall()
+                ]
+                if not ids:
+                    break
+                placeholders = ",".join("?" for _ in ids)
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {HISTORY_SCHEMA}.traces_archive ({cols}) "
+                    f"SELECT {cols} FROM main.traces WHERE id IN ({placeholders})",
+                    ids,
+                )
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {HISTORY_SCHEMA}.trace_hops_archive "
+                    f"(trace_id, direction, idx, node_id, snr, rssi) "
+                    f"SELECT trace_id, direction, idx, node_id, snr, rssi FROM main.trace_hops "
+                    f"WHERE trace_id IN ({placeholders})",
+                    ids,
+                )
+                conn.execute(f"DELETE FROM main.trace_hops WHERE trace_id IN ({placeholders})", ids)
+                conn.execute(f"DELETE FROM main.traces WHERE id IN ({placeholders})", ids)
+                conn.commit()
+            moved += len(ids)
+            if len(ids) < int(batch_size):
+                break
+        return moved
+
+    def write_deferred(self, items: Iterable[Tuple[str, Tuple[Any, ...]]]) -> int:
+        """Escribe en una única transacción las filas agrupadas por WriteBatcher.
+
+        items: [(tabla, fila)] con tabla 'commands_sent' (fila de log_command,
+        con sus agregados) o 'pings' (fila de save_ping). Devuelve filas escritas.
+        """
+        items = list(items)
+        if not items:
+            return 0
+        with closing(self._connect()) as conn:
+            pings = [row for table, row in items if table == 'pings']
+            if pings:
+                conn.executemany(self._PING_INSERT, pings)
+            for table, row in items:
+                if table == 'commands_sent':
+                    self._insert_command(conn, row)
+            conn.commit()
+        return len(items)
+
+    def wal_checkpoint(self, mode: str = "PASSIVE") -> Dict[str, Any]:
+        """Checkpoint del WAL (PASSIVE por defecto: no espera a lectores ni escritores).
+
+        Devuelve busy (1 si no pudo completarse), log_frames (páginas en el WAL),
+        checkpointed_frames (copiadas al fichero), checkpointed_bytes y ms. Con
+        el histórico separado son la suma de los dos ficheros.
+        """
+        mode = str(mode).upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Modo de checkpoint no válido: {mode}")
+        start = time.perf_counter()
+        busy = log_frames = done = done_bytes = 0
+        with closing(self._connect()) as conn:
+            for schema in self._schemas(conn):
+                s_busy, s_log, s_done = conn.execute(f"PRAGMA {schema}.wal_checkpoint({mode})").fetchone()
+                page_size = int(conn.execute(f"PRAGMA {schema}.page_size").fetchone()[0])
+                busy = max(busy, int(s_busy))
+                log_frames += max(0, int(s_log))
+                done += max(0, int(s_done))
+                done_bytes += max(0, int(s_done)) * page_size
+        return {
+            "busy": busy,
+            "log_frames": log_frames,
+            "checkpointed_frames": done,
+            "checkpointed_bytes": done_bytes,
+            "ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    @staticmethod
+    def _schemas(conn: sqlite3.Connection) -> List[str]:
+        """Ficheros de la conexión: ['main'] o ['main', 'history'] (DB_HISTORY_SPLIT)."""
+        return [r[1] for r in conn.execute("PRAGMA database_list") if r[1] in ("main", HISTORY_SCHEMA)]
+
+    def compact(self, *, max_pages: Optional[int] = None, convert: bool = False) -> Dict[str, int]:
+        """Devuelve al sistema las páginas libres y actualiza estadísticas del planificador.
+
+        - Con auto_vacuum=INCREMENTAL (BDs nuevas) ejecuta PRAGMA incremental_vacuum
+          (max_pages páginas como mucho; None = todas).
+        - Con auto_vacuum=NONE (BDs antiguas) las páginas libres solo se reutilizan;
+          convert=True cambia a INCREMENTAL con un VACUUM completo (una única vez,
+          reescribe el fichero).
+        - Siempre ejecuta PRAGMA optimize.
+
+        Con el histórico separado se compactan los dos ficheros (las páginas son
+        la suma; auto_vacuum es el del principal). Devuelve páginas antes/después,
+        páginas libres y páginas recuperadas.
+        """
+        out = {"pages_before": 0, "pages_after": 0, "freelist_before": 0, "freelist_after": 0, "reclaimed_bytes": 0}
+        with closing(self._connect()) as conn:
+            for schema in self._schemas(conn):
+                page_size = int(conn.execute(f"PRAGMA {schema}.page_size").fetchone()[0])
+                pages_before = int(conn.execute(f"PRAGMA {schema}.page_count").fetchone()[0])
+                free_before = int(conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0])
+                mode = int(conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0])
+                if mode != 2 and convert:
+                    conn.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+                    conn.execute(f"VACUUM {schema}")
+                    mode = int(conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0])
+                elif mode == 2 and free_before:
+                    # execute() solo avanza un paso (una página); executescript lo completa
+                    pages = f"({int(max_pages)})" if max_pages else ""
+                    conn.executescript(f"PRAGMA {schema}.incremental_vacuum{pages};")
+                pages_after = int(conn.execute(f"PRAGMA {schema}.page_count").fetchone()[0])
+                if schema == "main":
+                    out["auto_vacuum"] = mode
+                    out["page_size"] = page_size
+                out["pages_before"] += pages_before
+                out["pages_after"] += pages_after
+                out["freelist_before"] += free_before
+                out["freelist_after"] += int(conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0])
+                out["reclaimed_bytes"] += max(0, pages_before - pages_after) * page_size
+            conn.execute("PRAGMA optimize")
+        out["reclaimed_pages"] = max(0, out["pages_before"] - out["pages_after"])
+        return out
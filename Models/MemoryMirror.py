@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from create_db import HISTORY_SCHEMA, MIRROR_TABLES, ensure_mirror_triggers
+from Models.ConnectionPool import ConnectionPool
+from Models.QueryProfiler import ProfiledConnection
+from functions import log_p
+
+# Filas por consulta IN al aplicar cambios de nodos/tareas
+SYNC_CHUNK = 500
+
+# Cambios aplicados tras los que se podan de mirror_changes los ya leídos
+PRUNE_ROWS = 1000
+# Clave de la marca de poda en mirror_changes (tbl = ''): última seq borrada
+PRUNED_KEY = 'pruned'
+
+# Consultas de "últimos registros" que se copian para aemet_weather y tides:
+# el último por (scope, province_code) basta para aemet_weather_get_latest con
+# cualquier filtro, y tides_get_latest solo usa el más reciente.
+LATEST_QUERIES = {
+    'aemet_weather': """
+        SELECT * FROM aemet_weather WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY scope, province_code ORDER BY created_at DESC, id DESC
+                ) AS rn
+                FROM aemet_weather
+            ) WHERE rn = 1
+        )
+    """,
+    'tides': 'SELECT * FROM tides ORDER BY created_at DESC, id DESC LIMIT 1',
+}
+
+
+class MemoryMirror:
+    """Réplica en RAM (SQLite :memory:) de las tablas calientes de lectura.
+
+    Copia `nodes`, `tasks_control` y los últimos registros de `aemet_weather`
+    y `tides` con el mismo esquema e índices que el fichero, de modo que
+    Models/Database.py ejecuta sus consultas de lectura sin cambios contra la
+    réplica. Se carga una vez y se mantiene al día con el registro
+    `mirror_changes` que rellenan los triggers de create_db.py:
+
+      - Write-through: los métodos de escritura de Database llaman a
+        `write_through(conn)` tras su commit.
+      - Escrituras de otros hilos o procesos (cron, Gateway): antes de servir
+        una lectura se compara `PRAGMA data_version` y `total_changes` de la
+        conexión del hilo; solo si han cambiado se leen las claves nuevas de
+        `mirror_changes` (el caso habitual no toca la tarjeta SD).
+      - Cada PRUNE_ROWS cambios aplicados se borra lo ya leído de
+        `mirror_changes` dejando una marca (tbl '') con la última seq
+        borrada; la réplica de otro proceso que no la hubiera leído se
+        recarga entera en vez de perder cambios.
+
+    Los triggers solo existen con DB_MEMORY_MIRROR: la carga los crea si
+    faltan y Database los borra al arrancar sin réplica.
+
+    Con el histórico separado (DB_HISTORY_SPLIT), aemet_weather y tides están
+    en el esquema `history`, que tiene su propio mirror_changes y su propio
+    data_version: se siguen los dos.
+
+    Una instancia por ruta de BD y proceso. La conexión en memoria es única y
+    se protege con un lock (las consultas en RAM son de microsegundos).
+    """
+
+    _instances: Dict[str, MemoryMirror] = {}
+    _instances_lock = threading.Lock()
+    _pid = os.getpid()
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Última secuencia aplicada de cada mirror_changes (main / history)
+        self._last_seq: Dict[str, int] = {}
+        # Esquemas adjuntos a las conexiones del fichero (main [, history])
+        self._schemas: Tuple[str, ...] = ('main',)
+        self._file_key: Optional[Tuple[int, int]] = None
+        # Última (data_version de cada esquema, total_changes) vista por cada conexión del fichero
+        self._marks: "weakref.WeakKeyDictionary[sqlite3.Connection, Tuple[int, ...]]" = weakref.WeakKeyDictionary()
+        # Cambios aplicados desde la última poda de mirror_changes
+        self._since_prune = 0
+        self.stats = {"loads": 0, "syncs": 0, "rows": 0, "reads": 0, "prunes": 0}
+
+    @classmethod
+    def get_instance(cls, db_path: str) -> MemoryMirror:
+        """Obtiene o crea la réplica de db_path en este proceso."""
+        with cls._instances_lock:
+            if os.getpid() != cls._pid:
+                # Proceso hijo tras fork: no compartir la réplica del padre
+                cls._pid = os.getpid()
+                cls._instances = {}
+            mirror = cls._instances.get(db_path)
+            if mirror is None:
+                mirror = cls(db_path)
+                cls._instances[db_path] = mirror
+            return mirror
+
+    @classmethod
+    def close_all(cls) -> None:
+        """Descarta todas las réplicas (apagado o tests)."""
+        with cls._instances_lock:
+            mirrors = list(cls._instances.values())
+            cls._instances = {}
+        for mirror in mirrors:
+            mirror.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._marks = weakref.WeakKeyDictionary()
+
+    # ---------- CARGA Y SINCRONIZACIÓN ----------
+    def _load(self, src: sqlite3.Connection) -> None:
+        """Crea la réplica copiando esquema y datos desde la conexión del fichero."""
+        # BD migrada sin DB_MEMORY_MIRROR: sin triggers no se verían los cambios
+        ensure_mirror_triggers(src, enabled=True)
+        mem = sqlite3.connect(':memory:', check_same_thread=False, factory=ProfiledConnection)
+        mem.row_factory = sqlite3.Row
+        tables = tuple(MIRROR_TABLES)
+        placeholders = ','.join('?' * len(tables))
+        ddl: List[sqlite3.Row] = []
+        self._last_seq = {}
+        self._since_prune = 0
+        for name in self._schemas:
+            ddl += src.execute(
+                f"SELECT type, sql FROM {name}.sqlite_master WHERE tbl_name IN ({placeholders}) "
+                f"AND type IN ('table', 'index') AND sql IS NOT NULL",
+                tables,
+            ).fetchall()
+            if src.execute(
+                f"SELECT 1 FROM {name}.sqlite_master WHERE type = 'table' AND name = 'mirror_changes'"
+            ).fetchone():
+                row = src.execute(f'SELECT MAX(seq) AS seq FROM {name}.mirror_changes').fetchone()
+                self._last_seq[name] = int(row['seq'] or 0) if row else 0
+        # Tablas antes que índices
+        for row in sorted(ddl, key=lambda r: r['type'] != 'table'):
+            mem.execute(row['sql'])
+        for table in tables:
+            query = LATEST_QUERIES.get(table, f'SELECT * FROM {table}')
+            self._copy_rows(mem, table, src.execute(query).fetchall())
+        mem.commit()
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = mem
+        self.stats["loads"] += 1
+        log_p(f"[mirror] Réplica en RAM cargada ({self.db_path}, seq={self._last_seq})")
+
+    def _copy_rows(self, mem: sqlite3.Connection, table: str, rows: List[sqlite3.Row]) -> None:
+        if not rows:
+            return
+        cols = rows[0].keys()
+        mem.executemany(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+            [tuple(r) for r in rows],
+        )
+        self.stats["rows"] += len(rows)
+
+    def _apply_changes(self, src: sqlite3.Connection) -> None:
+        """Aplica en la réplica las claves cambiadas desde la última secuencia vista."""
+        by_table: Dict[str, List[str]] = {}
+        last_seq = dict(self._last_seq)
+        for name, seen in self._last_seq.items():
+            changes = src.execute(
+                f'SELECT tbl, key, seq FROM {name}.mirror_changes WHERE seq > ? ORDER BY seq', (seen,)
+            ).fetchall()
+            if any(c['tbl'] == '' for c in changes):
+                # Otro proceso podó cambios que esta réplica aún no había leído
+                self._load(src)
+                return
+            for change in changes:
+                by_table.setdefault(change['tbl'], []).append(change['key'])
+            if changes:
+                last_seq[name] = max(seen, max(int(c['seq']) for c in changes))
+        if not by_table:
+            return
+        mem = self._conn
+        for table, keys in by_table.items():
+            if table not in MIRROR_TABLES:
+                continue
+            if table in LATEST_QUERIES:
+                mem.execute(f'DELETE FROM {table}')
+                self._copy_rows(mem, table, src.execute(LATEST_QUERIES[table]).fetchall())
+                continue
+            key_col = MIRROR_TABLES[table]
+            for start in range(0, len(keys), SYNC_CHUNK):
+                part = keys[start:start + SYNC_CHUNK]
+                marks = ','.join('?' * len(part))
+                rows = src.execute(f'SELECT * FROM {table} WHERE {key_col} IN ({marks})', part).fetchall()
+                present = {r[key_col] for r in rows}
+                gone = [k for k in part if k not in present]
+                if gone:
+                    mem.execute(f"DELETE FROM {table} WHERE {key_col} IN ({','.join('?' * len(gone))})", gone)
+                self._copy_rows(mem, table, rows)
+        mem.commit()
+        self._last_seq = last_seq
+        self.stats["syncs"] += 1
+        self._since_prune += sum(len(keys) for keys in by_table.values())
+        if self._since_prune >= PRUNE_ROWS:
+            self._prune(src)
+
+    def _prune(self, src: sqlite3.Connection) -> None:
+        """Borra de mirror_changes lo que esta réplica ya ha aplicado.
+
+        Deja la marca PRUNED_KEY con la última seq borrada, así la secuencia
+        de los triggers (MAX(seq) + 1) sigue creciendo y las réplicas de otros
+        procesos que iban por detrás se recargan.
+        """
+        if src.in_transaction:
+            return
+        try:
+            for name, seq in self._last_seq.items():
+                src.execute(f"DELETE FROM {name}.mirror_changes WHERE seq <= ? AND tbl <> ''", (seq,))
+                src.execute(
+                    f"INSERT INTO {name}.mirror_changes (tbl, key, seq) VALUES ('', ?, ?) "
+                    f"ON CONFLICT(tbl, key) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+                    (PRUNED_KEY, seq),
+                )
+            src.commit()
+        except sqlite3.Error as e:
+            src.rollback()
+            log_p(f"[mirror] No se pudo podar mirror_changes: {e}", level="DEBUG")
+            return
+        self._since_prune = 0
+        self.stats["prunes"] += 1
+
+    def _mark(self, src: sqlite3.Connection) -> Tuple[int, ...]:
+        versions = tuple(int(src.execute(f'PRAGMA {name}.data_version').fetchone()[0]) for name in self._schemas)
+        return versions + (src.total_changes,)
+
+    @staticmethod
+    def _attached(src: sqlite3.Connection) -> Tuple[str, ...]:
+        names = {r[1] for r in src.execute('PRAGMA database_list')}
+        return ('main', HISTORY_SCHEMA) if HISTORY_SCHEMA in names else ('main',)
+
+    def sync(self, src: sqlite3.Connection, force: bool = False) -> bool:
+        """Pone la réplica al día usando la conexión del fichero del hilo actual.
+
+        Si nada ha cambiado para esta conexión desde la última vez (mismo
+        data_version y total_changes), no consulta el fichero. Devuelve False si
+        la réplica no se pudo cargar (las lecturas deben ir al fichero).
+        """
+        with self._lock:
+            try:
+                if src not in self._marks:
+                    # Conexión nueva (hilo nuevo o fichero reabierto): si el
+                    # fichero se ha reemplazado o se ha separado el histórico,
+                    # la réplica ya no le corresponde
+                    file_key = ConnectionPool._file_key(self.db_path)
+                    schemas = self._attached(src)
+                    if file_key != self._file_key or schemas != self._schemas:
+                        self.close()
+                        self._file_key = file_key
+                        self._schemas = schemas
+                mark = self._mark(src)
+                if self._conn is None:
+                    self._load(src)
+                elif force or self._marks.get(src) != mark:
+                    self._apply_changes(src)
+                self._marks[src] = mark
+                return True
+            except sqlite3.Error as e:
+                log_p(f"[mirror] No se pudo sincronizar la réplica en RAM: {e}", level="WARN")
+                self.close()
+                return False
+
+    def write_through(self, src: sqlite3.Connection) -> None:
+        """Refleja en RAM lo que acaba de confirmar `src` (llamar tras commit)."""
+        if self._conn is not None:
+            self.sync(src, force=True)
+
+    @contextmanager
+    def reading(self, src: sqlite3.Connection) -> Iterator[Optional[sqlite3.Connection]]:
+        """Sincroniza y bloquea la réplica para una lectura.
+
+        Devuelve la conexión en memoria, o None si la réplica no está disponible
+        (el llamante debe leer del fichero con `src`).
+        """
+        with self._lock:
+            if not self.sync(src):
+                yield None
+                return
+            self.stats["reads"] += 1
+            yield self._conn
@@ -1,4 +1,5 @@
 from Models.Database import Database
+from Models.NodeStore import NodeStore
 
 
 class Node:
@@ -22,38 +23,81 @@ class Node:
     last_heard = None
 
 
-    def __init__(self, id):
+    def __init__(self, id, row=None):
+        """Crea el nodo cargándolo de BD (o creándolo si no existe).
+
+        Si se pasa `row` (fila de `nodes` ya leída, p. ej. desde
+        Database.sync_nodes) no se consulta la BD.
+        """
         self.id = id
         self.updated = False
 
+        if row is not None:
+            self._load_row(row)
+            NodeStore.get_instance().seed(self.id, row)
+            return
+
         # Cargar desde BD si existe o crearlo
         try:
             db = Database()
             row = db.get_node(self.id)
             if row:
-                self.name = row.get('name', self.name)
-                self.num = row.get('num', self.num)
-                self.short_name = row.get('short_name', self.short_name)
-                self.mac_addr = row.get('mac_addr', self.mac_addr)
-                self.hw_model = row.get('hw_model', self.hw_model)
-                self.role = row.get('role', self.role)
-                self.is_favorite = bool(row.get('is_favorite')) if row.get('is_favorite') is not None else self.is_favorite
-                self.snr = row.get('snr', self.snr)
-                self.rssi = row.get('rssi', self.rssi)
-                self.public_key = row.get('public_key', self.public_key)
-                self.hops = row.get('hops', self.hops)
-                self.hop_start = row.get('hop_start', self.hop_start)
-                self.uptime = row.get('uptime', self.uptime)
-                self.via_mqtt = bool(row.get('via_mqtt')) if row.get('via_mqtt') is not None else self.via_mqtt
-                self.battery = row.get('battery', self.battery)
-                self.voltage = row.get('voltage', self.voltage)
-                self.last_heard = row.get('last_heard', self.last_heard)
+                self._load_row(row)
+                NodeStore.get_instance().seed(self.id, row)
             else:
                 db.create_node_if_not_exists(self.id)
+                NodeStore.get_instance().seed(self.id, {})
         except Exception:
             # Si la BD no está lista o hay error, continuar en memoria
             pass
 
+    def _load_row(self, row):
+        self.name = row.get('name', self.name)
+        self.num = row.get('num', self.num)
+        self.short_name = row.get('short_name', self.short_name)
+        self.mac_addr = row.get('mac_addr', self.mac_addr)
+        self.hw_model = row.get('hw_model', self.hw_model)
+        self.role = row.get('role', self.role)
+        self.is_favorite = bool(row.get('is_favorite')) if row.get('is_favorite') is not None else self.is_favorite
+        self.snr = row.get('snr', self.snr)
+        self.rssi = row.get('rssi', self.rssi)
+        self.public_key = row.get('public_key', self.public_key)
+        self.hops = row.get('hops', self.hops)
+        self.hop_start = row.get('hop_start', self.hop_start)
+        self.uptime = row.get('uptime', self.uptime)
+        self.via_mqtt = bool(row.get('via_mqtt')) if row.get('via_mqtt') is not None else self.via_mqtt
+        self.battery = row.get('battery', self.battery)
+        self.voltage = row.get('voltage', self.voltage)
+        self.last_heard = row.get('last_heard', self.last_heard)
+
+    @staticmethod
+    def device_columns(node_info):
+        """Columnas de `nodes` a partir de una entrada de `interface.nodes`.
+
+        Ejemplo de entrada (ver update_positions). Las claves sin valor en el
+        dispositivo se devuelven como None.
+        """
+        user = node_info.get('user') or {}
+        dev_m = node_info.get('deviceMetrics') or node_info.get('device_metrics') or {}
+        if not isinstance(dev_m, dict):
+            dev_m = {}
+        return {
+            "name": user.get('longName'),
+            "num": node_info.get('num'),
+            "short_name": user.get('shortName'),
+            "mac_addr": user.get('macaddr'),
+            "hw_model": user.get('hwModel'),
+            "role": user.get('role'),
+            "is_favorite": node_info.get('isFavorite'),
+            "snr": node_info.get('snr'),
+            "hops": node_info.get('hopsAway'),
+            "via_mqtt": node_info.get('viaMqtt'),
+            "last_heard": node_info.get('lastHeard'),
+            "battery": dev_m.get('batteryLevel'),
+            "voltage": dev_m.get('voltage'),
+            "uptime": dev_m.get('uptimeSeconds'),
+        }
+
     def update_metadata(self, node_info):
         self.name = node_info.get('name', self.name)
         self.num = node_info.get('num', self.num)
@@ -96,11 +140,10 @@ class Node:
 
         self.updated = True
 
-        # Persistir en BD
+        # Persistir en BD de forma diferida: NodeStore solo anota las columnas
+        # cambiadas y las vuelca agrupadas (ver Models/NodeStore.py)
         try:
-            db = Database()
-            db.create_node_if_not_exists(self.id)
-            db.update_node(self.id, {
+            NodeStore.get_instance().update(self.id, {
                 "name": self.name,
                 "num": self.num,
                 "short_name": self.short_name,
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import atexit
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from functions import log_p
+
+
+class NodeStore:
+    """Almacén write-behind del estado de los nodos.
+
+    Los callbacks de Meshtastic (hilo 'publishing') solo anotan en memoria las
+    columnas que han cambiado respecto a lo último persistido. `flush()` las
+    escribe para todos los nodos pendientes en una única transacción
+    (Database.upsert_nodes), de modo que un nodo muy activo ya no provoca
+    varios commits por segundo en la tarjeta SD.
+
+    Se vuelca:
+      - Desde main.loop() cuando vence NODE_FLUSH_INTERVAL (segundos).
+      - En el propio update() si hay NODE_FLUSH_MAX_DIRTY nodos pendientes.
+      - Al reconectar el puerto serie y al cerrar el proceso (atexit).
+    """
+
+    _instance: Optional[NodeStore] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, flush_interval: Optional[float] = None, max_dirty: Optional[int] = None) -> None:
+        import env as _env
+        self.flush_interval = float(flush_interval if flush_interval is not None
+                                    else getattr(_env, 'NODE_FLUSH_INTERVAL', 15))
+        self.max_dirty = int(max_dirty if max_dirty is not None
+                             else getattr(_env, 'NODE_FLUSH_MAX_DIRTY', 100))
+        self._lock = threading.Lock()
+        # Un único volcado a la vez (main.loop, umbral de tamaño o atexit)
+        self._flush_lock = threading.Lock()
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self._persisted: Dict[str, Dict[str, Any]] = {}
+        self._last_flush = time.monotonic()
+        self.stats = {"updates": 0, "flushes": 0, "rows": 0, "errors": 0}
+
+    @classmethod
+    def get_instance(cls) -> NodeStore:
+        """Obtiene o crea la instancia singleton (con volcado al salir)."""
+        # Se llega desde el hilo de recepción, los workers de comandos y
+        # main.loop(): dos instancias perderían los cambios de una de ellas
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = cls()
+                    atexit.register(instance.flush)
+                    cls._instance = instance
+        return cls._instance
+
+    @staticmethod
+    def _normalize(col: str, value: Any) -> Any:
+        if col in ("is_favorite", "via_mqtt") and value is not None:
+            return 1 if bool(value) else 0
+        return value
+
+    def seed(self, node_id: str, row: Dict[str, Any]) -> None:
+        """Registra el estado ya persistido de un nodo (leído de BD)."""
+        from Models.Database import Database
+        with self._lock:
+            self._persisted[node_id] = {
+                k: self._normalize(k, row.get(k)) for k in Database.NODE_COLUMNS if k in row
+            }
+
+    def update(self, node_id: str, data: Dict[str, Any]) -> None:
+        """Anota los cambios de un nodo; solo se guardan las columnas distintas."""
+        if not node_id or str(node_id).strip() in ("", "None", "null", "Desconocido", "none") or not data:
+            return
+        from Models.Database import Database
+        node_id = str(node_id).strip()
+        with self._lock:
+            self.stats["updates"] += 1
+            persisted = self._persisted.get(node_id, {})
+            pending = self._dirty.get(node_id)
+            for col, value in data.items():
+                if col not in Database.NODE_COLUMNS:
+                    continue
+                value = self._normalize(col, value)
+                if pending is not None and col in pending:
+                    pending[col] = value
+                elif col not in persisted or persisted[col] != value:
+                    if pending is None:
+                        pending = self._dirty[node_id] = {}
+                    pending[col] = value
+            too_many = len(self._dirty) >= self.max_dirty
+
+        if too_many:
+            self.flush()
+
+    def pending_count(self) -> int:
+        """Número de nodos con cambios sin volcar."""
+        with self._lock:
+            return len(self._dirty)
+
+    def flush_if_due(self) -> int:
+        """Vuelca si ha pasado el intervalo configurado desde el último volcado."""
+        if time.monotonic() - self._last_flush < self.flush_interval:
+            return 0
+        return self.flush()
+
+    def flush(self, db=None) -> int:
+        """Escribe en una transacción todos los cambios pendientes.
+
+        Devuelve el número de nodos escritos. Si falla, los cambios vuelven a la
+        cola (sin pisar los que hayan llegado mientras tanto).
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._dirty
+                self._dirty = {}
+                self._last_flush = time.monotonic()
+            if not batch:
+                return 0
+
+            try:
+                if db is None:
+                    from Models.Database import Database
+                    db = Database()
+                written = db.upsert_nodes(batch)
+            except Exception as e:
+                with self._lock:
+                    self.stats["errors"] += 1
+                    for node_id, cols in batch.items():
+                        newer = self._dirty.setdefault(node_id, {})
+                        for col, value in cols.items():
+                            newer.setdefault(col, value)
+                log_p(f"NodeStore: error al volcar nodos: {e}", level="WARN")
+                return 0
+
+            with self._lock:
+                for node_id, cols in batch.items():
+                    self._persisted.setdefault(node_id, {}).update(cols)
+                self.stats["flushes"] += 1
+                self.stats["rows"] += written
+            return written
@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import contextlib
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# Llamadas recientes por método que se conservan para calcular el p95
+SAMPLES_PER_METHOD = 500
+# Entradas del registro de consultas lentas que se guardan en memoria
+SLOW_LOG_KEEP = 100
+# Marcos de pila que no identifican al método llamante de _connect()
+_SKIP_FRAMES = frozenset(('_connect', '_reader'))
+# Sentencias que abren transacción implícita de escritura (espera de lock)
+_WRITE_KINDS = frozenset(('INSERT', 'UPDATE', 'DELETE', 'REPLACE'))
+# Sentencias a las que se les pide EXPLAIN QUERY PLAN
+_PLAN_KINDS = frozenset(('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'))
+_SCAN_RE = re.compile(r'^SCAN (\S+)$')
+_SUBQUERY_RE = re.compile(r'^(?:MATERIALIZE|CO-ROUTINE) (\S+)')
+_SPACES_RE = re.compile(r'\s+')
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor que suma filas y tiempo de lectura a su sentencia (solo con perfilado)."""
+
+    _entry: Optional[Dict[str, Any]] = None
+
+    def _account(self, fn: Callable[..., Any], *args: Any) -> Any:
+        start = time.perf_counter()
+        result = fn(*args)
+        entry = self._entry
+        if entry is not None:
+            rows = len(result) if isinstance(result, list) else (0 if result is None else 1)
+            entry["profiler"]._fetched(entry, rows, time.perf_counter() - start)
+        return result
+
+    def fetchone(self) -> Any:
+        return self._account(super().fetchone)
+
+    def fetchmany(self, size: int = 1) -> List[Any]:
+        return self._account(super().fetchmany, size)
+
+    def fetchall(self) -> List[Any]:
+        return self._account(super().fetchall)
+
+    def __next__(self) -> Any:
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Conexión que pasa cada execute/executemany por el QueryProfiler.
+
+    Con DB_PROFILE desactivado el coste es una comprobación de configuración
+    por sentencia y se usa el cursor normal de sqlite3.
+    """
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        profiler = QueryProfiler.active()
+        if profiler is None:
+            return super().execute(sql, parameters)
+        return profiler.execute(self, sql, parameters)
+
+    def executemany(self, sql: str, parameters: Any, /) -> sqlite3.Cursor:
+        profiler = QueryProfiler.active()
+        if profiler is None:
+            return super().executemany(sql, parameters)
+        return profiler.execute(self, sql, parameters, many=True)
+
+
+class QueryProfiler:
+    """Perfilador opcional de las consultas SQLite de Models/Database.py.
+
+    Se activa con DB_PROFILE. Cada `Database._connect()` abre una "llamada"
+    atribuida al método que la pidió (p. ej. `Database.get_node`) y el cierre
+    de la conexión (`with closing(...)`) la termina. Por método se acumulan:
+
+      - llamadas, tiempo total/medio/p95/máximo de la llamada completa,
+      - sentencias, tiempo en SQLite (ejecución + lectura de filas),
+      - filas devueltas o modificadas,
+      - espera de lock: las escrituras abren su transacción con
+        `BEGIN IMMEDIATE` cronometrado (mismo efecto que el BEGIN implícito
+        de sqlite3, pero separando la espera por el lock de escritura).
+
+    La primera vez que se ve cada sentencia se guarda su `EXPLAIN QUERY PLAN`
+    si recorre una tabla entera, y las sentencias que superan DB_SLOW_QUERY_MS
+    se anotan en `<DB_PROFILE_DIR>/slow_queries.log` (JSON por línea).
+
+    Cada proceso vuelca su resumen a `<DB_PROFILE_DIR>/<proceso>.json` cada
+    DB_PROFILE_DUMP_INTERVAL segundos; lo leen la acción `get_db_profile` del
+    Gateway y `python -m Models.QueryProfiler`.
+    """
+
+    _instance: Optional[QueryProfiler] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(
+        self,
+        slow_ms: Optional[float] = None,
+        profile_dir: Optional[str] = None,
+        dump_interval: Optional[float] = None,
+    ) -> None:
+        import env as _env
+        self.slow_ms = float(slow_ms if slow_ms is not None else getattr(_env, 'DB_SLOW_QUERY_MS', 200))
+        self.profile_dir = profile_dir if profile_dir is not None else getattr(
+            _env, 'DB_PROFILE_DIR', '/tmp/meshassistant_profile'
+        )
+        self.dump_interval = float(dump_interval if dump_interval is not None
+                                   else getattr(_env, 'DB_PROFILE_DUMP_INTERVAL', 60))
+        self.process = os.path.splitext(os.path.basename(sys.argv[0] or ''))[0].lstrip('-') or 'python'
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._methods: Dict[str, Dict[str, Any]] = {}
+        self._plans: Dict[str, Optional[List[str]]] = {}
+        self._full_scans: Dict[str, Dict[str, Any]] = {}
+        self._slow: Deque[Dict[str, Any]] = deque(maxlen=SLOW_LOG_KEEP)
+        self._since = datetime.now().isoformat(timespec='seconds')
+        self._last_dump = time.monotonic()
+
+    @classmethod
+    def get_instance(cls) -> QueryProfiler:
+        """Obtiene o crea la instancia singleton."""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def active(cls) -> Optional[QueryProfiler]:
+        """El perfilador si DB_PROFILE está activo; None en caso contrario."""
+        import env as _env
+        if not getattr(_env, 'DB_PROFILE', False):
+            return None
+        return cls.get_instance()
+
+    # ---------- LLAMADAS (Database._connect → close) ----------
+    def _stack(self) -> List[List[Any]]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @staticmethod
+    def _caller_name() -> str:
+        frame = sys._getframe(2)
+        while frame is not None and (
+            frame.f_code.co_name in _SKIP_FRAMES or frame.f_code.co_filename == contextlib.__file__
+        ):
+            frame = frame.f_back
+        if frame is None:
+            return '-'
+        code = frame.f_code
+        return getattr(code, 'co_qualname', code.co_name)
+
+    def begin(self, conn: sqlite3.Connection) -> None:
+        """Abre una llamada del método que ha pedido la conexión."""
+        self._stack().append([self._caller_name(), id(conn), time.perf_counter()])
+
+    def end(self, conn: sqlite3.Connection) -> None:
+        """Cierra la última llamada abierta con esta conexión."""
+        stack = self._stack()
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][1] == id(conn):
+                method, _, start = stack.pop(i)
+                break
+        else:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            stat = self._method(method)
+            stat["calls"] += 1
+            stat["total_ms"] += elapsed_ms
+            stat["max_ms"] = max(stat["max_ms"], elapsed_ms)
+            stat["samples"].append(elapsed_ms)
+        self.dump_if_due()
+
+    def _current_method(self) -> str:
+        stack = self._stack()
+        return stack[-1][0] if stack else '-'
+
+    def _method(self, name: str) -> Dict[str, Any]:
+        stat = self._methods.get(name)
+        if stat is None:
+            stat = self._methods[name] = {
+                "calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "samples": deque(maxlen=SAMPLES_PER_METHOD),
+                "statements": 0, "db_ms": 0.0, "rows": 0, "lock_wait_ms": 0.0,
+            }
+        return stat
+
+    # ---------- SENTENCIAS ----------
+    def execute(self, conn: sqlite3.Connection, sql: str, parameters: Any, many: bool = False) -> sqlite3.Cursor:
+        """Ejecuta la sentencia en `conn` midiendo tiempo, filas y espera de lock."""
+        method = self._current_method()
+        kind = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        if many and not isinstance(parameters, (list, tuple)):
+            parameters = list(parameters)
+
+        key = _SPACES_RE.sub(' ', sql).strip()
+        if kind in _PLAN_KINDS and key not in self._plans:
+            first = (parameters[0] if parameters else ()) if many else parameters
+            self._explain(conn, key, first, method)
+
+        lock_wait = 0.0
+        if kind in _WRITE_KINDS and not conn.in_transaction and conn.isolation_level is not None:
+            start = time.perf_counter()
+            sqlite3.Connection.execute(conn, 'BEGIN IMMEDIATE')
+            lock_wait = time.perf_counter() - start
+
+        cur = conn.cursor(ProfiledCursor)
+        start = time.perf_counter()
+        if many:
+            cur.executemany(sql, parameters)
+        else:
+            cur.execute(sql, parameters)
+        elapsed = time.perf_counter() - start
+
+        entry = {"profiler": self, "method": method, "sql": key, "ms": elapsed * 1000, "slow": False}
+        written = cur.rowcount if kind in _WRITE_KINDS and cur.rowcount > 0 else 0
+        with self._lock:
+            stat = self._method(method)
+            stat["statements"] += 1
+            stat["db_ms"] += elapsed * 1000
+            stat["rows"] += written
+            stat["lock_wait_ms"] += lock_wait * 1000
+        self._check_slow(entry, lock_wait * 1000)
+        if kind in ('SELECT', 'WITH', 'PRAGMA') or cur.description is not None:
+            cur._entry = entry
+        return cur
+
+    def _fetched(self, entry: Dict[str, Any], rows: int, elapsed: float) -> None:
+        entry["ms"] += elapsed * 1000
+        with self._lock:
+            stat = self._method(entry["method"])
+            stat["rows"] += rows
+            stat["db_ms"] += elapsed * 1000
+        self._check_slow(entry)
+
+    def _check_slow(self, entry: Dict[str, Any], lock_wait_ms: float = 0.0) -> None:
+        if entry["slow"] or entry["ms"] + lock_wait_ms < self.slow_ms:
+            return
+        entry["slow"] = True
+        record = {
+            "ts": datetime.now().isoformat(timespec='seconds'),
+            "process": self.process,
+            "method": entry["method"],
+            "ms": round(entry["ms"] + lock_wait_ms, 1),
+            "lock_wait_ms": round(lock_wait_ms, 1),
+            "sql": entry["sql"],
+        }
+        with self._lock:
+            self._slow.append(record)
+        self._append_slow_log(record)
+
+    def _explain(self, conn: sqlite3.Connection, key: str, parameters: Any, method: str) -> None:
+        try:
+            rows = sqlite3.Connection.execute(conn, f'EXPLAIN QUERY PLAN {key}', parameters).fetchall()
+        except (sqlite3.Error, ValueError):
+            with self._lock:
+                self._plans[key] = None
+            return
+        plan = [str(r[3]) for r in rows]
+        derived = set()
+        scanned: List[str] = []
+        for detail in plan:
+            m = _SUBQUERY_RE.match(detail)
+            if m:
+                derived.add(m.group(1))
+                continue
+            m = _SCAN_RE.match(detail)
+            if m and m.group(1) not in derived and not m.group(1).startswith('('):
+                scanned.append(m.group(1))
+        with self._lock:
+            self._plans[key] = plan
+            if scanned:
+                self._full_scans[key] = {"method": method, "tables": scanned, "plan": plan}
+
+    # ---------- RESUMEN Y VOLCADO ----------
+    @staticmethod
+    def _p95(samples: Deque[float]) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Resumen serializable: métodos (por tiempo total), full scans y lentas."""
+        with self._lock:
+            methods = []
+            for name, s in self._methods.items():
+                methods.append({
+                    "method": name,
+                    "calls": s["calls"],
+                    "total_ms": round(s["total_ms"], 1),
+                    "avg_ms": round(s["total_ms"] / s["calls"], 2) if s["calls"] else 0.0,
+                    "p95_ms": round(self._p95(s["samples"]), 2),
+                    "max_ms": round(s["max_ms"], 1),
+                    "statements": s["statements"],
+                    "db_ms": round(s["db_ms"], 1),
+                    "rows": s["rows"],
+                    "lock_wait_ms": round(s["lock_wait_ms"], 1),
+                })
+            methods.sort(key=lambda m: (m["total_ms"], m["db_ms"]), reverse=True)
+            return {
+                "process": self.process,
+                "pid": os.getpid(),
+                "since": self._since,
+                "updated_at": datetime.now().isoformat(timespec='seconds'),
+                "slow_ms": self.slow_ms,
+                "methods": methods,
+                "full_scans": [{"sql": sql, **info} for sql, info in self._full_scans.items()],
+                "slow_queries": list(self._slow),
+            }
+
+    def reset(self) -> None:
+        """Vacía las estadísticas acumuladas (no el registro de lentas en disco)."""
+        with self._lock:
+            self._methods = {}
+            self._plans = {}
+            self._full_scans = {}
+            self._slow.clear()
+            self._since = datetime.now().isoformat(timespec='seconds')
+
+    def dump_if_due(self) -> None:
+        if self.profile_dir and time.monotonic() - self._last_dump >= self.dump_interval:
+            self.dump()
+
+    def dump(self) -> Optional[str]:
+        """Escribe el resumen del proceso en <DB_PROFILE_DIR>/<proceso>.json."""
+        self._last_dump = time.monotonic()
+        if not self.profile_dir:
+            return None
+        path = os.path.join(self.profile_dir, f"{self.process}.json")
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                json.dump(self.snapshot(), fh, ensure_ascii=False)
+            os.replace(tmp, path)
+            return path
+        except OSError:
+            return None
+
+    def _append_slow_log(self, record: Dict[str, Any]) -> None:
+        if not self.profile_dir:
+            return
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(os.path.join(self.profile_dir, 'slow_queries.log'), 'a', encoding='utf-8') as fh:
+                fh.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError:
+            pass
+
+    @staticmethod
+    def load_dumps(profile_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Lee los resúmenes volcados por todos los procesos."""
+        if profile_dir is None:
+            import env as _env
+            profile_dir = getattr(_env, 'DB_PROFILE_DIR', '/tmp/meshassistant_profile')
+        dumps = []
+        for path in sorted(glob.glob(os.path.join(profile_dir or '', '*.json'))):
+            try:
+                with open(path, encoding='utf-8') as fh:
+                    dumps.append(json.load(fh))
+            except (OSError, ValueError):
+                continue
+        return dumps
+
+
+def format_report(dumps: List[Dict[str, Any]], top: int = 25) -> str:
+    """Tabla de texto con los métodos más costosos de cada proceso."""
+    lines: List[str] = []
+    for d in dumps:
+        lines.append(f"== {d.get('process')} (pid {d.get('pid')}) desde {d.get('since')} "
+                     f"hasta {d.get('updated_at')}")
+        lines.append(f"{'método':<45} {'llamadas':>8} {'total ms':>10} {'media':>8} {'p95':>8} "
+                     f"{'filas':>8} {'lock ms':>8}")
+        for m in d.get('methods', [])[:top]:
+            lines.append(f"{m['method'][:45]:<45} {m['calls']:>8} {m['total_ms']:>10} {m['avg_ms']:>8} "
+                         f"{m['p95_ms']:>8} {m['rows']:>8} {m['lock_wait_ms']:>8}")
+        for scan in d.get('full_scans', []):
+            lines.append(f"  [full scan] {scan['method']}: {', '.join(scan['tables'])} :: {scan['sql'][:120]}")
+        for slow in d.get('slow_queries', [])[-10:]:
+            lines.append(f"  [lenta {slow['ms']} ms] {slow['method']} :: {slow['sql'][:120]}")
+        lines.append('')
+    return '\n'.join(lines) if lines else 'Sin datos de perfilado (¿DB_PROFILE = True?)'
+
+
+if __name__ == "__main__":
+    # Uso: python -m Models.QueryProfiler [--json]
+    data = QueryProfiler.load_dumps()
+    if '--json' in sys.argv[1:]:
+        print(json.dumps(data, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(data))
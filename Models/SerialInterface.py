@@ -1,16 +1,25 @@
 from time import sleep
+from datetime import datetime
 import os
+import threading
+import time
+from typing import Optional
 from meshtastic import serial_interface
 from pubsub import pub
 from functions import log_p, search_command
 from data import commands_dict
 from Models.Node import Node
+from Models.CommandExecutor import CommandExecutor
+from Models.TxScheduler import TxScheduler, TX_PRIORITY_LOW, TX_PRIORITY_NORMAL
+from Models.TraceRoute import TraceTracker, TRACE_HOP_LIMIT
 
 
 class SerialInterface:
 
     lock = False
     node_dict = {}
+    # Altas en node_dict: callbacks pubsub y el hilo 'node-sync' de get_nodes
+    _node_lock = threading.Lock()
 
     # Eventos pubsub gestionados por esta clase: (handler, topic). Se usa para
     # suscribir y desuscribir de forma simétrica y evitar suscripciones duplicadas
@@ -41,6 +50,13 @@ class SerialInterface:
         # reconexión real la realiza el hilo principal en main.loop(), nunca el
         # hilo 'publishing' de Meshtastic (que reparte los mensajes recibidos).
         self._needs_reconnect = False
+        # Métrica de la última sincronización de nodos al conectar (get_nodes)
+        self.node_sync_stats = {}
+        # Cola única de transmisiones: todo envío a la radio pasa por aquí y
+        # sale espaciado por el hilo 'tx-sender' (ver Models/TxScheduler.py)
+        self.tx = TxScheduler()
+        # Traces en vuelo y resultados pendientes de recoger (Models/TraceRoute.py)
+        self.traces = TraceTracker()
 
     def _subscribe(self):
         for handler, topic in self._subscriptions():
@@ -89,6 +105,12 @@ class SerialInterface:
 
         log_p("Reconexión solicitada: cerrando interfaz previa...", level="WARN")
         self._unsubscribe()
+        # Volcar el estado de nodos pendiente antes de reconstruir la interfaz
+        try:
+            from Models.NodeStore import NodeStore
+            NodeStore.get_instance().flush()
+        except Exception:
+            pass
         self.disconnect()
 
         if not os.path.exists(self.serial_port):
@@ -141,11 +163,7 @@ class SerialInterface:
                 id = user.get('id', 'Desconocido')
 
                 # Pedir info del nodo que envía
-                fromNodeInfo = self.node_dict.get(id, None)
-
-                if not fromNodeInfo:
-                    fromNodeInfo = Node(id)
-                    self.node_dict[id] = fromNodeInfo
+                fromNodeInfo = self._get_node(id)
 
                 log_p(f"Nodo Actualizado: {user.get('longName', None)} ({id})")
 
@@ -180,6 +198,11 @@ class SerialInterface:
                 except Exception:
                     pass
 
+    def local_node_num(self):
+        """Número del nodo local conectado por UART (None si no se conoce)."""
+        my_info = getattr(self.interface, 'myInfo', None) if self.interface else None
+        return getattr(my_info, 'my_node_num', None)
+
     def on_receive_data(self, packet, interface):
         log_p(f"on_receive_data: {packet}", level="DEBUG")
         try:
@@ -209,11 +232,15 @@ class SerialInterface:
                 ch_util = dev_m.get('channelUtilization') if dev_m.get('channelUtilization') is not None else dev_m.get('channel_utilization')
                 air_tx = dev_m.get('airUtilTx') if dev_m.get('airUtilTx') is not None else dev_m.get('air_util_tx')
 
-                # Persistir telemetría en BD si el nodo existe
+                # La ocupación del canal que mide el nodo local ajusta la pausa
+                # entre transmisiones del planificador
+                if (ch_util is not None or air_tx is not None) and from_num is not None \
+                        and from_num == self.local_node_num():
+                    self.tx.update_airtime(ch_util, air_tx)
+
+                # Persistir telemetría (write-behind vía NodeStore)
                 if from_node_id:
                     try:
-                        from Models.Database import Database
-                        db = Database()
                         db_data = {}
                         if battery_lvl is not None:
                             db_data['battery'] = battery_lvl
@@ -225,12 +252,12 @@ class SerialInterface:
                             db_data['snr'] = packet.get('rxSnr')
                         if packet.get('rxRssi') is not None:
                             db_data['rssi'] = packet.get('rxRssi')
-                        if db_data:
-                            db.create_node_if_not_exists(from_node_id)
-                            db.update_node(from_node_id, db_data)
-                        
                         if from_node_id in self.node_dict:
+                            # update_metadata ya anota los cambios en NodeStore
                             self.node_dict[from_node_id].update_metadata(db_data)
+                        elif db_data:
+                            from Models.NodeStore import NodeStore
+                            NodeStore.get_instance().update(from_node_id, db_data)
                     except Exception:
                         pass
 
@@ -276,7 +303,7 @@ class SerialInterface:
         self.disconnect()
         self.connect()
 
-    def send (self, msg, dest=None, channel=0):
+    def send (self, msg, dest=None, channel=0, priority=TX_PRIORITY_NORMAL):
         """
         Envía un mensaje a un destino específico o al canal público
 
@@ -287,9 +314,14 @@ class SerialInterface:
                 - int: ID numérico del nodo (mensaje directo)
                 - str: ID en formato "!xxxxxxxx" (mensaje directo)
             channel (int): Número del canal (0-7). Por defecto 0 (canal primario)
+            priority (int): TX_PRIORITY_* (Models/TxScheduler.py)
+
+        No bloquea: encola el mensaje en el planificador de transmisión
+        (self.tx), que lo envía respetando la pausa mínima entre envíos.
 
         Returns:
-            bool: True si se envió correctamente, False en caso contrario
+            Future: su result() es True si se envió correctamente, False en
+            caso contrario (se puede esperar con result(timeout))
 
         Ejemplos:
             # Mensaje al canal público
@@ -304,6 +336,15 @@ class SerialInterface:
 
             # Mensaje a un canal específico
             self.send("Hola canal 1", channel=1)
+
+            # Esperar a que salga por la radio
+            ok = self.send("Hola", dest="!75e1ec00").result(timeout=30)
+        """
+        return self.tx.submit(self._transmit, msg, dest, channel, priority=priority)
+
+    def _transmit (self, msg, dest=None, channel=0):
+        """
+        Transmite ya (hilo 'tx-sender'). Devuelve True si se envió correctamente
         """
         if not self.interface:
             log_p("❌ Error: No hay interfaz conectada")
@@ -356,7 +397,7 @@ class SerialInterface:
             node_id (int|str): ID del nodo destino
 
         Returns:
-            bool: True si se envió correctamente
+            Future: resultado del envío (ver send)
         """
         return self.send(msg, dest=node_id)
 
@@ -369,7 +410,7 @@ class SerialInterface:
             channel (int): Número del canal (0-7)
 
         Returns:
-            bool: True si se envió correctamente
+            Future: resultado del envío (ver send)
         """
         return self.send(msg, dest="^all", channel=channel)
 
@@ -378,13 +419,30 @@ class SerialInterface:
         Responde automáticamente al remitente de un mensaje
         Detecta si el mensaje original era directo o de grupo y responde apropiadamente
 
+        No bloquea: la respuesta se encola en el planificador de transmisión.
+
         Args:
             msg (str): Mensaje de respuesta
             metadata (dict): Metadata del mensaje original (como el que creas en on_receive)
 
         Returns:
-            bool: True si se envió correctamente
+            Future: resultado del envío (ver send)
+        """
+        return self._reply_target(metadata)(msg)
+
+    def queue_replies (self, parts, metadata):
+        """
+        Encola una respuesta de varias partes. Salen en orden y espaciadas por
+        el planificador (misma prioridad = orden de llegada), así que las de un
+        mismo remitente (ya serializado por CommandExecutor) no se mezclan.
+
+        Returns:
+            list[Future]: resultado del envío de cada parte
         """
+        send = self._reply_target(metadata)
+        return [send(part) for part in parts if part]
+
+    def _reply_target (self, metadata):
         is_direct = metadata.get('is_direct', False)
         channel = metadata.get('channel', 0)
 
@@ -396,14 +454,21 @@ class SerialInterface:
             else:
                 from_id = str(node_from or '')
             log_p(f"Respondiendo en privado al nodo {from_id}")
-            return self.send(msg, dest=from_id)
+            return lambda msg: self.send(msg, dest=from_id)
         else:
             # Responder en el mismo canal
             log_p(f"↩️ Respondiendo en el canal {channel}")
-            return self.send(msg, dest="^all", channel=channel)
+            return lambda msg: self.send(msg, dest="^all", channel=channel)
+
+    def request_node_info(self, destination_id: str):
+        """Solicita NodeInfo a un nodo remoto a través de la radio Meshtastic.
 
-    def request_node_info(self, destination_id: str) -> bool:
-        """Solicita NodeInfo a un nodo remoto a través de la radio Meshtastic."""
+        Se encola con prioridad baja en el planificador de transmisión;
+        devuelve el Future del envío (ver send).
+        """
+        return self.tx.submit(self._request_node_info, destination_id, priority=TX_PRIORITY_LOW)
+
+    def _request_node_info(self, destination_id: str) -> bool:
         if not self.interface:
             log_p("No se puede solicitar NodeInfo: interfaz serie no inicializada", level="WARN")
             return False
@@ -454,10 +519,7 @@ class SerialInterface:
             if not node_id:
                 return
 
-            fromNodeInfo = self.node_dict.get(node_id)
-            if not fromNodeInfo:
-                fromNodeInfo = Node(node_id)
-                self.node_dict[node_id] = fromNodeInfo
+            fromNodeInfo = self._get_node(node_id)
 
             fromNodeInfo.update_metadata(node)
             log_p(f"Nodo reactivo actualizado: {fromNodeInfo.name} ({node_id})", level="DEBUG")
@@ -502,7 +564,8 @@ class SerialInterface:
             interface: La interfaz de meshtastic que se ha conectado
         """
         log_p("Conexión establecida con el dispositivo Meshtastic")
-        self.get_nodes()
+        # Fuera del hilo 'publishing' para no retrasar los primeros mensajes
+        threading.Thread(target=self.get_nodes, name="node-sync", daemon=True).start()
         try:
             from Models.EventBroadcaster import broadcast_event
             my_info = getattr(interface, 'myInfo', None)
@@ -533,278 +596,144 @@ class SerialInterface:
         except Exception:
             pass
 
-    def traceroute(self, node_id: str, timeout: float = 10.0):
-        """Ejecuta un TraceRoute real usando Meshtastic `sendTraceRoute` y capta la salida textual.
-
-        Compatibilidad de llamada (variantes probadas en orden):
-          1) sendTraceRoute(node_id, 3, False, callback)
-          2) sendTraceRoute(node_id, callback)
-          3) sendTraceRoute(node_id, 3, False)
-          4) sendTraceRoute(node_id)
-          5) sendTraceRoute(destinationId=node_id, onResponse=callback)
-          6) sendTraceRoute(id=node_id, onResponse=callback)
-          7) sendTraceRoute(destinationId=node_id)
-
-        Devuelve: dict con claves:
-          - text: str con la salida completa capturada (incluye líneas "Route traced ...")
-          - forward: lista de hops hacia destino (cada item: {id: str, snr: float|None})
-          - backward: lista de hops de regreso (cada item: {id: str, snr: float|None})
+    def start_traceroute(self, trace_id: int, node_id: str, timeout: Optional[float] = None):
+        """Inicia un TraceRoute sin esperar la respuesta.
+
+        Registra el trace en `self.traces` (TraceTracker) y encola el envío en
+        el planificador de transmisión con prioridad baja. El resultado
+        ({trace_id, node_id, ok, text, forward, backward} o `error`) llega a la
+        cola de completados de TraceTracker: por la respuesta RouteDiscovery,
+        por un error de routing o al vencer `timeout` segundos desde el envío
+        (por defecto TRACE_TIMEOUT; ver expire_traces). La respuesta se
+        asocia por id de paquete, así que puede haber varios en vuelo.
+        Devuelve el Future del envío.
         """
-        if not self.interface:
-            raise RuntimeError("Interfaz Meshtastic no conectada")
-
-        send_fn = getattr(self.interface, 'sendTraceRoute', None)
-        if send_fn is None or not callable(send_fn):
-            raise AttributeError("La interfaz Meshtastic no soporta sendTraceRoute()")
-
-        # Callback (por si la lib lo usa) – mantenemos por si aporta datos
-        results = []
-
-        def _on_response(*args, **kwargs):
-            try:
-                if args and isinstance(args[0], dict) and not kwargs:
-                    results.append(args[0])
-                else:
-                    results.append({'args': args, 'kwargs': kwargs})
-            except Exception:
-                results.append({'repr': repr((args, kwargs))})
-
-        # Capturar la salida textual que imprime la librería durante el trace
-        import time
-        import io
-        import contextlib
-
-        buf_out = io.StringIO()
-        buf_err = io.StringIO()
-
-        # Configurar un timeout ágil en la librería (por defecto 15s) para no bloquear
-        # 20 minutos (300s x waitFactor) si el nodo está inalcanzable u offline.
-        orig_expire = getattr(getattr(self.interface, '_timeout', None), 'expireTimeout', 300)
-        if hasattr(self.interface, '_timeout'):
-            try:
-                self.interface._timeout.expireTimeout = int(timeout)
-            except Exception:
-                pass
-
         # Normalizar node_id si es un nombre corto o alias
         target_id = node_id
         if not target_id.startswith('!') and not target_id.isdigit():
             try:
                 from Models.Database import Database
-                found = Database().get_node_by_identifier(target_id) or Database().get_node_by_short_name(target_id)
+                resolved = Database().resolve_identifier(target_id)
+                found = resolved["node"]
+                if resolved["ambiguous"]:
+                    ids = ", ".join(c['node_id'] for c in resolved["candidates"])
+                    log_p(f"Identificador ambiguo '{target_id}' ({ids}); se usa el más reciente", level="WARN")
                 if found and found.get('node_id'):
                     target_id = found['node_id']
             except Exception:
                 pass
 
-        try:
-            # Intentar variantes en orden de máxima compatibilidad (posicionales primero)
-            tried: list[str] = []
-            called = False
-
-            with contextlib.redirect_stdout(buf_out), contextlib.redirect_stderr(buf_err):
-                # 1) Firma estándar meshtastic (dest, hopLimit, channelIndex)
-                try:
-                    send_fn(dest=target_id, hopLimit=3, channelIndex=0)
-                    called = True
-                except (TypeError, SystemExit, Exception) as e:
-                    tried.append(str(e))
-
-            # 2) Posicional estándar (target_id, 3, 0)
-            if not called:
-                try:
-                    send_fn(target_id, 3, 0)
-                    called = True
-                except (TypeError, SystemExit, Exception) as e:
-                    tried.append(str(e))
-
-            # 3) Posicional con callback
-            if not called:
-                try:
-                    send_fn(target_id, 3, 0, _on_response)
-                    called = True
-                except (TypeError, SystemExit, Exception) as e:
-                    tried.append(str(e))
-
-            # 4) Posicional con callback como segundo argumento
-            if not called:
-                try:
-                    send_fn(target_id, _on_response)
-                    called = True
-                except (TypeError, SystemExit, Exception) as e:
-                    tried.append(str(e))
+        self.traces.register(trace_id, node_id, timeout)
+        return self.tx.submit(self._send_traceroute, trace_id, target_id, priority=TX_PRIORITY_LOW)
 
-            # 5) Posicional solo id
-            if not called:
-                try:
-                    send_fn(target_id)
-                    called = True
-                except (TypeError, SystemExit, Exception) as e:
-                    tried.append(str(e))
-
-            # 6) Keywords alternativas
-            if not called:
-                try:
-                    send_fn(destinationId=target_id, onResponse=_on_response)
-                    called = True
-                except (TypeError, SystemExit, Exception) as e:
-                    tried.append(str(e))
-                    try:
-                        send_fn(id=target_id, onResponse=_on_response)
-                        called = True
-                    except (TypeError, SystemExit, Exception) as e2:
-                        tried.append(str(e2))
+    def _send_traceroute(self, trace_id: int, target_id: str) -> bool:
+        # No se usa sendTraceRoute: la librería bloquea en waitForTraceRoute e
+        # imprime el resultado. sendData con el mismo RouteDiscovery vacío y
+        # onResponse propio deja la espera en manos de TraceTracker.
+        if not self.interface:
+            self.traces.fail(trace_id, "RuntimeError: Interfaz Meshtastic no conectada")
+            return False
+        try:
+            from meshtastic.protobuf import mesh_pb2, portnums_pb2
+            packet = self.interface.sendData(
+                mesh_pb2.RouteDiscovery(),
+                destinationId=target_id,
+                portNum=portnums_pb2.PortNum.TRACEROUTE_APP,
+                wantResponse=True,
+                onResponse=self.traces.on_response,
+                channelIndex=0,
+                hopLimit=TRACE_HOP_LIMIT,
+            )
+        except (Exception, SystemExit) as e:
+            self.traces.fail(trace_id, f"{e.__class__.__name__}: {e}")
+            return False
+        self.traces.sent(trace_id, packet.id)
+        return True
 
-            # 7) Último recurso: keyword mínima sin callback
-            if not called:
-                try:
-                    send_fn(destinationId=target_id)
-                    called = True
-                except (Exception, SystemExit) as e:
-                    tried.append(str(e))
-
-            if not called:
-                # Dejar la salida capturada hasta ahora y lanzar error
-                text_now = (buf_out.getvalue() or '') + (buf_err.getvalue() or '')
-                raise TypeError("sendTraceRoute no pudo ser invocado de forma compatible; errores: " + " | ".join(tried) + f"\n{text_now}")
-
-            # Ventana de espera para que se impriman las rutas
-            start = time.time()
-            last_len = 0
-            while time.time() - start < timeout:
-                # Si el callback recibe algo, reseteamos el contador para
-                # volver a esperar 'timeout' completo desde la última actividad
-                # (de lo contrario los sleep extra no prolongan la ventana real).
-                if len(results) != last_len:
-                    last_len = len(results)
-                    start = time.time()
-                    time.sleep(0.3)
-                time.sleep(0.2)
-        finally:
-            if hasattr(self.interface, '_timeout'):
-                try:
-                    self.interface._timeout.expireTimeout = orig_expire
-                except Exception:
-                    pass
+    def expire_traces(self) -> int:
+        """Da por caducados los traces sin respuesta dentro de su plazo.
 
-        text = (buf_out.getvalue() or '')
-        err_text = (buf_err.getvalue() or '')
-        if err_text and (not text):
-            text = err_text
-
-        # Parsear las líneas para extraer hops de ida y regreso
-        def _parse_forward_hops(txt: str):
-            import re
-            hops = []
-            lines = [l.strip() for l in txt.splitlines() if l.strip()]
-            # Buscar la línea inmediatamente posterior a "Route traced towards destination:"
-            for i, l in enumerate(lines):
-                if l.lower().startswith('route traced towards destination'):
-                    if i + 1 < len(lines):
-                        path_line = lines[i + 1]
-                        # Split por flechas
-                        parts = [p.strip() for p in path_line.split('-->')]
-                        # Cada parte puede ser "!id (X dB)" o solo "!id"
-                        # El primer elemento es el origen; hops son los siguientes
-                        def parse_part(part: str):
-                            m = re.search(r'(!?[0-9a-fA-F]{6,8}|![0-9a-fA-F]+)', part)
-                            if m:
-                                node = m.group(1)
-                                if not node.startswith('!'):
-                                    node = '!' + node
-                            else:
-                                node = None
-                            m2 = re.search(r'\(([-+]?\d+(?:\.\d+)?)\s*dB\)', part)
-                            snr = float(m2.group(1)) if m2 else None
-                            return node, snr
-                        parsed = [parse_part(p) for p in parts]
-                        # Tomar solo después del primero como hops
-                        for node, snr in parsed[1:]:
-                            if node:
-                                hops.append({'id': node, 'snr': snr})
-                    break
-            return hops
-
-        def _parse_backward_hops(txt: str):
-            import re
-            hops = []
-            lines = [l.strip() for l in txt.splitlines() if l.strip()]
-            # Buscar la línea inmediatamente posterior a "Route traced back to us:"
-            for i, l in enumerate(lines):
-                if l.lower().startswith('route traced back to us'):
-                    if i + 1 < len(lines):
-                        path_line = lines[i + 1]
-                        parts = [p.strip() for p in path_line.split('-->')]
-                        def parse_part(part: str):
-                            m = re.search(r'(!?[0-9a-fA-F]{6,8}|![0-9a-fA-F]+)', part)
-                            if m:
-                                node = m.group(1)
-                                if not node.startswith('!'):
-                                    node = '!' + node
-                            else:
-                                node = None
-                            m2 = re.search(r'\(([-+]?\d+(?:\.\d+)?)\s*dB\)', part)
-                            snr = float(m2.group(1)) if m2 else None
-                            return node, snr
-                        parsed = [parse_part(p) for p in parts]
-                        # El primer elemento es el destino y los siguientes los saltos de vuelta
-                        for node, snr in parsed[1:]:
-                            if node:
-                                hops.append({'id': node, 'snr': snr})
-                    break
-            return hops
-
-        forward_hops = _parse_forward_hops(text)
-        backward_hops = _parse_backward_hops(text)
-
-        return {
-            'text': text.strip(),
-            'forward': forward_hops,
-            'backward': backward_hops,
-        }
+        Suelta además su handler de respuesta en la librería (que no los
+        caduca). Devuelve cuántos han caducado.
+        """
+        expired = self.traces.expire()
+        handlers = getattr(self.interface, 'responseHandlers', None) if self.interface else None
+        if isinstance(handlers, dict):
+            for request_id in expired:
+                handlers.pop(request_id, None)
+        return len(expired)
+
+    def _get_node(self, node_id):
+        """Node en memoria de `node_id`, creándolo (y cargándolo de BD) si no existe."""
+        with self._node_lock:
+            node = self.node_dict.get(node_id)
+        if node is None:
+            node = Node(node_id)
+            with self._node_lock:
+                node = self.node_dict.setdefault(node_id, node)
+        return node
 
     def get_nodes (self):
         """
-        Obtiene y almacena la lista de nodos de la red Meshtastic
-        """
-        if self.interface:
-            node_list = self.interface.nodes
-            log_p(f"Nodos detectados en la red: {len(node_list)}")
-
-            # Instancio cada nodo y lo almaceno en un diccionario
-            for node_num, node_info in node_list.items():
-                user = node_info.get('user', {})
-                id = user.get('id')
-                if not id and node_num:
-                    try:
-                        id = f"!{int(node_num):08x}"
-                    except Exception:
-                        id = None
-                
-                if not id or str(id).strip() in ("", "None", "null", "Desconocido"):
-                    continue
+        Sincroniza en bloque la lista de nodos del dispositivo con la BD.
 
-                id = str(id).strip()
-                newNodeInfo = Node(id)
+        Una sola lectura de `nodes` y una transacción con las filas que han
+        cambiado (Database.sync_nodes). Deja la duración en `node_sync_stats`.
+        """
+        if not self.interface:
+            log_p("Error: No hay interfaz conectada")
+            return 0
+
+        started = time.monotonic()
+        node_list = dict(getattr(self.interface, 'nodes', None) or {})
+        log_p(f"Nodos detectados en la red: {len(node_list)}")
+
+        device_nodes = {}
+        for key, node_info in node_list.items():
+            if not isinstance(node_info, dict):
+                continue
+            user = node_info.get('user') or {}
+            id = user.get('id')
+            if not id and node_info.get('num') is not None:
+                try:
+                    id = f"!{int(node_info['num']):08x}"
+                except Exception:
+                    id = None
+            if not id and key:
+                id = key
 
-                newNodeInfo.update_metadata({
-                    "name": user.get('longName', None),
-                    "num": node_num,
-                    "short_name": user.get('shortName', None),
-                    "mac_addr": user.get('macaddr', None),
-                    "hw_model": user.get('hwModel', None),
-                    "role": user.get('role', None),
+            if not id or str(id).strip() in ("", "None", "null", "Desconocido"):
+                continue
 
-                    "snr": node_info.get('snr', None),
-                    "last_heard": node_info.get('lastHeard', None),
-                    "hops": node_info.get('hopsAway', None),
-                    "is_favorite": node_info.get('isFavorite', None),
-                })
+            device_nodes[str(id).strip()] = Node.device_columns(node_info)
 
-                newNodeInfo.update_metadata(node_info)
-                self.node_dict[id] = newNodeInfo
-        else:
-            log_p("Error: No hay interfaz conectada")
+        try:
+            from Models.Database import Database
+            result = Database().sync_nodes(device_nodes)
+        except Exception as e:
+            log_p(f"Error sincronizando nodos con la BD: {e}", level="WARN")
+            return 0
+
+        # Los Node se construyen aparte y se añaden de una vez bajo el lock:
+        # los callbacks pubsub no ven node_dict a medio rellenar y los nodos
+        # que ya crearon se conservan
+        with self._node_lock:
+            known = set(self.node_dict)
+        synced = {id: Node(id, row=row) for id, row in result["rows"].items() if id not in known}
+        with self._node_lock:
+            for id, node in synced.items():
+                self.node_dict.setdefault(id, node)
+
+        elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+        self.node_sync_stats = {
+            "runs": self.node_sync_stats.get("runs", 0) + 1,
+            "last_duration_ms": elapsed_ms,
+            "last_nodes": result["total"],
+            "last_changed": result["changed"],
+            "last_at": datetime.now().isoformat(timespec='seconds'),
+        }
+        log_p(f"Nodos sincronizados: {result['total']} ({result['changed']} con cambios) en {elapsed_ms} ms")
+        return result["changed"]
 
     def on_receive_text (self, packet, interface):
         """
@@ -833,11 +762,7 @@ class SerialInterface:
                     is_direct = True
 
                 # Pedir info del nodo que envía
-                fromNodeInfo = self.node_dict.get(from_id, None) if from_id else None
-
-                if from_id and not fromNodeInfo:
-                    fromNodeInfo = Node(from_id)
-                    self.node_dict[from_id] = fromNodeInfo
+                fromNodeInfo = self._get_node(from_id) if from_id else None
 
                 if fromNodeInfo:
                     fromNodeInfo.update_metadata({
@@ -893,25 +818,34 @@ class SerialInterface:
                         'in_group']:
                         return
 
-                    self.command_dict[command]["callback"](self,
-                                                           cmd_args, msg,
-                                                           metadata)
+                    # El callback se ejecuta en un worker de CommandExecutor:
+                    # este hilo ('publishing') vuelve enseguida a repartir
+                    # paquetes aunque el comando tarde (red, respuestas largas)
+                    CommandExecutor.get_instance().submit(
+                        from_id, self._run_command, command, cmd_args, msg, metadata
+                    )
 
-                    # Registro centralizado del comando en histórico
-                    # (commands_sent). Se hace aquí, tras ejecutar el callback,
-                    # para no duplicar esta lógica en cada Commands/*.py.
-                    try:
-                        from Models.Database import Database
-                        node_id = (metadata.get('node_from') or {}).get('id')
-                        message_tail = ' '.join(cmd_args) if cmd_args else None
-                        Database().log_command(
-                            node_id=node_id,
-                            command=command,
-                            message=message_tail,
-                            parameters=None,
-                        )
-                    except Exception as e:
-                        log_p(f"Error registrando comando: {e}", level="WARN")
+        except Exception as e:
+            log_p(f"Error procesando paquete: {e}")
 
+    def _run_command (self, command, cmd_args, msg, metadata):
+        """
+        Ejecuta el callback de un comando (en un worker de CommandExecutor)
+        """
+        self.command_dict[command]["callback"](self, cmd_args, msg, metadata)
+
+        # Registro centralizado del comando en histórico
+        # (commands_sent). Se hace aquí, tras ejecutar el callback,
+        # para no duplicar esta lógica en cada Commands/*.py.
+        try:
+            from Models.Database import Database
+            node_id = (metadata.get('node_from') or {}).get('id')
+            message_tail = ' '.join(cmd_args) if cmd_args else None
+            Database().log_command(
+                node_id=node_id,
+                command=command,
+                message=message_tail,
+                parameters=None,
+            )
         except Exception as e:
-            log_p(f"Error procesando paquete: {e}")
\ No newline at end of file
+            log_p(f"Error registrando comando: {e}", level="WARN")
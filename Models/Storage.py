@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from functions import log_p
+
+# Valores por modo de almacenamiento (DB_STORAGE_MODE). None = valor de SQLite.
+#  - default: comportamiento de SQLite (checkpoint automático cada 1000 páginas).
+#  - sdcard: WAL más grande con checkpoints PASSIVE desde la parte ociosa de
+#    main.loop() y escrituras de bajo valor agrupadas (Models/WriteBatcher.py),
+#    para reducir la amplificación de escritura en la tarjeta SD de la Pi.
+STORAGE_MODES: Dict[str, Dict[str, Any]] = {
+    "default": {
+        "wal_autocheckpoint": None,
+        "journal_size_limit": None,
+        "mmap_size": None,
+        "checkpoint_interval": 0,
+        "write_batch_interval": 0,
+    },
+    "sdcard": {
+        "wal_autocheckpoint": 4000,             # páginas (~16 MiB con páginas de 4 KiB)
+        "journal_size_limit": 16 * 1024 * 1024,  # bytes a los que se trunca el WAL tras un checkpoint
+        "mmap_size": 32 * 1024 * 1024,
+        "checkpoint_interval": 60,              # segundos entre checkpoints PASSIVE
+        "write_batch_interval": 30,             # segundos entre volcados de comandos y pings
+    },
+}
+
+# Variable de env.py que sobreescribe cada ajuste del modo
+_ENV_OVERRIDES = {
+    "wal_autocheckpoint": "DB_WAL_AUTOCHECKPOINT",
+    "journal_size_limit": "DB_JOURNAL_SIZE_LIMIT",
+    "mmap_size": "DB_MMAP_SIZE",
+    "checkpoint_interval": "DB_CHECKPOINT_INTERVAL",
+    "write_batch_interval": "DB_WRITE_BATCH_INTERVAL",
+}
+
+# Ventana de la métrica de bytes escritos por hora
+RATE_WINDOW = 3600.0
+# Intervalo mínimo entre muestras de /proc/self/io
+SAMPLE_INTERVAL = 60.0
+
+
+def storage_settings() -> Dict[str, Any]:
+    """Ajustes de almacenamiento efectivos: los del modo + los de env.py que no sean None."""
+    import env as _env
+    mode = str(getattr(_env, "DB_STORAGE_MODE", "default") or "default").lower()
+    if mode not in STORAGE_MODES:
+        log_p(f"DB_STORAGE_MODE desconocido '{mode}', se usa 'default'", level="WARN")
+        mode = "default"
+    settings: Dict[str, Any] = {"mode": mode, **STORAGE_MODES[mode]}
+    for key, var in _ENV_OVERRIDES.items():
+        value = getattr(_env, var, None)
+        if value is not None:
+            settings[key] = value
+    return settings
+
+
+def connection_pragmas(settings: Optional[Dict[str, Any]] = None) -> List[str]:
+    """PRAGMA por conexión del modo activo (los aplica ConnectionPool al abrir)."""
+    settings = settings if settings is not None else storage_settings()
+    return [
+        f"PRAGMA {name} = {int(settings[name])}"
+        for name in ("wal_autocheckpoint", "journal_size_limit", "mmap_size")
+        if settings.get(name) is not None
+    ]
+
+
+def process_write_bytes() -> Optional[int]:
+    """Bytes que este proceso ha enviado al dispositivo de bloques (/proc/self/io).
+
+    Incluye lo que no es SQLite (logs, etc.), pero es lo que llega de verdad a la
+    tarjeta SD. None si el sistema no lo ofrece.
+    """
+    try:
+        with open("/proc/self/io", "r", encoding="ascii") as fh:
+            for line in fh:
+                if line.startswith("write_bytes:"):
+                    return int(line.split(":", 1)[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class StorageMonitor:
+    """Checkpoints WAL controlados y métrica de bytes escritos por hora.
+
+    main.loop() llama a `run_if_due()` en su parte ociosa (tras el outbox y
+    antes de dormir). Con checkpoint_interval > 0 lanza un checkpoint PASSIVE:
+    copia al fichero principal lo que pueda sin esperar a lectores ni
+    escritores, así el checkpoint automático (y su pausa) no cae dentro del
+    callback de radio. Siempre toma una muestra de escritura para la métrica.
+    """
+
+    _instance: Optional[StorageMonitor] = None
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None) -> None:
+        self.settings = settings if settings is not None else storage_settings()
+        self._lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+        self._last_sample = 0.0
+        self._samples: Deque[Tuple[float, int]] = deque()
+        self._checkpoint_samples: Deque[Tuple[float, int]] = deque()
+        self.stats: Dict[str, Any] = {
+            "checkpoints": 0,
+            "checkpoint_busy": 0,
+            "checkpointed_bytes": 0,
+            "last_checkpoint": None,
+            "errors": 0,
+        }
+
+    @classmethod
+    def get_instance(cls) -> StorageMonitor:
+        """Obtiene o crea la instancia singleton."""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def run_if_due(self, db=None) -> Optional[Dict[str, Any]]:
+        """Checkpoint PASSIVE si ha vencido el intervalo y muestra de escritura.
+
+        Devuelve el resultado del checkpoint o None si no tocaba.
+        """
+        now = time.monotonic()
+        if now - self._last_sample >= SAMPLE_INTERVAL:
+            self._sample(now)
+        interval = float(self.settings.get("checkpoint_interval") or 0)
+        if interval <= 0 or now - self._last_checkpoint < interval:
+            return None
+        return self.checkpoint(db)
+
+    def checkpoint(self, db=None) -> Optional[Dict[str, Any]]:
+        """Ejecuta un checkpoint PASSIVE y actualiza las estadísticas."""
+        self._last_checkpoint = time.monotonic()
+        try:
+            if db is None:
+                from Models.Database import Database
+                db = Database()
+            result = db.wal_checkpoint("PASSIVE")
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            log_p(f"StorageMonitor: error en checkpoint: {e}", level="WARN")
+            return None
+        with self._lock:
+            self.stats["checkpoints"] += 1
+            self.stats["checkpoint_busy"] += int(bool(result["busy"]))
+            self.stats["checkpointed_bytes"] += result["checkpointed_bytes"]
+            self.stats["last_checkpoint"] = result
+            self._push(self._checkpoint_samples, time.monotonic(), self.stats["checkpointed_bytes"])
+        return result
+
+    def _sample(self, now: float) -> None:
+        self._last_sample = now
+        written = process_write_bytes()
+        if written is not None:
+            with self._lock:
+                self._push(self._samples, now, written)
+
+    @staticmethod
+    def _push(samples: Deque[Tuple[float, int]], now: float, value: int) -> None:
+        samples.append((now, value))
+        # Se conserva la muestra justo anterior a la ventana como referencia
+        while len(samples) > 2 and now - samples[1][0] >= RATE_WINDOW:
+            samples.popleft()
+
+    @staticmethod
+    def _per_hour(samples: Deque[Tuple[float, int]]) -> Optional[int]:
+        if len(samples) < 2:
+            return None
+        (t0, v0), (t1, v1) = samples[0], samples[-1]
+        if t1 <= t0:
+            return None
+        return int((v1 - v0) * 3600.0 / (t1 - t0))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Métricas para el heartbeat (system_status)."""
+        from Models.WriteBatcher import WriteBatcher
+        with self._lock:
+            out = dict(self.stats)
+            out["mode"] = self.settings.get("mode")
+            # Estimación sobre la última hora (o desde el arranque si es menos)
+            out["write_bytes_per_hour"] = self._per_hour(self._samples)
+            out["checkpoint_bytes_per_hour"] = self._per_hour(self._checkpoint_samples)
+        batcher = WriteBatcher.active()
+        out["write_batch"] = batcher.snapshot() if batcher is not None else None
+        return out
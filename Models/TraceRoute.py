@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from functions import log_p
+
+# SNR desconocido en RouteDiscovery (los valores vienen multiplicados por 4)
+UNK_SNR = -128
+
+# Saltos máximos con los que se envía la petición de traceroute
+TRACE_HOP_LIMIT = 3
+
+# Estados de un trace en TraceTracker
+TRACE_QUEUED = "queued"    # en el planificador de transmisión, sin enviar
+TRACE_SENT = "sent"        # enviado, esperando RouteDiscovery hasta el plazo
+TRACE_DONE = "done"        # resultado en la cola de completados
+
+
+def _node_id(num: Any) -> str:
+    try:
+        return f"!{int(num):08x}"
+    except (TypeError, ValueError):
+        return str(num)
+
+
+def _snr(value: Any) -> Optional[float]:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return None if value == UNK_SNR else value / 4
+
+
+def _path(route: List[Any], snrs: List[Any], end: Any) -> List[Dict[str, Any]]:
+    """Saltos intermedios de `route` seguidos de `end`, cada uno con su SNR."""
+    nodes = list(route) + [end]
+    return [{'id': _node_id(num), 'snr': _snr(snrs[i]) if i < len(snrs) else None}
+            for i, num in enumerate(nodes)]
+
+
+def _path_text(start: Any, hops: List[Dict[str, Any]]) -> str:
+    parts = [_node_id(start)]
+    for hop in hops:
+        parts.append(f"{hop['id']} ({'?' if hop['snr'] is None else hop['snr']}dB)")
+    return " --> ".join(parts)
+
+
+def parse_route_discovery(packet: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte la respuesta TRACEROUTE_APP en {text, forward, backward}.
+
+    Misma forma que devolvía el antiguo SerialInterface.traceroute(): los
+    saltos de ida van del primer intermedio al destino y los de vuelta del
+    primer intermedio de regreso a nuestro nodo. El texto reproduce las líneas
+    "Route traced ..." que imprimía la librería (se guarda en data_raw).
+    """
+    decoded = packet.get('decoded') or {}
+    payload = decoded.get('payload')
+    if isinstance(payload, (bytes, bytearray)):
+        from google.protobuf.json_format import MessageToDict
+        from meshtastic.protobuf import mesh_pb2
+        discovery = mesh_pb2.RouteDiscovery()
+        discovery.ParseFromString(bytes(payload))
+        route = MessageToDict(discovery)
+    else:
+        route = decoded.get('traceroute') or {}
+
+    us, dest = packet.get('to'), packet.get('from')
+    forward = _path(route.get('route', []), route.get('snrTowards', []), dest)
+    lines = ["Route traced towards destination:", _path_text(us, forward)]
+
+    backward: List[Dict[str, Any]] = []
+    route_back = route.get('routeBack', [])
+    snr_back = route.get('snrBack', [])
+    # Firmware antiguo no informa la vuelta: solo es válida con hopStart y un SNR por tramo
+    if 'hopStart' in packet and len(snr_back) == len(route_back) + 1:
+        backward = _path(route_back, snr_back, us)
+        lines += ["Route traced back to us:", _path_text(dest, backward)]
+
+    return {'text': "\n".join(lines), 'forward': forward, 'backward': backward}
+
+
+def trace_policy() -> Dict[str, Any]:
+    """Parámetros de Database.get_next_node_to_trace según la configuración."""
+    import env as _env
+    routers = getattr(_env, 'ROUTER_NODES', None) or getattr(_env, 'ROUTERS_LIST', None) or []
+    if isinstance(routers, str):
+        routers = [r.strip() for r in routers.split(',') if r.strip()]
+    return {
+        'hops_limit': int(getattr(_env, 'TRACES_HOPS', 2) or 2),
+        'reload_hours': int(getattr(_env, 'TRACES_RELOAD_INTERVAL', 72) or 72),
+        'router_reload_hours': int(getattr(_env, 'ROUTER_TRACE_INTERVAL_HOURS', 6) or 6),
+        'router_max_hops': int(getattr(_env, 'ROUTER_MAX_HOPS', 2) or 2),
+        'router_retry_short_hours': int(getattr(_env, 'ROUTER_RETRY_SHORT_HOURS', 1) or 1),
+        'router_max_retries': int(getattr(_env, 'ROUTER_MAX_RETRIES', 5) or 5),
+        'router_retry_long_hours': int(getattr(_env, 'ROUTER_RETRY_LONG_HOURS', 24) or 24),
+        'retry_hours': int(getattr(_env, 'TRACES_RETRY_INTERVAL', 24) or 24),
+        'router_identifiers': routers,
+    }
+
+
+def enqueue_next_traces(db: Any, count: int, policy: Optional[Dict[str, Any]] = None) -> List[int]:
+    """Encola (status='pending') hasta `count` traces hacia los siguientes candidatos.
+
+    Un nodo con trace encolado deja de ser candidato, así que cada vuelta
+    devuelve otro distinto. Devuelve los ids de `traces` encolados (menos de
+    `count` si no quedan candidatos con las ventanas cumplidas).
+    """
+    policy = trace_policy() if policy is None else policy
+    trace_ids: List[int] = []
+    for _ in range(max(0, int(count))):
+        node_id = db.get_next_node_to_trace(**policy)
+        if not node_id:
+            break
+        trace_id = db.enqueue_trace(node_id)
+        log_p(f"Traces: encolado trace id={trace_id} para nodo {node_id}")
+        trace_ids.append(trace_id)
+    return trace_ids
+
+
+class TraceTracker:
+    """Traces en vuelo y cola de resultados para main.loop().
+
+    Cada trace pasa por queued → sent → done: SerialInterface.start_traceroute
+    lo registra y lo encola en el planificador de transmisión; al enviarse se
+    anota el id del paquete (request id de la respuesta) y su plazo
+    (TRACE_TIMEOUT). La librería llama a `on_response` desde su hilo lector
+    con el RouteDiscovery (o un error de routing) y el resultado pasa a la
+    cola de completados; si vence el plazo, `expire()` lo completa como
+    timeout. main.loop() recoge los resultados con `drain()` y mientras tanto
+    sigue despachando outbox y alertas.
+
+    Un trace cuenta como en vuelo hasta que su resultado se recoge, así el
+    bucle no vuelve a tomar la misma fila de `traces` antes de marcarla.
+
+    Puede haber hasta TRACE_MAX_IN_FLIGHT traces a la vez, cada uno con su
+    plazo: `timeout_for()` lo deriva del tiempo de respuesta histórico
+    (Database.get_trace_rtt) entre TRACE_TIMEOUT_MIN y TRACE_TIMEOUT, así un
+    nodo cercano que no contesta no ocupa un hueco el plazo máximo. Por
+    defecto ambos valen 10 s (el plazo fijo de antes): el margen adaptativo
+    se abre al subir TRACE_TIMEOUT.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, max_in_flight: Optional[int] = None) -> None:
+        import env as _env
+        self.timeout = float(timeout if timeout is not None else getattr(_env, 'TRACE_TIMEOUT', 10) or 10)
+        self.min_timeout = min(self.timeout, float(getattr(_env, 'TRACE_TIMEOUT_MIN', 10) or 0))
+        self.timeout_factor = float(getattr(_env, 'TRACE_TIMEOUT_FACTOR', 3) or 3)
+        self.max_in_flight = max(1, int(max_in_flight if max_in_flight is not None
+                                        else getattr(_env, 'TRACE_MAX_IN_FLIGHT', 1) or 1))
+        self._lock = threading.Lock()
+        self._traces: Dict[int, Dict[str, Any]] = {}
+        self._by_request: Dict[int, int] = {}
+        self._completed: queue.Queue = queue.Queue()
+        self.stats = {"started": 0, "done": 0, "failed": 0, "timeouts": 0, "late": 0}
+
+    def timeout_for(self, rtt_ms: Optional[float]) -> float:
+        """Plazo (s) para un trace con tiempo de respuesta esperado `rtt_ms`.
+
+        TRACE_TIMEOUT_FACTOR veces el histórico, entre TRACE_TIMEOUT_MIN y
+        TRACE_TIMEOUT; sin histórico, TRACE_TIMEOUT.
+        """
+        if rtt_ms is None:
+            return self.timeout
+        return min(self.timeout, max(self.min_timeout, float(rtt_ms) / 1000 * self.timeout_factor))
+
+    def register(self, trace_id: int, node_id: str, timeout: Optional[float] = None) -> None:
+        """Anota un trace encolado para transmitir (con su plazo, por defecto TRACE_TIMEOUT)."""
+        with self._lock:
+            self._traces[trace_id] = {'trace_id': trace_id, 'node_id': node_id, 'state': TRACE_QUEUED,
+                                      'request_id': None, 'sent_at': None, 'deadline': None,
+                                      'timeout': float(timeout) if timeout is not None else self.timeout}
+            self.stats["started"] += 1
+
+    def sent(self, trace_id: int, request_id: int) -> None:
+        """El paquete salió: la respuesta llegará con `request_id` antes del plazo."""
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None or trace['state'] != TRACE_QUEUED:
+                return
+            now = time.monotonic()
+            trace.update(state=TRACE_SENT, request_id=request_id, sent_at=now, deadline=now + trace['timeout'])
+            self._by_request[request_id] = trace_id
+
+    def fail(self, trace_id: int, error: str) -> None:
+        """Completa el trace con error (envío fallido, nodo desconectado...)."""
+        self._complete(trace_id, ok=False, error=error)
+
+    def on_response(self, packet: Dict[str, Any]) -> None:
+        """Callback onResponse de sendData (hilo lector de la librería)."""
+        decoded = packet.get('decoded') or {}
+        with self._lock:
+            trace_id = self._by_request.get(decoded.get('requestId'))
+        if trace_id is None:
+            # Respuesta de un trace ya caducado
+            with self._lock:
+                self.stats["late"] += 1
+            log_p(f"TraceTracker: respuesta tardía para la petición {decoded.get('requestId')}", level="DEBUG")
+            return
+        if decoded.get('portnum') == 'ROUTING_APP':
+            reason = (decoded.get('routing') or {}).get('errorReason', 'NONE')
+            if reason != 'NONE':
+                self._complete(trace_id, ok=False, error=f"Routing: {reason}")
+            return
+        try:
+            result = parse_route_discovery(packet)
+        except Exception as e:
+            self._complete(trace_id, ok=False, error=f"{e.__class__.__name__}: {e}")
+            return
+        self._complete(trace_id, ok=True, **result)
+
+    def _complete(self, trace_id: int, ok: bool, wake: bool = True, **result: Any) -> None:
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None or trace['state'] == TRACE_DONE:
+                return
+            trace['state'] = TRACE_DONE
+            self._by_request.pop(trace['request_id'], None)
+            rtt = time.monotonic() - trace['sent_at'] if trace['sent_at'] is not None else None
+            if ok:
+                self.stats["done"] += 1
+            elif result.get('error') == 'Timeout':
+                self.stats["timeouts"] += 1
+            else:
+                self.stats["failed"] += 1
+        self._completed.put({'trace_id': trace_id, 'node_id': trace['node_id'], 'ok': ok,
+                             'request_id': trace['request_id'], 'rtt': rtt, 'timeout': trace['timeout'],
+                             **result})
+        if wake:
+            # Despertar al bucle para marcar el resultado y tomar el siguiente trace
+            from Models.Wakeup import WAKE_TRACE, wake_main_loop
+            wake_main_loop(WAKE_TRACE)
+
+    def expire(self, now: Optional[float] = None) -> List[int]:
+        """Completa como timeout los traces con el plazo vencido.
+
+        Devuelve los request id caducados (para soltar su handler en la librería).
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [t for t in self._traces.values()
+                       if t['state'] == TRACE_SENT and t['deadline'] <= now]
+        for trace in expired:
+            self._complete(trace['trace_id'], ok=False, wake=False, error='Timeout')
+        return [t['request_id'] for t in expired]
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Resultados completados desde la última llamada (y dejan de estar en vuelo)."""
+        results = []
+        while True:
+            try:
+                result = self._completed.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._traces.pop(result['trace_id'], None)
+            results.append(result)
+        return results
+
+    def in_flight(self) -> int:
+        """Traces registrados cuyo resultado aún no se ha recogido."""
+        with self._lock:
+            return len(self._traces)
+
+    def trace_ids(self) -> List[int]:
+        """Ids (tabla traces) de los traces en vuelo."""
+        with self._lock:
+            return list(self._traces)
+
+    def next_deadline(self) -> Optional[float]:
+        """Segundos hasta el plazo más próximo (None si no hay traces enviados)."""
+        with self._lock:
+            deadlines = [t['deadline'] for t in self._traces.values() if t['state'] == TRACE_SENT]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Métricas para el heartbeat (system_status)."""
+        with self._lock:
+            out = dict(self.stats)
+            out["in_flight"] = len(self._traces)
+            out["max_in_flight"] = self.max_in_flight
+            out["timeout"] = self.timeout
+            return out
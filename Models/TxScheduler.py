@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from functions import log_p
+
+# Prioridades de transmisión (menor = antes). Coinciden con las de outbox
+# (Database.OUTBOX_PRIORITY_*): alertas, mensajes normales y NodeInfo.
+TX_PRIORITY_ALERT = 0
+TX_PRIORITY_NORMAL = 1
+TX_PRIORITY_LOW = 2
+
+# Muestras de espera en cola que se conservan para la media
+WAIT_SAMPLES = 200
+
+
+class TxScheduler:
+    """Cola única de transmisiones a la radio con pausa mínima entre envíos.
+
+    SerialInterface encola aquí todo lo que transmite (send, reply_to_message,
+    request_node_info) y un único hilo 'tx-sender' lo envía por prioridad y,
+    dentro de la misma prioridad, en orden de llegada. Entre dos transmisiones
+    hay al menos `current_gap()` segundos, sea cual sea el origen (respuestas
+    de comandos, outbox o alertas AEMET), así que dos caminos ya no pueden
+    transmitir pegados.
+
+    La pausa parte de TX_MIN_GAP y crece con la ocupación del canal que
+    informa el nodo local (channel_util y air_util_tx, ver update_airtime):
+    por encima de TX_CHANNEL_UTIL_BUSY / TX_AIR_UTIL_BUSY se escala en
+    proporción, hasta TX_MAX_GAP.
+
+    Además lleva el presupuesto de aire para el tráfico opcional (traceroutes
+    que main.loop() repone por su cuenta): `airtime_available()` es False en
+    cuanto el air_util_tx del nodo local alcanza TX_AIRTIME_BUDGET.
+
+    `submit()` devuelve un concurrent.futures.Future con el bool del envío:
+    quien lo necesite puede esperar (`result(timeout)`) o registrar
+    `add_done_callback`; el resto sigue sin bloquearse.
+    """
+
+    def __init__(self, min_gap: Optional[float] = None, max_gap: Optional[float] = None) -> None:
+        import env as _env
+        if min_gap is None:
+            # OUTBOX_SEND_GAP era la pausa del outbox antes de este planificador
+            min_gap = getattr(_env, 'TX_MIN_GAP', getattr(_env, 'OUTBOX_SEND_GAP', 2.5))
+        self.min_gap = float(min_gap or 0)
+        self.max_gap = max(self.min_gap, float(max_gap if max_gap is not None
+                                               else getattr(_env, 'TX_MAX_GAP', 15.0)))
+        self.channel_util_busy = float(getattr(_env, 'TX_CHANNEL_UTIL_BUSY', 25.0) or 0)
+        self.air_util_busy = float(getattr(_env, 'TX_AIR_UTIL_BUSY', 7.5) or 0)
+        self.airtime_budget = float(getattr(_env, 'TX_AIRTIME_BUDGET', 5.0) or 0)
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[int, int, float, Callable[..., Any], Tuple[Any, ...], Future]] = []
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._next_at = 0.0
+        self._channel_util: Optional[float] = None
+        self._air_util_tx: Optional[float] = None
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "max_depth": 0, "wait_ms_max": 0.0}
+
+    def submit(self, func: Callable[..., Any], *args: Any, priority: int = TX_PRIORITY_NORMAL) -> Future:
+        """Encola la transmisión `func(*args)` (debe devolver bool) y retorna su Future."""
+        future: Future = Future()
+        with self._cond:
+            heapq.heappush(self._heap, (int(priority), next(self._seq), time.monotonic(), func, args, future))
+            self.stats["queued"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self._heap))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="tx-sender", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def update_airtime(self, channel_util: Optional[float] = None, air_util_tx: Optional[float] = None) -> None:
+        """Anota la ocupación del canal (%) que informa el nodo local."""
+        with self._cond:
+            if channel_util is not None:
+                self._channel_util = float(channel_util)
+            if air_util_tx is not None:
+                self._air_util_tx = float(air_util_tx)
+
+    def current_gap(self) -> float:
+        """Pausa mínima (s) entre transmisiones según la ocupación del canal."""
+        with self._cond:
+            factor = 1.0
+            if self._channel_util is not None and self.channel_util_busy > 0:
+                factor = max(factor, self._channel_util / self.channel_util_busy)
+            if self._air_util_tx is not None and self.air_util_busy > 0:
+                factor = max(factor, self._air_util_tx / self.air_util_busy)
+            return min(self.max_gap, self.min_gap * factor)
+
+    def airtime_available(self) -> bool:
+        """Si queda presupuesto de aire (TX_AIRTIME_BUDGET) para tráfico opcional.
+
+        Con `0` no hay presupuesto; sin dato del nodo local todavía, sí.
+        """
+        with self._cond:
+            if self.airtime_budget <= 0:
+                return False
+            return self._air_util_tx is None or self._air_util_tx < self.airtime_budget
+
+    def pending(self) -> int:
+        """Transmisiones en cola sin enviar."""
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                # Se espera a que venza la pausa sin sacar nada de la cola: si
+                # mientras tanto llega algo más prioritario, sale antes
+                while not self._heap or time.monotonic() < self._next_at:
+                    self._cond.wait(None if not self._heap else self._next_at - time.monotonic())
+                _, _, queued_at, func, args, future = heapq.heappop(self._heap)
+                wait_ms = (time.monotonic() - queued_at) * 1000
+                self._waits.append(wait_ms)
+                self.stats["wait_ms_max"] = round(max(self.stats["wait_ms_max"], wait_ms), 2)
+
+            ok = False
+            try:
+                ok = bool(func(*args))
+            except BaseException as e:
+                # SystemExit (our_exit de la librería) y similares no deben
+                # matar al hilo ni dejar el Future sin resolver
+                log_p(f"TxScheduler: error transmitiendo: {e!r}", level="WARN")
+                ok = False
+
+            try:
+                gap = self.current_gap()
+                with self._cond:
+                    self.stats["sent" if ok else "failed"] += 1
+                    # Un envío fallido no ha ocupado el aire: no hace falta esperar
+                    if ok:
+                        self._next_at = time.monotonic() + gap
+            finally:
+                future.set_result(ok)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Métricas para el heartbeat (system_status)."""
+        gap = self.current_gap()
+        airtime_ok = self.airtime_available()
+        with self._cond:
+            out = dict(self.stats)
+            out["pending"] = len(self._heap)
+            out["gap"] = round(gap, 2)
+            out["channel_util"] = self._channel_util
+            out["air_util_tx"] = self._air_util_tx
+            out["airtime_budget"] = self.airtime_budget
+            out["airtime_ok"] = airtime_ok
+            out["wait_ms_avg"] = round(sum(self._waits) / len(self._waits), 2) if self._waits else None
+            return out
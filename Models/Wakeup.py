@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import os
+import select
+import socket
+import time
+from typing import Optional, Set
+
+from functions import log_p
+
+# Ruta por defecto del socket Unix DGRAM por el que se despierta a main.loop()
+DEFAULT_WAKEUP_SOCKET_PATH = "/tmp/meshassistant_wakeup.sock"
+
+# Motivos de aviso: colas que main.loop() debe revisar al despertar
+WAKE_OUTBOX = "outbox"
+WAKE_TRACE = "trace"
+WAKE_AEMET = "aemet"
+WAKE_REASONS = frozenset((WAKE_OUTBOX, WAKE_TRACE, WAKE_AEMET))
+
+
+def _socket_path(socket_path: Optional[str] = None) -> str:
+    import env as _env
+    return socket_path or getattr(_env, "MAIN_WAKEUP_SOCKET", None) or DEFAULT_WAKEUP_SOCKET_PATH
+
+
+class WakeupListener:
+    """Espera de main.loop() que termina en cuanto alguien encola trabajo.
+
+    El daemon de radio abre un socket Unix DGRAM (MAIN_WAKEUP_SOCKET) y, en vez
+    de dormir un tiempo fijo, espera en él con `wait(timeout)`. Quien encola
+    trabajo (Database.enqueue_outbox, enqueue_trace, aemet_insert_alert; desde
+    la pasarela, el cron o el propio daemon) manda un datagrama con el motivo
+    (`wake_main_loop`) y el bucle despierta en milisegundos. El timeout queda
+    solo como respaldo.
+
+    Si el socket no se puede abrir, `wait` duerme el timeout completo y
+    devuelve todos los motivos (sondeo clásico).
+    """
+
+    def __init__(self, socket_path: Optional[str] = None) -> None:
+        self.socket_path = _socket_path(socket_path)
+        self._sock: Optional[socket.socket] = None
+        self.stats = {"wakeups": 0, "timeouts": 0}
+
+    @property
+    def active(self) -> bool:
+        """True si el socket está abierto y los avisos llegan."""
+        return self._sock is not None
+
+    def open(self) -> bool:
+        """Crea el socket (sustituyendo uno huérfano de una ejecución anterior)."""
+        if self._sock is not None:
+            return True
+        try:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self.socket_path)
+            sock.setblocking(False)
+            self._sock = sock
+            return True
+        except OSError as e:
+            log_p(f"Wakeup: no se pudo abrir {self.socket_path} ({e}); se usa sondeo", level="WARN")
+            return False
+
+    def wait(self, timeout: float) -> Set[str]:
+        """Espera un aviso como mucho `timeout` segundos.
+
+        Devuelve los motivos recibidos (vacío si venció el timeout). Descarta
+        de una vez todos los avisos acumulados.
+        """
+        if self._sock is None:
+            time.sleep(max(0.0, timeout))
+            return set(WAKE_REASONS)
+        try:
+            readable, _, _ = select.select([self._sock], [], [], max(0.0, timeout))
+        except (OSError, ValueError):
+            return set(WAKE_REASONS)
+        reasons: Set[str] = set()
+        while readable:
+            try:
+                data = self._sock.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                break
+            reason = data.decode("utf-8", "replace").strip()
+            # Un aviso sin motivo conocido revisa todas las colas
+            reasons |= {reason} if reason in WAKE_REASONS else set(WAKE_REASONS)
+        self.stats["wakeups" if reasons else "timeouts"] += 1
+        return reasons
+
+    def close(self) -> None:
+        """Cierra y elimina el socket."""
+        if self._sock is None:
+            return
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        finally:
+            self._sock = None
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+_sender: Optional[socket.socket] = None
+
+
+def wake_main_loop(reason: str, socket_path: Optional[str] = None) -> bool:
+    """Avisa a main.loop() de que hay trabajo (no bloquea ni lanza).
+
+    Devuelve False si el daemon no está escuchando.
+    """
+    global _sender
+    path = _socket_path(socket_path)
+    try:
+        if not os.path.exists(path):
+            return False
+        if _sender is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            _sender = sock
+        _sender.sendto(reason.encode("utf-8"), path)
+        return True
+    except OSError:
+        # Cola del socket llena (ya hay avisos pendientes) o daemon reiniciándose
+        return False
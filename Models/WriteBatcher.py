@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import atexit
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from functions import log_p
+
+# Tablas cuyas escrituras se pueden diferir (Database.write_deferred)
+DEFERRABLE_TABLES = ("commands_sent", "pings")
+
+
+class WriteBatcher:
+    """Agrupa escrituras de bajo valor en transacciones periódicas.
+
+    En modo DB_STORAGE_MODE='sdcard' (o con DB_WRITE_BATCH_INTERVAL > 0),
+    Database.log_command y Database.save_ping no hacen commit: anotan la fila
+    (con su hora real) y devuelven 0. Las filas se escriben juntas en una
+    única transacción (Database.write_deferred):
+      - Desde main.loop() cuando vence write_batch_interval (segundos).
+      - En add() si hay DB_WRITE_BATCH_MAX filas pendientes.
+      - Al cerrar el proceso (atexit) y en el apagado ordenado.
+
+    La telemetría de nodos ya va agrupada por NodeStore (NODE_FLUSH_INTERVAL).
+    """
+
+    _instance: Optional[WriteBatcher] = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, flush_interval: Optional[float] = None, max_pending: Optional[int] = None) -> None:
+        import env as _env
+        from Models.Storage import storage_settings
+        self.flush_interval = float(flush_interval if flush_interval is not None
+                                    else storage_settings().get("write_batch_interval") or 0)
+        self.max_pending = int(max_pending if max_pending is not None
+                               else getattr(_env, "DB_WRITE_BATCH_MAX", 200))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[Tuple[str, Tuple[Any, ...]]] = []
+        self._last_flush = time.monotonic()
+        self.stats = {"queued": 0, "flushes": 0, "rows": 0, "errors": 0, "last_flush_ms": None}
+
+    @classmethod
+    def get_instance(cls) -> WriteBatcher:
+        """Obtiene o crea la instancia singleton (con volcado al salir)."""
+        # Los workers de comandos llegan a la vez por Database.log_command:
+        # dos instancias repartirían el lote y registrarían dos volcados
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = cls()
+                    atexit.register(instance.flush)
+                    cls._instance = instance
+        return cls._instance
+
+    @classmethod
+    def active(cls) -> Optional[WriteBatcher]:
+        """El singleton si el agrupado está activo; None si cada escritura hace commit.
+
+        Con el agrupado desactivado no se crea la instancia (ni su volcado atexit).
+        """
+        if cls._instance is None:
+            from Models.Storage import storage_settings
+            if not float(storage_settings().get("write_batch_interval") or 0) > 0:
+                return None
+        batcher = cls.get_instance()
+        return batcher if batcher.flush_interval > 0 else None
+
+    def add(self, table: str, row: Tuple[Any, ...], db=None) -> None:
+        """Anota una fila para el siguiente volcado (`db` se usa si toca volcar ya)."""
+        if table not in DEFERRABLE_TABLES:
+            raise ValueError(f"Tabla no diferible: {table}")
+        with self._lock:
+            self._pending.append((table, row))
+            self.stats["queued"] += 1
+            too_many = len(self._pending) >= self.max_pending
+        if too_many:
+            self.flush(db)
+
+    def pending_count(self) -> int:
+        """Filas pendientes de volcar."""
+        with self._lock:
+            return len(self._pending)
+
+    def flush_if_due(self) -> int:
+        """Vuelca si ha pasado el intervalo configurado desde el último volcado."""
+        if time.monotonic() - self._last_flush < self.flush_interval:
+            return 0
+        return self.flush()
+
+    def flush(self, db=None) -> int:
+        """Escribe en una transacción todas las filas pendientes.
+
+        Devuelve el número de filas escritas. Si falla, las filas vuelven a la
+        cola delante de las que hayan llegado mientras tanto.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+                self._last_flush = time.monotonic()
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                if db is None:
+                    from Models.Database import Database
+                    db = Database()
+                written = db.write_deferred(batch)
+            except Exception as e:
+                with self._lock:
+                    self.stats["errors"] += 1
+                    self._pending = batch + self._pending
+                log_p(f"WriteBatcher: error al volcar escrituras: {e}", level="WARN")
+                return 0
+
+            with self._lock:
+                self.stats["flushes"] += 1
+                self.stats["rows"] += written
+                self.stats["last_flush_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            return written
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estadísticas y filas pendientes."""
+        with self._lock:
+            return {**self.stats, "pending": len(self._pending), "interval": self.flush_interval}
@@ -4,9 +4,11 @@ import asyncio
 import json
 import os
 import socket
+import threading
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, Optional, Set
+from typing import Any, Callable, Dict, Optional, Set
 import websockets
 
 import sys
@@ -26,6 +28,22 @@ DEFAULT_HOST = "0.0.0.0"
 DEFAULT_PORT = 8680
 DEFAULT_SOCKET_PATH = "/tmp/meshassistant_events.sock"
 MAX_RECENT_MESSAGES = 20
+DEFAULT_SNAPSHOT_INCLUDE = ["nodes", "routers", "recent_messages", "stats", "system_status", "local_node"]
+
+# Hilos dedicados a la BD (cada uno con su conexión del pool) y máximo de
+# ejecuciones simultáneas por acción; las que no aparecen usan GATEWAY_DB_WORKERS.
+DEFAULT_DB_WORKERS = 3
+DEFAULT_ACTION_LIMITS = {
+    "get_snapshot": 2,
+    "get_commands_audit": 1,
+    "get_polls": 2,
+}
+# Peticiones en curso por cliente WebSocket
+MAX_CLIENT_INFLIGHT = 8
+
+
+class ActionCancelled(Exception):
+    """La acción se canceló (cliente desconectado) entre dos consultas."""
 
 
 class UnixSocketProtocol(asyncio.DatagramProtocol):
@@ -74,6 +92,10 @@ class GatewayService:
         self.last_channel_metrics: Dict[str, Any] = {}
 
         self.db = Database()
+        self._db_executor: Optional[ThreadPoolExecutor] = None
+        self._action_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # Réplica en RAM de nodos/tareas/clima (DB_MEMORY_MIRROR) para las snapshots
+        self.db.preload_mirror()
         self._running = False
 
     def on_ipc_event(self, event_obj: Dict[str, Any]) -> None:
@@ -123,7 +145,14 @@ class GatewayService:
         ws: websockets.WebSocketServerProtocol,
         request: Dict[str, Any],
     ) -> Dict[str, Any]:
-        """Procesa una acción enviada por un cliente WebSocket y devuelve la respuesta."""
+        """Procesa una acción enviada por un cliente WebSocket y devuelve la respuesta.
+
+        En el bucle de eventos solo se hace E/S y se copia el estado en RAM; todo
+        acceso a la BD corre en el pool de hilos de BD (_execute_action), con un
+        límite de concurrencia por acción. Si la tarea se cancela (el cliente se
+        desconecta), el trabajo aún en cola se descarta y el que está en curso
+        se detiene en el siguiente punto de control.
+        """
         action = request.get("action")
         req_id = request.get("req_id")
         params = request.get("params", {})
@@ -138,164 +167,12 @@ class GatewayService:
         }
 
         try:
+            memory_data: Dict[str, Any] = {}
             if action == "get_snapshot":
-                # Resumen de estado actual
-                include = params.get("include", ["nodes", "routers", "recent_messages", "stats", "system_status", "local_node"])
-                snapshot_data: Dict[str, Any] = {}
-
-                if "recent_messages" in include:
-                    snapshot_data["recent_messages"] = list(self.recent_messages)
-                if "system_status" in include:
-                    snapshot_data["system_status"] = self.last_system_status
-                if "local_node" in include:
-                    snapshot_data["local_node"] = self.last_local_node
-                if "channel_metrics" in include:
-                    snapshot_data["channel_metrics"] = self.last_channel_metrics
-
-                if "nodes" in include:
-                    snapshot_data["nodes"] = self.db.get_all_nodes(limit=300)
-                    snapshot_data["nodes_summary"] = self.db.nodes_overview()
-                if "traces" in include:
-                    snapshot_data["traces"] = self.db.get_recent_traces(limit=10)
-                if "stats" in include:
-                    snapshot_data["stats"] = self.db.stats_summary()
-                if "routers" in include:
-                    router_ids = getattr(env, "ROUTER_NODES", []) or getattr(env, "ROUTERS_LIST", [])
-                    if isinstance(router_ids, str):
-                        router_ids = [r.strip() for r in router_ids.split(",") if r.strip()]
-                    raw_routers = self.db.get_router_nodes(router_ids)
-                    
-                    # Enriquecer routers con estado online/offline y segundos desde última señal
-                    enriched_routers = []
-                    now_dt = datetime.now()
-                    for node in raw_routers:
-                        r = dict(node)
-                        nid = r.get('node_id') or r.get('identifier') or r.get('id')
-                        r['id'] = nid
-                        r['name'] = r.get('short_name') or r.get('name') or nid or 'Router'
-                        ts = r.get('last_heard') or r.get('updated_at')
-                        diff_sec = None
-                        if ts:
-                            try:
-                                if isinstance(ts, (int, float)) or str(ts).isdigit():
-                                    dt = datetime.fromtimestamp(float(ts))
-                                else:
-                                    dt = datetime.fromisoformat(str(ts))
-                                diff_sec = max(0, int((now_dt - dt).total_seconds()))
-                            except Exception:
-                                diff_sec = None
-                        r['last_seen_sec'] = diff_sec
-                        r['status'] = 'online' if (diff_sec is not None and diff_sec < 86400 and not r.get('offline')) else 'offline'
-                        
-                        # Enriquecer con información de trace real más reciente vía base RAU0
-                        if nid:
-                            try:
-                                t_info = self.db.get_latest_trace_route_info(nid, base_identifiers=['RAU0'])
-                                if t_info:
-                                    r['trace_hops'] = t_info.get('hops')
-                                    r['trace_snr_text'] = t_info.get('snr_text')
-                                    r['trace_intermediates'] = t_info.get('intermediates', [])
-                            except Exception:
-                                pass
-
-                        enriched_routers.append(r)
-                    
-                    snapshot_data["routers"] = enriched_routers
-
-                # Incluir mapa de canales configurados
-                try:
-                    from data import channels
-                    snapshot_data["channels"] = channels
-                except Exception:
-                    pass
-
-                response["data"] = snapshot_data
-
-            elif action == "request_trace":
-                dest = params.get("dest")
-                if not dest:
-                    raise ValueError("Parámetro 'dest' obligatorio")
-                trace_id = self.db.enqueue_trace(str(dest))
-                response["data"] = {"trace_id": trace_id, "status": "queued"}
-
-            elif action == "request_node_info":
-                node_id = params.get("node_id") or params.get("dest")
-                if not node_id:
-                    raise ValueError("Parámetro 'node_id' obligatorio")
-                outbox_id = self.db.enqueue_outbox("__REQ_NODEINFO__", dest=str(node_id), channel=0)
-                response["data"] = {"queued": True, "outbox_id": outbox_id, "node_id": str(node_id)}
-
-            elif action == "get_polls":
-                polls = self.db.encuesta_list_active()
-                # Enriquecer con resultados de conteo
-                for p in polls:
-                    res = self.db.encuesta_results(p["id"])
-                    p["counts"] = res.get("counts", [])
-                    p["total_votes"] = res.get("total", 0)
-                response["data"] = {"polls": polls}
-
-            elif action == "vote_poll":
-                poll_id = params.get("poll_id")
-                option_index = params.get("option_index")
-                node_id = params.get("node_id") or "gateway_client"
-                if poll_id is None or option_index is None:
-                    raise ValueError("Parámetros 'poll_id' y 'option_index' obligatorios")
-                result = self.db.encuesta_vote(int(poll_id), str(node_id), int(option_index))
-                response["data"] = {"status": result}
-
-            elif action == "get_weather":
-                weather = self.db.aemet_weather_get_latest()
-                response["data"] = weather or {}
-
-            elif action == "get_tides":
-                tides = self.db.tides_get_latest()
-                response["data"] = tides or {}
-
-            elif action == "set_node_favorite":
-                node_id = params.get("node_id")
-                is_fav = bool(params.get("is_favorite", True))
-                if not node_id:
-                    raise ValueError("Parámetro 'node_id' obligatorio")
-                self.db.update_node(str(node_id), {"is_favorite": is_fav})
-                response["data"] = {"node_id": node_id, "is_favorite": is_fav}
-
-            elif action == "send_message":
-                text = params.get("text")
-                dest = params.get("dest", "^all")
-                channel = params.get("channel", 0)
-                if not text:
-                    raise ValueError("Parámetro 'text' obligatorio")
-                
-                # Encolar en outbox para que main.py lo transmita por serie/radio
-                outbox_id = self.db.enqueue_outbox(str(text), dest=str(dest), channel=int(channel))
-                response["data"] = {
-                    "queued": True,
-                    "outbox_id": outbox_id,
-                    "text": text,
-                    "dest": dest,
-                    "channel": int(channel)
-                }
-
-            elif action == "get_commands_audit":
-                h_param = params.get("hours", 24)
-                hours = None if (h_param in (None, 'all', 'None', 0)) else int(h_param)
-                limit = int(params.get("limit", 100))
-                offset = int(params.get("offset", 0))
-                node_id = params.get("node_id")
-                cmd = params.get("command")
-                response["data"] = {
-                    "ranking": self.db.get_top_command_users(limit=20, hours=hours),
-                    "recent_logs": self.db.get_commands_audit(limit=limit, offset=offset, hours=hours, node_id=node_id, command=cmd),
-                    "summary": self.db.get_commands_audit_summary(hours=hours),
-                    "offset": offset,
-                    "limit": limit,
-                }
-
-            elif action == "restart_serial":
-                response["data"] = {"requested": True, "message": "Solicitud de reinicio de enlace serie registrada"}
-
-            else:
-                raise ValueError(f"Acción desconocida: '{action}'")
+                memory_data = self._memory_snapshot(params.get("include", DEFAULT_SNAPSHOT_INCLUDE))
+            async with self._action_limiter(action):
+                data = await self._run_db(self._execute_action, action, params)
+            response["data"] = {**memory_data, **data} if memory_data else data
 
         except Exception as e:
             response["success"] = False
@@ -303,6 +180,241 @@ class GatewayService:
 
         return response
 
+    def _memory_snapshot(self, include: Any) -> Dict[str, Any]:
+        """Parte del snapshot que vive en RAM (se copia en el hilo del bucle)."""
+        data: Dict[str, Any] = {}
+        if "recent_messages" in include:
+            data["recent_messages"] = list(self.recent_messages)
+        if "system_status" in include:
+            data["system_status"] = self.last_system_status
+        if "local_node" in include:
+            data["local_node"] = self.last_local_node
+        if "channel_metrics" in include:
+            data["channel_metrics"] = self.last_channel_metrics
+        return data
+
+    # ---------- ACCESO A BD FUERA DEL BUCLE DE EVENTOS ----------
+    def _get_db_executor(self) -> ThreadPoolExecutor:
+        if self._db_executor is None:
+            workers = int(getattr(env, "GATEWAY_DB_WORKERS", DEFAULT_DB_WORKERS) or DEFAULT_DB_WORKERS)
+            self._db_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gateway-db")
+        return self._db_executor
+
+    def _action_limiter(self, action: Any) -> asyncio.Semaphore:
+        """Semáforo de la acción (GATEWAY_ACTION_LIMITS o DEFAULT_ACTION_LIMITS)."""
+        key = str(action)
+        sem = self._action_semaphores.get(key)
+        if sem is None:
+            limits = dict(DEFAULT_ACTION_LIMITS)
+            limits.update(getattr(env, "GATEWAY_ACTION_LIMITS", None) or {})
+            workers = int(getattr(env, "GATEWAY_DB_WORKERS", DEFAULT_DB_WORKERS) or DEFAULT_DB_WORKERS)
+            sem = asyncio.Semaphore(max(1, int(limits.get(key, workers))))
+            self._action_semaphores[key] = sem
+        return sem
+
+    async def _run_db(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Ejecuta func(*args, cancelled) en el pool de BD y espera su resultado.
+
+        Al cancelarse la espera se marca `cancelled` (threading.Event) para que
+        las acciones con varias consultas se detengan entre una y otra; si aún
+        no había empezado, el pool ya no la ejecuta.
+        """
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+        future = loop.run_in_executor(self._get_db_executor(), func, *args, cancelled)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    @staticmethod
+    def _check_cancelled(cancelled: Optional[threading.Event]) -> None:
+        if cancelled is not None and cancelled.is_set():
+            raise ActionCancelled()
+
+    def _execute_action(
+        self,
+        action: Any,
+        params: Dict[str, Any],
+        cancelled: Optional[threading.Event] = None,
+    ) -> Any:
+        """Parte de BD de cada acción; corre en el pool de hilos, nunca en el bucle."""
+        if action == "get_snapshot":
+            # Parte de BD del resumen de estado (la de RAM la añade _handle_action)
+            include = params.get("include", DEFAULT_SNAPSHOT_INCLUDE)
+            snapshot_data: Dict[str, Any] = {}
+
+            if "nodes" in include:
+                snapshot_data["nodes"] = self.db.get_all_nodes(limit=300)
+                snapshot_data["nodes_summary"] = self.db.nodes_overview()
+            self._check_cancelled(cancelled)
+            if "traces" in include:
+                snapshot_data["traces"] = self.db.get_recent_traces(limit=10)
+            self._check_cancelled(cancelled)
+            if "stats" in include:
+                snapshot_data["stats"] = self.db.stats_summary()
+            self._check_cancelled(cancelled)
+            if "routers" in include:
+                router_ids = getattr(env, "ROUTER_NODES", []) or getattr(env, "ROUTERS_LIST", [])
+                if isinstance(router_ids, str):
+                    router_ids = [r.strip() for r in router_ids.split(",") if r.strip()]
+                raw_routers = self.db.get_router_nodes(router_ids)
+                # Rutas precalculadas (trace_routes) de todos los routers en una consulta
+                try:
+                    trace_routes = self.db.get_latest_trace_routes(
+                        [r.get('node_id') for r in raw_routers if r.get('node_id')]
+                    )
+                except Exception:
+                    trace_routes = {}
+                
+                # Enriquecer routers con estado online/offline y segundos desde última señal
+                enriched_routers = []
+                now_dt = datetime.now()
+                for node in raw_routers:
+                    r = dict(node)
+                    nid = r.get('node_id') or r.get('identifier') or r.get('id')
+                    r['id'] = nid
+                    r['name'] = r.get('short_name') or r.get('name') or nid or 'Router'
+                    ts = r.get('last_heard') or r.get('updated_at')
+                    diff_sec = None
+                    if ts:
+                        try:
+                            if isinstance(ts, (int, float)) or str(ts).isdigit():
+                                dt = datetime.fromtimestamp(float(ts))
+                            else:
+                                dt = datetime.fromisoformat(str(ts))
+                            diff_sec = max(0, int((now_dt - dt).total_seconds()))
+                        except Exception:
+                            diff_sec = None
+                    r['last_seen_sec'] = diff_sec
+                    r['status'] = 'online' if (diff_sec is not None and diff_sec < 86400 and not r.get('offline')) else 'offline'
+                    
+                    # Enriquecer con información de trace real más reciente vía la base configurada
+                    t_info = trace_routes.get(nid) if nid else None
+                    if t_info:
+                        r['trace_hops'] = t_info.get('hops')
+                        r['trace_snr_text'] = t_info.get('snr_text')
+                        r['trace_intermediates'] = t_info.get('intermediates', [])
+
+                    enriched_routers.append(r)
+                
+                snapshot_data["routers"] = enriched_routers
+
+            # Incluir mapa de canales configurados
+            try:
+                from data import channels
+                snapshot_data["channels"] = channels
+            except Exception:
+                pass
+
+            return snapshot_data
+
+        elif action == "request_trace":
+            dest = params.get("dest")
+            if not dest:
+                raise ValueError("Parámetro 'dest' obligatorio")
+            trace_id = self.db.enqueue_trace(str(dest))
+            return {"trace_id": trace_id, "status": "queued"}
+
+        elif action == "request_node_info":
+            node_id = params.get("node_id") or params.get("dest")
+            if not node_id:
+                raise ValueError("Parámetro 'node_id' obligatorio")
+            outbox_id = self.db.enqueue_outbox(
+                self.db.OUTBOX_NODEINFO_TEXT, dest=str(node_id), channel=0,
+                priority=self.db.OUTBOX_PRIORITY_NODEINFO,
+            )
+            return {"queued": True, "outbox_id": outbox_id, "node_id": str(node_id)}
+
+        elif action == "get_polls":
+            # Encuestas y recuentos en una sola consulta (encuesta_recuento)
+            return {"polls": self.db.encuesta_list_active(with_results=True)}
+
+        elif action == "vote_poll":
+            poll_id = params.get("poll_id")
+            option_index = params.get("option_index")
+            node_id = params.get("node_id") or "gateway_client"
+            if poll_id is None or option_index is None:
+                raise ValueError("Parámetros 'poll_id' y 'option_index' obligatorios")
+            result = self.db.encuesta_vote(int(poll_id), str(node_id), int(option_index))
+            return {"status": result}
+
+        elif action == "get_weather":
+            weather = self.db.aemet_weather_get_latest()
+            return weather or {}
+
+        elif action == "get_tides":
+            tides = self.db.tides_get_latest()
+            return tides or {}
+
+        elif action == "set_node_favorite":
+            node_id = params.get("node_id")
+            is_fav = bool(params.get("is_favorite", True))
+            if not node_id:
+                raise ValueError("Parámetro 'node_id' obligatorio")
+            self.db.update_node(str(node_id), {"is_favorite": is_fav})
+            return {"node_id": node_id, "is_favorite": is_fav}
+
+        elif action == "send_message":
+            text = params.get("text")
+            dest = params.get("dest", "^all")
+            channel = params.get("channel", 0)
+            if not text:
+                raise ValueError("Parámetro 'text' obligatorio")
+            priority_name = str(params.get("priority") or "operator").lower()
+            if priority_name not in ("alert", "operator"):
+                raise ValueError("Parámetro 'priority' debe ser 'alert' u 'operator'")
+            ttl = params.get("ttl")
+
+            # Encolar en outbox para que main.py lo transmita por serie/radio
+            outbox_id = self.db.enqueue_outbox(
+                str(text), dest=str(dest), channel=int(channel),
+                priority=self.db.OUTBOX_PRIORITIES[priority_name],
+                ttl=int(ttl) if ttl is not None else None,
+            )
+            return {
+                "queued": True,
+                "outbox_id": outbox_id,
+                "text": text,
+                "dest": dest,
+                "channel": int(channel)
+            }
+
+        elif action == "get_commands_audit":
+            h_param = params.get("hours", 24)
+            hours = None if (h_param in (None, 'all', 'None', 0)) else int(h_param)
+            limit = int(params.get("limit", 100))
+            offset = int(params.get("offset", 0))
+            node_id = params.get("node_id")
+            cmd = params.get("command")
+            return {
+                "ranking": self.db.get_top_command_users(limit=20, hours=hours),
+                "recent_logs": self.db.get_commands_audit(limit=limit, offset=offset, hours=hours, node_id=node_id, command=cmd),
+                "summary": self.db.get_commands_audit_summary(hours=hours),
+                "offset": offset,
+                "limit": limit,
+            }
+
+        elif action == "get_db_profile":
+            # Resúmenes volcados por cada proceso (bot, cron, Gateway) y, si el
+            # perfilado está activo aquí, el del propio Gateway en vivo
+            from Models.QueryProfiler import QueryProfiler
+            processes = QueryProfiler.load_dumps()
+            profiler = QueryProfiler.active()
+            if profiler is not None:
+                if params.get("reset"):
+                    profiler.reset()
+                live = profiler.snapshot()
+                processes = [p for p in processes if p.get("pid") != live["pid"]] + [live]
+            return {"enabled": profiler is not None, "processes": processes}
+
+        elif action == "restart_serial":
+            return {"requested": True, "message": "Solicitud de reinicio de enlace serie registrada"}
+
+        else:
+            raise ValueError(f"Acción desconocida: '{action}'")
+
     async def _ws_handler(
         self,
         ws: websockets.WebSocketServerProtocol,
@@ -315,6 +427,7 @@ class GatewayService:
             pass
 
         self.connected_clients.add(ws)
+        inflight: Set[asyncio.Task] = set()
         remote_addr = getattr(ws, "remote_address", "desconocido")
         log_p(f"[Gateway WS] Cliente conectado: {remote_addr}")
 
@@ -332,12 +445,12 @@ class GatewayService:
             }
             await ws.send(json.dumps(welcome_msg, ensure_ascii=False))
 
+            # Cada petición se atiende en su propia tarea: el cliente puede
+            # seguir enviando (las respuestas llevan req_id) y, al desconectarse,
+            # se cancelan las que sigan en curso.
             async for message in ws:
                 try:
                     request = json.loads(message)
-                    if isinstance(request, dict):
-                        response = await self._handle_action(ws, request)
-                        await ws.send(json.dumps(response, ensure_ascii=False))
                 except json.JSONDecodeError:
                     err_resp = {
                         "type": "response",
@@ -345,14 +458,41 @@ class GatewayService:
                         "error": "Payload no es un JSON válido",
                     }
                     await ws.send(json.dumps(err_resp, ensure_ascii=False))
+                    continue
+                if not isinstance(request, dict):
+                    continue
+                if len(inflight) >= MAX_CLIENT_INFLIGHT:
+                    busy_resp = {
+                        "type": "response",
+                        "action": request.get("action"),
+                        "req_id": request.get("req_id"),
+                        "success": False,
+                        "data": None,
+                        "error": "Demasiadas peticiones en curso",
+                    }
+                    await ws.send(json.dumps(busy_resp, ensure_ascii=False))
+                    continue
+                task = asyncio.create_task(self._respond(ws, request))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
         except websockets.exceptions.ConnectionClosed:
             pass
         except Exception as e:
             log_p(f"[Gateway WS] Error en handler de cliente: {e}", level="DEBUG")
         finally:
+            for task in list(inflight):
+                task.cancel()
             self.connected_clients.discard(ws)
             log_p(f"[Gateway WS] Cliente desconectado: {remote_addr}")
 
+    async def _respond(self, ws: websockets.WebSocketServerProtocol, request: Dict[str, Any]) -> None:
+        """Atiende una petición y envía su respuesta (si el cliente sigue conectado)."""
+        response = await self._handle_action(ws, request)
+        try:
+            await ws.send(json.dumps(response, ensure_ascii=False))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
     def _process_http_request(self, connection: Any, request: Any) -> Optional[Any]:
         """Procesa peticiones HTTP entrantes para servir la SPA del mini dashboard de forma 100% offline."""
         # Si es una petición de WebSocket upgrade, permitir que continúe el handshake
@@ -447,6 +587,8 @@ class GatewayService:
             server.close()
             await server.wait_closed()
             transport.close()
+            if self._db_executor is not None:
+                self._db_executor.shutdown(wait=False, cancel_futures=True)
             if os.path.exists(self.socket_path):
                 try:
                     os.unlink(self.socket_path)
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import json
+import random
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from create_db import COMMAND_ROLLUP_MIGRATION_TASK, _backfill_command_rollups
+from Models.Database import Database
+
+# Tamaño del conjunto a escala 1.0 (producción grande de una malla regional)
+COUNTS = {
+    "nodes": 5000,
+    "commands_sent": 200000,
+    "traces": 50000,
+    "pings": 100000,
+    "weather_years": 3,     # aemet_weather cada 3 horas (provincia, ciudad y previsión)
+    "aemet": 3000,
+    "tides_days": 3 * 365,
+    "chistes": 2000,
+    "encuestas": 200,
+    "outbox": 5000,
+    "agenda": 500,
+}
+
+# Marca en tasks_control con la semilla y escala del conjunto generado
+DATASET_TASK = "benchmark_dataset"
+
+BOT_ID = "!b0000001"
+BASE_ID = "!ba5e0001"
+BASE_SHORT = "RAU0"
+COMMANDS = (
+    ("ping", 30), ("help", 12), ("clima", 10), ("chiste", 10), ("marea", 8), ("stats", 6),
+    ("routers", 6), ("snr", 5), ("trace", 4), ("agenda", 3), ("encuesta", 3), ("prevision", 3),
+)
+WEATHER_TEXT = ("Cielo poco nuboso con intervalos de nubes altas. Vientos flojos de componente "
+                "oeste, rolando a levante moderado en el litoral por la tarde. Temperaturas sin "
+                "cambios: máximas de 24 a 28 grados, mínimas de 14 a 17. ")
+
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts).isoformat(timespec='seconds')
+
+
+def _count(name: str, scale: float) -> int:
+    return max(1, int(COUNTS[name] * scale))
+
+
+def dataset_meta(db_path: str) -> Dict[str, Any]:
+    """Semilla/escala del conjunto ya generado en db_path ({} si no hay)."""
+    if not Path(db_path).exists():
+        return {}
+    try:
+        with closing(sqlite3.connect(db_path)) as conn:
+            row = conn.execute('SELECT extra FROM tasks_control WHERE name = ?', (DATASET_TASK,)).fetchone()
+    except sqlite3.Error:
+        return {}
+    return json.loads(row[0]) if row and row[0] else {}
+
+
+def generate(db_path: str, *, scale: float = 1.0, seed: int = 1234) -> Dict[str, Any]:
+    """Crea en db_path una BD sintética reproducible (misma semilla → mismos datos).
+
+    Las fechas son relativas al momento de la generación (las consultas de
+    "últimas 24 h" del modelo usan la hora actual). Devuelve los metadatos
+    guardados en tasks_control (semilla, escala, filas por tabla, segundos).
+    """
+    started = time.monotonic()
+    path = Path(db_path)
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+    Database.close_connections()
+    db = Database(str(path))
+
+    rng = random.Random(seed)
+    now = int(time.time())
+    rows: Dict[str, int] = {}
+
+    with closing(sqlite3.connect(db.db_path)) as conn:
+        conn.execute('PRAGMA synchronous = OFF')
+
+        nodes = _nodes(rng, now, _count("nodes", scale))
+        conn.executemany(
+            'INSERT INTO nodes (node_id, name, num, short_name, hw_model, role, is_favorite, snr, rssi, '
+            'hops, hop_start, via_mqtt, battery, voltage, last_heard, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            nodes,
+        )
+        rows["nodes"] = len(nodes)
+        node_ids = [n[0] for n in nodes]
+        routers = [n[0] for n in nodes if n[5] in (2, 4) and n[9] is not None and n[9] <= 2]
+        near = [n for n in nodes if not n[11] and n[9] is not None and n[9] <= 3]
+
+        traces, hops = _traces(rng, now, _count("traces", scale), near, routers)
+        conn.executemany(
+            'INSERT INTO traces (id, "from", "to", data_raw, status, created_at, updated_at, hops, hops_back, '
+            'to_name, to_name_short, created_ts, updated_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            traces,
+        )
+        conn.executemany(
+            'INSERT INTO trace_hops (trace_id, direction, idx, node_id, snr, rssi) VALUES (?, ?, ?, ?, ?, ?)', hops
+        )
+        rows["traces"], rows["trace_hops"] = len(traces), len(hops)
+
+        weights = [1.0 / (i + 1) ** 0.8 for i in range(len(node_ids))]
+        commands = _commands(rng, now, _count("commands_sent", scale), node_ids, weights)
+        conn.executemany(
+            'INSERT INTO commands_sent (node_id, command, message, created_at, created_ts) VALUES (?, ?, ?, ?, ?)',
+            commands,
+        )
+        rows["commands_sent"] = len(commands)
+
+        pings = []
+        for _ in range(_count("pings", scale)):
+            ts = now - rng.randint(0, 365 * 86400)
+            sender = rng.choices(nodes, weights)[0]
+            pings.append((sender[0], BOT_ID, sender[3], sender[9], f"ping {sender[3]}", _iso(ts), ts))
+        pings.sort(key=lambda p: p[6])
+        conn.executemany(
+            'INSERT INTO pings ("from", "to", from_name, hops, data_raw, created_at, created_ts) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            pings,
+        )
+        rows["pings"] = len(pings)
+
+        weather = []
+        scopes = ("province", "city", "forecast")
+        start = now - int(COUNTS["weather_years"] * 365 * 86400 * min(1.0, max(scale, 0.01)))
+        for i, ts in enumerate(range(start, now, 3 * 3600)):
+            scope = scopes[i % 3]
+            weather.append((scope, 'Cadiz', '11', 'Chipiona', '11016', 'hoy',
+                            WEATHER_TEXT * rng.randint(1, 3), _iso(ts), ts))
+        conn.executemany(
+            'INSERT INTO aemet_weather (scope, province, province_code, city, city_code, day, content, '
+            'created_at, created_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            weather,
+        )
+        rows["aemet_weather"] = len(weather)
+
+        alerts = []
+        for i in range(_count("aemet", scale)):
+            ts = now - rng.randint(3600, 3 * 365 * 86400)
+            msg = f"Aviso amarillo por viento en Litoral gaditano #{i}"
+            alerts.append(('Cadiz', msg, msg, f"bench{seed}-{i}", _iso(ts), 1, _iso(ts), ts))
+        conn.executemany(
+            'INSERT INTO aemet (province, data_raw, message, data_hash, created_at, published, published_at, '
+            'created_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            alerts,
+        )
+        rows["aemet"] = len(alerts)
+
+        tides = []
+        for d in range(_count("tides_days", scale), 0, -1):
+            ts = now - d * 86400
+            extremes = [{"time": _iso(ts + h * 3600), "type": t, "height": round(rng.uniform(0.3, 3.2), 2)}
+                        for h, t in ((2, "high"), (8, "low"), (14, "high"), (20, "low"))]
+            tides.append(('Chipiona', 'worldtides', 0, json.dumps(extremes), _iso(ts)))
+        conn.executemany(
+            'INSERT INTO tides (location, source, approximate, extremes, created_at) VALUES (?, ?, ?, ?, ?)', tides
+        )
+        rows["tides"] = len(tides)
+
+        chistes = [(rng.choice(node_ids), f"Chiste sintético número {i}", int(rng.random() < 0.05), 0, i + 1)
+                   for i in range(_count("chistes", scale))]
+        conn.executemany(
+            'INSERT INTO chistes ("from", content, need_approve, need_upload, chiste_id) VALUES (?, ?, ?, ?, ?)',
+            chistes,
+        )
+        rows["chistes"] = len(chistes)
+
+        rows["encuestas"], rows["encuesta_votos"] = _polls(conn, rng, now, _count("encuestas", scale), node_ids)
+
+        outbox = []
+        for i in range(_count("outbox", scale)):
+            ts = now - rng.randint(60, 90 * 86400)
+            outbox.append((f"Mensaje {i}", '^all', rng.randint(0, 3), 'sent', _iso(ts), _iso(ts + 5), ts, ts + 5))
+        conn.executemany(
+            'INSERT INTO outbox (text, dest, channel, status, created_at, sent_at, created_ts, updated_ts) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            outbox,
+        )
+        rows["outbox"] = len(outbox)
+
+        agenda = [(rng.choice(node_ids), f"Recordatorio {i}", _iso(now + rng.randint(-30, 30) * 86400))
+                  for i in range(_count("agenda", scale))]
+        conn.executemany('INSERT INTO agenda (node_id, content, moment) VALUES (?, ?, ?)', agenda)
+        rows["agenda"] = len(agenda)
+        conn.commit()
+
+        # Agregados de comandos con la misma migración que usa create_db.py
+        conn.execute('DELETE FROM tasks_control WHERE name = ?', (COMMAND_ROLLUP_MIGRATION_TASK,))
+        conn.commit()
+        _backfill_command_rollups(conn)
+
+    db.rebuild_trace_state()
+
+    meta = {
+        "seed": seed,
+        "scale": scale,
+        "rows": rows,
+        "generated_at": _iso(now),
+        "generated_ts": now,
+        "seconds": round(time.monotonic() - started, 1),
+    }
+    db.set_task_run(DATASET_TASK, extra=json.dumps(meta))
+    with closing(sqlite3.connect(db.db_path)) as conn:
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return meta
+
+
+def _nodes(rng: random.Random, now: int, count: int) -> List[Tuple[Any, ...]]:
+    alphabet = "ABCDEFGHJKLMNPRSTUVWXYZ0123456789"
+    nums = {int(BOT_ID[1:], 16), int(BASE_ID[1:], 16)}
+    out: List[Tuple[Any, ...]] = []
+    created = _iso(now - 400 * 86400)
+
+    def row(num, short, role, hops, via_mqtt, last_heard):
+        snr = None if via_mqtt else round(rng.uniform(-18.0, 12.0), 2)
+        return (f"!{num:08x}", f"Nodo {short} {num % 1000}", num, short, rng.choice((9, 43, 79, 48)),
+                role, int(rng.random() < 0.02), snr, None if snr is None else rng.randint(-125, -60),
+                hops, 7 if hops is not None else None, via_mqtt, rng.randint(20, 101),
+                round(rng.uniform(3.4, 4.3), 3), last_heard, created, _iso(last_heard))
+
+    out.append(row(int(BOT_ID[1:], 16), "BOT1", 0, 0, 0, now))
+    out.append(row(int(BASE_ID[1:], 16), BASE_SHORT, 2, 0, 0, now))
+    while len(out) < count:
+        num = rng.getrandbits(32)
+        if num in nums:
+            continue
+        nums.add(num)
+        # ~1 % de nombres cortos repetidos (colisiones reales en la malla)
+        short = (out[rng.randrange(len(out))][3] if rng.random() < 0.01 and out
+                 else ''.join(rng.choice(alphabet) for _ in range(4)))
+        role = rng.choices((0, 1, 2, 4, 5), (70, 15, 8, 2, 5))[0]
+        via_mqtt = int(rng.random() < 0.12)
+        hops = None if rng.random() < 0.05 else min(7, int(rng.expovariate(0.6)))
+        last_heard = now - int(rng.expovariate(1 / (5 * 86400)))
+        out.append(row(num, short, role, hops, via_mqtt, last_heard))
+    return out[:count]
+
+
+def _traces(
+    rng: random.Random,
+    now: int,
+    count: int,
+    targets: List[Tuple[Any, ...]],
+    routers: List[str],
+) -> Tuple[List[Tuple[Any, ...]], List[Tuple[Any, ...]]]:
+    traces: List[Tuple[Any, ...]] = []
+    hops: List[Tuple[Any, ...]] = []
+    if not targets:
+        return traces, hops
+    relays = routers or [t[0] for t in targets]
+    offsets = sorted((rng.randint(0, 365 * 86400) for _ in range(count)), reverse=True)
+    for trace_id, offset in enumerate(offsets, start=1):
+        target = rng.choice(targets)
+        created = now - offset
+        updated = created + rng.randint(5, 60)
+        roll = rng.random()
+        status = 'pending' if offset < 1800 and roll < 0.5 else ('done' if roll < 0.72 else 'error')
+        if status != 'done':
+            traces.append((trace_id, 'local' if status == 'error' else None, target[0],
+                           'Timeout' if status == 'error' else None, status, _iso(created),
+                           _iso(updated) if status == 'error' else _iso(created), None, None,
+                           None, None, created, updated if status == 'error' else created))
+            continue
+        middle = rng.sample(relays, k=min(len(relays), max(0, (target[9] or 0) - 1)))
+        forward = [BASE_ID] + [m for m in middle if m != target[0]] + [target[0]]
+        fwd_snr = [round(rng.uniform(-15.0, 12.0), 2) for _ in forward]
+        back = list(reversed(forward))[1:] + [BOT_ID]
+        back_snr = [round(rng.uniform(-15.0, 12.0), 2) for _ in back]
+        text = (
+            "Route traced towards destination:\n"
+            + f"{BOT_ID} --> " + " --> ".join(f"{n} ({s}dB)" for n, s in zip(forward, fwd_snr))
+            + "\nRoute traced back to us:\n"
+            + f"{target[0]} --> " + " --> ".join(f"{n} ({s}dB)" for n, s in zip(back, back_snr))
+        )
+        traces.append((trace_id, 'local', target[0], text, 'done', _iso(created), _iso(updated),
+                       len(forward) - 1, len(back) - 1, target[1], target[3], created, updated))
+        for direction, path, snrs in (('forward', forward, fwd_snr), ('return', back, back_snr)):
+            for idx, (node, snr) in enumerate(zip(path, snrs), start=1):
+                hops.append((trace_id, direction, idx, node, snr, None))
+    return traces, hops
+
+
+def _commands(
+    rng: random.Random,
+    now: int,
+    count: int,
+    node_ids: List[str],
+    weights: List[float],
+) -> List[Tuple[Any, ...]]:
+    names = [c[0] for c in COMMANDS]
+    cmd_weights = [c[1] for c in COMMANDS]
+    offsets = sorted((int(rng.expovariate(1 / (120 * 86400))) % (730 * 86400) for _ in range(count)), reverse=True)
+    senders = rng.choices(node_ids, weights, k=count)
+    cmds = rng.choices(names, cmd_weights, k=count)
+    return [
+        (sender if rng.random() > 0.01 else None, cmd, f"/{cmd}", _iso(now - off), now - off)
+        for sender, cmd, off in zip(senders, cmds, offsets)
+    ]
+
+
+def _polls(conn: sqlite3.Connection, rng: random.Random, now: int, count: int, node_ids: List[str]) -> Tuple[int, int]:
+    votes = 0
+    for i in range(count):
+        created = now - rng.randint(3600, 365 * 86400)
+        active = i < max(1, count // 20)
+        ends = now + 86400 if active else created + 7 * 86400
+        cur = conn.execute(
+            'INSERT INTO encuestas (owner_node_id, question, options, created_at, ends_at, status, closed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (node_ids[i % len(node_ids)], f"¿Pregunta {i}?", json.dumps(["Sí", "No", "Depende"]),
+             _iso(created), _iso(ends), 'active' if active else 'closed', None if active else _iso(ends)),
+        )
+        voters = rng.sample(node_ids, k=min(len(node_ids), rng.randint(3, 60)))
+        conn.executemany(
+            'INSERT INTO encuesta_votos (encuesta_id, node_id, option_index, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(cur.lastrowid, v, rng.randrange(3), _iso(created), _iso(created)) for v in voters],
+        )
+        votes += len(voters)
+    return count, votes
@@ -0,0 +1,452 @@
+from __future__ import annotations
+
+import argparse
+import inspect
+import json
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.dataset import BASE_ID, DATASET_TASK, dataset_meta, generate
+from Models.Database import Database
+
+# Benchmark de Models/Database sobre una BD sintética grande (benchmarks/dataset.py).
+#
+# Uso:
+#   python -m benchmarks.db_benchmark                    # compara con benchmarks/baseline.json
+#   python -m benchmarks.db_benchmark --update-baseline  # guarda la ejecución como referencia
+#   python -m benchmarks.db_benchmark --scale 0.1 --only get_node,stats_summary
+#
+# Todo es local (SQLite + stdlib): no necesita red ni el nodo Meshtastic.
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DEFAULT_WORKDIR = "/tmp/meshassistant_bench"
+# El conjunto cacheado se regenera si es más antiguo (las consultas de
+# "últimas 24 h" dejarían de encontrar filas).
+DATASET_MAX_AGE = 12 * 3600
+# Regresión: p50 por encima de la referencia × REGRESSION_FACTOR y además al
+# menos REGRESSION_MIN_MS más lento (evita falsos positivos en métodos de µs).
+REGRESSION_FACTOR = 1.5
+REGRESSION_MIN_MS = 0.5
+
+# Métodos públicos que no tiene sentido cronometrar (ciclo de vida del pool)
+SKIPPED = {
+    "close_connections": "Cierra el pool de conexiones del proceso; no es una operación de datos.",
+}
+
+CAP_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<alert xmlns="urn:oasis:names:tc:emergency:cap:1.2"><info><language>es-ES</language>'
+    '<event>Aviso amarillo de viento</event><severity>Moderate</severity>'
+    '<headline>Aviso amarillo por viento {n}</headline>'
+    '<description>Rachas máximas de 70 km/h en el litoral.</description>'
+    '<onset>2025-01-10T12:00:00+01:00</onset><expires>2025-01-10T23:59:59+01:00</expires>'
+    '<area><areaDesc>Litoral gaditano</areaDesc></area></info></alert>'
+)
+
+
+def case(
+    method: str,
+    run: Callable[[Database, Any], Any],
+    prepare: Optional[Callable[[Database], Any]] = None,
+    *,
+    rows: Optional[Callable[[Any], int]] = None,
+    iterations: Optional[int] = None,
+    destructive: bool = False,
+) -> Dict[str, Any]:
+    """Describe una medición.
+
+    - prepare(db): se ejecuta fuera del cronómetro antes de cada iteración y su
+      resultado se pasa a run (p. ej. encolar el trace que luego se marca).
+    - rows(result): filas procesadas por llamada (por defecto len() de listas o 1).
+    - iterations: tope propio para métodos pesados.
+    - destructive: se ejecuta al final (borra o reescribe datos).
+    """
+    return {"method": method, "run": run, "prepare": prepare, "rows": rows,
+            "iterations": iterations, "destructive": destructive}
+
+
+def _rows_of(result: Any) -> int:
+    if isinstance(result, list):
+        return len(result)
+    return 1
+
+
+def build_cases(db: Database, seed: int) -> List[Dict[str, Any]]:
+    """Lista de casos, uno por método público de Database."""
+    rng = random.Random(seed)
+    with closing(sqlite3.connect(db.db_path)) as conn:
+        nodes = conn.execute('SELECT node_id, short_name FROM nodes WHERE via_mqtt = 0 ORDER BY node_id').fetchall()
+        traced = [r[0] for r in conn.execute(
+            "SELECT DISTINCT \"to\" FROM traces WHERE status = 'done' ORDER BY \"to\" LIMIT 500")]
+        trace_ids = [r[0] for r in conn.execute("SELECT id FROM traces WHERE status = 'done' ORDER BY id DESC LIMIT 2000")]
+        polls = [r[0] for r in conn.execute('SELECT id FROM encuestas ORDER BY id')]
+        active_polls = [r[0] for r in conn.execute("SELECT id FROM encuestas WHERE status = 'active' ORDER BY id")]
+        chiste_ids = [r[0] for r in conn.execute('SELECT id FROM chistes ORDER BY id')]
+        last_chiste = conn.execute('SELECT COALESCE(MAX(chiste_id), 0) FROM chistes').fetchone()[0]
+        device = {r[0]: {k: r[k] for k in r.keys()} for r in _rows(conn, 'SELECT * FROM nodes')}
+    node_ids = [n[0] for n in nodes]
+    short_names = [n[1] for n in nodes if n[1]]
+    counter = iter(range(1, 10 ** 9))
+
+    def node() -> str:
+        return rng.choice(node_ids)
+
+    def fresh_node() -> str:
+        return f"!f{next(counter):07x}"
+
+    def route(target: str) -> Dict[str, Any]:
+        relay = rng.choice(traced or node_ids)
+        return {
+            "hops": [{"id": BASE_ID, "snr": 9.5, "rssi": None}, {"id": relay, "snr": 4.25, "rssi": None},
+                     {"id": target, "snr": -2.0, "rssi": None}],
+            "return_hops": [{"id": relay, "snr": 3.0, "rssi": None}, {"id": BASE_ID, "snr": 8.0, "rssi": None},
+                            {"id": "!b0000001", "snr": 10.0, "rssi": None}],
+        }
+
+    def sync_payload(_db: Database) -> Dict[str, Dict[str, Any]]:
+        # El dispositivo ve todos los nodos; ~1 % ha cambiado desde la última pasada
+        payload = {nid: {k: v for k, v in row.items() if k not in ("created_at", "updated_at")}
+                   for nid, row in device.items()}
+        for nid in rng.sample(list(payload), k=max(1, len(payload) // 100)):
+            payload[nid]["snr"] = round(rng.uniform(-15.0, 10.0), 2)
+        return payload
+
+    def new_poll(_db: Database) -> tuple:
+        owner = fresh_node()
+        return _db.encuesta_create(owner_node_id=owner, question="¿Bench?", options=["a", "b"]), owner
+
+    def claimed_outbox(_db: Database) -> List[int]:
+        _db.enqueue_outbox("bench")
+        return [m["id"] for m in _db.claim_outbox(limit=1)]
+
+    def deferred_rows(_db: Database) -> List[tuple]:
+        # Un volcado típico del modo SD: 30 s de comandos y pings
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+        ts = int(time.time())
+        rows = [("commands_sent", (node(), "ping", None, "/ping", stamp, ts)) for _ in range(20)]
+        rows += [("pings", (node(), "!b0000001", None, 1, "ping", stamp, ts)) for _ in range(10)]
+        return rows
+
+    def traced_pending(_db: Database) -> tuple:
+        target = node()
+        return _db.enqueue_trace(target), target
+
+    return [
+        case("add_agenda", lambda d, _: d.add_agenda(node(), "Recordatorio bench")),
+        case("aemet_bulk_insert",
+             lambda d, _: d.aemet_bulk_insert("Cadiz", [CAP_TEMPLATE.format(n=next(counter)) for _ in range(5)]),
+             rows=lambda r: r[0] + r[1]),
+        case("aemet_fix_legacy_rows", lambda d, _: d.aemet_fix_legacy_rows(), rows=lambda r: max(1, r[0])),
+        case("aemet_get_next_unpublished", lambda d, _: d.aemet_get_next_unpublished()),
+        case("aemet_get_recent_alerts", lambda d, _: d.aemet_get_recent_alerts(limit=3, hours=None)),
+        case("aemet_insert_alert", lambda d, _: d.aemet_insert_alert("Cadiz", f"Alerta bench {next(counter)}")),
+        case("aemet_mark_published", lambda d, alert_id: d.aemet_mark_published(alert_id),
+             lambda d: d.aemet_insert_alert("Cadiz", f"Alerta bench {next(counter)}")),
+        case("aemet_weather_get_latest", lambda d, _: d.aemet_weather_get_latest(scope="city")),
+        case("aemet_weather_insert",
+             lambda d, _: d.aemet_weather_insert(scope="city", content="Cielo despejado.", city="Chipiona",
+                                                 city_code="11016")),
+        case("bulk_insert_api_chistes",
+             lambda d, _: d.bulk_insert_api_chistes(
+                 [{"id": last_chiste + next(counter), "content": "Chiste API"} for _ in range(20)]),
+             rows=lambda r: r[0] + r[1]),
+        case("claim_outbox", lambda d, _: d.claim_outbox(limit=1), lambda d: d.enqueue_outbox("bench")),
+        case("cleanup_stale_pending_traces", lambda d, _: d.cleanup_stale_pending_traces()),
+        case("count_pending_traces", lambda d, _: d.count_pending_traces()),
+        case("create_node_if_not_exists", lambda d, _: d.create_node_if_not_exists(fresh_node())),
+        case("encuesta_close", lambda d, p: d.encuesta_close(*p), new_poll),
+        case("encuesta_create",
+             lambda d, _: d.encuesta_create(owner_node_id=fresh_node(), question="¿Bench?", options=["a", "b"])),
+        case("encuesta_delete", lambda d, p: d.encuesta_delete(*p), new_poll),
+        case("encuesta_expire_due", lambda d, _: d.encuesta_expire_due()),
+        case("encuesta_get", lambda d, _: d.encuesta_get(rng.choice(polls))),
+        case("encuesta_get_active_by_owner", lambda d, _: d.encuesta_get_active_by_owner(node())),
+        case("encuesta_list_active", lambda d, _: d.encuesta_list_active(with_results=True)),
+        case("encuesta_results", lambda d, _: d.encuesta_results(rng.choice(polls))),
+        case("encuesta_vote", lambda d, _: d.encuesta_vote(rng.choice(active_polls or polls), node(), rng.randrange(2))),
+        case("enqueue_outbox", lambda d, _: d.enqueue_outbox("Mensaje bench")),
+        case("enqueue_trace", lambda d, _: d.enqueue_trace(node())),
+        case("get_agenda", lambda d, _: d.get_agenda(node())),
+        case("get_all_nodes", lambda d, _: d.get_all_nodes()),
+        case("get_chistes_to_upload", lambda d, _: d.get_chistes_to_upload()),
+        case("get_commands_audit", lambda d, _: d.get_commands_audit(limit=100, hours=24 * 30)),
+        case("get_commands_audit_summary", lambda d, _: d.get_commands_audit_summary(hours=24 * 7)),
+        case("get_last_downloaded_chiste_id", lambda d, _: d.get_last_downloaded_chiste_id()),
+        case("get_last_trace_updated_at", lambda d, _: d.get_last_trace_updated_at()),
+        case("get_latest_trace_route_info", lambda d, _: d.get_latest_trace_route_info(rng.choice(traced or node_ids))),
+        case("get_latest_trace_routes",
+             lambda d, _: d.get_latest_trace_routes(rng.sample(traced or node_ids, k=min(50, len(traced or node_ids)))),
+             rows=len),
+        case("get_latest_trace_snr", lambda d, _: d.get_latest_trace_snr(rng.choice(traced or node_ids))),
+        case("get_next_in_queue", lambda d, _: d.get_next_in_queue()),
+        case("get_next_node_to_trace", lambda d, _: d.get_next_node_to_trace()),
+        case("get_next_pending_outbox", lambda d, _: d.get_next_pending_outbox()),
+        case("get_next_pending_trace", lambda d, _: d.get_next_pending_trace()),
+        case("get_node", lambda d, _: d.get_node(node())),
+        case("get_node_by_identifier", lambda d, _: d.get_node_by_identifier(rng.choice(short_names))),
+        case("get_node_by_short_name", lambda d, _: d.get_node_by_short_name(rng.choice(short_names).lower())),
+        case("get_node_link_history", lambda d, _: d.get_node_link_history(rng.choice(traced or node_ids))),
+        case("get_random_chiste", lambda d, _: d.get_random_chiste(bag=f"ch{rng.randrange(4)}")),
+        case("get_recent_traces", lambda d, _: d.get_recent_traces()),
+        case("get_router_nodes", lambda d, _: d.get_router_nodes()),
+        case("get_task_last_run", lambda d, _: d.get_task_last_run(DATASET_TASK)),
+        case("get_top_command_users", lambda d, _: d.get_top_command_users(hours=24 * 7)),
+        case("get_trace_hops", lambda d, _: d.get_trace_hops(rng.sample(trace_ids, k=min(50, len(trace_ids)))),
+             rows=len),
+        case("get_trace_rtt", lambda d, _: d.get_trace_rtt(rng.choice(traced or node_ids))),
+        case("log_command", lambda d, _: d.log_command(node_id=node(), command="ping", message="/ping")),
+        case("mark_chistes_uploaded", lambda d, _: d.mark_chistes_uploaded(rng.sample(chiste_ids, k=min(20, len(chiste_ids)))),
+             rows=lambda _: min(20, len(chiste_ids))),
+        case("mark_outbox_sent", lambda d, outbox_id: d.mark_outbox_sent(outbox_id),
+             lambda d: d.enqueue_outbox("bench")),
+        case("mark_trace_done", lambda d, p: d.mark_trace_done(p[0], False, "Timeout"), traced_pending),
+        case("mark_trace_done_with_route",
+             lambda d, p: d.mark_trace_done_with_route(p[0], True, text="Route traced", rtt_ms=rng.randint(3000, 20000),
+                                                    **route(p[1])),
+             traced_pending),
+        case("nodes_overview", lambda d, _: d.nodes_overview()),
+        case("preload_mirror", lambda d, _: d.preload_mirror()),
+        case("rebuild_trace_state", lambda d, _: d.rebuild_trace_state(), rows=lambda r: r, iterations=3),
+        case("release_outbox", lambda d, ids: d.release_outbox(ids), claimed_outbox),
+        case("resolve_identifier", lambda d, _: d.resolve_identifier(rng.choice(short_names))),
+        case("save_chiste", lambda d, _: d.save_chiste(node(), "Chiste bench", need_upload=True)),
+        case("save_ping", lambda d, _: d.save_ping(node(), "!b0000001", "ping", hops=1)),
+        case("save_trace", lambda d, _: d.save_trace("local", node(), "Route traced")),
+        case("set_task_run", lambda d, _: d.set_task_run("benchmark_task")),
+        case("snr_average", lambda d, _: d.snr_average()),
+        case("stats_summary", lambda d, _: d.stats_summary()),
+        case("sync_nodes", lambda d, payload: d.sync_nodes(payload), sync_payload,
+             rows=lambda r: r["total"], iterations=5),
+        case("tides_get_latest", lambda d, _: d.tides_get_latest()),
+        case("tides_insert",
+             lambda d, _: d.tides_insert(location="Chipiona", source="worldtides", approximate=False, extremes=[])),
+        case("update_node", lambda d, _: d.update_node(node(), {"snr": round(rng.uniform(-10, 10), 2)})),
+        case("wal_checkpoint", lambda d, _: d.wal_checkpoint("PASSIVE"), lambda d: d.save_ping(node(), "!b0000001", "ping"),
+             rows=lambda r: max(1, r["checkpointed_frames"])),
+        case("write_deferred", lambda d, items: d.write_deferred(items), deferred_rows, rows=lambda r: r),
+        case("upsert_nodes",
+             lambda d, _: d.upsert_nodes({nid: {"battery": rng.randint(1, 100)} for nid in rng.sample(node_ids, k=min(50, len(node_ids)))}),
+             rows=lambda r: r),
+        # Sin histórico separado (DB_HISTORY_SPLIT) mide solo la comprobación
+        case("archive_traces",
+             lambda d, _: d.archive_traces(int(time.time()) - 200 * 86400, max_batches=4, pause=0),
+             rows=lambda r: max(1, r), iterations=3, destructive=True),
+        case("purge_expired",
+             lambda d, _: d.purge_expired("pings", int(time.time()) - 300 * 86400, max_batches=4, pause=0),
+             rows=lambda r: max(1, r), iterations=3, destructive=True),
+        case("compact", lambda d, _: d.compact(), iterations=1, destructive=True),
+    ]
+
+
+def _rows(conn: sqlite3.Connection, sql: str) -> List[sqlite3.Row]:
+    conn.row_factory = sqlite3.Row
+    return conn.execute(sql).fetchall()
+
+
+def public_methods() -> List[str]:
+    """Métodos públicos de Database (los que el benchmark debe cubrir)."""
+    return sorted(
+        name for name, value in inspect.getmembers(Database)
+        if not name.startswith("_") and callable(value)
+    )
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def measure(db: Database, spec: Dict[str, Any], iterations: int) -> Dict[str, Any]:
+    """Ejecuta un caso `iterations` veces y devuelve p50/p95/media en ms y filas/s."""
+    n = max(1, min(iterations, spec["iterations"] or iterations))
+    rows_of = spec["rows"] or _rows_of
+    samples: List[float] = []
+    total_rows = 0
+    if not spec["destructive"]:
+        arg = spec["prepare"](db) if spec["prepare"] else None
+        spec["run"](db, arg)  # calentamiento (pool, caché de páginas)
+    for _ in range(n):
+        arg = spec["prepare"](db) if spec["prepare"] else None
+        start = time.perf_counter()
+        result = spec["run"](db, arg)
+        samples.append(time.perf_counter() - start)
+        total_rows += int(rows_of(result) or 0)
+    elapsed = sum(samples)
+    return {
+        "iterations": n,
+        "p50_ms": round(_percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(_percentile(samples, 95) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "rows_per_s": round(total_rows / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def prepare_database(workdir: str, *, scale: float, seed: int, regenerate: bool = False) -> Dict[str, Any]:
+    """Genera (o reutiliza) el conjunto y devuelve una copia de trabajo para medir.
+
+    El conjunto se cachea por semilla/escala en workdir; las mediciones escriben
+    sobre una copia para que cada ejecución parta de los mismos datos.
+    """
+    base = Path(workdir)
+    base.mkdir(parents=True, exist_ok=True)
+    cached = base / f"dataset-s{seed}-x{scale:g}.sqlite"
+    meta = {} if regenerate else dataset_meta(str(cached))
+    fresh = meta.get("seed") == seed and meta.get("scale") == scale and (
+        time.time() - float(meta.get("generated_ts") or 0) < DATASET_MAX_AGE
+    )
+    if not fresh:
+        meta = generate(str(cached), scale=scale, seed=seed)
+        Database.close_connections()
+    work = base / "work.sqlite"
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{work}{suffix}").unlink(missing_ok=True)
+    shutil.copyfile(cached, work)
+    return {"path": str(work), "dataset": meta, "reused": fresh}
+
+
+def run_benchmark(
+    *,
+    scale: float = 1.0,
+    seed: int = 1234,
+    iterations: int = 20,
+    workdir: str = DEFAULT_WORKDIR,
+    only: Optional[List[str]] = None,
+    regenerate: bool = False,
+) -> Dict[str, Any]:
+    """Genera/reutiliza el conjunto, mide cada método y devuelve el informe."""
+    prepared = prepare_database(workdir, scale=scale, seed=seed, regenerate=regenerate)
+    Database.close_connections()
+    db = Database(prepared["path"])
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        specs = build_cases(db, seed)
+        specs.sort(key=lambda s: s["destructive"])
+        for spec in specs:
+            if only and spec["method"] not in only:
+                continue
+            results[spec["method"]] = measure(db, spec, iterations)
+    finally:
+        Database.close_connections()
+    return {
+        "meta": {
+            "scale": scale,
+            "seed": seed,
+            "iterations": iterations,
+            "rows": prepared["dataset"].get("rows", {}),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "run_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "skipped": dict(SKIPPED),
+        "results": results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """Compara p50 por método con la referencia.
+
+    Devuelve {comparable, reason, regressions, rows} donde rows lleva el ratio
+    frente a la referencia. Si la escala o la semilla no coinciden no se compara.
+    """
+    meta, base_meta = report.get("meta", {}), baseline.get("meta", {})
+    for key in ("scale", "seed"):
+        if meta.get(key) != base_meta.get(key):
+            return {"comparable": False, "reason": f"{key} distinto ({meta.get(key)} vs {base_meta.get(key)})",
+                    "regressions": [], "rows": {}}
+    rows: Dict[str, Dict[str, Any]] = {}
+    regressions: List[str] = []
+    base_results = baseline.get("results", {})
+    for method, res in report.get("results", {}).items():
+        ref = base_results.get(method)
+        if not ref:
+            rows[method] = {"ratio": None, "regression": False}
+            continue
+        ratio = res["p50_ms"] / ref["p50_ms"] if ref["p50_ms"] else None
+        regression = (
+            res["p50_ms"] > ref["p50_ms"] * REGRESSION_FACTOR
+            and res["p50_ms"] - ref["p50_ms"] > REGRESSION_MIN_MS
+        )
+        rows[method] = {"ratio": round(ratio, 2) if ratio is not None else None, "regression": regression}
+        if regression:
+            regressions.append(method)
+    return {"comparable": True, "reason": None, "regressions": regressions, "rows": rows}
+
+
+def format_report(report: Dict[str, Any], comparison: Optional[Dict[str, Any]] = None) -> str:
+    """Tabla de texto con una fila por método (y el ratio frente a la referencia)."""
+    meta = report["meta"]
+    lines = [
+        f"Database benchmark · escala {meta['scale']:g} · semilla {meta['seed']} · "
+        f"Python {meta['python']} · SQLite {meta['sqlite']}",
+        "Filas: " + ", ".join(f"{k}={v}" for k, v in meta.get("rows", {}).items()),
+        "",
+        f"{'método':<32} {'n':>4} {'p50 ms':>10} {'p95 ms':>10} {'filas/s':>12} {'vs ref':>8}",
+    ]
+    for method, res in report["results"].items():
+        cmp_row = (comparison or {}).get("rows", {}).get(method, {})
+        ratio = cmp_row.get("ratio")
+        mark = " !" if cmp_row.get("regression") else ""
+        lines.append(
+            f"{method:<32} {res['iterations']:>4} {res['p50_ms']:>10.3f} {res['p95_ms']:>10.3f} "
+            f"{(res['rows_per_s'] or 0):>12.1f} {(f'{ratio:.2f}x' if ratio is not None else '-'):>8}{mark}"
+        )
+    for method, reason in report.get("skipped", {}).items():
+        lines.append(f"{method:<32} omitido: {reason}")
+    if comparison is not None:
+        lines.append("")
+        if not comparison["comparable"]:
+            lines.append(f"Sin comparación con la referencia: {comparison['reason']}")
+        elif comparison["regressions"]:
+            lines.append("Regresiones (p50): " + ", ".join(comparison["regressions"]))
+        else:
+            lines.append("Sin regresiones frente a la referencia.")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de Models/Database sobre una BD sintética grande.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor de tamaño del conjunto (1.0 = 5k nodos, 200k comandos...)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--only", default="", help="Lista de métodos separados por comas")
+    parser.add_argument("--regenerate", action="store_true", help="Regenera el conjunto aunque haya uno en caché")
+    parser.add_argument("--update-baseline", action="store_true", help="Guarda esta ejecución como referencia")
+    parser.add_argument("--json", action="store_true", help="Imprime el informe en JSON")
+    args = parser.parse_args(argv)
+
+    only = [m.strip() for m in args.only.split(",") if m.strip()] or None
+    report = run_benchmark(scale=args.scale, seed=args.seed, iterations=args.iterations,
+                           workdir=args.workdir, only=only, regenerate=args.regenerate)
+
+    baseline_path = Path(args.baseline)
+    comparison = None
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    elif baseline_path.exists():
+        comparison = compare(report, json.loads(baseline_path.read_text(encoding="utf-8")))
+
+    if args.json:
+        print(json.dumps({"report": report, "comparison": comparison}, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(report, comparison))
+        if args.update_baseline:
+            print(f"\nReferencia guardada en {baseline_path}")
+    return 1 if comparison and comparison["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,26 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import Optional, Union
+from contextlib import closing
+from typing import Callable, Dict, Optional, Tuple, Union
+import hashlib
+import json
 import sqlite3
+import time
+
+from functions import log_p
 
 # Archivo de base de datos SQLite (en el raíz del proyecto)
 DATABASE_FILE = Path(__file__).resolve().parent / "database.sql"
 
 
 def _execute_schema(conn: sqlite3.Connection) -> None:
+    """Migración 1: esquema base (tablas, columnas añadidas después e índices)."""
     cur = conn.cursor()
 
     # Usamos comillas dobles para columnas con palabras reservadas ("from", "to")
     cur.executescript(
         """
+        PRAGMA auto_vacuum=INCREMENTAL; -- solo tiene efecto en BDs nuevas (sin tablas)
         PRAGMA journal_mode=WAL;
         PRAGMA synchronous=NORMAL;
 
@@ -25,6 +33,24 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
             chiste_id INTEGER NULL
         );
 
+        -- Bolsa barajada de chistes aprobados por canal (o conversación privada):
+        -- permutación persistida que se recorre con un cursor, sin repetir
+        -- hasta agotarla. bag = 'ch<N>' para canales o el id del nodo en DM.
+        CREATE TABLE IF NOT EXISTS chiste_bag (
+            bag TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            chiste_id INTEGER NOT NULL,  -- chistes.id
+            PRIMARY KEY (bag, position)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS chiste_bag_state (
+            bag TEXT PRIMARY KEY,
+            cursor INTEGER NOT NULL DEFAULT 0,   -- siguiente posición a servir
+            size INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,  -- versión del conjunto aprobado al barajar
+            last_id INTEGER NULL                 -- último chiste servido
+        );
+
         CREATE TABLE IF NOT EXISTS traces (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             "from" TEXT NULL,
@@ -35,33 +61,64 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
             updated_at TEXT NULL,
             hops INTEGER NULL,
             hops_back INTEGER NULL,
-            -- Enriquecimiento de trace: destino y hasta 7 saltos
+            -- Enriquecimiento de trace: nombres del destino (saltos en trace_hops)
             to_name TEXT NULL,
             to_name_short TEXT NULL,
-            hop1_id TEXT NULL, hop1_name TEXT NULL, hop1_name_short TEXT NULL, hop1_snr REAL NULL, hop1_rssi REAL NULL,
-            hop2_id TEXT NULL, hop2_name TEXT NULL, hop2_name_short TEXT NULL, hop2_snr REAL NULL, hop2_rssi REAL NULL,
-            hop3_id TEXT NULL, hop3_name TEXT NULL, hop3_name_short TEXT NULL, hop3_snr REAL NULL, hop3_rssi REAL NULL,
-            hop4_id TEXT NULL, hop4_name TEXT NULL, hop4_name_short TEXT NULL, hop4_snr REAL NULL, hop4_rssi REAL NULL,
-            hop5_id TEXT NULL, hop5_name TEXT NULL, hop5_name_short TEXT NULL, hop5_snr REAL NULL, hop5_rssi REAL NULL,
-            hop6_id TEXT NULL, hop6_name TEXT NULL, hop6_name_short TEXT NULL, hop6_snr REAL NULL, hop6_rssi REAL NULL,
-            hop7_id TEXT NULL, hop7_name TEXT NULL, hop7_name_short TEXT NULL, hop7_snr REAL NULL, hop7_rssi REAL NULL,
-            -- Hops de regreso (hasta 7)
-            hop_return1_id TEXT NULL, hop_return1_name TEXT NULL, hop_return1_name_short TEXT NULL, hop_return1_snr REAL NULL, hop_return1_rssi REAL NULL,
-            hop_return2_id TEXT NULL, hop_return2_name TEXT NULL, hop_return2_name_short TEXT NULL, hop_return2_snr REAL NULL, hop_return2_rssi REAL NULL,
-            hop_return3_id TEXT NULL, hop_return3_name TEXT NULL, hop_return3_name_short TEXT NULL, hop_return3_snr REAL NULL, hop_return3_rssi REAL NULL,
-            hop_return4_id TEXT NULL, hop_return4_name TEXT NULL, hop_return4_name_short TEXT NULL, hop_return4_snr REAL NULL, hop_return4_rssi REAL NULL,
-            hop_return5_id TEXT NULL, hop_return5_name TEXT NULL, hop_return5_name_short TEXT NULL, hop_return5_snr REAL NULL, hop_return5_rssi REAL NULL,
-            hop_return6_id TEXT NULL, hop_return6_name TEXT NULL, hop_return6_name_short TEXT NULL, hop_return6_snr REAL NULL, hop_return6_rssi REAL NULL,
-            hop_return7_id TEXT NULL, hop_return7_name TEXT NULL, hop_return7_name_short TEXT NULL, hop_return7_snr REAL NULL, hop_return7_rssi REAL NULL
+            -- Epoch (segundos) de created_at/updated_at para filtros por rango indexados
+            created_ts INTEGER NULL,
+            updated_ts INTEGER NULL
+        );
+
+        -- Saltos de cada traceroute (ida y vuelta), sin límite de longitud
+        CREATE TABLE IF NOT EXISTS trace_hops (
+            trace_id INTEGER NOT NULL,
+            direction TEXT NOT NULL,   -- 'forward' (ida) | 'return' (vuelta)
+            idx INTEGER NOT NULL,      -- posición del salto (1..N)
+            node_id TEXT NULL,
+            snr REAL NULL,
+            rssi REAL NULL,
+            PRIMARY KEY (trace_id, direction, idx)
+        ) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_trace_hops_node ON trace_hops(node_id, trace_id);
+
+        -- Ruta exterior (base -> destino) del último trace 'done' de cada nodo,
+        -- precalculada al completar el trace (usada por /routers y el Gateway)
+        CREATE TABLE IF NOT EXISTS trace_routes (
+            node_id TEXT PRIMARY KEY,
+            trace_id INTEGER NOT NULL,
+            hops INTEGER NULL,                -- NULL: el trace no tenía ruta utilizable
+            snrs TEXT NULL,                   -- JSON [snr] de cada tramo exterior
+            intermediates TEXT NULL,          -- JSON [node_id] de repetidores intermedios
+            path TEXT NULL,                   -- JSON [node_id] desde la base hasta el destino
+            snr_text TEXT NULL,               -- ej. '9.0dB, 9.2dB'
+            base TEXT NOT NULL,               -- JSON de identificadores de base usados
+            updated_at TEXT NULL              -- updated_at del trace
+        );
+
+        -- Estado materializado de traces por nodo (mantenido por Models/Database.py)
+        CREATE TABLE IF NOT EXISTS trace_state (
+            node_id TEXT PRIMARY KEY,
+            last_status TEXT NULL,                        -- 'done' | 'error' | NULL (nunca trazado)
+            last_updated_epoch INTEGER NULL,
+            consecutive_errors INTEGER NOT NULL DEFAULT 0,
+            pending_trace_id INTEGER NULL,                -- trace en cola para este nodo
+            next_eligible_at INTEGER NOT NULL DEFAULT 0,  -- epoch a partir del cual es candidato
+            priority INTEGER NOT NULL DEFAULT 2           -- 0 router cercano | 1 normal | 2 excluido
         );
 
+        CREATE INDEX IF NOT EXISTS idx_trace_state_next ON trace_state(priority, next_eligible_at)
+            WHERE pending_trace_id IS NULL;
+
         CREATE TABLE IF NOT EXISTS pings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             "from" TEXT NOT NULL,
             "to" TEXT NOT NULL,
             from_name TEXT,
             hops INTEGER,
-            data_raw TEXT NOT NULL
+            data_raw TEXT NOT NULL,
+            created_at TEXT NULL,
+            created_ts INTEGER NULL
         );
 
         CREATE TABLE IF NOT EXISTS queue (
@@ -103,7 +160,10 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
             updated_at TEXT
         );
 
-        CREATE INDEX IF NOT EXISTS idx_nodes_short_name ON nodes(short_name);
+        -- Búsquedas de nodos por nombre sin distinguir mayúsculas
+        -- (Database.resolve_identifier): comparar con "= ? COLLATE NOCASE"
+        CREATE INDEX IF NOT EXISTS idx_nodes_short_name_nocase ON nodes(short_name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_nodes_name_nocase ON nodes(name COLLATE NOCASE);
         CREATE INDEX IF NOT EXISTS idx_nodes_num ON nodes(num);
 
         -- Control de tareas periódicas
@@ -113,6 +173,38 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
             extra TEXT
         );
 
+        -- Versión del conjunto de chistes aprobados (tasks_control 'chistes_version').
+        -- Con triggers para detectar también aprobaciones hechas fuera del bot.
+        CREATE TRIGGER IF NOT EXISTS trg_chistes_version_ins AFTER INSERT ON chistes
+        WHEN NEW.need_approve = 0
+        BEGIN
+            INSERT INTO tasks_control (name, last_run_at, extra)
+            VALUES ('chistes_version', datetime('now', 'localtime'), '1')
+            ON CONFLICT(name) DO UPDATE SET
+                last_run_at = excluded.last_run_at,
+                extra = CAST(COALESCE(tasks_control.extra, '0') AS INTEGER) + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_chistes_version_upd AFTER UPDATE OF need_approve ON chistes
+        WHEN OLD.need_approve IS NOT NEW.need_approve
+        BEGIN
+            INSERT INTO tasks_control (name, last_run_at, extra)
+            VALUES ('chistes_version', datetime('now', 'localtime'), '1')
+            ON CONFLICT(name) DO UPDATE SET
+                last_run_at = excluded.last_run_at,
+                extra = CAST(COALESCE(tasks_control.extra, '0') AS INTEGER) + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_chistes_version_del AFTER DELETE ON chistes
+        WHEN OLD.need_approve = 0
+        BEGIN
+            INSERT INTO tasks_control (name, last_run_at, extra)
+            VALUES ('chistes_version', datetime('now', 'localtime'), '1')
+            ON CONFLICT(name) DO UPDATE SET
+                last_run_at = excluded.last_run_at,
+                extra = CAST(COALESCE(tasks_control.extra, '0') AS INTEGER) + 1;
+        END;
+
         -- Histórico de alertas AEMET descargadas
         CREATE TABLE IF NOT EXISTS aemet (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -122,7 +214,8 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
             data_hash TEXT UNIQUE,
             created_at TEXT,
             published INTEGER NOT NULL DEFAULT 0,
-            published_at TEXT NULL
+            published_at TEXT NULL,
+            created_ts INTEGER NULL
         );
 
         -- Histórico de predicción meteorológica (clima) descargada de AEMET
@@ -136,7 +229,8 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
             day TEXT,                -- 'hoy' | 'manana' | ...
             content TEXT NOT NULL,   -- texto listo para mostrar (provincia o ciudad)
             data_raw TEXT NULL,      -- payload original (texto/JSON) por si acaso
-            created_at TEXT
+            created_at TEXT,
+            created_ts INTEGER NULL
         );
 
         CREATE INDEX IF NOT EXISTS idx_aemet_weather_created ON aemet_weather(created_at);
@@ -148,9 +242,32 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
             command TEXT,
             parameters TEXT NULL,
             message TEXT,
-            created_at TEXT
+            created_at TEXT,
+            created_ts INTEGER NULL
         );
 
+        -- Agregados de commands_sent mantenidos por Database.log_command
+        -- (/stats y la auditoría del Gateway leen de aquí, no del histórico)
+        CREATE TABLE IF NOT EXISTS command_rollup_hourly (
+            hour INTEGER NOT NULL,              -- epoch del inicio de la hora
+            command TEXT NOT NULL,
+            node_id TEXT NOT NULL DEFAULT '',   -- '' si el comando no tenía nodo
+            count INTEGER NOT NULL DEFAULT 0,
+            last_at TEXT NULL,                  -- created_at del último comando
+            last_id INTEGER NULL,               -- id en commands_sent del último comando
+            PRIMARY KEY (hour, command, node_id)
+        ) WITHOUT ROWID;
+
+        -- Mismos agregados sin ventana temporal (totales históricos)
+        CREATE TABLE IF NOT EXISTS command_rollup_total (
+            node_id TEXT NOT NULL DEFAULT '',
+            command TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            last_at TEXT NULL,
+            last_id INTEGER NULL,
+            PRIMARY KEY (node_id, command)
+        ) WITHOUT ROWID;
+
         -- Predicción de mareas descargada/estimada (servida offline por /marea)
         CREATE TABLE IF NOT EXISTS tides (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -190,6 +307,39 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
 
         CREATE UNIQUE INDEX IF NOT EXISTS idx_voto_unico ON encuesta_votos(encuesta_id, node_id);
 
+        -- Recuento materializado de votos por opción. Lo mantienen los triggers
+        -- de encuesta_votos en la misma transacción que el voto (alta, cambio de
+        -- opción o borrado), así listar resultados no agrupa encuesta_votos.
+        CREATE TABLE IF NOT EXISTS encuesta_recuento (
+            encuesta_id INTEGER NOT NULL,
+            option_index INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (encuesta_id, option_index)
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS trg_encuesta_votos_insert AFTER INSERT ON encuesta_votos
+        BEGIN
+            INSERT INTO encuesta_recuento (encuesta_id, option_index, count)
+            VALUES (NEW.encuesta_id, NEW.option_index, 1)
+            ON CONFLICT(encuesta_id, option_index) DO UPDATE SET count = count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_encuesta_votos_update AFTER UPDATE OF option_index ON encuesta_votos
+        WHEN OLD.option_index IS NOT NEW.option_index
+        BEGIN
+            UPDATE encuesta_recuento SET count = count - 1
+            WHERE encuesta_id = OLD.encuesta_id AND option_index = OLD.option_index AND count > 0;
+            INSERT INTO encuesta_recuento (encuesta_id, option_index, count)
+            VALUES (NEW.encuesta_id, NEW.option_index, 1)
+            ON CONFLICT(encuesta_id, option_index) DO UPDATE SET count = count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_encuesta_votos_delete AFTER DELETE ON encuesta_votos
+        BEGIN
+            UPDATE encuesta_recuento SET count = count - 1
+            WHERE encuesta_id = OLD.encuesta_id AND option_index = OLD.option_index AND count > 0;
+        END;
+
         -- Cola de mensajes salientes (Web / API / WiFi Gateway)
         CREATE TABLE IF NOT EXISTS outbox (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -198,7 +348,15 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
             channel INTEGER NOT NULL DEFAULT 0,
             status TEXT NOT NULL DEFAULT 'pending',
             created_at TEXT NULL,
-            sent_at TEXT NULL
+            sent_at TEXT NULL,
+            created_ts INTEGER NULL,
+            updated_ts INTEGER NULL,     -- epoch de sent_at (envío, error o caducidad)
+            priority INTEGER NOT NULL DEFAULT 1,  -- 0 alerta, 1 operador, 2 NodeInfo
+            expires_ts INTEGER NULL,     -- epoch a partir del cual ya no se envía
+            content_hash TEXT NULL,      -- sha1(dest, channel, text) para deduplicar
+            lease_token TEXT NULL,       -- reclamación en curso (status 'sending')
+            lease_until INTEGER NULL,    -- epoch en que caduca la reclamación
+            attempts INTEGER NOT NULL DEFAULT 0
         );
 
         CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, created_at);
@@ -209,39 +367,34 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
     conn.commit()
 
     # Idempotent migration: ensure new columns exist in existing databases
-    def _has_column(table: str, column: str) -> bool:
-        cur2 = conn.execute(f'PRAGMA table_info({table})')
-        cols = [r[1] for r in cur2.fetchall()]  # r[1] is name
-        return column in cols
-
     # Ensure columns in pings: from_name (TEXT), hops (INTEGER)
-    if not _has_column('pings', 'from_name'):
+    if not _has_column(conn, 'pings', 'from_name'):
         conn.execute('ALTER TABLE pings ADD COLUMN from_name TEXT')
-    if not _has_column('pings', 'hops'):
+    if not _has_column(conn, 'pings', 'hops'):
         conn.execute('ALTER TABLE pings ADD COLUMN hops INTEGER')
     conn.commit()
 
     # Ensure new column in chistes: chiste_id
-    if not _has_column('chistes', 'chiste_id'):
+    if not _has_column(conn, 'chistes', 'chiste_id'):
         conn.execute('ALTER TABLE chistes ADD COLUMN chiste_id INTEGER NULL')
         conn.commit()
 
     # Ensure new column in aemet: message
-    if not _has_column('aemet', 'message'):
+    if not _has_column(conn, 'aemet', 'message'):
         conn.execute('ALTER TABLE aemet ADD COLUMN message TEXT NULL')
         conn.commit()
 
     # Ensure new column in nodes: role, battery, voltage
-    if not _has_column('nodes', 'role'):
+    if not _has_column(conn, 'nodes', 'role'):
         conn.execute('ALTER TABLE nodes ADD COLUMN role INTEGER NULL')
         conn.commit()
-    if not _has_column('nodes', 'battery'):
+    if not _has_column(conn, 'nodes', 'battery'):
         conn.execute('ALTER TABLE nodes ADD COLUMN battery INTEGER NULL')
         conn.commit()
-    if not _has_column('nodes', 'voltage'):
+    if not _has_column(conn, 'nodes', 'voltage'):
         conn.execute('ALTER TABLE nodes ADD COLUMN voltage REAL NULL')
         conn.commit()
-    if not _has_column('nodes', 'created_at'):
+    if not _has_column(conn, 'nodes', 'created_at'):
         conn.execute('ALTER TABLE nodes ADD COLUMN created_at TEXT NULL')
         conn.execute('UPDATE nodes SET created_at = updated_at WHERE created_at IS NULL')
         conn.commit()
@@ -251,121 +404,882 @@ def _execute_schema(conn: sqlite3.Connection) -> None:
     cur.execute('CREATE INDEX IF NOT EXISTS idx_chistes_need_approve ON chistes(need_approve)')
     cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_chistes_chiste_id ON chistes(chiste_id)')
     cur.execute('CREATE INDEX IF NOT EXISTS idx_nodes_role ON nodes(role)')
+    # Sustituido por idx_nodes_short_name_nocase (UPPER(short_name) no lo usaba)
+    cur.execute('DROP INDEX IF EXISTS idx_nodes_short_name')
     cur.execute('CREATE INDEX IF NOT EXISTS idx_commands_sent_created ON commands_sent(created_at, node_id)')
-    # Índices para optimizar cola y consultas de traces
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_traces_status_created ON traces(status, created_at)')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_traces_to_updated ON traces("to", updated_at)')
-    
+
     # Limpieza de registros corruptos/vacíos
     conn.execute("DELETE FROM nodes WHERE node_id IS NULL OR trim(node_id) = '' OR node_id IN ('None', 'null', 'Desconocido')")
     conn.execute("DELETE FROM commands_sent WHERE node_id IS NULL OR trim(node_id) = '' OR command IS NULL OR trim(command) IN ('', '/', '!')")
     conn.commit()
 
-    # Migración idempotente para adaptar la tabla traces existente
-    # - Añadir columnas status, created_at, updated_at si faltan
-    # - Permitir NULL en "from" y data_raw (si antes eran NOT NULL -> rebuild)
-    info_rows = conn.execute('PRAGMA table_info(traces)').fetchall()
-    colnames = [r[1] for r in info_rows]
 
-    needs_rebuild = False
-    if 'status' not in colnames or 'created_at' not in colnames or 'updated_at' not in colnames:
-        needs_rebuild = True
+def _has_column(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(r[1] == column for r in conn.execute(f'PRAGMA table_info({table})'))
+
+
+def _migrate_trace_hops(conn: sqlite3.Connection) -> None:
+    """Vuelca los saltos de las columnas heredadas hopN_* / hop_returnN_* a trace_hops."""
+    if _has_column(conn, 'traces', 'hop1_id'):
+        _backfill_trace_hops(conn)
+
+
+def _migrate_traces_table(conn: sqlite3.Connection) -> None:
+    """Adapta la tabla traces existente (rebuild por lotes si hace falta) y sus índices."""
+    if _traces_needs_rebuild(conn):
+        _rebuild_traces(conn)
+
+    # Columnas de enriquecimiento (BDs existentes que no necesitaban rebuild)
+    for col in ('hops', 'hops_back', 'to_name', 'to_name_short'):
+        if not _has_column(conn, 'traces', col):
+            col_type = 'INTEGER' if col.startswith('hops') else 'TEXT'
+            conn.execute(f'ALTER TABLE traces ADD COLUMN {col} {col_type} NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_traces_status_created ON traces(status, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_traces_to_updated ON traces("to", updated_at)')
+    conn.commit()
+
+
+def _migrate_epoch_columns(conn: sqlite3.Connection) -> None:
+    """Columnas epoch indexadas (created_ts/updated_ts) en tablas con histórico."""
+    if not _has_column(conn, 'pings', 'created_at'):
+        conn.execute('ALTER TABLE pings ADD COLUMN created_at TEXT NULL')
+    for table, pairs in EPOCH_COLUMNS.items():
+        for ts_col, _ in pairs:
+            if not _has_column(conn, table, ts_col):
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {ts_col} INTEGER NULL')
+    conn.commit()
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_traces_status_created_ts ON traces(status, created_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_traces_updated_ts ON traces(updated_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_commands_sent_created_ts ON commands_sent(created_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_pings_created_ts ON pings(created_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_aemet_created_ts ON aemet(created_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_aemet_weather_created_ts ON aemet_weather(created_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status_updated_ts ON outbox(status, updated_ts)')
+    conn.commit()
+    _backfill_epoch_columns(conn)
+
+
+def _migrate_trace_rtt(conn: sqlite3.Connection) -> None:
+    """Tiempo de respuesta de traceroute por nodo (plazo adaptativo de los traces)."""
+    for column in ('rtt_ms', 'rtt_hops'):
+        if not _has_column(conn, 'trace_state', column):
+            conn.execute(f'ALTER TABLE trace_state ADD COLUMN {column} INTEGER NULL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_trace_state_rtt ON trace_state(rtt_hops) WHERE rtt_ms IS NOT NULL')
+    conn.commit()
+
+
+def _drop_sender_chiste_bags(conn: sqlite3.Connection) -> None:
+    """Borra las bolsas de chistes por remitente: los privados comparten la bolsa 'dm'."""
+    for table in ('chiste_bag', 'chiste_bag_state'):
+        conn.execute(f"DELETE FROM {table} WHERE bag != 'dm' AND bag NOT GLOB 'ch[0-9]*'")
+    conn.commit()
+
+
+def _backfill_trace_routes(conn: sqlite3.Connection, chunk_size: int = 500) -> None:
+    """Ruta exterior precalculada (trace_routes) de los nodos con traces anteriores a la tabla.
+
+    Los nuevos se guardan al completar el trace; así las lecturas
+    (Database.get_latest_trace_routes) no tienen que calcular ni escribir.
+    """
+    from Models.Database import Database
+
+    ids = [
+        r[0]
+        for r in conn.execute(
+            """
+            SELECT MAX(t.id) FROM traces t
+            WHERE t.status = 'done' AND t."to" IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM trace_routes r WHERE r.node_id = t."to")
+            GROUP BY t."to"
+            """
+        ).fetchall()
+    ]
+    previous = conn.row_factory
+    conn.row_factory = sqlite3.Row
+    try:
+        for start in range(0, len(ids), chunk_size):
+            for trace_id in ids[start:start + chunk_size]:
+                Database._store_trace_route(conn, trace_id)
+            conn.commit()
+    finally:
+        conn.row_factory = previous
+
+
+def _migrate_trace_state_recency(conn: sqlite3.Connection) -> None:
+    """Desempate por actividad del nodo (nodes.updated_at) al elegir el siguiente trace."""
+    if not _has_column(conn, 'trace_state', 'node_updated_epoch'):
+        conn.execute('ALTER TABLE trace_state ADD COLUMN node_updated_epoch INTEGER NULL')
+    conn.execute(
+        """
+        UPDATE trace_state SET node_updated_epoch = (
+            SELECT CAST(strftime('%s', n.updated_at, 'utc') AS INTEGER)
+            FROM nodes n WHERE n.node_id = trace_state.node_id
+        )
+        WHERE node_updated_epoch IS NULL
+        """
+    )
+    conn.execute('DROP INDEX IF EXISTS idx_trace_state_next')
+    conn.execute(
+        'CREATE INDEX idx_trace_state_next ON trace_state(priority, next_eligible_at, node_updated_epoch DESC) '
+        'WHERE pending_trace_id IS NULL'
+    )
+    conn.commit()
+
+
+def _migrate_outbox_v2(conn: sqlite3.Connection) -> None:
+    """Outbox v2: prioridad, caducidad, reclamación (lease) y hash de contenido."""
+    for column, ddl in OUTBOX_V2_COLUMNS:
+        if not _has_column(conn, 'outbox', column):
+            conn.execute(f'ALTER TABLE outbox ADD COLUMN {column} {ddl}')
+    # Solo los pendientes participan en la deduplicación (pocas filas)
+    pending = conn.execute(
+        "SELECT id, text, dest, channel FROM outbox WHERE content_hash IS NULL AND status = 'pending' ORDER BY id"
+    ).fetchall()
+    seen_hashes = set()
+    for row_id, text, dest, channel in pending:
+        digest = outbox_content_hash(text, dest, channel)
+        if digest in seen_hashes:
+            # Duplicado antiguo ya pendiente: se conserva el primero
+            conn.execute(
+                "UPDATE outbox SET status = 'expired', updated_ts = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = ?",
+                (row_id,),
+            )
+            continue
+        seen_hashes.add(digest)
+        conn.execute('UPDATE outbox SET content_hash = ? WHERE id = ?', (digest, row_id))
+    conn.commit()
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_claim ON outbox(status, priority, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_lease ON outbox(status, lease_until)')
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_pending_hash ON outbox(content_hash) WHERE status = 'pending'"
+    )
+    conn.commit()
+
+
+# Tablas replicadas en RAM por Models/MemoryMirror.py: {tabla: expresión de clave}.
+# Los triggers anotan en mirror_changes la clave de cada fila alta/cambiada/borrada
+# (una fila por clave, con la secuencia del último cambio). En aemet_weather y
+# tides solo importan los últimos registros, así que la clave es fija ('').
+MIRROR_TABLES = {
+    'nodes': 'node_id',
+    'tasks_control': 'name',
+    'aemet_weather': "''",
+    'tides': "''",
+}
+
+
+def memory_mirror_enabled() -> bool:
+    """True si env.DB_MEMORY_MIRROR pide la réplica en RAM."""
+    try:
+        import env as _env
+    except ImportError:
+        return False
+    return bool(getattr(_env, 'DB_MEMORY_MIRROR', False))
+
+
+def ensure_mirror_triggers(conn: sqlite3.Connection, enabled: Optional[bool] = None) -> None:
+    """Crea mirror_changes y sus triggers con DB_MEMORY_MIRROR; sin ella los borra.
+
+    Idempotente. Sin réplica en RAM nadie lee el registro, así que cada
+    escritura de nodes/tasks_control no paga el INSERT extra. Los triggers
+    solo pueden escribir en su propio fichero, así que cada esquema con
+    tablas replicadas (main y, si está separado, history) tiene su propio
+    mirror_changes.
+    """
+    if enabled is None:
+        enabled = memory_mirror_enabled()
+    by_schema: Dict[str, Dict[str, str]] = {}
+    for table, key in MIRROR_TABLES.items():
+        by_schema.setdefault(table_schema(conn, table), {})[table] = key
+    statements = []
+    for schema, tables in by_schema.items():
+        if not enabled:
+            statements += [
+                f'DROP TRIGGER IF EXISTS {schema}.trg_mirror_{table}_{event}'
+                for table in tables for event in ('insert', 'update', 'delete')
+            ]
+            statements.append(f'DROP TABLE IF EXISTS {schema}.mirror_changes')
+            continue
+        statements += [
+            f"""
+            CREATE TABLE IF NOT EXISTS {schema}.mirror_changes (
+                tbl TEXT NOT NULL,
+                key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                PRIMARY KEY (tbl, key)
+            ) WITHOUT ROWID
+            """,
+            f'CREATE INDEX IF NOT EXISTS {schema}.idx_mirror_changes_seq ON mirror_changes(seq)',
+        ]
+        for table, key in tables.items():
+            for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                key_sql = key if key.startswith("'") else f'{row}.{key}'
+                statements.append(
+                    f"""
+                    CREATE TRIGGER IF NOT EXISTS {schema}.trg_mirror_{table}_{event.lower()} AFTER {event} ON {table}
+                    BEGIN
+                        INSERT INTO mirror_changes (tbl, key, seq)
+                        VALUES ('{table}', {key_sql}, (SELECT COALESCE(MAX(seq), 0) + 1 FROM mirror_changes))
+                        ON CONFLICT(tbl, key) DO UPDATE SET seq = excluded.seq;
+                    END
+                    """
+                )
+    for sql in statements:
+        conn.execute(sql)
+    conn.commit()
+
+
+# Columnas añadidas a outbox en la v2 (prioridad, caducidad, lease y hash)
+OUTBOX_V2_COLUMNS = (
+    ('priority', 'INTEGER NOT NULL DEFAULT 1'),
+    ('expires_ts', 'INTEGER NULL'),
+    ('content_hash', 'TEXT NULL'),
+    ('lease_token', 'TEXT NULL'),
+    ('lease_until', 'INTEGER NULL'),
+    ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+)
+
+
+def outbox_content_hash(text: str, dest: str, channel: int) -> str:
+    """Hash de deduplicación de un mensaje saliente (destino, canal y texto)."""
+    raw = f"{dest}\x1f{int(channel)}\x1f{text}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+# Columnas epoch (INTEGER, segundos) que acompañan a los *_at en ISO local:
+# {tabla: ((columna_ts, columna_iso_origen), ...)}
+EPOCH_COLUMNS = {
+    'traces': (('created_ts', 'created_at'), ('updated_ts', 'updated_at')),
+    'commands_sent': (('created_ts', 'created_at'),),
+    'pings': (('created_ts', 'created_at'),),
+    'aemet': (('created_ts', 'created_at'),),
+    'aemet_weather': (('created_ts', 'created_at'),),
+    'outbox': (('created_ts', 'created_at'), ('updated_ts', 'sent_at')),
+}
+EPOCH_MIGRATION_TASK = 'migration_epoch_ts'
+EPOCH_MIGRATION_CHUNK = 5000
+
+
+def _backfill_epoch_columns(conn: sqlite3.Connection, chunk_size: int = EPOCH_MIGRATION_CHUNK) -> int:
+    """Rellena created_ts/updated_ts de las filas anteriores a la migración.
+
+    Los *_at se guardan en hora local sin zona, así que se convierten con el
+    modificador 'utc' de SQLite (igual que datetime.fromisoformat().timestamp()).
+    Se procesa por rangos de id con un commit por lote; al terminar se marca
+    'done' en tasks_control y no se vuelve a ejecutar. Devuelve filas tocadas.
+    """
+    row = conn.execute(
+        'SELECT extra FROM tasks_control WHERE name = ?', (EPOCH_MIGRATION_TASK,)
+    ).fetchone()
+    if row and row[0] == 'done':
+        return 0
+
+    updated = 0
+    for table, pairs in EPOCH_COLUMNS.items():
+        bounds = conn.execute(f'SELECT MIN(id), MAX(id) FROM {table}').fetchone()
+        if bounds[0] is None:
+            continue
+        sets = ', '.join(
+            f"{ts_col} = COALESCE({ts_col}, CAST(strftime('%s', {src}, 'utc') AS INTEGER))"
+            for ts_col, src in pairs
+        )
+        pending = ' OR '.join(f'({ts_col} IS NULL AND {src} IS NOT NULL)' for ts_col, src in pairs)
+        start = bounds[0] - 1
+        while start < bounds[1]:
+            end = start + int(chunk_size)
+            cur = conn.execute(
+                f'UPDATE {table} SET {sets} WHERE id > ? AND id <= ? AND ({pending})',
+                (start, end),
+            )
+            conn.commit()
+            updated += cur.rowcount
+            start = end
+
+    conn.execute(
+        """
+        INSERT INTO tasks_control (name, last_run_at, extra) VALUES (?, datetime('now', 'localtime'), 'done')
+        ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at, extra = 'done'
+        """,
+        (EPOCH_MIGRATION_TASK,),
+    )
+    conn.commit()
+    return updated
+
+
+# Progreso de la migración de saltos: tasks_control.extra guarda el último id
+# copiado o 'done' al terminar.
+TRACE_HOPS_MIGRATION_TASK = 'migration_trace_hops'
+TRACE_HOPS_MIGRATION_CHUNK = 500
+
+
+def _backfill_trace_hops(conn: sqlite3.Connection, chunk_size: int = TRACE_HOPS_MIGRATION_CHUNK) -> int:
+    """Copia a trace_hops los saltos de las columnas heredadas de traces.
+
+    Migración online y reanudable: procesa `chunk_size` trazas por transacción
+    (los otros procesos pueden escribir entre lotes) y guarda el último id
+    copiado en tasks_control. Devuelve el número de saltos insertados.
+    """
+    row = conn.execute(
+        'SELECT extra FROM tasks_control WHERE name = ?', (TRACE_HOPS_MIGRATION_TASK,)
+    ).fetchone()
+    progress = row[0] if row else None
+    if progress == 'done':
+        return 0
+    last_id = int(progress) if progress and str(progress).isdigit() else 0
+
+    directions = (('forward', 'hop'), ('return', 'hop_return'))
+    select_cols = ', '.join(
+        f'{prefix}{i}_id, {prefix}{i}_snr, {prefix}{i}_rssi'
+        for _, prefix in directions
+        for i in range(1, 8)
+    )
+    inserted = 0
+    while True:
+        rows = conn.execute(
+            f'SELECT id, {select_cols} FROM traces WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, int(chunk_size)),
+        ).fetchall()
+        if not rows:
+            break
+
+        hops = []
+        for r in rows:
+            trace_id = r[0]
+            pos = 1
+            for direction, _ in directions:
+                for i in range(1, 8):
+                    node_id, snr, rssi = r[pos], r[pos + 1], r[pos + 2]
+                    pos += 3
+                    if node_id is None and snr is None:
+                        continue
+                    hops.append((trace_id, direction, i, node_id, snr, rssi))
+
+        last_id = rows[-1][0]
+        conn.executemany(
+            'INSERT OR IGNORE INTO trace_hops (trace_id, direction, idx, node_id, snr, rssi) VALUES (?, ?, ?, ?, ?, ?)',
+            hops,
+        )
+        conn.execute(
+            """
+            INSERT INTO tasks_control (name, last_run_at, extra) VALUES (?, datetime('now', 'localtime'), ?)
+            ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at, extra = excluded.extra
+            """,
+            (TRACE_HOPS_MIGRATION_TASK, str(last_id)),
+        )
+        conn.commit()
+        inserted += len(hops)
+
+    conn.execute(
+        """
+        INSERT INTO tasks_control (name, last_run_at, extra) VALUES (?, datetime('now', 'localtime'), 'done')
+        ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at, extra = 'done'
+        """,
+        (TRACE_HOPS_MIGRATION_TASK,),
+    )
+    conn.commit()
+    return inserted
+
+
+# Progreso de la reconstrucción de traces: tasks_control.extra guarda JSON
+# {"last": último id copiado, "started": inicio (ISO local)} o 'done'.
+TRACES_REBUILD_TASK = 'migration_traces_rebuild'
+TRACES_REBUILD_CHUNK = 5000
+
+# Columnas de traces tras el rebuild (las heredadas hopN_* no se copian:
+# sus saltos ya están en trace_hops)
+TRACES_COLUMNS = (
+    ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    ('"from"', 'TEXT NULL'),
+    ('"to"', 'TEXT NOT NULL'),
+    ('data_raw', 'TEXT NULL'),
+    ('status', 'TEXT NULL'),
+    ('created_at', 'TEXT NULL'),
+    ('updated_at', 'TEXT NULL'),
+    ('hops', 'INTEGER NULL'),
+    ('hops_back', 'INTEGER NULL'),
+    ('to_name', 'TEXT NULL'),
+    ('to_name_short', 'TEXT NULL'),
+    ('created_ts', 'INTEGER NULL'),
+    ('updated_ts', 'INTEGER NULL'),
+)
+
+
+def _traces_needs_rebuild(conn: sqlite3.Connection) -> bool:
+    """True si traces es anterior a status/created_at/updated_at o tiene "from"/data_raw NOT NULL."""
+    cols = {r[1]: r for r in conn.execute('PRAGMA table_info(traces)').fetchall()}
+    if not {'status', 'created_at', 'updated_at'} <= set(cols):
+        return True
+    # r[3] -> notnull flag (1 si NOT NULL)
+    return any(name in cols and cols[name][3] == 1 for name in ('from', 'data_raw'))
+
+
+def _rebuild_traces(conn: sqlite3.Connection, chunk_size: int = TRACES_REBUILD_CHUNK) -> int:
+    """Reconstruye traces con el esquema actual (patrón *table rebuild*).
+
+    Copia a traces_new por lotes de `chunk_size` filas (un commit por lote,
+    con el progreso en tasks_control, así que se reanuda si se interrumpe).
+    Al final, en una transacción IMMEDIATE, copia lo llegado o modificado
+    durante la copia y sustituye la tabla. Devuelve las filas copiadas.
+    """
+    row = conn.execute('SELECT extra FROM tasks_control WHERE name = ?', (TRACES_REBUILD_TASK,)).fetchone()
+    if row and row[0] and row[0] != 'done':
+        progress = json.loads(row[0])
     else:
-        cols = {r[1]: r for r in info_rows}
-        # r[3] -> notnull flag (1 si NOT NULL)
-        if ('from' in cols and cols['from'][3] == 1) or ('data_raw' in cols and cols['data_raw'][3] == 1):
-            needs_rebuild = True
+        progress = {'last': 0, 'started': time.strftime('%Y-%m-%dT%H:%M:%S')}
 
-    if needs_rebuild:
-        cur.executescript(
+    def save(extra: str) -> None:
+        conn.execute(
             """
-            BEGIN TRANSACTION;
-            CREATE TABLE IF NOT EXISTS traces_new (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                "from" TEXT NULL,
-                "to" TEXT NOT NULL,
-                data_raw TEXT NULL,
-                status TEXT NULL,
-                created_at TEXT NULL,
-                updated_at TEXT NULL,
-                hops INTEGER NULL,
-                hops_back INTEGER NULL,
-                to_name TEXT NULL,
-                to_name_short TEXT NULL,
-                hop1_id TEXT NULL, hop1_name TEXT NULL, hop1_name_short TEXT NULL, hop1_snr REAL NULL, hop1_rssi REAL NULL,
-                hop2_id TEXT NULL, hop2_name TEXT NULL, hop2_name_short TEXT NULL, hop2_snr REAL NULL, hop2_rssi REAL NULL,
-                hop3_id TEXT NULL, hop3_name TEXT NULL, hop3_name_short TEXT NULL, hop3_snr REAL NULL, hop3_rssi REAL NULL,
-                hop4_id TEXT NULL, hop4_name TEXT NULL, hop4_name_short TEXT NULL, hop4_snr REAL NULL, hop4_rssi REAL NULL,
-                hop5_id TEXT NULL, hop5_name TEXT NULL, hop5_name_short TEXT NULL, hop5_snr REAL NULL, hop5_rssi REAL NULL,
-                hop6_id TEXT NULL, hop6_name TEXT NULL, hop6_name_short TEXT NULL, hop6_snr REAL NULL, hop6_rssi REAL NULL,
-                hop7_id TEXT NULL, hop7_name TEXT NULL, hop7_name_short TEXT NULL, hop7_snr REAL NULL, hop7_rssi REAL NULL,
-                hop_return1_id TEXT NULL, hop_return1_name TEXT NULL, hop_return1_name_short TEXT NULL, hop_return1_snr REAL NULL, hop_return1_rssi REAL NULL,
-                hop_return2_id TEXT NULL, hop_return2_name TEXT NULL, hop_return2_name_short TEXT NULL, hop_return2_snr REAL NULL, hop_return2_rssi REAL NULL,
-                hop_return3_id TEXT NULL, hop_return3_name TEXT NULL, hop_return3_name_short TEXT NULL, hop_return3_snr REAL NULL, hop_return3_rssi REAL NULL,
-                hop_return4_id TEXT NULL, hop_return4_name TEXT NULL, hop_return4_name_short TEXT NULL, hop_return4_snr REAL NULL, hop_return4_rssi REAL NULL,
-                hop_return5_id TEXT NULL, hop_return5_name TEXT NULL, hop_return5_name_short TEXT NULL, hop_return5_snr REAL NULL, hop_return5_rssi REAL NULL,
-                hop_return6_id TEXT NULL, hop_return6_name TEXT NULL, hop_return6_name_short TEXT NULL, hop_return6_snr REAL NULL, hop_return6_rssi REAL NULL,
-                hop_return7_id TEXT NULL, hop_return7_name TEXT NULL, hop_return7_name_short TEXT NULL, hop_return7_snr REAL NULL, hop_return7_rssi REAL NULL
-            );
-            INSERT INTO traces_new (id, "from", "to", data_raw)
-            SELECT id, "from", "to", data_raw FROM traces;
-            DROP TABLE traces;
-            ALTER TABLE traces_new RENAME TO traces;
-            COMMIT;
+            INSERT INTO tasks_control (name, last_run_at, extra) VALUES (?, datetime('now', 'localtime'), ?)
+            ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at, extra = excluded.extra
+            """,
+            (TRACES_REBUILD_TASK, extra),
+        )
+        conn.commit()
+
+    existing = {r[1] for r in conn.execute('PRAGMA table_info(traces)').fetchall()}
+    columns = ', '.join(name for name, _ in TRACES_COLUMNS if name.strip('"') in existing)
+    ddl = ', '.join(f'{name} {decl}' for name, decl in TRACES_COLUMNS)
+    conn.execute(f'CREATE TABLE IF NOT EXISTS traces_new ({ddl})')
+    conn.commit()
+
+    total = conn.execute('SELECT COUNT(*) FROM traces WHERE id > ?', (progress['last'],)).fetchone()[0]
+    copied = 0
+    log_p(f"Migración: reconstruyendo traces ({total} filas por copiar, lotes de {int(chunk_size)})")
+    while True:
+        bounds = conn.execute(
+            'SELECT MAX(id), COUNT(*) FROM (SELECT id FROM traces WHERE id > ? ORDER BY id LIMIT ?)',
+            (progress['last'], int(chunk_size)),
+        ).fetchone()
+        if not bounds[1]:
+            break
+        conn.execute(
+            f'INSERT OR REPLACE INTO traces_new ({columns}) SELECT {columns} FROM traces WHERE id > ? AND id <= ?',
+            (progress['last'], bounds[0]),
+        )
+        progress['last'] = bounds[0]
+        copied += bounds[1]
+        save(json.dumps(progress))
+        log_p(f"Migración traces: {copied}/{total} filas copiadas")
+
+    # Sustitución: lo insertado o actualizado por otros procesos durante la copia
+    conn.execute('BEGIN IMMEDIATE')
+    recent = 'id > ?'
+    params: Tuple = (progress['last'],)
+    if 'updated_at' in existing:
+        recent += ' OR updated_at >= ?'
+        params += (progress['started'],)
+    if 'status' in existing:
+        recent += " OR status = 'pending'"
+    conn.execute(f'INSERT OR REPLACE INTO traces_new ({columns}) SELECT {columns} FROM traces WHERE {recent}', params)
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'traces'").fetchone()
+    conn.execute('DROP TABLE traces')
+    conn.execute('ALTER TABLE traces_new RENAME TO traces')
+    if seq is not None:
+        # Los ids no se reutilizan aunque se hubieran borrado las últimas filas
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'traces'", (seq[0],))
+    conn.commit()
+    save('done')
+    log_p(f"Migración traces: tabla reconstruida ({copied} filas)")
+    return copied
+
+
+# Marca de la reconstrucción de encuesta_recuento ('done' al terminar)
+POLL_TALLY_MIGRATION_TASK = 'migration_poll_tallies'
+
+
+def _backfill_poll_tallies(conn: sqlite3.Connection) -> int:
+    """Reconstruye encuesta_recuento desde encuesta_votos (una única vez).
+
+    Las encuestas tienen pocos votos, así que basta una transacción. Devuelve
+    el número de votos contados.
+    """
+    row = conn.execute(
+        'SELECT extra FROM tasks_control WHERE name = ?', (POLL_TALLY_MIGRATION_TASK,)
+    ).fetchone()
+    if row and row[0] == 'done':
+        return 0
+    conn.execute('DELETE FROM encuesta_recuento')
+    conn.execute(
+        'INSERT INTO encuesta_recuento (encuesta_id, option_index, count) '
+        'SELECT encuesta_id, option_index, COUNT(*) FROM encuesta_votos GROUP BY encuesta_id, option_index'
+    )
+    counted = conn.execute('SELECT COALESCE(SUM(count), 0) FROM encuesta_recuento').fetchone()[0]
+    conn.execute(
+        """
+        INSERT INTO tasks_control (name, last_run_at, extra) VALUES (?, datetime('now', 'localtime'), 'done')
+        ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at, extra = 'done'
+        """,
+        (POLL_TALLY_MIGRATION_TASK,),
+    )
+    conn.commit()
+    return int(counted)
+
+
+# Progreso del volcado de commands_sent a command_rollup_*: tasks_control.extra
+# guarda JSON {"last": último id agregado, "cutoff": último id anterior a los
+# agregados} o 'done'. Los comandos con id > cutoff ya los agrega log_command.
+COMMAND_ROLLUP_MIGRATION_TASK = 'migration_command_rollups'
+COMMAND_ROLLUP_MIGRATION_CHUNK = 5000
+
+
+def _backfill_command_rollups(conn: sqlite3.Connection, chunk_size: int = COMMAND_ROLLUP_MIGRATION_CHUNK) -> int:
+    """Agrega el histórico de commands_sent en command_rollup_hourly/_total.
+
+    Reanudable: procesa `chunk_size` comandos por transacción y guarda el
+    progreso en tasks_control. Devuelve el número de comandos agregados.
+    """
+    row = conn.execute(
+        'SELECT extra FROM tasks_control WHERE name = ?', (COMMAND_ROLLUP_MIGRATION_TASK,)
+    ).fetchone()
+    if row and row[0] == 'done':
+        return 0
+    if row and row[0]:
+        progress = json.loads(row[0])
+    else:
+        cutoff = conn.execute('SELECT MAX(id) FROM commands_sent').fetchone()[0] or 0
+        progress = {'last': 0, 'cutoff': int(cutoff)}
+
+    def save(extra: str) -> None:
+        conn.execute(
             """
+            INSERT INTO tasks_control (name, last_run_at, extra) VALUES (?, datetime('now', 'localtime'), ?)
+            ON CONFLICT(name) DO UPDATE SET last_run_at = excluded.last_run_at, extra = excluded.extra
+            """,
+            (COMMAND_ROLLUP_MIGRATION_TASK, extra),
         )
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_traces_status_created ON traces(status, created_at)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_traces_to_updated ON traces("to", updated_at)')
         conn.commit()
 
-    # Asegurar columnas de enriquecimiento en traces (idempotente, para BDs existentes sin rebuild)
-    enrichment_cols = [
-        'hops', 'hops_back', 'to_name', 'to_name_short',
-    ] + [
-        f'hop{i}_id' for i in range(1, 8)
-    ] + [
-        f'hop{i}_name' for i in range(1, 8)
-    ] + [
-        f'hop{i}_name_short' for i in range(1, 8)
-    ] + [
-        f'hop{i}_snr' for i in range(1, 8)
-    ] + [
-        f'hop{i}_rssi' for i in range(1, 8)
-    ] + [
-        f'hop_return{i}_id' for i in range(1, 8)
-    ] + [
-        f'hop_return{i}_name' for i in range(1, 8)
-    ] + [
-        f'hop_return{i}_name_short' for i in range(1, 8)
-    ] + [
-        f'hop_return{i}_snr' for i in range(1, 8)
-    ] + [
-        f'hop_return{i}_rssi' for i in range(1, 8)
-    ]
+    done = 0
+    while progress['last'] < progress['cutoff']:
+        start = progress['last']
+        end = min(start + int(chunk_size), progress['cutoff'])
+        conn.execute(
+            """
+            INSERT INTO command_rollup_hourly (hour, command, node_id, count, last_at, last_id)
+            SELECT (created_ts / 3600) * 3600, command, COALESCE(node_id, ''), COUNT(*), MAX(created_at), MAX(id)
+            FROM commands_sent
+            WHERE id > ? AND id <= ? AND command IS NOT NULL AND created_ts IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT(hour, command, node_id) DO UPDATE SET
+                count = count + excluded.count,
+                last_at = MAX(COALESCE(last_at, ''), excluded.last_at),
+                last_id = MAX(COALESCE(last_id, 0), excluded.last_id)
+            """,
+            (start, end),
+        )
+        conn.execute(
+            """
+            INSERT INTO command_rollup_total (node_id, command, count, last_at, last_id)
+            SELECT COALESCE(node_id, ''), command, COUNT(*), MAX(created_at), MAX(id)
+            FROM commands_sent
+            WHERE id > ? AND id <= ? AND command IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT(node_id, command) DO UPDATE SET
+                count = count + excluded.count,
+                last_at = MAX(COALESCE(last_at, ''), excluded.last_at),
+                last_id = MAX(COALESCE(last_id, 0), excluded.last_id)
+            """,
+            (start, end),
+        )
+        done += conn.execute(
+            'SELECT COUNT(*) FROM commands_sent WHERE id > ? AND id <= ? AND command IS NOT NULL', (start, end)
+        ).fetchone()[0]
+        progress['last'] = end
+        save(json.dumps(progress))
+
+    save('done')
+    return done
+
+
+# ---------- Histórico en un fichero aparte (DB_HISTORY_SPLIT) ----------
+# Las tablas frías viven en <bd>_history<ext> (p. ej. database_history.sql),
+# adjuntado como esquema `history` en cada conexión. Los nombres sin esquema
+# se resuelven primero en main y luego en history, así que las consultas de
+# Models/Database.py no cambian. Cada fichero tiene su propio lock de
+# escritura: insertar histórico (cron, log de comandos) no bloquea la cola.
+HISTORY_SCHEMA = 'history'
+HISTORY_TABLES = (
+    'commands_sent',
+    'command_rollup_hourly',
+    'command_rollup_total',
+    'pings',
+    'aemet_weather',
+    'tides',
+)
+# Versión del esquema del fichero de histórico (su propio PRAGMA user_version)
+HISTORY_VERSION = 1
+HISTORY_SPLIT_CHUNK = 5000
+
+
+def history_path(db_path: Union[str, Path]) -> Path:
+    """Fichero de histórico asociado a una BD: database.sql -> database_history.sql."""
+    path = Path(db_path)
+    return path.with_name(f'{path.stem}_history{path.suffix}')
+
+
+def history_split_enabled() -> bool:
+    """True si env.DB_HISTORY_SPLIT pide separar el histórico."""
+    try:
+        import env as _env
+    except ImportError:
+        return False
+    return bool(getattr(_env, 'DB_HISTORY_SPLIT', False))
+
 
-    for col in enrichment_cols:
-        if not _has_column('traces', col):
-            # Tipos según sufijo
-            if col.endswith('_snr') or col.endswith('_rssi'):
-                conn.execute(f'ALTER TABLE traces ADD COLUMN {col} REAL NULL')
-            else:
-                conn.execute(f'ALTER TABLE traces ADD COLUMN {col} TEXT NULL')
+def attach_history(conn: sqlite3.Connection, db_path: Union[str, Path]) -> bool:
+    """Adjunta el fichero de histórico como `history` si existe.
+
+    Se adjunta siempre que el fichero exista (aunque luego se desactive
+    DB_HISTORY_SPLIT): sus tablas ya no están en el fichero principal.
+    """
+    path = history_path(db_path)
+    if not path.exists():
+        return False
+    if not any(r[1] == HISTORY_SCHEMA for r in conn.execute('PRAGMA database_list')):
+        conn.execute(f'ATTACH DATABASE ? AS {HISTORY_SCHEMA}', (str(path),))
+    return True
+
+
+def table_schema(conn: sqlite3.Connection, table: str) -> str:
+    """Esquema ('main' o 'history') en el que está la tabla."""
+    if conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+        return 'main'
+    try:
+        found = conn.execute(
+            f"SELECT 1 FROM {HISTORY_SCHEMA}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # history no adjuntado
+        return 'main'
+    return HISTORY_SCHEMA if found else 'main'
+
+
+def _copy_to_history(conn: sqlite3.Connection, table: str, rowid: bool, limit: Optional[int] = None) -> int:
+    """Copia a history las filas de main.<table> que aún no están (por rowid si lo hay)."""
+    main_cols = [r[1] for r in conn.execute(f'PRAGMA main.table_info({table})')]
+    hist_cols = {r[1] for r in conn.execute(f'PRAGMA {HISTORY_SCHEMA}.table_info({table})')}
+    cols = ', '.join(f'"{c}"' for c in main_cols if c in hist_cols)
+    sql = f'INSERT OR IGNORE INTO {HISTORY_SCHEMA}.{table} ({cols}) SELECT {cols} FROM main.{table}'
+    if not rowid:
+        return conn.execute(sql).rowcount
+    last = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {HISTORY_SCHEMA}.{table}').fetchone()[0]
+    sql += ' WHERE rowid > ? ORDER BY rowid'
+    if limit is not None:
+        return conn.execute(sql + ' LIMIT ?', (last, int(limit))).rowcount
+    return conn.execute(sql, (last,)).rowcount
+
+
+def _move_history_tables(conn: sqlite3.Connection, path: Path, chunk_size: int = HISTORY_SPLIT_CHUNK) -> int:
+    """Mueve HISTORY_TABLES de main al fichero de histórico.
+
+    Crea cada tabla (con sus índices) en el histórico con el mismo SQL que en
+    main y copia las filas por lotes de `chunk_size` (un commit por lote; se
+    reanuda desde el último rowid copiado). Al final, en una transacción
+    IMMEDIATE, copia lo insertado mientras tanto y los agregados, conserva el
+    contador AUTOINCREMENT y borra las tablas de main. Devuelve filas movidas.
+    """
+    pending = []
+    for table in HISTORY_TABLES:
+        row = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if row is None:
+            continue
+        rowid = 'WITHOUT ROWID' not in row[0].upper()
+        pending.append((table, rowid))
+        if conn.execute(
+            f"SELECT 1 FROM {HISTORY_SCHEMA}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone():
+            continue
+        ddl = [row[0]] + [
+            r[0] for r in conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (table,),
+            )
+        ]
+        # Mismo SQL que en main, ejecutado directamente en el fichero de histórico
+        with closing(sqlite3.connect(path, timeout=10.0)) as hconn:
+            for sql in ddl:
+                hconn.execute(sql)
+            hconn.commit()
+
+    moved = 0
+    for table, rowid in pending:
+        if not rowid:
+            continue
+        total = conn.execute(f'SELECT COUNT(*) FROM main.{table}').fetchone()[0]
+        if total:
+            log_p(f"Histórico: moviendo {table} ({total} filas, lotes de {int(chunk_size)})")
+        while True:
+            copied = _copy_to_history(conn, table, rowid, limit=chunk_size)
+            conn.commit()
+            if copied <= 0:
+                break
+            moved += copied
+            log_p(f"Histórico {table}: {moved} filas copiadas")
+
+    if not pending:
+        return moved
+    conn.execute('BEGIN IMMEDIATE')
+    for table, rowid in pending:
+        moved += max(0, _copy_to_history(conn, table, rowid))
+        seq = conn.execute('SELECT seq FROM main.sqlite_sequence WHERE name = ?', (table,)).fetchone()
+        if seq is not None:
+            updated = conn.execute(
+                f'UPDATE {HISTORY_SCHEMA}.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (seq[0], table)
+            ).rowcount
+            if not updated:
+                conn.execute(f'INSERT INTO {HISTORY_SCHEMA}.sqlite_sequence (name, seq) VALUES (?, ?)', (table, seq[0]))
+        conn.execute(f'DROP TABLE main.{table}')
     conn.commit()
+    log_p(f"Histórico: {len(pending)} tablas en {path.name} ({moved} filas movidas)")
+    return moved
 
 
-def ensure_database(db_path: Optional[str | Path] = None) -> Path:
-    """Asegura que la BD existe y aplica el esquema (idempotente)."""
+def _ensure_history_archive(conn: sqlite3.Connection) -> None:
+    """Tablas del histórico para los traces archivados (Database.archive_traces)."""
+    columns = ', '.join(
+        f'{name} {"INTEGER PRIMARY KEY" if name == "id" else decl}' for name, decl in TRACES_COLUMNS
+    )
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {HISTORY_SCHEMA}.traces_archive ({columns})')
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {HISTORY_SCHEMA}.trace_hops_archive (
+            trace_id INTEGER NOT NULL,
+            direction TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            node_id TEXT NULL,
+            snr REAL NULL,
+            rssi REAL NULL,
+            PRIMARY KEY (trace_id, direction, idx)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {HISTORY_SCHEMA}.idx_traces_archive_to ON traces_archive("to", updated_ts)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {HISTORY_SCHEMA}.idx_traces_archive_updated ON traces_archive(updated_ts)')
+    conn.execute(
+        f'CREATE INDEX IF NOT EXISTS {HISTORY_SCHEMA}.idx_trace_hops_archive_node ON trace_hops_archive(node_id, trace_id)'
+    )
+    conn.commit()
+
+
+def ensure_history(conn: sqlite3.Connection, db_path: Union[str, Path], force: bool = False) -> Path:
+    """Crea el fichero de histórico y le mueve las tablas frías (idempotente).
+
+    Un histórico al día se reconoce con su PRAGMA user_version (HISTORY_VERSION).
+    Con force=True se repite todo: las tablas que las migraciones hayan vuelto
+    a crear en main se fusionan con las del histórico.
+    """
+    path = history_path(db_path)
+    if not path.exists():
+        with closing(sqlite3.connect(path)) as hconn:
+            # auto_vacuum solo se puede fijar antes de crear tablas
+            hconn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            hconn.execute('PRAGMA journal_mode = WAL')
+    attach_history(conn, db_path)
+    version = int(conn.execute(f'PRAGMA {HISTORY_SCHEMA}.user_version').fetchone()[0])
+    if version >= HISTORY_VERSION and not force:
+        return path
+    _move_history_tables(conn, path)
+    _ensure_history_archive(conn)
+    ensure_mirror_triggers(conn)
+    conn.execute(f'PRAGMA {HISTORY_SCHEMA}.user_version = {int(HISTORY_VERSION)}')
+    conn.commit()
+    return path
+
+
+# Migraciones ordenadas: (versión, nombre, función). La versión aplicada se
+# guarda en PRAGMA user_version, así una BD al día se reconoce con una sola
+# lectura. Cada paso es idempotente (BDs anteriores a user_version empiezan en
+# 0 y los repiten todos) y los pesados guardan su progreso en tasks_control
+# para reanudarse. Los cambios de esquema nuevos se añaden como paso nuevo al
+# final, nunca modificando uno ya publicado. (Las funciones se resuelven al
+# llamar para poder sustituirlas en los tests.)
+MIGRATIONS: Tuple[Tuple[int, str, Callable[[sqlite3.Connection], None]], ...] = (
+    (1, 'base_schema', lambda conn: _execute_schema(conn)),
+    (2, 'trace_hops', lambda conn: _migrate_trace_hops(conn)),
+    (3, 'traces_table', lambda conn: _migrate_traces_table(conn)),
+    (4, 'epoch_columns', lambda conn: _migrate_epoch_columns(conn)),
+    (5, 'command_rollups', lambda conn: _backfill_command_rollups(conn)),
+    (6, 'poll_tallies', lambda conn: _backfill_poll_tallies(conn)),
+    (7, 'mirror_triggers', lambda conn: ensure_mirror_triggers(conn)),
+    (8, 'outbox_v2', lambda conn: _migrate_outbox_v2(conn)),
+    (9, 'trace_rtt', lambda conn: _migrate_trace_rtt(conn)),
+    (10, 'trace_routes_backfill', lambda conn: _backfill_trace_routes(conn)),
+    (11, 'trace_state_recency', lambda conn: _migrate_trace_state_recency(conn)),
+    (12, 'chiste_dm_bag', lambda conn: _drop_sender_chiste_bags(conn)),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    """Versión de esquema aplicada (PRAGMA user_version)."""
+    return int(conn.execute('PRAGMA user_version').fetchone()[0])
+
+
+def migrate(conn: sqlite3.Connection, force: bool = False) -> int:
+    """Aplica en orden las migraciones pendientes y devuelve la versión final.
+
+    Con force=True se repiten todas (son idempotentes). user_version se sube
+    tras cada paso, así un proceso interrumpido continúa por el siguiente.
+    """
+    current = schema_version(conn)
+    if current > SCHEMA_VERSION:
+        log_p(f"La BD tiene esquema v{current}, más nuevo que este código (v{SCHEMA_VERSION})", level="WARN")
+        return current
+    for version, name, step in MIGRATIONS:
+        if version <= current and not force:
+            continue
+        start = time.perf_counter()
+        step(conn)
+        conn.commit()
+        if version > current:
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        log_p(f"Migración v{version} ({name}) aplicada en {(time.perf_counter() - start) * 1000:.0f} ms")
+    return max(current, SCHEMA_VERSION)
+
+
+# Rutas ya verificadas en este proceso -> (st_dev, st_ino) del fichero.
+# Evita incluso leer user_version en cada Database() (Node, comandos...).
+_VERIFIED: Dict[str, Tuple[int, int]] = {}
+
+
+def _file_key(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+        return st.st_dev, st.st_ino
+    except OSError:
+        return None
+
+
+def ensure_database(db_path: Optional[str | Path] = None, force: bool = False) -> Path:
+    """Asegura que la BD existe y tiene el esquema al día.
+
+    Si PRAGMA user_version ya es SCHEMA_VERSION no se ejecuta nada más; si no,
+    se aplican las migraciones pendientes. Con el histórico separado
+    (DB_HISTORY_SPLIT) se comprueba también su versión (ensure_history). En
+    el mismo proceso y fichero (inodo) las siguientes llamadas vuelven sin
+    abrir la BD. Con force=True se repiten todas las migraciones.
+    """
     target = Path(db_path) if db_path else DATABASE_FILE
+    key = str(target)
+    if not force and key in _VERIFIED and _VERIFIED[key] == _file_key(target):
+        return target
+
     if not target.exists():
         target.parent.mkdir(parents=True, exist_ok=True)
-        # Crear archivo vacío primero
-        with sqlite3.connect(target):
-            pass
 
-    # Siempre aplicar esquema para asegurar tablas nuevas
-    with sqlite3.connect(target) as conn:
-        _execute_schema(conn)
+    with closing(sqlite3.connect(target)) as conn:
+        # Con el histórico separado, las migraciones ven también sus tablas
+        split = history_split_enabled() or history_path(target).exists()
+        if split:
+            attach_history(conn, target)
+        if force or schema_version(conn) < SCHEMA_VERSION:
+            migrate(conn, force=force)
+        if split:
+            ensure_history(conn, target, force=force)
 
+    _VERIFIED[key] = _file_key(target)
     return target
 
 
@@ -6,6 +6,7 @@ from typing import Optional
 from Models.Database import Database
 from Models.Api import Api
 from Models.Aemet import Aemet
+from Models.TraceRoute import enqueue_next_traces
 from functions import log_p
 import env
 
@@ -136,7 +137,10 @@ def send_trace() -> None:
     """Encola la ejecución de un traceroute para que lo procese el proceso principal.
 
     Restricciones:
-    - Throttle global: 1 intento cada TRACES_INTERVAL minutos medido con traces.updated_at del último procesado
+    - Throttle global: 1 tanda cada TRACES_INTERVAL minutos medido con traces.updated_at del último procesado.
+      Es el ritmo de reserva: mientras haya presupuesto de aire (TX_AIRTIME_BUDGET),
+      main.loop() repone cada trace completado sin esperar a este intervalo
+    - Como mucho TRACE_MAX_IN_FLIGHT traces pendientes a la vez (por defecto 1)
     - Ventanas por nodo configurables: TRACES_RELOAD_INTERVAL (éxito) y TRACES_RETRY_INTERVAL (error)
     """
     # Permitir deshabilitar traces por configuración
@@ -151,10 +155,12 @@ def send_trace() -> None:
     if cleaned > 0:
         log_p(f"[cron] send_trace: expiradas {cleaned} trazas pendientes obsoletas")
 
-    # Si ya hay una traza pendiente en cola siendo procesada por main.py, no encolar otra
-    pending = db.get_next_pending_trace()
-    if pending:
-        log_p(f"[cron] send_trace: omitido (ya hay un trace pendiente en proceso: id={pending['id']})")
+    # main.py procesa hasta TRACE_MAX_IN_FLIGHT traces a la vez: no encolar más
+    # de los que caben
+    max_in_flight = max(1, int(getattr(env, 'TRACE_MAX_IN_FLIGHT', 1) or 1))
+    pending_count = db.count_pending_traces()
+    if pending_count >= max_in_flight:
+        log_p(f"[cron] send_trace: omitido (ya hay {pending_count} trace(s) pendiente(s) en proceso)")
         return
 
     # Throttle global 5 minutos basado en el último trace realizado (updated_at)
@@ -170,36 +176,10 @@ def send_trace() -> None:
         except Exception:
             pass
 
-    # Seleccionar próximo nodo candidato respetando configuración y prioridad a routers cada 6h
-    hops_limit = int(getattr(env, 'TRACES_HOPS', 2) or 2)
-    reload_hours = int(getattr(env, 'TRACES_RELOAD_INTERVAL', 72) or 72)
-    router_reload_hours = int(getattr(env, 'ROUTER_TRACE_INTERVAL_HOURS', 6) or 6)
-    router_max_hops = int(getattr(env, 'ROUTER_MAX_HOPS', 2) or 2)
-    router_retry_short_hours = int(getattr(env, 'ROUTER_RETRY_SHORT_HOURS', 1) or 1)
-    router_max_retries = int(getattr(env, 'ROUTER_MAX_RETRIES', 5) or 5)
-    router_retry_long_hours = int(getattr(env, 'ROUTER_RETRY_LONG_HOURS', 24) or 24)
-    retry_hours = int(getattr(env, 'TRACES_RETRY_INTERVAL', 24) or 24)
-
-    routers_cfg = getattr(env, 'ROUTER_NODES', None) or getattr(env, 'ROUTERS_LIST', None) or []
-    if isinstance(routers_cfg, str):
-        routers_cfg = [r.strip() for r in routers_cfg.split(',') if r.strip()]
-
-    node_id = db.get_next_node_to_trace(
-        hops_limit=hops_limit,
-        reload_hours=reload_hours,
-        router_reload_hours=router_reload_hours,
-        router_max_hops=router_max_hops,
-        router_retry_short_hours=router_retry_short_hours,
-        router_max_retries=router_max_retries,
-        router_retry_long_hours=router_retry_long_hours,
-        retry_hours=retry_hours,
-        router_identifiers=routers_cfg,
-    )
-    if node_id:
-        # Encolar petición en la propia tabla traces (status='pending')
-        trace_id = db.enqueue_trace(node_id)
-        log_p(f"[cron] send_trace: encolado trace id={trace_id} para nodo {node_id}")
-    else:
+    # Seleccionar próximos nodos candidatos respetando configuración y
+    # prioridad a routers cada 6h
+    if not enqueue_next_traces(db, max_in_flight - pending_count):
+        hops_limit = int(getattr(env, 'TRACES_HOPS', 2) or 2)
         log_p(f"[cron] send_trace: ningún nodo candidato (≤{hops_limit} hops, no MQTT, ventanas cumplidas)")
 
 
@@ -728,6 +708,7 @@ def run_all():
     weather_forecast_aemet()
     tides_fetch()
     encuestas_expire()
+    db_retention()
     log_p("[cron] run_all: fin")
 
 
@@ -745,5 +726,70 @@ def encuestas_expire() -> None:
         log_p(f"[cron] encuestas_expire: error: {e}", level="WARN")
 
 
+def db_retention() -> None:
+    """Purga por lotes el histórico caducado y compacta la BD.
+
+    - Cadencia: DB_RETENTION_INTERVAL (por defecto 60 min).
+    - Días por tabla: Database.RETENTION_DEFAULTS + env.DB_RETENTION_DAYS
+      (None = conservar siempre).
+    - Lotes de DB_RETENTION_BATCH filas, como mucho DB_RETENTION_MAX_BATCHES
+      por tabla y pasada: nunca retiene el lock de escritura mucho tiempo.
+    - DB_ARCHIVE_DIR: si se define, copia las filas a JSONL comprimido antes.
+    - Con el histórico separado (DB_HISTORY_SPLIT), antes mueve a
+      history.traces_archive los traces de más de DB_HOT_TRACES_DAYS días.
+    """
+    import json
+    import time
+
+    db = Database()
+    task_name = 'db_retention'
+
+    period_min = int(getattr(env, 'DB_RETENTION_INTERVAL', 60) or 60)
+    if not _should_run(db, task_name, period_min):
+        log_p(f"[cron] db_retention: omitido (cooldown {period_min}min)")
+        return
+
+    report = {}
+    try:
+        days_cfg = dict(Database.RETENTION_DEFAULTS)
+        days_cfg.update(getattr(env, 'DB_RETENTION_DAYS', None) or {})
+        batch = int(getattr(env, 'DB_RETENTION_BATCH', 500) or 500)
+        max_batches = int(getattr(env, 'DB_RETENTION_MAX_BATCHES', 20) or 20)
+        archive_dir = getattr(env, 'DB_ARCHIVE_DIR', None) or None
+
+        deleted = {}
+        now = int(time.time())
+        archived = 0
+        hot_days = getattr(env, 'DB_HOT_TRACES_DAYS', 30)
+        if hot_days:
+            try:
+                archived = db.archive_traces(now - int(hot_days) * 86400, batch_size=batch,
+                                             max_batches=max_batches)
+            except Exception as e:
+                log_p(f"[cron] db_retention: error archivando traces: {e}", level="WARN")
+        for rule, days in days_cfg.items():
+            if not days or rule not in Database.RETENTION_RULES:
+                continue
+            try:
+                n = db.purge_expired(rule, now - int(days) * 86400, batch_size=batch,
+                                     max_batches=max_batches, archive_dir=archive_dir)
+            except Exception as e:
+                log_p(f"[cron] db_retention: error purgando {rule}: {e}", level="WARN")
+                continue
+            if n:
+                deleted[rule] = n
+
+        stats = db.compact(convert=bool(getattr(env, 'DB_VACUUM_CONVERT', False)))
+        report = {'deleted': deleted, 'archived_traces': archived, **stats}
+        log_p(f"[cron] db_retention: borradas {sum(deleted.values())} filas {deleted or ''}, "
+              f"{archived} traces al histórico; "
+              f"páginas {stats['pages_before']} -> {stats['pages_after']} "
+              f"(recuperadas {stats['reclaimed_pages']}, libres {stats['freelist_after']})")
+    except Exception as e:
+        log_p(f"[cron] db_retention: excepción general: {e}", level="WARN")
+    finally:
+        db.set_task_run(task_name, extra=json.dumps(report) if report else None)
+
+
 if __name__ == '__main__':
     run_all()
\ No newline at end of file
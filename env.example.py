@@ -4,13 +4,82 @@ DEBUG = False
 ## Interfaz serial
 SERIAL_DEVICE_PATH = '/dev/cu.usbserial-212110'
 
+## Comandos: ejecución fuera del hilo de recepción (Models/CommandExecutor.py)
+COMMAND_WORKERS = 2                # Comandos ejecutándose a la vez (0 = en el hilo de recepción, modo antiguo)
+COMMAND_QUEUE_MAX = 50             # Comandos en espera a partir de los cuales se descartan los nuevos
+
+## Bucle principal (main.loop): avisos por socket en vez de sondeo fijo (Models/Wakeup.py)
+MAIN_WAKEUP_SOCKET = '/tmp/meshassistant_wakeup.sock'  # Socket Unix DGRAM que despierta al bucle
+MAIN_LOOP_INTERVAL = 5             # Segundos máximos de espera: heartbeat, volcados y checkpoints
+MAIN_LOOP_POLL_INTERVAL = 30       # Segundos entre revisiones completas de colas sin aviso (respaldo)
+
+## Radio: planificador de transmisión (Models/TxScheduler.py)
+TX_MIN_GAP = 2.5                   # Segundos mínimos entre dos transmisiones (sustituye a OUTBOX_SEND_GAP)
+TX_MAX_GAP = 15.0                  # Pausa máxima con el canal muy ocupado
+TX_CHANNEL_UTIL_BUSY = 25.0        # % de channel_util del nodo local a partir del cual la pausa crece en proporción
+TX_AIR_UTIL_BUSY = 7.5             # % de air_util_tx del nodo local a partir del cual la pausa crece en proporción
+TX_AIRTIME_BUDGET = 5.0            # % de air_util_tx hasta el que el bucle repone traceroutes sin esperar al cron (0 = nunca)
+
+## Base de datos: volcado diferido (write-behind) del estado de nodos
+NODE_FLUSH_INTERVAL = 15           # Segundos entre volcados de cambios de nodos a SQLite
+NODE_FLUSH_MAX_DIRTY = 100         # Nodos pendientes que fuerzan un volcado inmediato
+
+## Base de datos: modo de almacenamiento (Models/Storage.py, Models/WriteBatcher.py)
+DB_STORAGE_MODE = 'default'        # 'sdcard': checkpoints WAL controlados y comandos/pings agrupados
+DB_WAL_AUTOCHECKPOINT = None       # Páginas de WAL que disparan el checkpoint automático (None = según modo)
+DB_JOURNAL_SIZE_LIMIT = None       # Bytes a los que se trunca el WAL tras un checkpoint (None = según modo)
+DB_MMAP_SIZE = None                # Bytes de E/S mapeada en memoria (None = según modo)
+DB_CHECKPOINT_INTERVAL = None      # Segundos entre checkpoints PASSIVE desde main.loop (None = según modo)
+DB_WRITE_BATCH_INTERVAL = None     # Segundos entre volcados agrupados de comandos y pings (None = según modo, 0 = no agrupar)
+DB_WRITE_BATCH_MAX = 200           # Filas pendientes que fuerzan un volcado inmediato
+
+## Base de datos: histórico en un fichero aparte (create_db.ensure_history)
+DB_HISTORY_SPLIT = False           # True: comandos, pings, clima, mareas y traces antiguos en database_history.sql (ATTACH)
+DB_HOT_TRACES_DAYS = 30            # Con el histórico separado: días que los traces siguen en la BD principal
+
+## Base de datos: réplica en RAM de tablas de lectura frecuente (Models/MemoryMirror.py)
+DB_MEMORY_MIRROR = False           # True: nodes, tasks_control y último clima/mareas se leen desde RAM
+
+## Base de datos: perfilado de consultas (Models/QueryProfiler.py)
+DB_PROFILE = False                 # True: mide llamadas, latencias, filas y esperas de lock por método
+DB_SLOW_QUERY_MS = 200             # Umbral (ms) del registro de consultas lentas
+DB_PROFILE_DIR = '/tmp/meshassistant_profile'  # Resúmenes por proceso (JSON) y slow_queries.log
+DB_PROFILE_DUMP_INTERVAL = 60      # Segundos entre volcados del resumen de cada proceso
+
+## Base de datos: retención del histórico (cron_tasks.db_retention)
+# Días que se conserva cada tabla (None = siempre). Las claves que falten usan
+# el valor por defecto de Database.RETENTION_DEFAULTS.
+DB_RETENTION_DAYS = {
+    'pings': None,
+    'commands_sent': None,         # /stats y la auditoría usan los agregados command_rollup_*
+    'traces': None,                # traces 'done'
+    'traces_error': 30,            # traces fallidos
+    'aemet': None,                 # alertas ya publicadas
+    'aemet_weather': 30,
+    'tides': 30,
+    'outbox': 30,                  # mensajes enviados, con error o caducados
+}
+DB_RETENTION_INTERVAL = 60         # Minutos entre pasadas de purga
+DB_RETENTION_BATCH = 500           # Filas por lote (una transacción corta por lote)
+DB_RETENTION_MAX_BATCHES = 20      # Lotes máximos por tabla y pasada
+DB_ARCHIVE_DIR = None              # Carpeta para archivar lo borrado (JSONL .gz); None = no archivar
+DB_VACUUM_CONVERT = False          # True: pasa una BD antigua a auto_vacuum incremental (VACUUM único)
+
+## Cola de salida (outbox) hacia la radio
+OUTBOX_TTL = 900                   # Segundos de validez de un mensaje encolado (0 = sin caducidad)
+OUTBOX_BATCH = 5                   # Mensajes reclamados y enviados por vuelta del bucle principal
+
 ## Traces (configurables por variables de entorno)
 ENABLE_TRACES = False              # Si es False, el cron no encola traces
 TRACES_HOPS = 2                    # Hops máximos permitidos para traces (<=)
-TRACES_INTERVAL = 15                # Intervalo en minutos entre traces (global)
+TRACES_INTERVAL = 15                # Intervalo en minutos entre tandas del cron (ritmo sin presupuesto de aire)
 TRACES_RETRY_INTERVAL = 24         # Horas para reintentar tras un fallo
 TRACES_RELOAD_INTERVAL = 72        # Horas para repetir nodos generales tras un éxito (3 días)
 ROUTER_TRACE_INTERVAL_HOURS = 6    # Cadencia prioritaria para routers (cada 6 horas)
+TRACE_TIMEOUT = 10                 # Segundos máximos de espera de la respuesta de un traceroute (sin bloquear el bucle); subirlo (p. ej. 40) abre el margen adaptativo
+TRACE_TIMEOUT_MIN = 10             # Plazo mínimo (s) aunque el tiempo de respuesta histórico sea menor
+TRACE_TIMEOUT_FACTOR = 3           # Plazo = este múltiplo del tiempo de respuesta histórico del nodo
+TRACE_MAX_IN_FLIGHT = 1            # Traces en vuelo a la vez (y tamaño de la tanda que encola el cron)
 
 ## Api para Chistes, habilitado solo si tiene API key
 CHISTES_API_ENABLED = False
@@ -72,4 +141,6 @@ TIDES_HWI_MIN = 60        # Solo para la estimación offline: intervalo de estab
 GATEWAY_WS_HOST = '0.0.0.0'                      # Escucha en red local
 GATEWAY_WS_PORT = 8680                           # Puerto WebSocket (868 MHz)
 GATEWAY_EVENTS_SOCKET = '/tmp/meshassistant_events.sock'  # Socket Unix DGRAM
-GATEWAY_API_TOKEN = ''                           # Opcional: token de autenticación en handshake
\ No newline at end of file
+GATEWAY_API_TOKEN = ''                           # Opcional: token de autenticación en handshake
+GATEWAY_DB_WORKERS = 3                           # Hilos dedicados a consultas SQLite (fuera del bucle asyncio)
+GATEWAY_ACTION_LIMITS = {}                       # Máx. ejecuciones simultáneas por acción, p. ej. {'get_snapshot': 2}
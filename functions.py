@@ -91,13 +91,18 @@ def reply_long(interface, metadata, text, *, max_parts: int = MESH_MAX_PARTS):
     """Responde troceando el texto en hasta `max_parts` mensajes de la malla.
 
     Reutiliza split_messages y respeta el límite de ~200 bytes de Meshtastic,
-    esperando 1 s entre partes para no saturar la radio.
+    esperando 2.5 s entre partes para no saturar la radio. Con SerialInterface
+    las partes se encolan (queue_replies) y la pausa la pone su planificador
+    de transmisión, no el worker del comando.
     """
     from time import sleep
 
     parts = split_messages(text, max_bytes=MESH_MAX_BYTES, max_parts=max_parts)
     if not parts:
         parts = [text]
+    if hasattr(interface, 'queue_replies'):
+        interface.queue_replies(parts, metadata)
+        return
     for idx, part in enumerate(parts):
         interface.reply_to_message(part, metadata)
         if idx < len(parts) - 1:
@@ -1,7 +1,17 @@
 import env
+import threading
+import time
+from functools import partial
 from time import sleep
 from functions import log_p
 from Models.SerialInterface import SerialInterface
+from Models.NodeStore import NodeStore
+from Models.Storage import StorageMonitor
+from Models.WriteBatcher import WriteBatcher
+from Models.CommandExecutor import CommandExecutor
+from Models.TraceRoute import enqueue_next_traces, trace_policy
+from Models.TxScheduler import TX_PRIORITY_ALERT
+from Models.Wakeup import WAKE_AEMET, WAKE_OUTBOX, WAKE_REASONS, WAKE_TRACE, WakeupListener
 from create_db import ensure_database
 import json
 from functions import sanitize_text
@@ -9,8 +19,157 @@ from functions import sanitize_text
 # Ruta del dispositivo serial
 SERIAL_DEVICE_PATH = env.SERIAL_DEVICE_PATH
 
-def loop():
+
+def when_all(futures, callback):
+    """Llama a callback() cuando terminan todos los Future (en el hilo del último)."""
+    futures = list(futures)
+    if not futures:
+        callback()
+        return
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(_future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(_done)
+
+
+def _outbox_done(db, interface, msg, future):
+    """Marca un mensaje de outbox al terminar su transmisión (hilo 'tx-sender')."""
+    ok = future.result()
+    try:
+        if ok:
+            db.mark_outbox_sent(msg['id'])
+        else:
+            # Vuelve a la cola sin esperar al lease (hasta OUTBOX_MAX_ATTEMPTS)
+            db.release_outbox([msg['id']], count_attempt=True)
+    except Exception as e:
+        log_p(f"[outbox] Error marcando mensaje #{msg['id']}: {e}", level="WARN")
+    if not ok or msg['text'] == db.OUTBOX_NODEINFO_TEXT:
+        return
+    try:
+        from Models.EventBroadcaster import broadcast_event
+        my_num = interface.local_node_num()
+        broadcast_event("message_rx", {
+            "outbox_id": msg['id'],
+            "from": f"!{my_num:08x}" if my_num else "local",
+            "from_name": "Bot (Local)",
+            "from_short_name": "BOT",
+            "to": msg['dest'],
+            "channel": msg['channel'],
+            "text": msg['text'],
+            "is_direct": (msg['dest'] != '^all'),
+            "is_outgoing": True,
+            "via_mqtt": False,
+        })
+    except Exception:
+        pass
+
+
+def _aemet_done(db, alert_id, handles, in_flight):
+    """Marca periodo por canal y alerta publicada al terminar todas sus partes."""
+    try:
+        sent_any = False
+        for ch, futures in handles.items():
+            if any(f.result() for f in futures):
+                sent_any = True
+                db.set_task_run(f'aemet_publish_ch_{ch}')
+        if sent_any:
+            db.aemet_mark_published(alert_id)
+    except Exception as e:
+        log_p(f"Error marcando alerta AEMET publicada: {e}", level="WARN")
+    finally:
+        in_flight.discard(alert_id)
+
+
+def _trace_finished(db, result):
+    """Guarda el resultado de un trace (TraceTracker) y avisa a la pasarela."""
+    trace_id, node_id = result['trace_id'], result['node_id']
+    from Models.EventBroadcaster import broadcast_event
+    if not result['ok']:
+        # En caso de fallo, guardar el error como texto plano en data_raw
+        error_txt = result.get('error') or 'Error'
+        log_p(f"[traceroute] Trace #{trace_id} falló: {error_txt}", level="WARN")
+        db.mark_trace_done_with_route(
+            trace_id, False,
+            text=error_txt,
+            to_name=None,
+            to_name_short=None,
+            hops=None,
+        )
+        try:
+            broadcast_event("trace_completed", {
+                "trace_id": trace_id,
+                "to": node_id,
+                "success": False,
+                "error": error_txt,
+            })
+        except Exception:
+            pass
+        return
+
+    text = result.get('text', '')
+
+    # Resolver nombres del destino
+    to_row = db.get_node(node_id)
+    to_name = (to_row or {}).get('name') if to_row else None
+    to_short = (to_row or {}).get('short_name') if to_row else None
+
+    # Saltos de ida y de regreso (sin límite) con nombres desde BD (si existen)
+    def _hops(route):
+        hops = []
+        for hop in route or []:
+            hid = hop.get('id')
+            hrow = db.get_node(hid) if hid else None
+            hops.append({
+                'id': hid,
+                'name': (hrow or {}).get('name') if hrow else None,
+                'name_short': (hrow or {}).get('short_name') if hrow else None,
+                'snr': hop.get('snr'),
+                'rssi': (hrow or {}).get('rssi') if hrow else None,
+            })
+        return hops
+
+    hops = _hops(result.get('forward'))
+    return_hops = _hops(result.get('backward'))
+
+    # Marcar trace como completado en la MISMA fila, guardando el texto en data_raw
+    db.mark_trace_done_with_route(
+        trace_id, True,
+        text=text,
+        to_name=to_name,
+        to_name_short=to_short,
+        hops=hops,
+        return_hops=return_hops,
+        rtt_ms=int(result['rtt'] * 1000) if result.get('rtt') is not None else None,
+    )
+    log_p(f"[traceroute] Trace #{trace_id} completado con éxito: {text[:60]}")
+
+    # Notificar a la pasarela WiFi
+    try:
+        broadcast_event("trace_completed", {
+            "trace_id": trace_id,
+            "to": node_id,
+            "to_name": to_name,
+            "to_name_short": to_short,
+            "success": True,
+            "hops_forward": hops,
+            "hops_backward": return_hops,
+            "raw_text": text,
+        })
+    except Exception:
+        pass
+
+
+def loop(wakeup=None):
     interface = SerialInterface(SERIAL_DEVICE_PATH)
+    wakeup = wakeup or WakeupListener()
 
     try:
         interface.connect()
@@ -19,7 +178,21 @@ def loop():
         from Models.Database import Database
         from Models.Aemet import Aemet
         db = Database()
+        db.preload_mirror()
         aemet = Aemet()
+        # Alertas AEMET encoladas en la radio y aún sin terminar de transmitir
+        aemet_in_flight = set()
+
+        # El bucle espera en `wakeup` en vez de dormir: enqueue_outbox,
+        # enqueue_trace y aemet_insert_alert lo despiertan con el motivo y solo
+        # se consulta la cola correspondiente. Cada MAIN_LOOP_POLL_INTERVAL s
+        # se revisan todas igualmente (leases caducados, ventana AEMET, avisos
+        # perdidos) y cada MAIN_LOOP_INTERVAL s se repiten heartbeat y volcados.
+        tick = float(getattr(env, 'MAIN_LOOP_INTERVAL', 5) or 5)
+        poll_interval = float(getattr(env, 'MAIN_LOOP_POLL_INTERVAL', 30) or 0)
+        last_poll = 0.0
+        last_heartbeat = 0.0
+        due = set(WAKE_REASONS)
 
         while True:
             # Reconexión ordenada si el nodo se cayó. Se hace aquí (hilo principal),
@@ -28,157 +201,91 @@ def loop():
                 sleep(2)
                 continue
 
-            # Procesar (si hay) un trace pendiente encolado por cron (en la misma tabla traces)
+            if time.monotonic() - last_poll >= poll_interval:
+                due |= WAKE_REASONS
+                last_poll = time.monotonic()
+
+            # Traces: se recogen los resultados de los que estaban en vuelo
+            # (respuesta, error de routing o plazo vencido) y, mientras haya
+            # hueco (TRACE_MAX_IN_FLIGHT), se inician los siguientes pendientes
+            # encolados por cron (en la misma tabla traces), cada uno con su
+            # plazo según el histórico. El envío no espera la respuesta. Sin
+            # pendientes, si queda presupuesto de aire (TX_AIRTIME_BUDGET) se
+            # encola aquí el siguiente candidato, sin esperar a TRACES_INTERVAL.
             try:
-                import env as _env
-                _rcfg = getattr(_env, 'ROUTER_NODES', None) or getattr(_env, 'ROUTERS_LIST', None) or []
-                if isinstance(_rcfg, str):
-                    _rcfg = [r.strip() for r in _rcfg.split(',') if r.strip()]
-
-                pending = db.get_next_pending_trace(router_identifiers=_rcfg)
-                if pending:
-                    node_id = pending.get('to')
-                    log_p(f"[traceroute] Iniciando trace #{pending['id']} hacia {node_id}")
+                interface.expire_traces()
+                finished = interface.traces.drain()
+                for result in finished:
                     try:
-                        # Ejecutar traceroute y capturar texto + hops hacia destino
-                        result = interface.traceroute(node_id)
-                        text = (result or {}).get('text', '')
-                        forward = (result or {}).get('forward', []) or []
-                        backward = (result or {}).get('backward', []) or []
-
-                        # Resolver nombres del destino
-                        to_row = db.get_node(node_id)
-                        to_name = (to_row or {}).get('name') if to_row else None
-                        to_short = (to_row or {}).get('short_name') if to_row else None
-
-                        # Construir hasta 7 hops de ida con nombres desde BD (si existen)
-                        hops = []
-                        for hop in forward[:7]:
-                            hid = hop.get('id')
-                            hsnr = hop.get('snr')
-                            hrow = db.get_node(hid) if hid else None
-                            hops.append({
-                                'id': hid,
-                                'name': (hrow or {}).get('name') if hrow else None,
-                                'name_short': (hrow or {}).get('short_name') if hrow else None,
-                                'snr': hsnr,
-                                'rssi': (hrow or {}).get('rssi') if hrow else None,
-                            })
-
-                        # Construir hasta 7 hops de regreso
-                        return_hops = []
-                        for hop in backward[:7]:
-                            hid = hop.get('id')
-                            hsnr = hop.get('snr')
-                            hrow = db.get_node(hid) if hid else None
-                            return_hops.append({
-                                'id': hid,
-                                'name': (hrow or {}).get('name') if hrow else None,
-                                'name_short': (hrow or {}).get('short_name') if hrow else None,
-                                'snr': hsnr,
-                                'rssi': (hrow or {}).get('rssi') if hrow else None,
-                            })
-
-                        # Marcar trace como completado en la MISMA fila, guardando el texto en data_raw
-                        db.mark_trace_done_with_route(
-                            pending['id'], True,
-                            text=text,
-                            to_name=to_name,
-                            to_name_short=to_short,
-                            hops=hops,
-                            return_hops=return_hops,
-                        )
-                        log_p(f"[traceroute] Trace #{pending['id']} completado con éxito: {text[:60]}")
-
-                        # Notificar a la pasarela WiFi
-                        try:
-                            from Models.EventBroadcaster import broadcast_event
-                            broadcast_event("trace_completed", {
-                                "trace_id": pending['id'],
-                                "to": node_id,
-                                "to_name": to_name,
-                                "to_name_short": to_short,
-                                "success": True,
-                                "hops_forward": hops,
-                                "hops_backward": return_hops,
-                                "raw_text": text,
-                            })
-                        except Exception:
-                            pass
-                    except (Exception, SystemExit) as e:
-                        # En caso de fallo, guardar el error como texto plano en data_raw
-                        error_txt = f"{e.__class__.__name__}: {e}"
-                        log_p(f"[traceroute] Trace #{pending['id']} falló: {error_txt}", level="WARN")
-                        db.mark_trace_done_with_route(
-                            pending['id'], False,
-                            text=error_txt,
-                            to_name=None,
-                            to_name_short=None,
-                            hops=None,
-                        )
-                        try:
-                            from Models.EventBroadcaster import broadcast_event
-                            broadcast_event("trace_completed", {
-                                "trace_id": pending['id'],
-                                "to": node_id,
-                                "success": False,
-                                "error": error_txt,
-                            })
-                        except Exception:
-                            pass
+                        _trace_finished(db, result)
+                    except Exception as e:
+                        log_p(f"[traceroute] Error guardando trace #{result['trace_id']}: {e}", level="WARN")
+                if finished:
+                    due.add(WAKE_TRACE)
+
+                policy = trace_policy()
+                _rcfg = policy['router_identifiers']
+
+                # Con el canal ocupado (pausa del planificador por encima de la
+                # mínima) no se solapan traces: uno cada vez
+                limit = interface.traces.max_in_flight
+                if interface.tx.current_gap() > interface.tx.min_gap:
+                    limit = 1
+                while WAKE_TRACE in due and interface.traces.in_flight() < limit:
+                    pending = db.get_next_pending_trace(router_identifiers=_rcfg,
+                                                        exclude_ids=interface.traces.trace_ids())
+                    if not pending:
+                        if (getattr(env, 'ENABLE_TRACES', False) and interface.tx.airtime_available()
+                                and enqueue_next_traces(db, 1, policy)):
+                            continue
+                        break
+                    node_id = pending.get('to')
+                    timeout = interface.traces.timeout_for(db.get_trace_rtt(node_id))
+                    log_p(f"[traceroute] Iniciando trace #{pending['id']} hacia {node_id} (plazo {timeout:.0f}s)")
+                    interface.start_traceroute(pending['id'], node_id, timeout=timeout)
             except (Exception, SystemExit) as e:
                 log_p(f"[traceroute] Error en bucle de traces: {e}", level="WARN")
                 # No interrumpir el loop por errores de BD
                 pass
 
-            # Despacho de mensajes pendientes en cola de salida (Web / API / Gateway)
+            # Despacho de mensajes pendientes en cola de salida (Web / API / Gateway).
+            # Se reclaman por prioridad (alerta > operador > NodeInfo) solo los
+            # que caben en el planificador de transmisión (como mucho
+            # OUTBOX_BATCH en cola) y se encolan sin esperar: el ritmo lo marca
+            # interface.tx. Cada mensaje se marca al terminar su transmisión.
+            outbox_busy = False
             try:
-                pending_msg = db.get_next_pending_outbox()
-                if pending_msg:
+                batch_size = int(getattr(env, 'OUTBOX_BATCH', 5) or 5)
+                room = batch_size - interface.tx.pending()
+                claimed = db.claim_outbox(limit=room) if room > 0 and WAKE_OUTBOX in due else []
+                # Lote lleno, o aviso sin sitio en el planificador: se reintenta enseguida
+                outbox_busy = len(claimed) >= room if room > 0 else WAKE_OUTBOX in due
+                for pending_msg in claimed:
                     out_id = pending_msg['id']
                     out_text = pending_msg['text']
                     out_dest = pending_msg['dest']
                     out_ch = pending_msg['channel']
 
-                    if out_text == "__REQ_NODEINFO__":
+                    if out_text == db.OUTBOX_NODEINFO_TEXT:
                         log_p(f"[outbox] Procesando solicitud NodeInfo para '{out_dest}'")
-                        ok = interface.request_node_info(out_dest)
-                        db.mark_outbox_sent(out_id, ok=ok)
+                        handle = interface.request_node_info(out_dest)
                     else:
                         log_p(f"[outbox] Transmitiendo mensaje #{out_id} a '{out_dest}' ch={out_ch}: {out_text[:40]}")
-                        ok = interface.send(out_text, dest=out_dest, channel=out_ch)
-                        db.mark_outbox_sent(out_id, ok=ok)
-                        
-                        try:
-                            from Models.EventBroadcaster import broadcast_event
-                            my_info = getattr(interface.interface, 'myInfo', None)
-                            my_id = f"!{my_info.my_node_num:08x}" if getattr(my_info, 'my_node_num', None) else "local"
-                            broadcast_event("message_rx", {
-                                "outbox_id": out_id,
-                                "from": my_id,
-                                "from_name": "Bot (Local)",
-                                "from_short_name": "BOT",
-                                "to": out_dest,
-                                "channel": out_ch,
-                                "text": out_text,
-                                "is_direct": (out_dest != '^all'),
-                                "is_outgoing": True,
-                                "via_mqtt": False,
-                            })
-                        except Exception:
-                            pass
+                        handle = interface.send(out_text, dest=out_dest, channel=out_ch,
+                                                priority=pending_msg['priority'])
+                    handle.add_done_callback(partial(_outbox_done, db, interface, pending_msg))
             except Exception as e:
                 log_p(f"[outbox] Error procesando mensaje saliente: {e}", level="WARN")
 
             # Publicación de alertas AEMET mínima (si hay API key y dentro de ventana horaria)
             try:
-                if getattr(__import__('env'), 'AEMET_API_KEY', None):
+                if WAKE_AEMET in due and getattr(__import__('env'), 'AEMET_API_KEY', None):
                     # Respetar ventana horaria
                     now_hour = __import__('datetime').datetime.now().hour
                     if aemet.is_within_hour_window(now_hour):
                         # Comprobar siguiente alerta sin publicar
                         alert = db.aemet_get_next_unpublished()
-                        if alert:
+                        if alert and alert['id'] not in aemet_in_flight:
                             # Comprobar período por canal
                             period_min = aemet.period_to_minutes(getattr(aemet, 'period', 'Hour'))
                             publish_channels = []
@@ -228,85 +335,127 @@ def loop():
 
                                 messages = build_aemet_messages(base_text)
 
-                                sent_any = False
-                                for ch_idx, ch in enumerate(publish_channels):
-                                    # Enviar hasta 3 mensajes con 5s entre cada parte,
-                                    # ignorando cooldown intra-alerta.
-                                    part_ok = False
-                                    for idx, msg in enumerate(messages):
-                                        ok = interface.send(msg, dest='^all', channel=ch)
-                                        if ok:
-                                            part_ok = True
-                                        # Esperar 1s entre partes (no tras la última)
-                                        if idx < len(messages) - 1:
-                                            sleep(2.5)
-                                    if part_ok:
-                                        sent_any = True
-                                        # Marcar periodo por canal tras completar el envío (1 o 2 partes)
-                                        db.set_task_run(f'aemet_publish_ch_{ch}')
-                                    # Esperar también entre canales: si no, la 1ª parte
-                                    # del siguiente canal saldría pegada a la última del
-                                    # anterior, lanzando 2 mensajes masivos seguidos y
-                                    # pudiendo saturar la radio. No esperar tras el último.
-                                    if ch_idx < len(publish_channels) - 1:
-                                        sleep(2.5)
-
-                                if sent_any:
-                                    db.aemet_mark_published(alert['id'])
+                                # Hasta 3 partes por canal, encoladas con prioridad
+                                # de alerta: la pausa entre partes y entre canales
+                                # la pone interface.tx (sin saturar la radio ni
+                                # bloquear este bucle). Al terminar todas se marca
+                                # el periodo de cada canal con algún envío y la
+                                # alerta como publicada.
+                                aemet_in_flight.add(alert['id'])
+                                handles = {
+                                    ch: [interface.send(msg, dest='^all', channel=ch, priority=TX_PRIORITY_ALERT)
+                                         for msg in messages]
+                                    for ch in publish_channels
+                                }
+                                when_all(
+                                    [f for futures in handles.values() for f in futures],
+                                    partial(_aemet_done, db, alert['id'], handles, aemet_in_flight),
+                                )
             except Exception as e:
                 # No romper el loop por AEMET, pero dejar rastro para poder
                 # diagnosticar fallos en la publicación de alertas de emergencia.
                 log_p(f"Error publicando alerta AEMET: {e}", level="WARN")
 
-            # Heartbeat para la pasarela WiFi y métricas de canal
-            try:
-                from Models.EventBroadcaster import broadcast_event
-                broadcast_event("system_status", {
-                    "uart_connected": interface.interface is not None,
-                    "serial_port": SERIAL_DEVICE_PATH,
-                    "nodes_in_memory": len(interface.node_dict),
-                })
-
-                # Consultar y emitir telemetría de canal y datos del nodo local
-                if interface and interface.interface:
-                    my_info = getattr(interface.interface, 'myInfo', None)
-                    my_num = getattr(my_info, 'my_node_num', None)
-                    if my_num:
-                        my_id = f"!{my_num:08x}"
-                        ln = {}
-                        if hasattr(interface.interface, 'nodes') and my_id in interface.interface.nodes:
-                            ln = interface.interface.nodes[my_id]
-                        elif hasattr(interface.interface, 'nodesByNum') and my_num in interface.interface.nodesByNum:
-                            ln = interface.interface.nodesByNum[my_num]
-
-                        if isinstance(ln, dict):
-                            user = ln.get('user', {})
-                            broadcast_event("local_node_info", {
-                                "my_node_id": user.get('id') or my_id,
-                                "my_num": my_num,
-                                "name": user.get('longName'),
-                                "short_name": user.get('shortName'),
-                                "hw_model": user.get('hwModel'),
-                                "region": str(getattr(my_info, 'region', None) or ''),
-                            })
-
-                            dm = ln.get('deviceMetrics') or ln.get('device_metrics') or {}
-                            ch_u = dm.get('channelUtilization') if dm.get('channelUtilization') is not None else dm.get('channel_utilization')
-                            a_tx = dm.get('airUtilTx') if dm.get('airUtilTx') is not None else dm.get('air_util_tx')
-                            if ch_u is not None or a_tx is not None:
-                                broadcast_event("channel_metrics", {
-                                    "channel_util": ch_u,
-                                    "air_util_tx": a_tx,
+            # Tareas periódicas: cada MAIN_LOOP_INTERVAL s, aunque el bucle
+            # despierte antes por outbox, traces o AEMET
+            if time.monotonic() - last_heartbeat >= tick:
+                last_heartbeat = time.monotonic()
+
+                # Heartbeat para la pasarela WiFi y métricas de canal
+                try:
+                    from Models.EventBroadcaster import broadcast_event
+                    broadcast_event("system_status", {
+                        "uart_connected": interface.interface is not None,
+                        "serial_port": SERIAL_DEVICE_PATH,
+                        "nodes_in_memory": len(interface.node_dict),
+                        "node_sync": getattr(interface, 'node_sync_stats', {}),
+                        "storage": StorageMonitor.get_instance().snapshot(),
+                        "commands": CommandExecutor.get_instance().snapshot(),
+                        "tx": interface.tx.snapshot(),
+                        "wakeup": {**wakeup.stats, "active": wakeup.active},
+                        "traces": interface.traces.snapshot(),
+                    })
+
+                    # Consultar y emitir telemetría de canal y datos del nodo local
+                    if interface and interface.interface:
+                        my_info = getattr(interface.interface, 'myInfo', None)
+                        my_num = getattr(my_info, 'my_node_num', None)
+                        if my_num:
+                            my_id = f"!{my_num:08x}"
+                            ln = {}
+                            if hasattr(interface.interface, 'nodes') and my_id in interface.interface.nodes:
+                                ln = interface.interface.nodes[my_id]
+                            elif hasattr(interface.interface, 'nodesByNum') and my_num in interface.interface.nodesByNum:
+                                ln = interface.interface.nodesByNum[my_num]
+
+                            if isinstance(ln, dict):
+                                user = ln.get('user', {})
+                                broadcast_event("local_node_info", {
+                                    "my_node_id": user.get('id') or my_id,
+                                    "my_num": my_num,
+                                    "name": user.get('longName'),
+                                    "short_name": user.get('shortName'),
+                                    "hw_model": user.get('hwModel'),
+                                    "region": str(getattr(my_info, 'region', None) or ''),
                                 })
+
+                                dm = ln.get('deviceMetrics') or ln.get('device_metrics') or {}
+                                ch_u = dm.get('channelUtilization') if dm.get('channelUtilization') is not None else dm.get('channel_utilization')
+                                a_tx = dm.get('airUtilTx') if dm.get('airUtilTx') is not None else dm.get('air_util_tx')
+                                if ch_u is not None or a_tx is not None:
+                                    interface.tx.update_airtime(ch_u, a_tx)
+                                    broadcast_event("channel_metrics", {
+                                        "channel_util": ch_u,
+                                        "air_util_tx": a_tx,
+                                    })
+                except Exception:
+                    pass
+
+                # Volcado periódico (write-behind) del estado de nodos
+                try:
+                    NodeStore.get_instance().flush_if_due()
+                except Exception:
+                    pass
+
+                # Volcado agrupado de comandos y pings (DB_STORAGE_MODE='sdcard')
+                try:
+                    batcher = WriteBatcher.active()
+                    if batcher is not None:
+                        batcher.flush_if_due()
+                except Exception:
+                    pass
+
+            # Con la cola de salida llena se vuelve a reclamar en cuanto haya
+            # sitio en el planificador. Un trace completado despierta el bucle
+            # (WAKE_TRACE) y la espera no pasa del plazo del trace en vuelo.
+            due = set()
+            trace_wait = interface.traces.next_deadline()
+            if outbox_busy:
+                due.add(WAKE_OUTBOX)
+                due |= wakeup.wait(min(interface.tx.current_gap(), trace_wait if trace_wait is not None else tick))
+                continue
+
+            # Parte ociosa: checkpoint PASSIVE del WAL y muestra de bytes escritos
+            try:
+                StorageMonitor.get_instance().run_if_due(db)
             except Exception:
                 pass
-
-            sleep(5)
+            # Hasta el próximo heartbeat (o el plazo del trace en vuelo)
+            wait = max(0.0, tick - (time.monotonic() - last_heartbeat))
+            due |= wakeup.wait(min(wait, trace_wait) if trace_wait is not None else wait)
 
     except KeyboardInterrupt:
         print("\n\n👋 Cerrando conexión...")
         if interface:
             interface.disconnect()
+        # Persistir cambios de nodos, comandos y pings pendientes antes de salir
+        NodeStore.get_instance().flush()
+        batcher = WriteBatcher.active()
+        if batcher is not None:
+            batcher.flush()
+        # Cerrar conexiones SQLite del pool (checkpoint WAL al cerrar la última)
+        from Models.Database import Database
+        Database.close_connections()
         print("Desconectado correctamente")
 
         exit(0)
@@ -326,16 +475,21 @@ def main():
     log_p("Iniciando receptor de mensajes Meshtastic por UART...")
     log_p("Presiona Ctrl+C para salir\n")
 
+    wakeup = None
     try:
         # Asegurar base de datos creada (solo crea si no existe)
         ensure_database()
 
+        # Socket por el que enqueue_outbox / enqueue_trace despiertan al bucle
+        wakeup = WakeupListener()
+        wakeup.open()
+
         # El daemon debe seguir vivo pase lo que pase: si loop() cae por una
         # desconexión del puerto serie o una excepción no controlada, esperamos
         # un margen prudencial y reintentamos el bucle/reconexión indefinidamente.
         while True:
             try:
-                loop()
+                loop(wakeup)
             except KeyboardInterrupt:
                 # Salida controlada por el usuario
                 break
@@ -345,6 +499,9 @@ def main():
     except KeyboardInterrupt:
         # Fin controlado durante el arranque
         pass
+    finally:
+        if wakeup is not None:
+            wakeup.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,89 @@
+import unittest
+import os
+import tempfile
+import shutil
+from contextlib import closing
+from Models.Database import Database
+
+
+class TestChisteBag(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_chiste_bag.sql")
+        self.db = Database(self.db_path)
+        self.db.bulk_insert_api_chistes([{"id": i, "content": f"chiste {i}"} for i in range(1, 11)])
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _draw(self, n, bag="ch0"):
+        return [self.db.get_random_chiste(bag=bag)["content"] for _ in range(n)]
+
+    def test_no_repeats_until_bag_is_exhausted(self):
+        first = self._draw(10)
+        self.assertEqual(len(set(first)), 10)
+        second = self._draw(10)
+        self.assertEqual(set(second), set(first))
+        # El primero de la nueva vuelta no repite el último servido
+        self.assertNotEqual(second[0], first[-1])
+
+    def test_bags_are_independent_per_channel(self):
+        self._draw(9, bag="ch0")
+        other = self._draw(10, bag="ch1")
+        self.assertEqual(len(set(other)), 10)
+
+    def test_sender_bags_are_dropped_by_migration(self):
+        import create_db
+        self._draw(3, bag="!a1b2c3d4")
+        self._draw(3, bag=Database.CHISTE_DM_BAG)
+        self._draw(3, bag="ch2")
+        with closing(self.db._connect()) as conn:
+            create_db._drop_sender_chiste_bags(conn)
+            bags = {r[0] for r in conn.execute("SELECT DISTINCT bag FROM chiste_bag")}
+            states = {r[0] for r in conn.execute("SELECT bag FROM chiste_bag_state")}
+        self.assertEqual(bags, {"dm", "ch2"})
+        self.assertEqual(states, {"dm", "ch2"})
+
+    def test_unapproved_are_never_served(self):
+        self.db.save_chiste(from_="RAU0", content="pendiente", need_approve=True)
+        self.assertNotIn("pendiente", self._draw(20))
+
+    def test_approval_refreshes_bag_without_repeats(self):
+        seen = self._draw(4)
+        new_id = self.db.save_chiste(from_="RAU0", content="nuevo", need_approve=True)
+        with closing(self.db._connect()) as conn:
+            conn.execute("UPDATE chistes SET need_approve = 0 WHERE id = ?", (new_id,))
+            # Un chiste aún no servido deja de estar aprobado
+            conn.execute("UPDATE chistes SET need_approve = 1 WHERE content NOT IN (?, ?, ?, ?, 'nuevo') "
+                         "AND id = (SELECT MIN(id) FROM chistes WHERE content NOT IN (?, ?, ?, ?, 'nuevo'))",
+                         (*seen, *seen))
+            conn.commit()
+            dropped = conn.execute("SELECT content FROM chistes WHERE need_approve = 1 AND content != 'nuevo' "
+                                   "AND content != 'pendiente'").fetchone()[0]
+        # 10 aprobados: quedan 6 en esta vuelta, ninguno ya servido
+        rest = self._draw(6)
+        self.assertIn("nuevo", rest)
+        self.assertNotIn(dropped, rest)
+        self.assertEqual(len(set(seen + rest)), 10)
+
+    def test_selection_does_not_sort_table(self):
+        self._draw(1)
+        with closing(self.db._connect()) as conn:
+            plan = " ".join(
+                r[3] for r in conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT c.id FROM chiste_bag b JOIN chistes c ON c.id = b.chiste_id "
+                    "WHERE b.bag = 'ch0' AND b.position = 1 AND c.need_approve = 0"
+                ).fetchall()
+            )
+        self.assertNotIn("SCAN", plan)
+
+    def test_empty_table_returns_none(self):
+        with closing(self.db._connect()) as conn:
+            conn.execute("DELETE FROM chistes")
+            conn.commit()
+        self.assertIsNone(self.db.get_random_chiste())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+import threading
+import time
+from unittest import mock
+
+from Models.CommandExecutor import CommandExecutor
+from Models.Node import Node
+from Models.SerialInterface import SerialInterface
+from Models.TxScheduler import TxScheduler
+
+
+def text_packet(from_id, text):
+    return {
+        'decoded': {'text': text},
+        'fromId': from_id,
+        'from': int(from_id[1:], 16),
+        'toId': '!0000beef',
+        'to': 0xbeef,
+    }
+
+
+class TestCommandExecutor(unittest.TestCase):
+    def setUp(self):
+        CommandExecutor._instance = None
+        SerialInterface.node_dict = {}
+
+    def tearDown(self):
+        CommandExecutor._instance = None
+        SerialInterface.node_dict = {}
+
+    def test_fifo_per_sender_and_global_cap(self):
+        executor = CommandExecutor(workers=2, max_pending=50)
+        lock = threading.Lock()
+        order, running, peak = [], [0], [0]
+
+        def task(sender, n):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+                order.append((sender, n))
+
+        for n in range(4):
+            for sender in ("!a", "!b", "!c"):
+                self.assertTrue(executor.submit(sender, task, sender, n))
+        self.assertTrue(executor.wait_idle(5))
+
+        self.assertLessEqual(peak[0], 2)
+        for sender in ("!a", "!b", "!c"):
+            self.assertEqual([n for s, n in order if s == sender], [0, 1, 2, 3])
+        snap = executor.snapshot()
+        self.assertEqual((snap["submitted"], snap["completed"], snap["pending"]), (12, 12, 0))
+        self.assertGreater(snap["wait_ms_max"], 0)
+
+    def test_full_queue_drops_and_errors_are_counted(self):
+        executor = CommandExecutor(workers=1, max_pending=2)
+        gate = threading.Event()
+        executor.submit("!a", gate.wait, 5)
+        deadline = time.monotonic() + 2
+        while executor.snapshot()["running"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+        self.assertTrue(executor.submit("!b", lambda: None))
+        self.assertTrue(executor.submit("!b", lambda: 1 / 0))
+        self.assertFalse(executor.submit("!c", lambda: None))
+        gate.set()
+        self.assertTrue(executor.wait_idle(5))
+        snap = executor.snapshot()
+        self.assertEqual((snap["dropped"], snap["errors"], snap["max_depth"]), (1, 1, 2))
+
+    def test_system_exit_does_not_block_sender(self):
+        executor = CommandExecutor(workers=1, max_pending=50)
+        done = []
+
+        def bye():
+            raise SystemExit(1)
+
+        executor.submit("!a", bye)
+        executor.submit("!a", done.append, 1)
+        executor.submit("!a", done.append, 2)
+        self.assertTrue(executor.wait_idle(5))
+        self.assertEqual(done, [1, 2])
+        snap = executor.snapshot()
+        self.assertEqual((snap["errors"], snap["completed"], snap["running"]), (1, 3, 0))
+
+    def test_singleton_created_once_across_threads(self):
+        class SlowExecutor(CommandExecutor):
+            _instance = None
+
+            def __init__(self):
+                time.sleep(0.02)
+                super().__init__(workers=1, max_pending=10)
+
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append(SlowExecutor.get_instance())) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len({id(e) for e in seen}), 1)
+
+    def test_slow_command_does_not_delay_receive(self):
+        CommandExecutor._instance = CommandExecutor(workers=2, max_pending=50)
+        interface = SerialInterface("/dev/null")
+        sent = []
+        interface.tx = TxScheduler(min_gap=0.01)
+        interface._transmit = lambda msg, dest=None, channel=0: sent.append((msg, dest)) or True
+
+        def slow(iface, args, msg, metadata):
+            time.sleep(0.3)
+            iface.queue_replies(["parte 1", "parte 2"], metadata)
+
+        def fast(iface, args, msg, metadata):
+            iface.reply_to_message("pong", metadata)
+
+        commands = {"prevision": {"callback": slow, "in_group": True},
+                    "ping": {"callback": fast, "in_group": True}}
+        for node_id in ("!00000001", "!00000002"):
+            SerialInterface.node_dict[node_id] = Node(node_id, row={})
+
+        with mock.patch.object(interface, "command_dict", commands), \
+                mock.patch("Models.Database.Database.log_command") as log_command:
+            start = time.perf_counter()
+            interface.on_receive_text(text_packet("!00000001", "/prevision"), None)
+            interface.on_receive_text(text_packet("!00000001", "/ping"), None)
+            interface.on_receive_text(text_packet("!00000002", "/ping"), None)
+            self.assertLess(time.perf_counter() - start, 0.2)
+
+            self.assertTrue(CommandExecutor.get_instance().wait_idle(5))
+            deadline = time.monotonic() + 5
+            while len(sent) < 4 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        # El ping del otro nodo no espera al comando lento; los del mismo nodo sí
+        self.assertEqual(sent, [("pong", "!00000002"), ("parte 1", "!00000001"),
+                                ("parte 2", "!00000001"), ("pong", "!00000001")])
+        self.assertEqual(log_command.call_count, 3)
+
+    def test_multipart_reply_is_queued_without_sleeping(self):
+        from Commands.help import help_callback
+        interface = SerialInterface("/dev/null")
+        sent = []
+        interface.tx = TxScheduler(min_gap=0.05)
+        interface._transmit = lambda msg, dest=None, channel=0: sent.append((msg, dest)) or True
+        metadata = {'is_direct': True, 'node_from': {'id': '!00000001'}}
+
+        extra = {f"comando{i}": {"info": "", "callback": None} for i in range(40)}
+        with mock.patch.dict("data.commands_dict", extra):
+            start = time.perf_counter()
+            help_callback(interface, [], "/help", metadata)
+        # El worker no espera la pausa entre partes: la pone el planificador
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+        deadline = time.monotonic() + 5
+        while interface.tx.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(len(sent), 3)
+        self.assertTrue(all(dest == "!00000001" for _, dest in sent))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import shutil
+import time
+from datetime import datetime, timedelta
+from Models.Database import Database
+from create_db import ensure_database, COMMAND_ROLLUP_MIGRATION_TASK
+
+
+class TestCommandRollups(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_rollups.sql")
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_log_command_updates_rollups(self):
+        db = Database(self.db_path)
+        db.log_command(node_id="!11111111", command="ping")
+        db.log_command(node_id="!11111111", command="/PING")
+        db.log_command(node_id="!11111111", command="weather")
+        db.log_command(node_id=None, command="help")
+
+        with db._connect() as conn:
+            hourly = conn.execute(
+                "SELECT command, node_id, count FROM command_rollup_hourly ORDER BY command"
+            ).fetchall()
+        self.assertEqual([tuple(r) for r in hourly], [("help", "", 1), ("ping", "!11111111", 2), ("weather", "!11111111", 1)])
+
+        stats = db.stats_summary()
+        self.assertEqual(stats["cmd_total"], 4)
+        self.assertEqual(stats["cmd_today"], 4)
+        self.assertEqual(stats["cmd_top"], ("ping", 2))
+
+        ranking = db.get_top_command_users(hours=None)
+        self.assertEqual(ranking[0]["node_id"], "!11111111")
+        self.assertEqual(ranking[0]["count"], 3)
+        self.assertEqual(ranking[0]["last_command"], "weather")
+        self.assertIsNone(ranking[1]["node_id"])
+
+        summary = db.get_commands_audit_summary(hours=1)
+        self.assertEqual(summary["total"], 4)
+        self.assertEqual(summary["unique_nodes"], 1)
+
+    def test_window_mixes_rollup_and_partial_hour(self):
+        db = Database(self.db_path)
+        db.log_command(node_id="!11111111", command="ping")
+        # Comando de hace 3 horas (fuera de la ventana de 2 h)
+        old = datetime.now() - timedelta(hours=3)
+        old_ts = int(old.timestamp())
+        with db._connect() as conn:
+            conn.execute(
+                "INSERT INTO command_rollup_hourly (hour, command, node_id, count, last_at, last_id) VALUES (?, 'ping', '!22222222', 5, ?, 0)",
+                (old_ts - old_ts % 3600, old.isoformat(timespec="seconds")),
+            )
+            conn.commit()
+        self.assertEqual(db.get_commands_audit_summary(hours=2)["total"], 1)
+        self.assertEqual(db.get_commands_audit_summary(hours=5)["total"], 6)
+
+    def test_backfill_existing_history(self):
+        now = datetime.now()
+        rows = [
+            ("!11111111", "ping", (now - timedelta(hours=h)).isoformat(timespec="seconds"))
+            for h in range(0, 30)
+        ] + [("!22222222", "chiste", now.isoformat(timespec="seconds"))]
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                'CREATE TABLE commands_sent (id INTEGER PRIMARY KEY AUTOINCREMENT, node_id TEXT, '
+                'command TEXT, parameters TEXT NULL, message TEXT, created_at TEXT)'
+            )
+            conn.executemany('INSERT INTO commands_sent (node_id, command, created_at) VALUES (?, ?, ?)', rows)
+
+        ensure_database(self.db_path, force=True)
+        db = Database(self.db_path)
+        with db._connect() as conn:
+            marker = conn.execute("SELECT extra FROM tasks_control WHERE name = ?", (COMMAND_ROLLUP_MIGRATION_TASK,)).fetchone()
+        self.assertEqual(marker["extra"], "done")
+
+        # Nuevos comandos tras la migración se agregan una sola vez
+        db.log_command(node_id="!22222222", command="chiste")
+        ensure_database(self.db_path, force=True)
+
+        self.assertEqual(db.stats_summary()["cmd_total"], 32)
+        ranking = db.get_top_command_users(hours=None)
+        self.assertEqual((ranking[0]["node_id"], ranking[0]["count"]), ("!11111111", 30))
+        self.assertEqual((ranking[1]["node_id"], ranking[1]["count"]), ("!22222222", 2))
+
+        since = int(time.time()) - 24 * 3600
+        with db._connect() as conn:
+            expected = conn.execute("SELECT COUNT(*) FROM commands_sent WHERE created_ts >= ?", (since,)).fetchone()[0]
+        self.assertEqual(db.get_commands_audit_summary(hours=24)["total"], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
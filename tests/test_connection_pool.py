@@ -0,0 +1,72 @@
+import unittest
+import os
+import tempfile
+import shutil
+import threading
+from contextlib import closing
+from Models.Database import Database
+from create_db import ensure_database
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_pool.sql")
+        self.db = Database(self.db_path)
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_same_thread_reuses_connection(self):
+        with closing(self.db._connect()) as c1:
+            pass
+        with closing(self.db._connect()) as c2:
+            pass
+        self.assertIs(c1, c2)
+        # La conexión sigue usable tras close()
+        self.assertEqual(c2.execute("SELECT 1").fetchone()[0], 1)
+
+    def test_uncommitted_changes_rolled_back_on_close(self):
+        with closing(self.db._connect()) as conn:
+            conn.execute("INSERT INTO tasks_control (name, last_run_at) VALUES ('x', 'y')")
+        self.assertIsNone(self.db.get_task_last_run('x'))
+
+    def test_other_thread_gets_own_connection(self):
+        result = {}
+
+        def worker():
+            result['conn'] = self.db._connect()
+            self.db.set_task_run('hilo')
+
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+        self.assertIsNot(result['conn'], self.db._connect())
+        self.assertIsNotNone(self.db.get_task_last_run('hilo'))
+
+    def test_recreated_file_reopens_connection(self):
+        self.db.set_task_run('antes')
+        old = self.db._connect()
+        os.remove(self.db_path)
+        db = Database(self.db_path)
+        self.assertIsNot(old, db._connect())
+        self.assertIsNone(db.get_task_last_run('antes'))
+
+    def test_ensure_database_is_verified_once(self):
+        import create_db
+        calls = []
+        original = create_db._execute_schema
+        create_db._execute_schema = lambda conn: calls.append(conn) or original(conn)
+        try:
+            ensure_database(self.db_path)
+            ensure_database(self.db_path)
+            self.assertEqual(calls, [])
+            ensure_database(self.db_path, force=True)
+            self.assertEqual(len(calls), 1)
+        finally:
+            create_db._execute_schema = original
+
+
+if __name__ == "__main__":
+    unittest.main()
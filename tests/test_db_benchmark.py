@@ -0,0 +1,59 @@
+import unittest
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+
+from benchmarks import db_benchmark
+from benchmarks.dataset import dataset_meta, generate
+from Models.Database import Database
+
+
+class TestDbBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_dataset_is_reproducible(self):
+        first = generate(f"{self.test_dir}/a.sqlite", scale=0.01, seed=7)
+        second = generate(f"{self.test_dir}/b.sqlite", scale=0.01, seed=7)
+        self.assertEqual(first["rows"], second["rows"])
+        self.assertEqual(dataset_meta(f"{self.test_dir}/a.sqlite")["seed"], 7)
+        query = 'SELECT "to", hops, data_raw FROM traces ORDER BY id'
+        with closing(sqlite3.connect(f"{self.test_dir}/a.sqlite")) as a, \
+                closing(sqlite3.connect(f"{self.test_dir}/b.sqlite")) as b:
+            self.assertEqual(a.execute(query).fetchall(), b.execute(query).fetchall())
+            # Las rutas generadas se pueden leer como las reales (trace_hops + rollups)
+            self.assertGreater(a.execute('SELECT COUNT(*) FROM trace_hops').fetchone()[0], 0)
+            self.assertEqual(
+                a.execute('SELECT COALESCE(SUM(count), 0) FROM command_rollup_total').fetchone()[0],
+                first["rows"]["commands_sent"],
+            )
+
+    def test_every_public_method_is_measured(self):
+        report = db_benchmark.run_benchmark(scale=0.01, seed=7, iterations=1, workdir=self.test_dir)
+        covered = set(report["results"]) | set(report["skipped"])
+        self.assertEqual(covered, set(db_benchmark.public_methods()))
+        for res in report["results"].values():
+            self.assertLessEqual(res["p50_ms"], res["p95_ms"])
+        # Los métodos destructivos van al final
+        self.assertEqual(list(report["results"])[-2:], ["purge_expired", "compact"])
+
+    def test_compare_flags_regressions(self):
+        meta = {"scale": 1.0, "seed": 1}
+        baseline = {"meta": meta, "results": {"get_node": {"p50_ms": 2.0}, "log_command": {"p50_ms": 0.1}}}
+        report = {"meta": meta, "results": {"get_node": {"p50_ms": 5.0}, "log_command": {"p50_ms": 0.3}}}
+        result = db_benchmark.compare(report, baseline)
+        # log_command triplica pero por debajo del mínimo absoluto: no cuenta
+        self.assertEqual(result["regressions"], ["get_node"])
+        self.assertEqual(result["rows"]["get_node"]["ratio"], 2.5)
+
+        other = db_benchmark.compare({"meta": {"scale": 0.1, "seed": 1}, "results": {}}, baseline)
+        self.assertFalse(other["comparable"])
+
+
+if __name__ == "__main__":
+    unittest.main()
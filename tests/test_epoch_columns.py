@@ -0,0 +1,68 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import shutil
+from datetime import datetime, timedelta
+from Models.Database import Database
+from create_db import ensure_database, EPOCH_MIGRATION_TASK
+
+
+class TestEpochColumns(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_epoch.sql")
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_legacy_rows_are_backfilled(self):
+        old = datetime.now() - timedelta(days=2)
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                'CREATE TABLE commands_sent (id INTEGER PRIMARY KEY AUTOINCREMENT, node_id TEXT, '
+                'command TEXT, parameters TEXT NULL, message TEXT, created_at TEXT)'
+            )
+            conn.execute(
+                'CREATE TABLE pings (id INTEGER PRIMARY KEY AUTOINCREMENT, "from" TEXT NOT NULL, '
+                '"to" TEXT NOT NULL, from_name TEXT, hops INTEGER, data_raw TEXT NOT NULL)'
+            )
+            conn.executemany(
+                'INSERT INTO commands_sent (node_id, command, created_at) VALUES (?, ?, ?)',
+                [("!11111111", "ping", old.isoformat(timespec="seconds")),
+                 ("!11111111", "ping", datetime.now().isoformat(timespec="seconds"))],
+            )
+            conn.execute('INSERT INTO pings ("from", "to", data_raw) VALUES (\'!a\', \'!b\', \'{}\')')
+
+        ensure_database(self.db_path, force=True)
+
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute('SELECT created_at, created_ts FROM commands_sent ORDER BY id').fetchall()
+            marker = conn.execute('SELECT extra FROM tasks_control WHERE name = ?', (EPOCH_MIGRATION_TASK,)).fetchone()
+            ping_ts = conn.execute('SELECT created_ts FROM pings').fetchone()[0]
+        for created_at, created_ts in rows:
+            self.assertEqual(created_ts, int(datetime.fromisoformat(created_at).timestamp()))
+        self.assertEqual(marker[0], "done")
+        self.assertIsNone(ping_ts)
+
+        db = Database(self.db_path)
+        self.assertEqual(db.get_commands_audit_summary(hours=24)["total"], 1)
+        self.assertEqual(db.get_commands_audit_summary(hours=None)["total"], 2)
+        self.assertEqual(db.stats_summary()["cmd_today"], 1)
+
+    def test_new_rows_store_epoch(self):
+        db = Database(self.db_path)
+        db.save_ping("!a", "!b", "{}")
+        outbox_id = db.enqueue_outbox("hola")
+        db.mark_outbox_sent(outbox_id)
+        with db._connect() as conn:
+            ping = conn.execute('SELECT created_at, created_ts FROM pings').fetchone()
+            outbox = conn.execute('SELECT created_ts, updated_ts FROM outbox').fetchone()
+        self.assertEqual(ping["created_ts"], int(datetime.fromisoformat(ping["created_at"]).timestamp()))
+        self.assertIsNotNone(outbox["created_ts"])
+        self.assertGreaterEqual(outbox["updated_ts"], outbox["created_ts"])
+
+
+if __name__ == "__main__":
+    unittest.main()
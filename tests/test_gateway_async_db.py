@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from Models.Database import Database
+from Services.Gateway import GatewayService
+
+
+class TestGatewayAsyncDb(unittest.IsolatedAsyncioTestCase):
+    """El acceso a BD del Gateway no debe bloquear el bucle de eventos."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.gateway = GatewayService(host="127.0.0.1", port=8690)
+        self.gateway.db = Database(os.path.join(self.test_dir, "test_gateway_async.sql"))
+
+    def tearDown(self):
+        if self.gateway._db_executor is not None:
+            self.gateway._db_executor.shutdown(wait=True)
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _slow_nodes(self, delay, calls=None, active=None):
+        def get_all_nodes(limit=500, only_rf=False):
+            if active is not None:
+                with active["lock"]:
+                    active["now"] += 1
+                    active["max"] = max(active["max"], active["now"])
+            time.sleep(delay)
+            if active is not None:
+                with active["lock"]:
+                    active["now"] -= 1
+            if calls is not None:
+                calls.append(threading.current_thread().name)
+            return []
+        return get_all_nodes
+
+    async def test_event_loop_stays_responsive(self):
+        calls = []
+        self.gateway.db.get_all_nodes = self._slow_nodes(0.3, calls)
+        max_lag = 0.0
+
+        async def ticker():
+            nonlocal max_lag
+            for _ in range(20):
+                start = time.monotonic()
+                await asyncio.sleep(0.01)
+                max_lag = max(max_lag, time.monotonic() - start)
+
+        resp, _ = await asyncio.gather(
+            self.gateway._handle_action(None, {"action": "get_snapshot", "params": {"include": ["nodes"]}}),
+            ticker(),
+        )
+        self.assertTrue(resp["success"])
+        self.assertTrue(calls[0].startswith("gateway-db"))
+        self.assertLess(max_lag, 0.15)
+
+    async def test_per_action_limit(self):
+        active = {"now": 0, "max": 0, "lock": threading.Lock()}
+        self.gateway.db.get_all_nodes = self._slow_nodes(0.05, active=active)
+        request = {"action": "get_snapshot", "params": {"include": ["nodes"]}}
+        responses = await asyncio.gather(*(self.gateway._handle_action(None, request) for _ in range(5)))
+        self.assertTrue(all(r["success"] for r in responses))
+        self.assertEqual(active["max"], 2)
+
+    async def test_cancel_stops_between_queries(self):
+        stats_calls = []
+        self.gateway.db.get_all_nodes = self._slow_nodes(0.2)
+        self.gateway.db.stats_summary = lambda: stats_calls.append(1) or {}
+        task = asyncio.create_task(self.gateway._handle_action(
+            None, {"action": "get_snapshot", "params": {"include": ["nodes", "stats"]}}
+        ))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        # Deja terminar la consulta en curso: la siguiente ya no se ejecuta
+        await asyncio.sleep(0.3)
+        self.assertEqual(stats_calls, [])
+
+    async def test_memory_parts_are_merged(self):
+        self.gateway.last_system_status = {"uart_connected": True}
+        resp = await self.gateway._handle_action(
+            None, {"action": "get_snapshot", "params": {"include": ["system_status", "nodes"]}}
+        )
+        self.assertEqual(resp["data"]["system_status"], {"uart_connected": True})
+        self.assertIn("nodes", resp["data"])
+
+
+if __name__ == "__main__":
+    unittest.main()
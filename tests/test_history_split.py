@@ -0,0 +1,157 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import shutil
+import time
+from contextlib import closing
+from datetime import datetime
+
+import env
+import create_db
+from create_db import HISTORY_TABLES, attach_history, ensure_database, history_path
+from Models.Database import Database
+
+
+class TestHistorySplit(unittest.TestCase):
+    def setUp(self):
+        self._previous = {name: getattr(env, name, False) for name in ("DB_HISTORY_SPLIT", "DB_MEMORY_MIRROR")}
+        env.DB_HISTORY_SPLIT = False
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_split.sql")
+
+    def tearDown(self):
+        for name, value in self._previous.items():
+            setattr(env, name, value)
+        Database.close_connections()
+        create_db._VERIFIED.clear()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _split(self) -> Database:
+        env.DB_HISTORY_SPLIT = True
+        create_db._VERIFIED.clear()
+        return Database(self.db_path)
+
+    def _tables(self, schema):
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            attach_history(conn, self.db_path)
+            return {r[0] for r in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+
+    def test_existing_history_moves_and_queries_keep_working(self):
+        db = Database(self.db_path)
+        for i in range(5):
+            db.log_command(node_id="!11111111", command="ping")
+        db.save_ping("!11111111", "!bot", "{}")
+        db.tides_insert(location="Chipiona", source="estimacion", approximate=True,
+                        extremes=[{"time": datetime(2026, 5, 1, 6, 0), "type": "high", "height": 3.1}])
+        last_command = db.log_command(node_id="!22222222", command="clima")
+        Database.close_connections()
+
+        db = self._split()
+        self.assertTrue(history_path(self.db_path).exists())
+        self.assertFalse(set(HISTORY_TABLES) & self._tables("main"))
+        self.assertTrue(set(HISTORY_TABLES) <= self._tables("history"))
+
+        self.assertEqual(db.stats_summary()["cmd_total"], 6)
+        self.assertEqual(db.tides_get_latest()["location"], "Chipiona")
+        # Los ids siguen la secuencia anterior
+        self.assertEqual(db.log_command(node_id="!22222222", command="clima"), last_command + 1)
+        self.assertEqual(db.get_top_command_users(hours=None)[0]["count"], 5)
+
+        # Re-aplicar todas las migraciones no deja tablas duplicadas en main
+        ensure_database(self.db_path, force=True)
+        self.assertFalse(set(HISTORY_TABLES) & self._tables("main"))
+        self.assertEqual(db.stats_summary()["cmd_total"], 7)
+
+    def test_history_writes_do_not_block_queue(self):
+        self._split()
+        with closing(sqlite3.connect(self.db_path, timeout=0)) as writer, \
+                closing(sqlite3.connect(self.db_path, timeout=0)) as queue:
+            attach_history(writer, self.db_path)
+            attach_history(queue, self.db_path)
+            writer.execute('INSERT INTO pings ("from", "to", data_raw) VALUES (\'!a\', \'!b\', \'{}\')')
+            self.assertTrue(writer.in_transaction)
+            # El lock del histórico no afecta a la cola del fichero principal
+            queue.execute("INSERT INTO outbox (text) VALUES ('hola')")
+            queue.commit()
+            with self.assertRaises(sqlite3.OperationalError):
+                queue.execute('INSERT INTO pings ("from", "to", data_raw) VALUES (\'!c\', \'!d\', \'{}\')')
+            queue.rollback()
+            writer.commit()
+
+    def test_old_traces_go_to_archive(self):
+        db = self._split()
+        old = int(time.time()) - 90 * 86400
+        ids = []
+        for ok in (True, False, True, False):
+            trace_id = db.enqueue_trace("!00000002")
+            db.mark_trace_done_with_route(trace_id, ok, text="t", hops=[{"id": "!00000001"}, {"id": "!00000002"}])
+            ids.append(trace_id)
+        with closing(db._connect()) as conn:
+            conn.execute("UPDATE traces SET updated_ts = ?", (old,))
+            conn.commit()
+            hops = conn.execute("SELECT COUNT(*) FROM trace_hops WHERE trace_id IN (?, ?)", ids[:2]).fetchone()[0]
+
+        # Se quedan el último 'done' y el error posterior
+        self.assertEqual(db.archive_traces(int(time.time()) - 30 * 86400), 2)
+        self.assertEqual(db.archive_traces(int(time.time()) - 30 * 86400), 0)
+        with closing(db._connect()) as conn:
+            self.assertEqual([r[0] for r in conn.execute("SELECT id FROM main.traces ORDER BY id")], ids[2:])
+            self.assertEqual([r[0] for r in conn.execute("SELECT id FROM traces_archive ORDER BY id")], ids[:2])
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM trace_hops_archive").fetchone()[0], hops)
+        db.rebuild_trace_state(["!00000002"])
+        with closing(db._connect()) as conn:
+            state = conn.execute("SELECT * FROM trace_state WHERE node_id = '!00000002'").fetchone()
+        self.assertEqual((state["last_status"], state["consecutive_errors"]), ("error", 1))
+
+        self.assertEqual(db.purge_expired("traces_error", int(time.time()), pause=0), 2)
+        with closing(db._connect()) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM traces_archive").fetchone()[0], 1)
+
+    def test_archived_traces_are_still_readable(self):
+        db = self._split()
+        ids = []
+        for _ in range(2):
+            trace_id = db.enqueue_trace("!00000002")
+            db.mark_trace_done_with_route(trace_id, True, text="t", hops=[{"id": "!00000001"}, {"id": "!00000002"}])
+            ids.append(trace_id)
+        with closing(db._connect()) as conn:
+            conn.execute("UPDATE traces SET updated_ts = ?", (int(time.time()) - 90 * 86400,))
+            conn.commit()
+        self.assertEqual(db.archive_traces(int(time.time()) - 30 * 86400), 1)
+
+        history = db.get_node_link_history("!00000001")
+        self.assertEqual([h["trace_id"] for h in history], list(reversed(ids)))
+        self.assertEqual(history[-1]["to"], "!00000002")
+        recent = db.get_recent_traces()
+        self.assertEqual([t["id"] for t in recent], list(reversed(ids)))
+        self.assertEqual([h["id"] for h in recent[-1]["hops_forward"]], ["!00000001", "!00000002"])
+
+    def test_memory_mirror_follows_history_changes(self):
+        env.DB_MEMORY_MIRROR = True
+        db = self._split()
+        db.tides_insert(location="Rota", source="estimacion", approximate=True, extremes=[])
+        self.assertEqual(db.tides_get_latest()["location"], "Rota")
+        # Otro proceso escribe mareas en el fichero de histórico
+        with closing(sqlite3.connect(self.db_path)) as other:
+            attach_history(other, self.db_path)
+            other.execute(
+                "INSERT INTO tides (location, source, approximate, extremes, created_at) "
+                "VALUES ('Cádiz', 'worldtides', 0, '[]', '2999-01-01T00:00:00')"
+            )
+            other.commit()
+        self.assertEqual(db.tides_get_latest()["location"], "Cádiz")
+
+    def test_checkpoint_and_compact_cover_both_files(self):
+        db = self._split()
+        for _ in range(20):
+            db.save_ping("!a", "!b", "x" * 500)
+        result = db.wal_checkpoint("PASSIVE")
+        self.assertGreater(result["checkpointed_frames"], 0)
+        self.assertEqual(db.purge_expired("pings", int(time.time()) + 60, pause=0), 20)
+        stats = db.compact()
+        self.assertGreaterEqual(stats["pages_before"], stats["pages_after"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import shutil
+from contextlib import closing
+from unittest import mock
+import env
+from Models.Database import Database
+from Models.MemoryMirror import MemoryMirror
+from Models.QueryProfiler import ProfiledConnection
+
+
+class TestMemoryMirror(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_mirror.sql")
+        self._previous = getattr(env, 'DB_MEMORY_MIRROR', False)
+        env.DB_MEMORY_MIRROR = True
+        self.db = Database(self.db_path)
+        self.db.upsert_nodes({
+            "!11111111": {"short_name": "AAAA", "snr": 5.0, "role": 2, "hops": 1},
+            "!22222222": {"short_name": "BBBB", "snr": 7.0},
+        })
+        self.mirror = MemoryMirror.get_instance(self.db.db_path)
+
+    def tearDown(self):
+        env.DB_MEMORY_MIRROR = self._previous
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_reads_are_served_from_ram(self):
+        self.assertEqual(self.db.get_node("!11111111")["short_name"], "AAAA")
+        syncs = self.mirror.stats["syncs"]
+        reads = self.mirror.stats["reads"]
+        self.assertEqual(self.db.get_node_by_identifier("bbbb")["node_id"], "!22222222")
+        self.assertEqual(self.db.snr_average()["count"], 2)
+        self.assertEqual(self.db.nodes_overview()["total"], 2)
+        self.assertEqual([n["node_id"] for n in self.db.get_router_nodes(None)], ["!11111111"])
+        # Sin escrituras nuevas no se consulta el registro de cambios del fichero
+        self.assertEqual(self.mirror.stats["syncs"], syncs)
+        self.assertEqual(self.mirror.stats["reads"], reads + 4)
+
+    def test_write_through(self):
+        self.db.get_node("!11111111")
+        self.db.update_node("!11111111", {"short_name": "ZZZZ"})
+        self.db.create_node_if_not_exists("!33333333")
+        self.db.set_task_run("prueba", extra="x")
+        self.assertEqual(self.db.get_node("!11111111")["short_name"], "ZZZZ")
+        self.assertIsNotNone(self.db.get_node("!33333333"))
+        self.assertIsNotNone(self.db.get_task_last_run("prueba"))
+
+    def test_changes_from_other_process(self):
+        self.db.get_node("!11111111")
+        # Otra conexión (p. ej. el proceso del Gateway o el cron) escribe en el fichero
+        with sqlite3.connect(self.db_path) as other:
+            other.execute("UPDATE nodes SET short_name = 'EXT1' WHERE node_id = '!11111111'")
+            other.execute("DELETE FROM nodes WHERE node_id = '!22222222'")
+        self.assertEqual(self.db.get_node("!11111111")["short_name"], "EXT1")
+        self.assertIsNone(self.db.get_node("!22222222"))
+        self.assertEqual(len(self.db.get_all_nodes()), 1)
+
+    def test_latest_weather_and_tides(self):
+        self.db.aemet_weather_insert(scope="province", province_code="11", content="viejo")
+        self.db.aemet_weather_insert(scope="province", province_code="11", content="nuevo")
+        self.db.aemet_weather_insert(scope="forecast", province_code="11", content="prevision")
+        self.db.aemet_weather_insert(scope="city", province_code="41", content="sevilla")
+        self.db.tides_insert(location="Cádiz", source="test", approximate=False, extremes=[])
+        self.assertEqual(self.db.aemet_weather_get_latest(scope="province")["content"], "nuevo")
+        self.assertEqual(self.db.aemet_weather_get_latest(scope="forecast")["content"], "prevision")
+        self.assertEqual(self.db.aemet_weather_get_latest(province_code="41")["content"], "sevilla")
+        self.assertEqual(self.db.tides_get_latest()["location"], "Cádiz")
+        with self.mirror.reading(self.db._connect()) as mem:
+            self.assertEqual(mem.execute("SELECT COUNT(*) FROM aemet_weather").fetchone()[0], 3)
+
+    def test_replaced_file_is_reloaded(self):
+        self.db.get_node("!11111111")
+        # Fichero borrado y recreado en la misma ruta sin cerrar conexiones
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+        db = Database(self.db_path)
+        self.assertIsNone(db.get_node("!11111111"))
+
+    def _triggers(self, path):
+        with closing(sqlite3.connect(path)) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_mirror_%'"
+            ).fetchone()[0]
+
+    def test_triggers_only_with_mirror(self):
+        self.db.get_node("!11111111")
+        self.assertEqual(self._triggers(self.db_path), 12)
+
+        env.DB_MEMORY_MIRROR = False
+        other_path = os.path.join(self.test_dir, "sin_mirror.sql")
+        Database(other_path).upsert_nodes({"!44444444": {"short_name": "DDDD"}})
+        self.assertEqual(self._triggers(other_path), 0)
+        # Al desactivar la réplica se borran los de una BD que ya los tenía
+        Database(self.db_path)
+        self.assertEqual(self._triggers(self.db_path), 0)
+
+    def test_applied_changes_are_pruned(self):
+        self.db.get_node("!11111111")
+        # Réplica de otro proceso que se queda atrás mientras se poda
+        other_conn = sqlite3.connect(self.db_path, factory=ProfiledConnection)
+        other_conn.row_factory = sqlite3.Row
+        other = MemoryMirror(self.db_path)
+        self.assertTrue(other.sync(other_conn))
+        with mock.patch("Models.MemoryMirror.PRUNE_ROWS", 3):
+            for n in range(5, 10):
+                self.db.upsert_nodes({f"!{n:08x}": {"short_name": f"N{n}"}})
+        self.assertGreaterEqual(self.mirror.stats["prunes"], 1)
+        with closing(self.db._connect()) as conn:
+            self.assertLess(conn.execute("SELECT COUNT(*) FROM mirror_changes").fetchone()[0], 5)
+        self.assertEqual(self.db.get_node("!00000009")["short_name"], "N9")
+
+        with other.reading(other_conn) as mem:
+            count = mem.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+        self.assertEqual(count, 7)
+        self.assertEqual(other.stats["loads"], 2)
+        other.close()
+        other_conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import os
+import tempfile
+import shutil
+import threading
+import time
+from unittest import mock
+from Models.Database import Database
+from Models.NodeStore import NodeStore
+
+
+class CountingDatabase(Database):
+    """Database que cuenta las llamadas a upsert_nodes."""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.upserts = []
+
+    def upsert_nodes(self, changes):
+        self.upserts.append({k: dict(v) for k, v in changes.items()})
+        return super().upsert_nodes(changes)
+
+
+class TestNodeStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_nodestore.sql")
+        self.db = CountingDatabase(self.db_path)
+        self.store = NodeStore(flush_interval=3600, max_dirty=1000)
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_coalesces_updates_into_single_flush(self):
+        for i in range(20):
+            self.store.update("!aaaa0001", {"snr": 5.0 + i, "battery": 90})
+            self.store.update("!aaaa0002", {"rssi": -100 - i, "via_mqtt": False})
+
+        self.assertEqual(self.store.pending_count(), 2)
+        self.assertEqual(self.store.flush(self.db), 2)
+        self.assertEqual(len(self.db.upserts), 1)
+
+        n1 = self.db.get_node("!aaaa0001")
+        n2 = self.db.get_node("!aaaa0002")
+        self.assertEqual(n1["snr"], 24.0)
+        self.assertEqual(n1["battery"], 90)
+        self.assertEqual(n2["rssi"], -119)
+        self.assertEqual(n2["via_mqtt"], 0)
+        self.assertIsNotNone(n1["updated_at"])
+
+    def test_only_changed_columns_are_flushed(self):
+        self.store.update("!aaaa0001", {"snr": 5.0, "battery": 90, "name": "Uno"})
+        self.store.flush(self.db)
+
+        # Mismos valores: nada que volcar
+        self.store.update("!aaaa0001", {"snr": 5.0, "battery": 90, "name": "Uno"})
+        self.assertEqual(self.store.pending_count(), 0)
+        self.assertEqual(self.store.flush(self.db), 0)
+
+        self.store.update("!aaaa0001", {"snr": 6.5, "battery": 90, "name": "Uno"})
+        self.store.flush(self.db)
+        self.assertEqual(self.db.upserts[-1], {"!aaaa0001": {"snr": 6.5}})
+        self.assertEqual(self.db.get_node("!aaaa0001")["name"], "Uno")
+
+    def test_seed_avoids_rewriting_persisted_values(self):
+        self.db.create_node_if_not_exists("!aaaa0003")
+        self.db.update_node("!aaaa0003", {"short_name": "N3", "is_favorite": True})
+        self.store.seed("!aaaa0003", self.db.get_node("!aaaa0003"))
+
+        self.store.update("!aaaa0003", {"short_name": "N3", "is_favorite": True})
+        self.assertEqual(self.store.pending_count(), 0)
+
+    def test_size_threshold_triggers_flush(self):
+        store = NodeStore(flush_interval=3600, max_dirty=3)
+        store.flush(self.db)  # nada pendiente
+        calls = []
+        original = store.flush
+        store.flush = lambda db=None: calls.append(1) or original(self.db)
+
+        store.update("!aaaa0001", {"snr": 1.0})
+        store.update("!aaaa0002", {"snr": 2.0})
+        self.assertEqual(calls, [])
+        store.update("!aaaa0003", {"snr": 3.0})
+        self.assertEqual(calls, [1])
+        self.assertEqual(store.pending_count(), 0)
+        self.assertEqual(self.db.get_node("!aaaa0003")["snr"], 3.0)
+
+    def test_failed_flush_keeps_changes(self):
+        class BrokenDatabase:
+            def upsert_nodes(self, changes):
+                raise RuntimeError("disk I/O error")
+
+        self.store.update("!aaaa0001", {"snr": 1.0})
+        self.assertEqual(self.store.flush(BrokenDatabase()), 0)
+        self.store.update("!aaaa0001", {"battery": 50})
+        self.assertEqual(self.store.flush(self.db), 1)
+        node = self.db.get_node("!aaaa0001")
+        self.assertEqual(node["snr"], 1.0)
+        self.assertEqual(node["battery"], 50)
+
+    def test_singleton_created_once_across_threads(self):
+        class SlowStore(NodeStore):
+            _instance = None
+
+            def __init__(self):
+                time.sleep(0.02)
+                super().__init__(flush_interval=3600)
+
+        seen = []
+        with mock.patch("Models.NodeStore.atexit.register") as register:
+            threads = [threading.Thread(target=lambda: seen.append(SlowStore.get_instance())) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len({id(s) for s in seen}), 1)
+        self.assertEqual(register.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
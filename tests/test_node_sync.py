@@ -0,0 +1,111 @@
+import unittest
+import os
+import threading
+import tempfile
+import shutil
+from types import SimpleNamespace
+from unittest import mock
+from Models.Database import Database
+from Models.Node import Node
+from Models.SerialInterface import SerialInterface
+
+
+class CountingDatabase(Database):
+    """Database que anota lo que se escribe con upsert_nodes."""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.upserts = []
+
+    def upsert_nodes(self, changes):
+        self.upserts.append({k: dict(v) for k, v in changes.items()})
+        return super().upsert_nodes(changes)
+
+
+def device_node(num, short_name, snr=5.0, battery=90):
+    return {
+        'num': num,
+        'user': {'id': f"!{num:08x}", 'longName': f"Nodo {short_name}", 'shortName': short_name,
+                 'hwModel': 'HELTEC_V3', 'role': 'CLIENT'},
+        'snr': snr,
+        'hopsAway': 1,
+        'lastHeard': 1762114855,
+        'isFavorite': False,
+        'deviceMetrics': {'batteryLevel': battery, 'voltage': 4.1, 'uptimeSeconds': 245},
+    }
+
+
+class TestNodeSync(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db = CountingDatabase(os.path.join(self.test_dir, "test_node_sync.sql"))
+        self.nodes = {f"!{n:08x}": device_node(n, f"N{n}") for n in range(1, 301)}
+
+    def tearDown(self):
+        SerialInterface.node_dict = {}
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _device(self):
+        return {node_id: Node.device_columns(info) for node_id, info in self.nodes.items()}
+
+    def test_only_changed_rows_are_written(self):
+        first = self.db.sync_nodes(self._device())
+        self.assertEqual((first["total"], first["changed"]), (300, 300))
+        self.assertEqual(self.db.get_node("!00000001")["hops"], 1)
+        self.assertEqual(self.db.get_node("!00000001")["battery"], 90)
+
+        again = self.db.sync_nodes(self._device())
+        self.assertEqual(again["changed"], 0)
+        self.assertEqual(len(self.db.upserts), 1)
+
+        self.nodes["!00000002"]["snr"] = -3.5
+        third = self.db.sync_nodes(self._device())
+        self.assertEqual(third["changed"], 1)
+        self.assertEqual(self.db.upserts[-1], {"!00000002": {"snr": -3.5}})
+        self.assertEqual(third["rows"]["!00000002"]["snr"], -3.5)
+
+    def test_missing_values_do_not_erase(self):
+        self.db.sync_nodes(self._device())
+        # El dispositivo a veces solo conoce el número del nodo
+        result = self.db.sync_nodes({"!00000001": Node.device_columns({'num': 1})})
+        self.assertEqual(result["changed"], 0)
+        self.assertEqual(self.db.get_node("!00000001")["short_name"], "N1")
+
+    def test_get_nodes_builds_node_dict_without_per_node_queries(self):
+        serial = SerialInterface("/dev/null")
+        serial.node_dict = {}
+        serial.interface = SimpleNamespace(nodes=self.nodes)
+        with mock.patch("Models.Database.Database", return_value=self.db), \
+                mock.patch.object(self.db, "get_node", side_effect=AssertionError("consulta por nodo")):
+            changed = serial.get_nodes()
+        self.assertEqual(changed, 300)
+        self.assertEqual(len(serial.node_dict), 300)
+        self.assertEqual(serial.node_dict["!00000003"].short_name, "N3")
+        self.assertEqual(serial.node_sync_stats["last_nodes"], 300)
+        self.assertIn("last_duration_ms", serial.node_sync_stats)
+
+    def test_reactive_nodes_survive_concurrent_sync(self):
+        serial = SerialInterface("/dev/null")
+        serial.node_dict = {}
+        serial.interface = SimpleNamespace(nodes=self.nodes)
+        seen = {}
+
+        def reactive():
+            # Callbacks pubsub creando nodos mientras corre el volcado en bloque
+            for n in range(1, 301, 3):
+                node_id = f"!{n:08x}"
+                seen[node_id] = serial._get_node(node_id)
+
+        with mock.patch("Models.Database.Database", return_value=self.db):
+            worker = threading.Thread(target=reactive)
+            worker.start()
+            serial.get_nodes()
+            worker.join()
+        self.assertEqual(len(serial.node_dict), 300)
+        for node_id, node in seen.items():
+            self.assertIs(serial.node_dict[node_id], node)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import shutil
+import time
+from contextlib import closing
+from Models.Database import Database
+from create_db import ensure_database
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_outbox.sql")
+        self.db = Database(self.db_path)
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _status(self, outbox_id):
+        with closing(self.db._connect()) as conn:
+            return conn.execute("SELECT status FROM outbox WHERE id = ?", (outbox_id,)).fetchone()[0]
+
+    def test_claim_orders_by_priority_then_fifo(self):
+        nodeinfo = self.db.enqueue_outbox(Database.OUTBOX_NODEINFO_TEXT, dest="!11111111")
+        first = self.db.enqueue_outbox("hola 1")
+        second = self.db.enqueue_outbox("hola 2")
+        alert = self.db.enqueue_outbox("ALERTA", priority=Database.OUTBOX_PRIORITY_ALERT)
+
+        claimed = self.db.claim_outbox(limit=3)
+        self.assertEqual([m["id"] for m in claimed], [alert, first, second])
+        self.assertEqual(self._status(first), "sending")
+        # Lo ya reclamado no se vuelve a entregar
+        self.assertEqual([m["id"] for m in self.db.claim_outbox(limit=3)], [nodeinfo])
+
+    def test_dedup_by_hash_only_while_pending(self):
+        a = self.db.enqueue_outbox("hola", dest="^all", channel=1)
+        self.assertEqual(self.db.enqueue_outbox("hola", dest="^all", channel=1), a)
+        self.assertNotEqual(self.db.enqueue_outbox("hola", dest="^all", channel=2), a)
+        # Duplicado con más prioridad: sube la del pendiente
+        self.db.enqueue_outbox("hola", dest="^all", channel=1, priority=Database.OUTBOX_PRIORITY_ALERT)
+        self.assertEqual(self.db.claim_outbox(limit=1)[0]["id"], a)
+        self.db.mark_outbox_sent(a)
+        self.assertNotEqual(self.db.enqueue_outbox("hola", dest="^all", channel=1), a)
+
+    def test_expired_messages_are_not_sent(self):
+        stale = self.db.enqueue_outbox("viejo", ttl=60)
+        fresh = self.db.enqueue_outbox("nuevo", ttl=0)
+        with closing(self.db._connect()) as conn:
+            conn.execute("UPDATE outbox SET expires_ts = ? WHERE id = ?", (int(time.time()) - 1, stale))
+            conn.commit()
+        self.assertEqual([m["id"] for m in self.db.claim_outbox(limit=5)], [fresh])
+        self.assertEqual(self._status(stale), "expired")
+
+    def test_expired_lease_is_reclaimed(self):
+        msg = self.db.enqueue_outbox("hola")
+        self.db.claim_outbox(limit=1, lease_seconds=60)
+        # Simula una caída a mitad de envío: el lease caduca sin mark_outbox_sent
+        with closing(self.db._connect()) as conn:
+            conn.execute("UPDATE outbox SET lease_until = ? WHERE id = ?", (int(time.time()) - 1, msg))
+            conn.commit()
+        claimed = self.db.claim_outbox(limit=1)
+        self.assertEqual([(m["id"], m["attempts"]) for m in claimed], [(msg, 2)])
+
+    def test_expired_lease_with_pending_twin(self):
+        msg = self.db.enqueue_outbox("hola")
+        self.db.claim_outbox(limit=1)
+        twin = self.db.enqueue_outbox("hola")
+        self.assertNotEqual(twin, msg)
+        with closing(self.db._connect()) as conn:
+            conn.execute("UPDATE outbox SET lease_until = 0 WHERE id = ?", (msg,))
+            conn.commit()
+        self.assertEqual([m["id"] for m in self.db.claim_outbox(limit=5)], [twin])
+        self.assertEqual(self._status(msg), "expired")
+
+    def test_release_returns_to_pending(self):
+        msg = self.db.enqueue_outbox("hola")
+        self.db.claim_outbox(limit=1)
+        self.db.release_outbox([msg])
+        claimed = self.db.claim_outbox(limit=1)
+        self.assertEqual([(m["id"], m["attempts"]) for m in claimed], [(msg, 1)])
+
+    def test_failed_send_is_retried_until_max_attempts(self):
+        msg = self.db.enqueue_outbox("hola")
+        for attempt in range(1, Database.OUTBOX_MAX_ATTEMPTS + 1):
+            claimed = self.db.claim_outbox(limit=1, lease_seconds=600)
+            self.assertEqual([(m["id"], m["attempts"]) for m in claimed], [(msg, attempt)])
+            # Fallo de envío: vuelve a la cola sin esperar a que caduque el lease
+            self.db.release_outbox([msg], count_attempt=True)
+        self.assertEqual(self._status(msg), "error")
+        self.assertEqual(self.db.claim_outbox(limit=1), [])
+
+    def test_legacy_pending_rows_get_hash(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("DROP INDEX idx_outbox_pending_hash")
+            for _ in range(2):
+                conn.execute(
+                    "INSERT INTO outbox (text, dest, channel, status) VALUES ('hola', '^all', 0, 'pending')"
+                )
+        ensure_database(self.db_path, force=True)
+        with closing(self.db._connect()) as conn:
+            statuses = [r[0] for r in conn.execute("SELECT status FROM outbox ORDER BY id")]
+        self.assertEqual(statuses, ["pending", "expired"])
+        self.assertEqual(self.db.enqueue_outbox("hola"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
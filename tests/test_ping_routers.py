@@ -327,6 +327,7 @@ class TestPingRouters(unittest.TestCase):
         with db._connect() as conn:
             conn.execute("UPDATE traces SET updated_at = ? WHERE id = ?", (t_30m_ago, t_id))
             conn.commit()
+        db.rebuild_trace_state()
 
         cand = db.get_next_node_to_trace(
             hops_limit=2,
@@ -343,6 +344,7 @@ class TestPingRouters(unittest.TestCase):
         with db._connect() as conn:
             conn.execute("UPDATE traces SET updated_at = ? WHERE id = ?", (t_70m_ago, t_id))
             conn.commit()
+        db.rebuild_trace_state()
 
         cand = db.get_next_node_to_trace(
             hops_limit=2,
@@ -362,6 +364,7 @@ class TestPingRouters(unittest.TestCase):
             with db._connect() as conn:
                 conn.execute("UPDATE traces SET updated_at = ? WHERE id = ?", (t_2h_ago, t_extra))
                 conn.commit()
+        db.rebuild_trace_state()
 
         cand = db.get_next_node_to_trace(
             hops_limit=2,
@@ -378,6 +381,7 @@ class TestPingRouters(unittest.TestCase):
         with db._connect() as conn:
             conn.execute("UPDATE traces SET updated_at = ? WHERE \"to\" = ?", (t_25h_ago, router_id))
             conn.commit()
+        db.rebuild_trace_state()
 
         cand = db.get_next_node_to_trace(
             hops_limit=2,
@@ -396,6 +400,7 @@ class TestPingRouters(unittest.TestCase):
         with db._connect() as conn:
             conn.execute("UPDATE traces SET updated_at = ? WHERE id = ?", (t_2h_ago, t_success))
             conn.commit()
+        db.rebuild_trace_state()
 
         cand = db.get_next_node_to_trace(
             hops_limit=2,
@@ -0,0 +1,97 @@
+import unittest
+import os
+import tempfile
+import shutil
+from contextlib import closing
+from unittest import mock
+
+from create_db import POLL_TALLY_MIGRATION_TASK, _backfill_poll_tallies
+from Models.Database import Database
+from Services.Gateway import GatewayService
+
+
+class TestPollTallies(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.test_dir, "test_poll_tallies.sql"))
+        self.poll = self.db.encuesta_create(owner_node_id="!owner", question="¿Playa?", options=["Sí", "No", "Quizá"])
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_votes_and_changes_update_tally(self):
+        self.assertEqual(self.db.encuesta_vote(self.poll, "!a", 0), "new")
+        self.assertEqual(self.db.encuesta_vote(self.poll, "!b", 0), "new")
+        self.assertEqual(self.db.encuesta_vote(self.poll, "!c", 2), "new")
+        self.assertEqual(self.db.encuesta_results(self.poll), {"counts": [2, 0, 1], "total": 3})
+
+        self.assertEqual(self.db.encuesta_vote(self.poll, "!b", 1), "changed")
+        self.assertEqual(self.db.encuesta_vote(self.poll, "!b", 1), "same")
+        self.assertEqual(self.db.encuesta_results(self.poll), {"counts": [1, 1, 1], "total": 3})
+
+        self.assertTrue(self.db.encuesta_delete(self.poll, "!owner"))
+        self.assertEqual(self.db.encuesta_results(self.poll), {"counts": [], "total": 0})
+        with closing(self.db._connect()) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM encuesta_recuento").fetchone()[0], 0)
+
+    def test_list_active_with_results_in_one_query(self):
+        other = self.db.encuesta_create(owner_node_id="!other", question="¿Cena?", options=["A", "B"])
+        empty = self.db.encuesta_create(owner_node_id="!third", question="¿Nada?", options=["X", "Y"])
+        self.db.encuesta_vote(self.poll, "!a", 1)
+        self.db.encuesta_vote(other, "!a", 0)
+        self.db.encuesta_vote(other, "!b", 0)
+
+        statements = []
+        real_connect = self.db._connect
+
+        def tracing_connect():
+            conn = real_connect()
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        with mock.patch.object(self.db, "_connect", side_effect=tracing_connect):
+            polls = self.db.encuesta_list_active(with_results=True)
+        self.assertEqual(len([s for s in statements if s.lstrip().upper().startswith("SELECT")]), 1)
+        by_id = {p["id"]: p for p in polls}
+        self.assertEqual(by_id[self.poll]["counts"], [0, 1, 0])
+        self.assertEqual((by_id[other]["counts"], by_id[other]["total_votes"]), ([2, 0], 2))
+        self.assertEqual((by_id[empty]["counts"], by_id[empty]["total_votes"]), ([0, 0], 0))
+        self.assertEqual([p["id"] for p in polls], [p["id"] for p in self.db.encuesta_list_active()])
+
+    def test_gateway_get_polls_does_not_query_per_poll(self):
+        self.db.encuesta_vote(self.poll, "!a", 2)
+        gateway = GatewayService(host="127.0.0.1", port=8690)
+        gateway.db = self.db
+        with mock.patch.object(self.db, "encuesta_results", side_effect=AssertionError("consulta por encuesta")):
+            data = gateway._execute_action("get_polls", {})
+        self.assertEqual(data["polls"][0]["counts"], [0, 0, 1])
+        self.assertEqual(data["polls"][0]["total_votes"], 1)
+
+    def test_poll_updated_event(self):
+        with mock.patch("Models.EventBroadcaster.broadcast_event") as broadcast:
+            self.db.encuesta_vote(self.poll, "!a", 1)
+            self.db.encuesta_vote(self.poll, "!a", 1)
+            self.db.encuesta_close(self.poll, "!owner")
+        events = [c.args for c in broadcast.call_args_list]
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0][0], "poll_updated")
+        self.assertEqual(events[0][1], {"poll_id": self.poll, "reason": "vote", "vote": "new", "status": "active",
+                                        "counts": [0, 1, 0], "total_votes": 1})
+        self.assertEqual((events[1][1]["reason"], events[1][1]["status"]), ("closed", "closed"))
+
+    def test_backfill_rebuilds_tally_from_votes(self):
+        self.db.encuesta_vote(self.poll, "!a", 0)
+        self.db.encuesta_vote(self.poll, "!b", 2)
+        with closing(self.db._connect()) as conn:
+            # BD anterior a encuesta_recuento: votos sin recuento ni marca
+            conn.execute("DELETE FROM encuesta_recuento")
+            conn.execute("DELETE FROM tasks_control WHERE name = ?", (POLL_TALLY_MIGRATION_TASK,))
+            conn.commit()
+            self.assertEqual(_backfill_poll_tallies(conn), 2)
+            self.assertEqual(_backfill_poll_tallies(conn), 0)
+        self.assertEqual(self.db.encuesta_results(self.poll), {"counts": [1, 0, 1], "total": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
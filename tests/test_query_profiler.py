@@ -0,0 +1,93 @@
+import unittest
+import json
+import os
+import sqlite3
+import tempfile
+import shutil
+import threading
+import time
+from contextlib import closing
+import env
+from Models.Database import Database
+from Models.QueryProfiler import QueryProfiler, format_report
+
+
+class TestQueryProfiler(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.profile_dir = os.path.join(self.test_dir, "profile")
+        self._previous = getattr(env, 'DB_PROFILE', False)
+        self.db = Database(os.path.join(self.test_dir, "test_profiler.sql"))
+        env.DB_PROFILE = True
+        QueryProfiler._instance = QueryProfiler(slow_ms=1000, profile_dir=self.profile_dir, dump_interval=3600)
+        self.profiler = QueryProfiler._instance
+
+    def tearDown(self):
+        env.DB_PROFILE = self._previous
+        QueryProfiler._instance = None
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _method(self, name):
+        return next(m for m in self.profiler.snapshot()["methods"] if m["method"] == name)
+
+    def test_calls_rows_and_latency_per_method(self):
+        self.db.upsert_nodes({f"!{i:08x}": {"short_name": f"N{i}"} for i in range(10)})
+        for _ in range(3):
+            self.db.get_node("!00000001")
+        self.db.get_all_nodes()
+
+        get_node = self._method("Database.get_node")
+        self.assertEqual(get_node["calls"], 3)
+        self.assertEqual(get_node["rows"], 3)
+        self.assertGreater(get_node["p95_ms"], 0)
+        self.assertEqual(self._method("Database.get_all_nodes")["rows"], 10)
+        self.assertGreaterEqual(self._method("Database.upsert_nodes")["rows"], 10)
+
+    def test_full_scans_are_explained(self):
+        self.db.get_all_nodes()
+        self.db.get_node("!00000001")
+        scans = {s["method"]: s for s in self.profiler.snapshot()["full_scans"]}
+        self.assertIn("nodes", scans["Database.get_all_nodes"]["tables"])
+        self.assertNotIn("Database.get_node", scans)
+
+    def test_slow_queries_are_logged(self):
+        self.profiler.slow_ms = 0
+        self.db.get_node("!00000001")
+        slow = self.profiler.snapshot()["slow_queries"]
+        self.assertTrue(any(s["method"] == "Database.get_node" for s in slow))
+        with open(os.path.join(self.profile_dir, "slow_queries.log"), encoding="utf-8") as fh:
+            self.assertIn("Database.get_node", fh.read())
+
+    def test_lock_wait_is_measured(self):
+        blocker = sqlite3.connect(self.db.db_path, timeout=10, check_same_thread=False)
+        blocker.execute("BEGIN IMMEDIATE")
+
+        def release():
+            time.sleep(0.2)
+            blocker.commit()
+
+        thread = threading.Thread(target=release)
+        thread.start()
+        self.db.set_task_run("prueba")
+        thread.join()
+        blocker.close()
+        self.assertGreaterEqual(self._method("Database.set_task_run")["lock_wait_ms"], 150)
+
+    def test_dump_and_report(self):
+        self.db.get_node("!00000001")
+        path = self.profiler.dump()
+        with open(path, encoding="utf-8") as fh:
+            self.assertEqual(json.load(fh)["pid"], os.getpid())
+        dumps = QueryProfiler.load_dumps(self.profile_dir)
+        self.assertIn("Database.get_node", format_report(dumps))
+
+    def test_disabled_uses_plain_cursor(self):
+        env.DB_PROFILE = False
+        with closing(self.db._connect()) as conn:
+            self.assertIs(type(conn.execute("SELECT 1")), sqlite3.Cursor)
+        self.assertEqual(self.profiler.snapshot()["methods"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
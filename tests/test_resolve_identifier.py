@@ -0,0 +1,59 @@
+import unittest
+import os
+import tempfile
+import shutil
+from contextlib import closing
+from Models.Database import Database
+
+
+class TestResolveIdentifier(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.test_dir, "test_resolve.sql"))
+        self.db.upsert_nodes({
+            "!0000abcd": {"num": 0xabcd, "short_name": "Rau0", "name": "Azotea Raul"},
+            "!00001234": {"num": 0x1234, "short_name": "BASE", "name": "Base Norte"},
+            "!00005678": {"num": 0x5678, "short_name": "base", "name": "Base Sur"},
+        })
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_all_identifier_kinds(self):
+        cases = {
+            "!0000ABCD": ("node_id", "!0000abcd"),
+            # El decimal también se prueba como !hex (nodos aún sin num en BD)
+            str(0xabcd): ("node_id", "!0000abcd"),
+            "rau0": ("short_name", "!0000abcd"),
+            "AZOTEA raul": ("name", "!0000abcd"),
+        }
+        for ident, (kind, node_id) in cases.items():
+            res = self.db.resolve_identifier(ident)
+            self.assertEqual((res["kind"], res["node"]["node_id"]), (kind, node_id), ident)
+            self.assertFalse(res["ambiguous"])
+        self.db.upsert_nodes({"!0000ffff": {"num": 77}})
+        self.assertEqual(self.db.resolve_identifier("77")["kind"], "num")
+        self.assertEqual(self.db.get_node_by_identifier("Rau0")["node_id"], "!0000abcd")
+        self.assertIsNone(self.db.resolve_identifier("nadie")["node"])
+
+    def test_short_name_collision_is_reported(self):
+        res = self.db.resolve_identifier("Base")
+        self.assertTrue(res["ambiguous"])
+        self.assertEqual({c["node_id"] for c in res["candidates"]}, {"!00001234", "!00005678"})
+        # Un nombre largo exacto no es ambiguo
+        self.assertFalse(self.db.resolve_identifier("base norte")["ambiguous"])
+
+    def test_lookups_use_nocase_indexes(self):
+        with closing(self.db._connect()) as conn:
+            for col in ("short_name", "name"):
+                plan = " ".join(
+                    r[3] for r in conn.execute(
+                        f"EXPLAIN QUERY PLAN SELECT node_id FROM nodes WHERE {col} = ? COLLATE NOCASE", ("x",)
+                    )
+                )
+                self.assertIn(f"idx_nodes_{col}_nocase", plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
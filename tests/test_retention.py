@@ -0,0 +1,79 @@
+import unittest
+import os
+import gzip
+import json
+import tempfile
+import shutil
+import time
+from Models.Database import Database
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_retention.sql")
+        self.db = Database(self.db_path)
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _age(self, table, ids, column, days):
+        with self.db._connect() as conn:
+            conn.executemany(
+                f"UPDATE {table} SET {column} = ? WHERE id = ?",
+                [(int(time.time()) - days * 86400, i) for i in ids],
+            )
+            conn.commit()
+
+    def test_purges_in_batches_only_expired_rows(self):
+        ids = [self.db.save_ping("!a", "!b", "{}") for _ in range(12)]
+        self._age("pings", ids[:7], "created_ts", 100)
+
+        deleted = self.db.purge_expired("pings", int(time.time()) - 90 * 86400, batch_size=3, max_batches=2, pause=0)
+        self.assertEqual(deleted, 6)
+        deleted = self.db.purge_expired("pings", int(time.time()) - 90 * 86400, batch_size=3, max_batches=2, pause=0)
+        self.assertEqual(deleted, 1)
+        with self.db._connect() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM pings").fetchone()[0], 5)
+
+    def test_outbox_keeps_pending_and_traces_drop_hops(self):
+        sent = self.db.enqueue_outbox("enviado")
+        self.db.mark_outbox_sent(sent)
+        pending = self.db.enqueue_outbox("pendiente")
+        self._age("outbox", [sent, pending], "created_ts", 40)
+        self._age("outbox", [sent], "updated_ts", 40)
+
+        trace_id = self.db.enqueue_trace("!00000001")
+        self.db.mark_trace_done_with_route(trace_id, False, text="error", hops=[{"id": "!00000002", "snr": 1.0}])
+        self._age("traces", [trace_id], "updated_ts", 40)
+
+        limit = int(time.time()) - 30 * 86400
+        archive = os.path.join(self.test_dir, "archive")
+        self.assertEqual(self.db.purge_expired("outbox", limit, pause=0), 1)
+        self.assertEqual(self.db.purge_expired("traces", limit, pause=0), 0)
+        self.assertEqual(self.db.purge_expired("traces_error", limit, archive_dir=archive, pause=0), 1)
+
+        self.assertEqual(self.db.get_next_pending_outbox()["id"], pending)
+        self.assertEqual(self.db.get_trace_hops([trace_id])[trace_id]["forward"], [])
+        archived = [f for f in os.listdir(archive)]
+        self.assertEqual(len(archived), 2)
+        with gzip.open(os.path.join(archive, [f for f in archived if f.startswith("traces-")][0]), "rt") as fh:
+            self.assertEqual(json.loads(fh.readline())["id"], trace_id)
+
+    def test_compact_reclaims_pages(self):
+        with self.db._connect() as conn:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+        for _ in range(200):
+            self.db.save_ping("!a", "!b", "x" * 2000)
+        with self.db._connect() as conn:
+            conn.execute("UPDATE pings SET created_ts = 0")
+            conn.commit()
+        self.db.purge_expired("pings", int(time.time()), batch_size=500, pause=0)
+        stats = self.db.compact()
+        self.assertGreater(stats["reclaimed_pages"], 50)
+        self.assertEqual(stats["freelist_after"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
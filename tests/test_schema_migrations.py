@@ -0,0 +1,107 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import shutil
+from contextlib import closing
+from unittest import mock
+
+import create_db
+from create_db import SCHEMA_VERSION, TRACES_REBUILD_TASK, _rebuild_traces, ensure_database
+from Models.Database import Database
+
+
+class TestSchemaMigrations(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_migrations.sql")
+
+    def tearDown(self):
+        Database.close_connections()
+        create_db._VERIFIED.clear()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _user_version(self):
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def test_current_database_needs_one_pragma_read(self):
+        ensure_database(self.db_path)
+        self.assertEqual(self._user_version(), SCHEMA_VERSION)
+
+        statements = []
+        real_connect = sqlite3.connect
+
+        def tracing_connect(*args, **kwargs):
+            conn = real_connect(*args, **kwargs)
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        create_db._VERIFIED.clear()
+        with mock.patch("create_db.sqlite3.connect", side_effect=tracing_connect):
+            ensure_database(self.db_path)
+        self.assertEqual(statements, ["PRAGMA user_version"])
+
+    def test_only_pending_steps_run(self):
+        ensure_database(self.db_path)
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            conn.execute("PRAGMA user_version = 5")
+        create_db._VERIFIED.clear()
+
+        ran = []
+        steps = tuple((v, name, lambda conn, name=name: ran.append(name)) for v, name, _ in create_db.MIGRATIONS)
+        with mock.patch.object(create_db, "MIGRATIONS", steps):
+            ensure_database(self.db_path)
+            self.assertEqual(ran, ["poll_tallies", "mirror_triggers", "outbox_v2", "trace_rtt",
+                                   "trace_routes_backfill", "trace_state_recency", "chiste_dm_bag"])
+            self.assertEqual(self._user_version(), SCHEMA_VERSION)
+
+            # Una BD de una versión más nueva del código no se toca
+            with closing(sqlite3.connect(self.db_path)) as conn:
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+            ran.clear()
+            ensure_database(self.db_path, force=True)
+            self.assertEqual(ran, [])
+
+    def test_legacy_traces_rebuilt_in_chunks(self):
+        hop_cols = ", ".join(
+            f"{p}{i}_id TEXT, {p}{i}_snr REAL, {p}{i}_rssi REAL" for p in ("hop", "hop_return") for i in range(1, 8)
+        )
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                'CREATE TABLE traces (id INTEGER PRIMARY KEY AUTOINCREMENT, "from" TEXT NOT NULL, "to" TEXT NOT NULL, '
+                f'data_raw TEXT NOT NULL, status TEXT, created_at TEXT, updated_at TEXT, {hop_cols})'
+            )
+            for n in range(1, 8):
+                conn.execute(
+                    'INSERT INTO traces ("from", "to", data_raw, status, created_at, updated_at, hop1_id, hop1_snr) '
+                    "VALUES ('!base', ?, '{}', 'done', '2024-01-01T10:00:00', '2024-01-01T10:00:05', ?, 6.5)",
+                    (f"!dest{n}", f"!dest{n}"),
+                )
+            conn.execute("DELETE FROM traces WHERE id = 7")
+
+        with mock.patch("create_db._rebuild_traces", side_effect=lambda conn: _rebuild_traces(conn, chunk_size=2)):
+            ensure_database(self.db_path)
+
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            cols = {r[1]: r[3] for r in conn.execute("PRAGMA table_info(traces)")}
+            self.assertEqual(cols["from"], 0)
+            self.assertEqual(cols["data_raw"], 0)
+            self.assertNotIn("hop1_id", cols)
+            self.assertIn("updated_ts", cols)
+            rows = conn.execute('SELECT id, "to", status, created_ts FROM traces ORDER BY id').fetchall()
+            self.assertEqual([r[0] for r in rows], [1, 2, 3, 4, 5, 6])
+            self.assertTrue(all(r[2] == "done" and r[3] is not None for r in rows))
+            # Los saltos heredados se copiaron antes de reconstruir
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM trace_hops").fetchone()[0], 6)
+            marker = conn.execute("SELECT extra FROM tasks_control WHERE name = ?", (TRACES_REBUILD_TASK,)).fetchone()
+            self.assertEqual(marker[0], "done")
+            self.assertGreaterEqual(conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE tbl_name = 'traces' "
+                                                 "AND type = 'index'").fetchone()[0], 4)
+
+        # El autoincremento no reutiliza el id borrado
+        self.assertEqual(Database(self.db_path).enqueue_trace("!nuevo"), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+import os
+import tempfile
+import shutil
+import threading
+import time
+from contextlib import closing
+from unittest import mock
+
+import env
+from Models.Database import Database
+from Models.Storage import StorageMonitor, connection_pragmas, storage_settings
+from Models.WriteBatcher import WriteBatcher
+
+STORAGE_VARS = ("DB_STORAGE_MODE", "DB_WAL_AUTOCHECKPOINT", "DB_JOURNAL_SIZE_LIMIT", "DB_MMAP_SIZE",
+                "DB_CHECKPOINT_INTERVAL", "DB_WRITE_BATCH_INTERVAL")
+
+
+class TestStorageMode(unittest.TestCase):
+    def setUp(self):
+        self._saved = {name: getattr(env, name, None) for name in STORAGE_VARS}
+        for name in STORAGE_VARS:
+            setattr(env, name, None)
+        env.DB_STORAGE_MODE = "sdcard"
+        WriteBatcher._instance = None
+        Database.close_connections()
+        self.test_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.test_dir, "test_storage.sql"))
+
+    def tearDown(self):
+        for name, value in self._saved.items():
+            setattr(env, name, value)
+        WriteBatcher._instance = None
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _count(self, table):
+        with closing(self.db._connect()) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def test_settings_and_connection_pragmas(self):
+        env.DB_MMAP_SIZE = 1024 * 1024
+        settings = storage_settings()
+        self.assertEqual(settings["mode"], "sdcard")
+        self.assertEqual(settings["wal_autocheckpoint"], 4000)
+        self.assertEqual(settings["mmap_size"], 1024 * 1024)
+        self.assertIn("PRAGMA journal_size_limit = 16777216", connection_pragmas(settings))
+
+        Database.close_connections()
+        with closing(self.db._connect()) as conn:
+            self.assertEqual(conn.execute("PRAGMA wal_autocheckpoint").fetchone()[0], 4000)
+            self.assertEqual(conn.execute("PRAGMA journal_size_limit").fetchone()[0], 16 * 1024 * 1024)
+
+        env.DB_STORAGE_MODE = "default"
+        env.DB_MMAP_SIZE = None
+        self.assertEqual(connection_pragmas(), [])
+
+    def test_low_value_writes_are_grouped(self):
+        self.assertEqual(self.db.log_command(node_id="!aaaa0001", command="ping", message="hola"), 0)
+        self.assertEqual(self.db.save_ping("!aaaa0001", "!bot", "ping", hops=2), 0)
+        self.db.log_command(node_id="!aaaa0002", command="clima")
+        self.assertEqual((self._count("commands_sent"), self._count("pings")), (0, 0))
+
+        batcher = WriteBatcher.active()
+        self.assertEqual(batcher.pending_count(), 3)
+        self.assertEqual(batcher.flush(self.db), 3)
+        self.assertEqual((self._count("commands_sent"), self._count("pings")), (2, 1))
+        self.assertEqual(self.db.stats_summary()["cmd_total"], 2)
+        self.assertEqual(batcher.snapshot()["flushes"], 1)
+
+    def test_batch_size_forces_flush_and_default_mode_commits(self):
+        WriteBatcher._instance = WriteBatcher(flush_interval=3600, max_pending=2)
+        self.db.log_command(node_id="!aaaa0001", command="ping")
+        self.db.log_command(node_id="!aaaa0001", command="ping")
+        self.assertEqual(self._count("commands_sent"), 2)
+
+        WriteBatcher._instance = WriteBatcher(flush_interval=0)
+        self.assertIsNone(WriteBatcher.active())
+        self.assertGreater(self.db.log_command(node_id="!aaaa0001", command="ping"), 0)
+
+        # Sin agrupado configurado no se crea el singleton
+        WriteBatcher._instance = None
+        env.DB_STORAGE_MODE = "default"
+        self.assertIsNone(WriteBatcher.active())
+        self.assertGreater(self.db.log_command(node_id="!aaaa0001", command="ping"), 0)
+        self.assertIsNone(WriteBatcher._instance)
+
+    def test_passive_checkpoint_metrics(self):
+        for i in range(20):
+            self.db.create_node_if_not_exists(f"!c{i:07x}")
+        monitor = StorageMonitor(settings={**storage_settings(), "checkpoint_interval": 60})
+        self.assertIsNone(monitor.run_if_due(self.db))
+
+        result = monitor.checkpoint(self.db)
+        self.assertEqual(result["busy"], 0)
+        self.assertEqual(result["checkpointed_frames"], result["log_frames"])
+        snap = monitor.snapshot()
+        self.assertEqual((snap["mode"], snap["checkpoints"]), ("sdcard", 1))
+        self.assertEqual(snap["checkpointed_bytes"], result["checkpointed_bytes"])
+        self.assertIn("write_bytes_per_hour", snap)
+        with self.assertRaises(ValueError):
+            self.db.wal_checkpoint("NOW")
+
+    def test_batcher_singleton_created_once_across_threads(self):
+        class SlowBatcher(WriteBatcher):
+            _instance = None
+
+            def __init__(self):
+                time.sleep(0.02)
+                super().__init__(flush_interval=3600)
+
+        seen = []
+        with mock.patch("Models.WriteBatcher.atexit.register") as register:
+            threads = [threading.Thread(target=lambda: seen.append(SlowBatcher.get_instance())) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len({id(b) for b in seen}), 1)
+        self.assertEqual(register.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
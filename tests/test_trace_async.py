@@ -0,0 +1,97 @@
+import unittest
+import time
+from types import SimpleNamespace
+
+from meshtastic.protobuf import mesh_pb2
+
+from Models.SerialInterface import SerialInterface
+from Models.TraceRoute import UNK_SNR, TraceTracker
+from Models.TxScheduler import TxScheduler
+
+US, HOP, DEST = 0x0000beef, 0x11111111, 0x22222222
+
+
+class FakeMesh:
+    """Interfaz Meshtastic mínima: sendData anota el handler como la librería."""
+
+    def __init__(self):
+        self.responseHandlers = {}
+        self.sent = []
+        self._next_id = 100
+
+    def sendData(self, data, destinationId, portNum, wantResponse, onResponse, channelIndex, hopLimit):
+        self._next_id += 1
+        self.responseHandlers[self._next_id] = onResponse
+        self.sent.append((destinationId, portNum, hopLimit))
+        return SimpleNamespace(id=self._next_id)
+
+    def respond(self, request_id, decoded, **packet):
+        handler = self.responseHandlers.pop(request_id)
+        handler({'from': DEST, 'to': US, 'decoded': {'requestId': request_id, **decoded}, **packet})
+
+
+class TestTraceAsync(unittest.TestCase):
+    def setUp(self):
+        self.interface = SerialInterface("/dev/null")
+        self.interface.interface = FakeMesh()
+        self.interface.tx = TxScheduler(min_gap=0)
+        self.interface.traces = TraceTracker(timeout=30)
+
+    def _start(self, trace_id):
+        future = self.interface.start_traceroute(trace_id, f"!{DEST:08x}")
+        self.assertTrue(future.result(timeout=5))
+        return self.interface.interface._next_id
+
+    def test_route_discovery_completes_without_blocking(self):
+        request_id = self._start(7)
+        self.assertEqual(self.interface.traces.in_flight(), 1)
+        self.assertEqual(self.interface.traces.drain(), [])
+
+        route = mesh_pb2.RouteDiscovery(route=[HOP], snr_towards=[24, UNK_SNR],
+                                        route_back=[HOP], snr_back=[-10, 30])
+        self.interface.interface.respond(request_id, {'portnum': 'TRACEROUTE_APP',
+                                                      'payload': route.SerializeToString()}, hopStart=3)
+
+        [result] = self.interface.traces.drain()
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['trace_id'], 7)
+        self.assertEqual(result['forward'], [{'id': '!11111111', 'snr': 6.0}, {'id': '!22222222', 'snr': None}])
+        self.assertEqual(result['backward'], [{'id': '!11111111', 'snr': -2.5}, {'id': '!0000beef', 'snr': 7.5}])
+        self.assertEqual(result['text'].splitlines(), [
+            "Route traced towards destination:",
+            "!0000beef --> !11111111 (6.0dB) --> !22222222 (?dB)",
+            "Route traced back to us:",
+            "!22222222 --> !11111111 (-2.5dB) --> !0000beef (7.5dB)",
+        ])
+        self.assertEqual(self.interface.traces.in_flight(), 0)
+
+    def test_routing_error_and_timeout(self):
+        request_id = self._start(1)
+        self.interface.interface.respond(request_id, {'portnum': 'ROUTING_APP',
+                                                      'routing': {'errorReason': 'NO_RESPONSE'}})
+        [result] = self.interface.traces.drain()
+        self.assertEqual((result['ok'], result['error']), (False, "Routing: NO_RESPONSE"))
+
+        self.interface.traces.timeout = 0.01
+        request_id = self._start(2)
+        self.assertIsNotNone(self.interface.traces.next_deadline())
+        time.sleep(0.02)
+        self.assertEqual(self.interface.expire_traces(), 1)
+        # El handler caducado se suelta en la librería
+        self.assertNotIn(request_id, self.interface.interface.responseHandlers)
+        [result] = self.interface.traces.drain()
+        self.assertEqual((result['trace_id'], result['error']), (2, 'Timeout'))
+
+        snap = self.interface.traces.snapshot()
+        self.assertEqual((snap["failed"], snap["timeouts"], snap["in_flight"]), (1, 1, 0))
+
+    def test_send_failure_completes_trace(self):
+        self.interface.interface = None
+        self.assertFalse(self.interface.start_traceroute(3, "!22222222").result(timeout=5))
+        [result] = self.interface.traces.drain()
+        self.assertFalse(result['ok'])
+        self.assertIn("no conectada", result['error'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import shutil
+from Models.Database import Database
+from create_db import ensure_database, _backfill_trace_hops
+
+
+class TestTraceHops(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_trace_hops.sql")
+        self.db = Database(self.db_path)
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_long_route_is_not_truncated(self):
+        self.db.create_node_if_not_exists("!00000005")
+        self.db.update_node("!00000005", {"name": "Quinto", "short_name": "N5"})
+        trace_id = self.db.enqueue_trace("!00000009")
+        hops = [{"id": f"!0000000{i}", "snr": float(i)} for i in range(1, 10)]
+        back = [{"id": f"!0000000{i}", "snr": -float(i)} for i in range(9, 0, -1)]
+        self.db.mark_trace_done_with_route(trace_id, True, text="ok", hops=hops, return_hops=back)
+
+        route = self.db.get_trace_hops([trace_id])[trace_id]
+        self.assertEqual([h["id"] for h in route["forward"]], [h["id"] for h in hops])
+        self.assertEqual(len(route["return"]), 9)
+        self.assertEqual(route["forward"][4]["name_short"], "N5")
+
+        recent = self.db.get_recent_traces(limit=5)
+        self.assertEqual(len(recent[0]["hops_forward"]), 9)
+        self.assertEqual(recent[0]["hops_forward"][4]["name"], "Quinto")
+        self.assertEqual(recent[0]["hops"], 8)
+
+        history = self.db.get_node_link_history("!00000005")
+        self.assertEqual({h["direction"] for h in history}, {"forward", "return"})
+
+    def test_remarking_trace_replaces_hops(self):
+        trace_id = self.db.enqueue_trace("!00000002")
+        self.db.mark_trace_done_with_route(trace_id, True, text="ok", hops=[{"id": "!00000001"}, {"id": "!00000002"}])
+        self.db.mark_trace_done_with_route(trace_id, True, text="ok", hops=[{"id": "!00000002"}])
+        route = self.db.get_trace_hops([trace_id])[trace_id]
+        self.assertEqual([h["id"] for h in route["forward"]], ["!00000002"])
+
+    def test_backfill_from_legacy_columns_in_chunks(self):
+        legacy = os.path.join(self.test_dir, "legacy.sql")
+        with sqlite3.connect(legacy) as conn:
+            cols = ", ".join(
+                f"{p}{i}_id TEXT, {p}{i}_name TEXT, {p}{i}_name_short TEXT, {p}{i}_snr REAL, {p}{i}_rssi REAL"
+                for p in ("hop", "hop_return") for i in range(1, 8)
+            )
+            conn.execute(
+                f'CREATE TABLE traces (id INTEGER PRIMARY KEY AUTOINCREMENT, "from" TEXT NULL, "to" TEXT NOT NULL, '
+                f'data_raw TEXT NULL, status TEXT, created_at TEXT, updated_at TEXT, hops INTEGER, hops_back INTEGER, '
+                f'to_name TEXT, to_name_short TEXT, {cols})'
+            )
+            for n in range(1, 8):
+                conn.execute(
+                    'INSERT INTO traces ("to", status, hop1_id, hop1_snr, hop2_id, hop2_snr, hop_return1_id, hop_return1_snr) '
+                    "VALUES (?, 'done', '!base', 10.0, ?, 4.5, '!base', 5.0)",
+                    (f"!dest{n}", f"!dest{n}"),
+                )
+
+        ensure_database(legacy)
+        with sqlite3.connect(legacy) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM trace_hops").fetchone()[0], 21)
+            self.assertEqual(
+                conn.execute("SELECT extra FROM tasks_control WHERE name = 'migration_trace_hops'").fetchone()[0],
+                "done",
+            )
+            # Reanudar desde un progreso parcial no duplica ni repite trabajo
+            conn.execute("UPDATE tasks_control SET extra = '3' WHERE name = 'migration_trace_hops'")
+            conn.execute("DELETE FROM trace_hops WHERE trace_id > 3")
+            conn.commit()
+            self.assertEqual(_backfill_trace_hops(conn, chunk_size=2), 12)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM trace_hops").fetchone()[0], 21)
+
+        info = Database(legacy).get_latest_trace_route_info("!dest1", ["RAU0", "!base"])
+        self.assertEqual(info["snrs"], [5.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from meshtastic.protobuf import mesh_pb2
+
+from Models.Database import Database
+from Models.SerialInterface import SerialInterface
+from Models.TraceRoute import TraceTracker, enqueue_next_traces, trace_policy
+from Models.TxScheduler import TxScheduler
+
+
+class FakeMesh:
+    """sendData que anota el handler por id de paquete, como la librería."""
+
+    def __init__(self):
+        self.responseHandlers = {}
+        self._next_id = 500
+
+    def sendData(self, data, **kwargs):
+        self._next_id += 1
+        self.responseHandlers[self._next_id] = kwargs["onResponse"]
+        return type("Packet", (), {"id": self._next_id})()
+
+    def respond(self, request_id, decoded):
+        handler = self.responseHandlers.pop(request_id)
+        handler({'from': 0x33333333, 'to': 0xbeef, 'decoded': {'requestId': request_id, **decoded}})
+
+
+class TestTracePipeline(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db = Database(os.path.join(self.test_dir, "test_trace_pipeline.sql"))
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _node(self, node_id, hops):
+        self.db.create_node_if_not_exists(node_id)
+        self.db.update_node(node_id, {"hops": hops})
+
+    def _done(self, node_id, relays, rtt_ms):
+        trace_id = self.db.enqueue_trace(node_id)
+        hops = [{"id": f"!r{i:07d}"} for i in range(relays)] + [{"id": node_id}]
+        self.db.mark_trace_done_with_route(trace_id, True, text="t", hops=hops, rtt_ms=rtt_ms)
+
+    def test_rtt_history_per_node_and_hop_count(self):
+        self._node("!00000001", 1)
+        self._node("!00000002", 1)
+        self._node("!00000003", 2)
+        self._done("!00000001", 1, 8000)
+        self._done("!00000001", 1, 4000)
+        # Media móvil del propio nodo
+        self.assertEqual(self.db.get_trace_rtt("!00000001"), 7000)
+        # Sin histórico propio: media de los nodos a la misma distancia
+        self.assertEqual(self.db.get_trace_rtt("!00000002"), 7000)
+        self.assertIsNone(self.db.get_trace_rtt("!00000003"))
+        self.assertIsNone(self.db.get_trace_rtt("!desconocido"))
+
+        # Un error no altera el histórico
+        trace_id = self.db.enqueue_trace("!00000001")
+        self.db.mark_trace_done_with_route(trace_id, False, text="Timeout", rtt_ms=None)
+        self.assertEqual(self.db.get_trace_rtt("!00000001"), 7000)
+
+    def test_pending_queue_skips_traces_in_flight(self):
+        first = self.db.enqueue_trace("!00000001")
+        second = self.db.enqueue_trace("!00000002")
+        self.assertEqual(self.db.count_pending_traces(), 2)
+        self.assertEqual(self.db.get_next_pending_trace()["id"], first)
+        self.assertEqual(self.db.get_next_pending_trace(exclude_ids=[first])["id"], second)
+        self.assertIsNone(self.db.get_next_pending_trace(exclude_ids=[first, second]))
+
+    def test_traces_in_flight_complete_independently(self):
+        interface = SerialInterface("/dev/null")
+        interface.interface = FakeMesh()
+        interface.tx = TxScheduler(min_gap=0)
+        interface.traces = TraceTracker(timeout=30, max_in_flight=2)
+        tracker = interface.traces
+        self.assertEqual(tracker.timeout_for(None), 30)
+        self.assertEqual(tracker.timeout_for(1000), tracker.min_timeout)
+        self.assertEqual(tracker.timeout_for(8000), 24)
+        self.assertEqual(tracker.timeout_for(60000), 30)
+
+        self.assertTrue(interface.start_traceroute(1, "!22222222", timeout=0.05).result(timeout=5))
+        slow_request = interface.interface._next_id
+        self.assertTrue(interface.start_traceroute(2, "!33333333", timeout=30).result(timeout=5))
+        fast_request = interface.interface._next_id
+        self.assertEqual(sorted(tracker.trace_ids()), [1, 2])
+
+        # La respuesta del segundo llega antes y se asocia por id de paquete
+        route = mesh_pb2.RouteDiscovery(snr_towards=[20])
+        interface.interface.respond(fast_request, {'portnum': 'TRACEROUTE_APP',
+                                                   'payload': route.SerializeToString()})
+        [result] = tracker.drain()
+        self.assertEqual((result['trace_id'], result['ok'], result['timeout']), (2, True, 30))
+        self.assertIsNotNone(result['rtt'])
+
+        time.sleep(0.1)
+        self.assertEqual(interface.expire_traces(), 1)
+        self.assertNotIn(slow_request, interface.interface.responseHandlers)
+        [result] = tracker.drain()
+        self.assertEqual((result['trace_id'], result['error']), (1, 'Timeout'))
+        self.assertEqual(tracker.snapshot()["in_flight"], 0)
+
+    def test_completed_trace_is_replaced_before_traces_interval(self):
+        self._node("!00000001", 1)
+        self._node("!00000002", 1)
+        policy = dict(trace_policy(), hops_limit=2, router_identifiers=[])
+        interface = SerialInterface("/dev/null")
+        interface.interface = FakeMesh()
+        interface.tx = TxScheduler(min_gap=0)
+        interface.traces = TraceTracker(timeout=30, max_in_flight=1)
+        interface.tx.airtime_budget = 5.0
+
+        [first] = enqueue_next_traces(self.db, 1, policy)
+        pending = self.db.get_next_pending_trace()
+        self.assertEqual(pending["id"], first)
+        self.assertTrue(interface.start_traceroute(first, pending["to"]).result(timeout=5))
+        route = mesh_pb2.RouteDiscovery(snr_towards=[20])
+        interface.interface.respond(interface.interface._next_id,
+                                    {'portnum': 'TRACEROUTE_APP', 'payload': route.SerializeToString()})
+        [result] = interface.traces.drain()
+        self.db.mark_trace_done_with_route(first, True, text=result['text'], hops=result['forward'])
+
+        # Recién completado: el cron esperaría TRACES_INTERVAL desde aquí
+        self.assertIsNotNone(self.db.get_last_trace_updated_at())
+        self.assertIsNone(self.db.get_next_pending_trace())
+        # Con presupuesto de aire el hueco libre se repone enseguida con otro nodo
+        self.assertTrue(interface.tx.airtime_available())
+        [second] = enqueue_next_traces(self.db, 1, policy)
+        replaced = self.db.get_next_pending_trace(exclude_ids=interface.traces.trace_ids())
+        self.assertEqual(replaced["id"], second)
+        self.assertNotEqual(replaced["to"], pending["to"])
+
+        # Sin candidatos con la ventana cumplida no se encola nada
+        self.db.mark_trace_done_with_route(second, True, text="t", hops=[{"id": replaced["to"]}])
+        self.assertEqual(enqueue_next_traces(self.db, 1, policy), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
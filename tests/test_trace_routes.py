@@ -0,0 +1,115 @@
+import unittest
+import os
+import tempfile
+import shutil
+from contextlib import closing
+import env
+from create_db import ensure_database
+from Models.Database import Database
+
+
+ROUTE_TEXT = (
+    "Route traced towards destination:\n"
+    "!63ca1feb --> !875e3787 (11.0dB) --> !2b39ef06 (9.0dB) --> !b2b8c605 (8.5dB)\n"
+    "Route traced back to us:\n"
+    "!b2b8c605 --> !2b39ef06 (9.25dB) --> !875e3787 (9.0dB) --> !63ca1feb (11.75dB)"
+)
+
+
+class TestTraceRoutes(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_trace_routes.sql")
+        self.db = Database(self.db_path)
+        env.BASE_NODE_SHORT_NAME = 'RAU0'
+        env.BASE_NODE_ID = '!875e3787'
+        self.db.create_node_if_not_exists("!2b39ef06")
+        self.db.update_node("!2b39ef06", {"short_name": "herc"})
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _complete(self, node_id, text):
+        trace_id = self.db.enqueue_trace(node_id)
+        self.db.mark_trace_done_with_route(trace_id, True, text=text, hops=[], return_hops=[])
+        return trace_id
+
+    def test_route_is_stored_on_completion(self):
+        trace_id = self._complete("!b2b8c605", ROUTE_TEXT)
+        with closing(self.db._connect()) as conn:
+            row = dict(conn.execute("SELECT * FROM trace_routes WHERE node_id = '!b2b8c605'").fetchone())
+        self.assertEqual(row["trace_id"], trace_id)
+        self.assertEqual(row["hops"], 1)
+        self.assertEqual(row["snr_text"], "9.0dB, 9.2dB")
+
+        info = self.db.get_latest_trace_route_info("!b2b8c605")
+        self.assertEqual(info["intermediates"], ["herc"])
+        self.assertEqual(info["path"], ["!875e3787", "!2b39ef06", "!b2b8c605"])
+        self.assertEqual(info["snrs"], [9.0, 9.25])
+
+    def test_read_does_not_parse_again(self):
+        self._complete("!b2b8c605", ROUTE_TEXT)
+        calls = []
+        original = Database._parse_trace_route
+        Database._parse_trace_route = staticmethod(lambda *a: calls.append(a) or original(*a))
+        try:
+            routes = self.db.get_latest_trace_routes(["!b2b8c605", "!sin_trace"])
+        finally:
+            Database._parse_trace_route = staticmethod(original)
+        self.assertEqual(calls, [])
+        self.assertEqual(set(routes), {"!b2b8c605"})
+
+    def test_rename_invalidates_name_cache(self):
+        self._complete("!b2b8c605", ROUTE_TEXT)
+        self.assertEqual(self.db.get_latest_trace_route_info("!b2b8c605")["intermediates"], ["herc"])
+        self.db.upsert_nodes({"!2b39ef06": {"short_name": "HRC2"}})
+        self.assertEqual(self.db.get_latest_trace_route_info("!b2b8c605")["intermediates"], ["HRC2"])
+
+    def _route_count(self):
+        with closing(self.db._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM trace_routes").fetchone()[0]
+
+    def test_legacy_trace_is_backfilled_by_migration(self):
+        self._complete("!b2b8c605", ROUTE_TEXT)
+        with closing(self.db._connect()) as conn:
+            conn.execute("DELETE FROM trace_routes")
+            conn.commit()
+        # La lectura calcula la ruta en memoria pero no escribe
+        self.assertEqual(self.db.get_latest_trace_route_info("!b2b8c605")["hops"], 1)
+        self.assertEqual(self._route_count(), 0)
+
+        ensure_database(self.db_path, force=True)
+        self.assertEqual(self._route_count(), 1)
+        self.assertEqual(self.db.get_latest_trace_route_info("!b2b8c605")["intermediates"], ["herc"])
+
+    def test_name_lookup_reads_stored_route(self):
+        trace_id = self._complete("!b2b8c605", ROUTE_TEXT)
+        with closing(self.db._connect()) as conn:
+            # Destino que no está en nodes: solo se conoce su nombre por el trace
+            conn.execute("UPDATE traces SET to_name_short = 'FARO' WHERE id = ?", (trace_id,))
+            conn.commit()
+        calls = []
+        original = Database._parse_trace_route
+        Database._parse_trace_route = staticmethod(lambda *a: calls.append(a) or original(*a))
+        try:
+            for _ in range(2):
+                self.assertEqual(self.db.get_latest_trace_route_info("faro")["hops"], 1)
+        finally:
+            Database._parse_trace_route = staticmethod(original)
+        self.assertEqual(calls, [])
+
+    def test_intermediates_match_short_name(self):
+        with closing(self.db._connect()) as conn:
+            names = self.db._resolve_node_names(conn, ["!2B39EF06", "HERC", "!ffffffff"])
+        self.assertEqual(names, {"!2B39EF06": "herc", "HERC": "herc", "!ffffffff": "!ffffffff"})
+
+    def test_failed_trace_keeps_previous_route(self):
+        self._complete("!b2b8c605", ROUTE_TEXT)
+        trace_id = self.db.enqueue_trace("!b2b8c605")
+        self.db.mark_trace_done_with_route(trace_id, False, text="Timeout", hops=[])
+        self.assertEqual(self.db.get_latest_trace_route_info("!b2b8c605")["hops"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import os
+import time
+import tempfile
+import shutil
+from datetime import datetime, timedelta
+from Models.Database import Database
+
+
+class TestTraceState(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, "test_trace_state.sql")
+        self.db = Database(self.db_path)
+
+    def tearDown(self):
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _state(self, node_id):
+        with self.db._connect() as conn:
+            row = conn.execute("SELECT * FROM trace_state WHERE node_id = ?", (node_id,)).fetchone()
+            return dict(row) if row else None
+
+    def _node(self, node_id, **data):
+        self.db.create_node_if_not_exists(node_id)
+        self.db.update_node(node_id, data)
+
+    def test_priorities_follow_node_attributes(self):
+        self._node("!router01", short_name="RT01", role=2, hops=1)
+        self._node("!client01", short_name="CL01", role=0, hops=1)
+        self._node("!mqtt0001", short_name="MQ01", role=0, hops=0, via_mqtt=True)
+        self._node("!far00001", short_name="FA01", role=0, hops=5)
+
+        self.assertEqual(self._state("!router01")["priority"], 0)
+        self.assertEqual(self._state("!client01")["priority"], 1)
+        self.assertEqual(self._state("!mqtt0001")["priority"], 2)
+        self.assertEqual(self._state("!far00001")["priority"], 2)
+        self.assertEqual(self.db.get_next_node_to_trace(), "!router01")
+
+        # Cambio de rol vía escritura agrupada (NodeStore) recalcula la prioridad
+        self.db.upsert_nodes({"!router01": {"role": 0}})
+        self.assertEqual(self._state("!router01")["priority"], 1)
+
+    def test_never_traced_prefers_recently_updated(self):
+        now = datetime.now()
+        for n, age_min in (("!client01", 30), ("!client02", 5), ("!client03", 60)):
+            self._node(n, short_name=n[-4:], role=0, hops=1)
+            with self.db._connect() as conn:
+                conn.execute("UPDATE nodes SET updated_at = ? WHERE node_id = ?",
+                             ((now - timedelta(minutes=age_min)).isoformat(timespec="seconds"), n))
+                conn.commit()
+        self.db.rebuild_trace_state()
+        self.assertEqual(self.db.get_next_node_to_trace(), "!client02")
+        self.db.enqueue_trace("!client02")
+        self.assertEqual(self.db.get_next_node_to_trace(), "!client01")
+
+    def test_telemetry_updates_refresh_recency(self):
+        now = datetime.now()
+        for n, age_min in (("!client01", 30), ("!client02", 5), ("!client03", 60)):
+            self._node(n, short_name=n[-4:], role=0, hops=1)
+            with self.db._connect() as conn:
+                conn.execute("UPDATE nodes SET updated_at = ? WHERE node_id = ?",
+                             ((now - timedelta(minutes=age_min)).isoformat(timespec="seconds"), n))
+                conn.commit()
+        self.db.rebuild_trace_state()
+        self.assertEqual(self.db.get_next_node_to_trace(), "!client02")
+
+        # Solo telemetría (sin role/short_name/hops/via_mqtt): update_node...
+        self.db.update_node("!client03", {"snr": 4.5, "last_heard": int(time.time())})
+        self.assertEqual(self.db.get_next_node_to_trace(), "!client03")
+        self.db.enqueue_trace("!client03")
+        # ...y el volcado en bloque de NodeStore
+        self.db.upsert_nodes({"!client01": {"battery": 80}})
+        self.assertEqual(self.db.get_next_node_to_trace(), "!client01")
+
+    def test_enqueue_and_result_maintain_state(self):
+        self._node("!router01", short_name="RT01", role=2, hops=1)
+        trace_id = self.db.enqueue_trace("!router01")
+        self.assertEqual(self._state("!router01")["pending_trace_id"], trace_id)
+        self.assertIsNone(self.db.get_next_node_to_trace())
+
+        self.db.mark_trace_done_with_route(trace_id, False, text="timeout")
+        st = self._state("!router01")
+        self.assertIsNone(st["pending_trace_id"])
+        self.assertEqual(st["last_status"], "error")
+        self.assertEqual(st["consecutive_errors"], 1)
+        self.assertAlmostEqual(st["next_eligible_at"], int(time.time()) + 3600, delta=5)
+
+        trace_id = self.db.enqueue_trace("!router01")
+        self.db.mark_trace_done_with_route(trace_id, True, text="ok")
+        st = self._state("!router01")
+        self.assertEqual(st["consecutive_errors"], 0)
+        self.assertAlmostEqual(st["next_eligible_at"], int(time.time()) + 6 * 3600, delta=5)
+
+    def test_stale_pending_traces_count_as_errors(self):
+        self._node("!client01", short_name="CL01", role=0, hops=1)
+        trace_id = self.db.enqueue_trace("!client01")
+        old = (datetime.now() - timedelta(minutes=30)).isoformat(timespec="seconds")
+        with self.db._connect() as conn:
+            conn.execute("UPDATE traces SET created_at = ?, created_ts = ? WHERE id = ?", (old, int(datetime.fromisoformat(old).timestamp()), trace_id))
+            conn.commit()
+
+        self.assertEqual(self.db.cleanup_stale_pending_traces(max_age_minutes=15), 1)
+        st = self._state("!client01")
+        self.assertIsNone(st["pending_trace_id"])
+        self.assertEqual(st["last_status"], "error")
+        self.assertEqual(st["consecutive_errors"], 1)
+
+    def test_pending_queue_prefers_routers(self):
+        self._node("!client01", short_name="CL01", role=0, hops=1)
+        self._node("!router01", short_name="RT01", role=2, hops=1)
+        self.db.enqueue_trace("!client01")
+        router_trace = self.db.enqueue_trace("!router01")
+        self.assertEqual(self.db.get_next_pending_trace()["id"], router_trace)
+
+    def test_rebuild_from_history(self):
+        self._node("!router01", short_name="RT01", role=2, hops=1)
+        for _ in range(5):
+            t = self.db.enqueue_trace("!router01")
+            self.db.mark_trace_done_with_route(t, False, text="timeout")
+        with self.db._connect() as conn:
+            conn.execute("DELETE FROM trace_state")
+            conn.commit()
+
+        self.assertEqual(self.db.rebuild_trace_state(), 1)
+        st = self._state("!router01")
+        self.assertEqual(st["consecutive_errors"], 5)
+        self.assertAlmostEqual(st["next_eligible_at"], int(time.time()) + 24 * 3600, delta=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import threading
+import time
+
+from Models.TxScheduler import TxScheduler, TX_PRIORITY_ALERT, TX_PRIORITY_LOW, TX_PRIORITY_NORMAL
+
+
+class TestTxScheduler(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+
+    def _transmit(self, text, ok=True):
+        self.sent.append((text, time.monotonic()))
+        return ok
+
+    def test_priority_and_minimum_gap(self):
+        tx = TxScheduler(min_gap=0.1, max_gap=1)
+        gate = threading.Event()
+        first = tx.submit(gate.wait, 5)
+        normal = [tx.submit(self._transmit, f"n{i}") for i in range(2)]
+        low = tx.submit(self._transmit, "nodeinfo", priority=TX_PRIORITY_LOW)
+        alert = tx.submit(self._transmit, "alerta", priority=TX_PRIORITY_ALERT)
+        gate.set()
+
+        self.assertTrue(first.result(timeout=5))
+        self.assertTrue(all(f.result(timeout=5) for f in normal + [low, alert]))
+        self.assertEqual([t for t, _ in self.sent], ["alerta", "n0", "n1", "nodeinfo"])
+        times = [at for _, at in self.sent]
+        self.assertTrue(all(b - a >= 0.09 for a, b in zip(times, times[1:])))
+        snap = tx.snapshot()
+        self.assertEqual((snap["sent"], snap["pending"]), (5, 0))
+        self.assertGreaterEqual(snap["max_depth"], 4)
+
+    def test_gap_follows_channel_occupancy(self):
+        tx = TxScheduler(min_gap=2.0, max_gap=10.0)
+        self.assertEqual(tx.current_gap(), 2.0)
+        tx.update_airtime(channel_util=12.0)
+        self.assertEqual(tx.current_gap(), 2.0)
+        tx.update_airtime(channel_util=50.0)
+        self.assertEqual(tx.current_gap(), 4.0)
+        tx.update_airtime(air_util_tx=30.0)
+        self.assertEqual(tx.current_gap(), 8.0)
+        tx.update_airtime(channel_util=95.0, air_util_tx=45.0)
+        self.assertEqual(tx.current_gap(), 10.0)
+        self.assertEqual(tx.snapshot()["channel_util"], 95.0)
+
+    def test_airtime_budget(self):
+        tx = TxScheduler(min_gap=0)
+        tx.airtime_budget = 5.0
+        # Sin dato del nodo local todavía hay presupuesto
+        self.assertTrue(tx.airtime_available())
+        tx.update_airtime(air_util_tx=4.9)
+        self.assertTrue(tx.airtime_available())
+        tx.update_airtime(air_util_tx=5.0)
+        self.assertFalse(tx.airtime_available())
+        self.assertEqual((tx.snapshot()["airtime_budget"], tx.snapshot()["airtime_ok"]), (5.0, False))
+        tx.update_airtime(air_util_tx=1.0)
+        tx.airtime_budget = 0
+        self.assertFalse(tx.airtime_available())
+
+    def test_failed_send_does_not_hold_the_queue(self):
+        tx = TxScheduler(min_gap=5.0)
+        failed = tx.submit(self._transmit, "sin radio", False)
+        boom = tx.submit(lambda: 1 / 0, priority=TX_PRIORITY_NORMAL)
+        ok = tx.submit(self._transmit, "hola")
+        self.assertFalse(failed.result(timeout=1))
+        self.assertFalse(boom.result(timeout=1))
+        self.assertTrue(ok.result(timeout=1))
+        self.assertEqual(tx.snapshot()["failed"], 2)
+
+    def test_system_exit_resolves_future_and_keeps_sending(self):
+        tx = TxScheduler(min_gap=0)
+
+        def our_exit():
+            raise SystemExit(1)
+
+        exited = tx.submit(our_exit)
+        ok = tx.submit(self._transmit, "hola")
+        self.assertFalse(exited.result(timeout=1))
+        self.assertTrue(ok.result(timeout=1))
+        self.assertEqual((tx.snapshot()["failed"], tx.snapshot()["sent"]), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import env
+from Models.Database import Database
+from Models.Wakeup import WAKE_OUTBOX, WAKE_REASONS, WAKE_TRACE, WakeupListener, wake_main_loop
+
+
+class TestWakeup(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self._previous = getattr(env, "MAIN_WAKEUP_SOCKET", None)
+        env.MAIN_WAKEUP_SOCKET = os.path.join(self.test_dir, "wakeup.sock")
+        self.listener = WakeupListener()
+        self.assertTrue(self.listener.open())
+        self.db = Database(os.path.join(self.test_dir, "test_wakeup.sql"))
+
+    def tearDown(self):
+        self.listener.close()
+        env.MAIN_WAKEUP_SOCKET = self._previous
+        Database.close_connections()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_enqueue_wakes_the_loop_quickly(self):
+        timer = threading.Timer(0.05, self.db.enqueue_outbox, args=("hola",))
+        start = time.monotonic()
+        timer.start()
+        reasons = self.listener.wait(5)
+        elapsed = time.monotonic() - start
+        timer.join()
+        self.assertEqual(reasons, {WAKE_OUTBOX})
+        self.assertLess(elapsed, 1)
+
+        # Varios avisos acumulados se recogen en una sola vuelta
+        self.db.enqueue_trace("!00000001")
+        self.db.enqueue_outbox("adiós")
+        self.assertEqual(self.listener.wait(1), {WAKE_OUTBOX, WAKE_TRACE})
+        self.assertEqual(self.listener.wait(0.05), set())
+        self.assertEqual(self.listener.stats, {"wakeups": 2, "timeouts": 1})
+
+    def test_unknown_reason_and_fallbacks(self):
+        self.assertTrue(wake_main_loop("otra"))
+        self.assertEqual(self.listener.wait(1), set(WAKE_REASONS))
+
+        self.listener.close()
+        self.assertFalse(os.path.exists(env.MAIN_WAKEUP_SOCKET))
+        self.assertFalse(wake_main_loop(WAKE_OUTBOX))
+        # Sin socket, el bucle vuelve al sondeo: espera el timeout y revisa todo
+        self.assertEqual(self.listener.wait(0.01), set(WAKE_REASONS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -385,6 +385,9 @@ class MeshDashboard {
       case "poll_created":
         this.sendAction("get_polls");
         break;
+      case "poll_updated":
+        this.applyPollUpdate(data);
+        break;
       case "message_ack":
         this.showToast(`Mensaje entregado con éxito a ${data.dest}`);
         break;
@@ -1175,7 +1178,25 @@ class MeshDashboard {
   // ==========================================================================
   // Renderizado: Encuestas & Clima
   // ==========================================================================
+  applyPollUpdate(data) {
+    // Recuento incremental: solo se pide get_polls si la encuesta no está en la lista
+    if (!data || data.poll_id === undefined) return;
+    const polls = this.polls || [];
+    const idx = polls.findIndex(p => p.id === data.poll_id);
+    if (data.status !== "active") {
+      if (idx >= 0) this.renderPolls(polls.filter(p => p.id !== data.poll_id));
+      return;
+    }
+    if (idx < 0) {
+      this.sendAction("get_polls");
+      return;
+    }
+    polls[idx] = { ...polls[idx], counts: data.counts || [], total_votes: data.total_votes || 0 };
+    this.renderPolls(polls);
+  }
+
   renderPolls(polls) {
+    this.polls = polls;
     if (!this.pollsContainer) return;
 
     if (polls.length === 0) {